@@ -0,0 +1,179 @@
+"""
+Load-test POST /predict/ under WSGI worker threads and under ASGI.
+
+Both applications are driven in-process against the local fake LLM, whose
+every call takes --latency seconds. The WSGI run models a sync server with
+--workers threads per process; the ASGI run sends all requests to one event
+loop at once. The interesting number is the peak of concurrent in-flight
+LLM calls: capped at the worker count under WSGI, and only bounded by the
+offered load under ASGI. Run from the repository root:
+
+    python benchmarks/bench_asgi.py --requests 400 --latency 0.5 --workers 8
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llm_stock_prediction.settings")
+os.environ["LLM_PROVIDER"] = "fake"
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.asgi import get_asgi_application  # noqa: E402
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+
+from predictor import llm_clients  # noqa: E402
+from predictor.cache import reset_response_cache  # noqa: E402
+from predictor.fake_llm import FakeChatModel  # noqa: E402
+
+
+class InFlight:
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.current -= 1
+
+
+IN_FLIGHT = InFlight()
+
+
+class CountingFakeChatModel(FakeChatModel):
+    def _generate(self, *args, **kwargs):
+        with IN_FLIGHT:
+            return super()._generate(*args, **kwargs)
+
+    async def _agenerate(self, *args, **kwargs):
+        with IN_FLIGHT:
+            return await super()._agenerate(*args, **kwargs)
+
+
+def configure(latency):
+    # Every request must reach the LLM, and hit localhost: no cache, no
+    # throttling, and no coalescing of identical in-flight prompts
+    settings.ALLOWED_HOSTS = ["localhost"]
+    settings.LLM_RESPONSE_CACHE = {"BACKEND": "dummy"}
+    settings.PREDICTION_THROTTLING = {"ENABLED": False, "COALESCE": False}
+    settings.LLM_CLIENT = dict(getattr(settings, "LLM_CLIENT", {}), FAKE={"latency": latency})
+    llm_clients.PROVIDERS["fake"] = lambda model, api_key, config: CountingFakeChatModel(
+        model_name=model, **config["FAKE"]
+    )
+    llm_clients.reset_client_registry()
+    reset_response_cache()
+
+
+def wsgi_request(app):
+    environ = {
+        "REQUEST_METHOD": "POST",
+        "PATH_INFO": "/predict/",
+        "SCRIPT_NAME": "",
+        "QUERY_STRING": "",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "HTTP_HOST": "localhost",
+        "CONTENT_LENGTH": "0",
+        "wsgi.input": io.BytesIO(b""),
+        "wsgi.url_scheme": "http",
+        "wsgi.errors": sys.stderr,
+    }
+    status = []
+    body = b"".join(app(environ, lambda s, headers, exc_info=None: status.append(s)))
+    return status[0].startswith("200") and b"Prediction Results" in body
+
+
+async def asgi_request(app):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/predict/",
+        "raw_path": b"/predict/",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"localhost"), (b"content-length", b"0")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 80),
+    }
+    request_sent = False
+    never = asyncio.Event()
+    messages = []
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await never.wait()  # the client never disconnects
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    status = messages[0]["status"]
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return status == 200 and b"Prediction Results" in body
+
+
+def report(label, requests, ok, elapsed, latency):
+    print(
+        f"{label:<26} {ok}/{requests} ok in {elapsed:6.2f}s  "
+        f"{requests / elapsed * 60:8.0f} req/min  peak in-flight LLM calls {IN_FLIGHT.peak:4d}  "
+        f"(effective {requests * latency / elapsed:6.1f})"
+    )
+
+
+def run_wsgi(requests, workers, latency):
+    app = get_wsgi_application()
+    IN_FLIGHT.peak = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        ok = sum(pool.map(lambda _: wsgi_request(app), range(requests)))
+    report(f"WSGI, {workers} worker threads", requests, ok, time.perf_counter() - start, latency)
+
+
+def run_asgi(requests, latency):
+    app = get_asgi_application()
+    IN_FLIGHT.peak = 0
+
+    async def main():
+        results = await asyncio.gather(*[asgi_request(app) for _ in range(requests)])
+        return sum(results)
+
+    start = time.perf_counter()
+    ok = asyncio.run(main())
+    report("ASGI, one event loop", requests, ok, time.perf_counter() - start, latency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    configure(args.latency)
+    run_wsgi(args.requests, args.workers, args.latency)
+    run_asgi(args.requests, args.latency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark backtest scoring over thousands of stored-like runs.
+
+Builds synthetic realized prices and `runs` predictions of 10 symbols x 12
+months each, then times one vectorized scoring pass over all of them, and
+the walk-forward replay inline and on a process pool. Run from the
+repository root:
+
+    python benchmarks/bench_backtest.py --runs 5000 --symbols 500 --months 120
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llm_stock_prediction.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+import numpy as np  # noqa: E402
+from bench_csv_digest import synthetic_csv  # noqa: E402
+
+from predictor.backtest import PredictionSet, RealizedPrices, score_predictions, walk_forward  # noqa: E402
+from predictor.summarize import load_price_table  # noqa: E402
+
+
+def synthetic_runs(realized, runs, seed=0):
+    rng = np.random.default_rng(seed)
+    symbols = np.unique(realized.symbols)
+    months = np.unique(realized.months)
+    picks = rng.integers(0, len(symbols), size=(runs, 10))
+    starts = rng.integers(1, max(len(months) - 12, 2), size=runs)
+    run_index = np.repeat(np.arange(runs), 120)
+    symbol_index = np.repeat(picks.reshape(-1), 12)
+    month_index = np.minimum((starts[:, None, None] + np.arange(12)[None, None, :]).repeat(10, axis=1).reshape(-1),
+                             len(months) - 1)
+    prices = rng.uniform(10, 500, size=len(run_index))
+    return PredictionSet([f"run{i}" for i in range(runs)], run_index, symbols[symbol_index], months[month_index], prices)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5000)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--months", type=int, default=120)
+    parser.add_argument("--windows", type=int, default=24)
+    parser.add_argument("--workers", type=int, default=None, help="walk-forward processes (default: all cores)")
+    args = parser.parse_args()
+
+    table = load_price_table(synthetic_csv(args.symbols, args.months))
+    realized = RealizedPrices.from_table(table)
+    predictions = synthetic_runs(realized, args.runs)
+    start = time.perf_counter()
+    result = score_predictions(predictions, realized)
+    elapsed = time.perf_counter() - start
+    print(f"scored {len(predictions):,} rows of {args.runs:,} runs in {elapsed * 1000:.1f} ms "
+          f"(MAPE {result.portfolio['mape']:.1%}, hit rate {result.portfolio['hit_rate']:.1%})")
+
+    for label, workers in (("inline", 1), ("process pool", args.workers)):
+        start = time.perf_counter()
+        replay, replay_realized = walk_forward(table, args.windows, 12, max_workers=workers)
+        score_predictions(replay, replay_realized)
+        print(f"walk-forward {args.windows} windows {label:>12}: {time.perf_counter() - start:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
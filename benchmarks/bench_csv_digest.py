@@ -0,0 +1,77 @@
+"""
+Benchmark the CSV digest against sending the raw upload to the LLM.
+
+Reports prompt-size reduction and end-to-end latency (preprocessing plus a
+fake LLM call whose latency grows with prompt size). Run from the
+repository root:
+
+    python benchmarks/bench_csv_digest.py --symbols 500 --months 60
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llm_stock_prediction.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from predictor.fake_llm import FakeChatModel  # noqa: E402
+from predictor.summarize import build_csv_digest, estimate_tokens  # noqa: E402
+from predictor.views import build_llm_messages, build_persona_prompt  # noqa: E402
+
+
+def synthetic_csv(symbols, months, seed=0):
+    rng = random.Random(seed)
+    lines = ["symbol,date,open,high,low,close,volume"]
+    for s in range(symbols):
+        price = rng.uniform(10, 500)
+        for m in range(months):
+            price *= 1 + rng.gauss(0.005, 0.05)
+            lines.append(
+                f"SYM{s:05d},{2000 + m // 12}-{m % 12 + 1:02d},{price:.2f},{price * 1.03:.2f},"
+                f"{price * 0.97:.2f},{price:.2f},{rng.randint(10_000, 5_000_000)}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+def end_to_end(label, prepare, csv_data, base_latency, seconds_per_1k_tokens):
+    start = time.perf_counter()
+    payload = prepare(csv_data)
+    prep = time.perf_counter() - start
+    messages = build_llm_messages(build_persona_prompt(), payload)
+    tokens = sum(estimate_tokens(m.content) for m in messages)
+    llm = FakeChatModel(latency=base_latency + tokens / 1000 * seconds_per_1k_tokens)
+    llm.invoke(messages)
+    total = time.perf_counter() - start
+    print(f"{label:<8} prompt ~{tokens:>9,} tokens  prep {prep * 1000:8.1f} ms  end-to-end {total:7.3f} s")
+    return tokens, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--months", type=int, default=60)
+    parser.add_argument("--token-budget", type=int, default=6000)
+    parser.add_argument("--base-latency", type=float, default=0.2)
+    parser.add_argument("--seconds-per-1k-tokens", type=float, default=0.01)
+    args = parser.parse_args()
+
+    csv_data = synthetic_csv(args.symbols, args.months)
+    print(f"{args.symbols} symbols x {args.months} months, {len(csv_data):,} bytes")
+    raw_tokens, raw_time = end_to_end(
+        "raw", lambda data: data, csv_data, args.base_latency, args.seconds_per_1k_tokens
+    )
+    digest_tokens, digest_time = end_to_end(
+        "digest", lambda data: build_csv_digest(data, args.token_budget), csv_data,
+        args.base_latency, args.seconds_per_1k_tokens,
+    )
+    print(f"prompt reduction: {raw_tokens / digest_tokens:.1f}x, latency reduction: {raw_time / digest_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
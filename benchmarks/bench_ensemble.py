@@ -0,0 +1,61 @@
+"""
+Benchmark ensemble predictions against a single LLM call.
+
+A fake chat model with a long latency tail stands in for the provider.
+Reports the mean and worst wall time of one call, of an ensemble waiting for
+all samples, and of an ensemble that cancels stragglers after a quorum.
+Run from the repository root:
+
+    python benchmarks/bench_ensemble.py --samples 5 --quorum 3 --rounds 20
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llm_stock_prediction.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from predictor.ensemble import DEFAULT_ENSEMBLE_SETTINGS, predict_ensemble  # noqa: E402
+from predictor.fake_llm import FakeChatModel  # noqa: E402
+from predictor.views import build_llm_messages, parse_llm_output  # noqa: E402
+
+
+def run(label, rounds, predict):
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        predict()
+        timings.append(time.perf_counter() - started)
+    print(f"{label:>28}: mean {sum(timings) / rounds * 1000:7.1f} ms  max {max(timings) * 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--quorum", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="base latency of a call, seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="up to this many extra seconds per call")
+    args = parser.parse_args()
+
+    model = FakeChatModel(latency=args.latency, latency_jitter=args.jitter, seed=1)
+    messages = build_llm_messages("prompt", "symbol,date,open,high,low,close,volume\n")
+
+    def call(prompt, csv_data, **options):
+        return model.invoke(messages, **options).content
+
+    config = {**DEFAULT_ENSEMBLE_SETTINGS, "ENABLED": True, "SAMPLES": args.samples, "MAX_CONCURRENCY": args.samples}
+    run("single call", args.rounds, lambda: call("prompt", ""))
+    run(f"ensemble of {args.samples}, all", args.rounds,
+        lambda: predict_ensemble("prompt", "", call, parse_llm_output, {**config, "QUORUM": None}))
+    run(f"ensemble of {args.samples}, quorum {args.quorum}", args.rounds,
+        lambda: predict_ensemble("prompt", "", call, parse_llm_output, {**config, "QUORUM": args.quorum}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark the local baseline forecaster on a large synthetic upload.
+
+Times the forecast alone (on an already loaded price table, as the predict
+path gets it from the artifact cache) and the full local prediction
+including parsing the completion. Run from the repository root:
+
+    python benchmarks/bench_forecast.py --symbols 5000 --months 60
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llm_stock_prediction.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from bench_csv_digest import synthetic_csv  # noqa: E402
+
+from predictor.forecast import forecast_completion, forecast_table  # noqa: E402
+from predictor.parsing import parse_completion  # noqa: E402
+from predictor.summarize import load_price_table  # noqa: E402
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--symbols", type=int, default=5000)
+    parser.add_argument("--months", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    csv_data = synthetic_csv(args.symbols, args.months)
+    start = time.perf_counter()
+    table = load_price_table(csv_data)
+    print(f"{args.symbols} symbols x {args.months} months, {len(table):,} rows "
+          f"(text parse {time.perf_counter() - start:.3f} s, done once per upload)")
+    forecast = best_of(args.repeat, lambda: forecast_table(table))
+    end_to_end = best_of(args.repeat, lambda: parse_completion(forecast_completion(table), 10, 12))
+    print(f"forecast all symbols      {forecast * 1000:8.1f} ms")
+    print(f"forecast + render + parse {end_to_end * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
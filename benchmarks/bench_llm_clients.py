@@ -0,0 +1,57 @@
+"""
+Benchmark per-call chat model construction against the pooled client registry.
+
+Uses the local fake provider: every freshly built client pays
+--connect-latency once (standing in for DNS/TCP/TLS setup), every call pays
+--latency. Run from the repository root:
+
+    python benchmarks/bench_llm_clients.py --calls 50 --threads 4
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llm_stock_prediction.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from predictor.llm_clients import ClientRegistry, DEFAULT_CLIENT_SETTINGS  # noqa: E402
+from predictor.fake_llm import FakeChatModel  # noqa: E402
+
+
+def run(label, get_client, calls, threads):
+    def one_call(_):
+        get_client().invoke("benchmark")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one_call, range(calls)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {calls} calls in {elapsed:.3f}s  ({elapsed / calls * 1000:.1f} ms/call)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--connect-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    fake_options = {"latency": args.latency, "connect_latency": args.connect_latency}
+    config = dict(DEFAULT_CLIENT_SETTINGS, FAKE=fake_options)
+    registry = ClientRegistry(config)
+
+    per_call = run("new client per call", lambda: FakeChatModel(**fake_options), args.calls, args.threads)
+    pooled = run("pooled registry", lambda: registry.get("fake", "fake-chat-model"), args.calls, args.threads)
+    print(f"speedup: {per_call / pooled:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Micro-benchmark the single-pass completion parser against the legacy regexes.
+
+Two workloads are timed at growing sizes: well-formed completions with many
+prediction rows, and adversarial ones full of unterminated "<table" and
+"```csv" openers, where the legacy lazy DOTALL patterns rescan the rest of
+the text from every opener. Run from the repository root:
+
+    python benchmarks/bench_parser.py
+"""
+import argparse
+import csv
+import gc
+import io
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from predictor.parsing import parse_completion  # noqa: E402
+
+
+def legacy_parse(llm_output):
+    # The regex implementation parse_llm_output used before parsing.py,
+    # plus the csv.reader pass predict_view made to count rows
+    csv_match = re.search(r"```csv\s*(.*?)```", llm_output, re.DOTALL)
+    prediction_csv = csv_match.group(1).strip() if csv_match else ""
+    table_match = re.search(r"(<table.*?>.*?</table>)", llm_output, re.DOTALL)
+    table_html = table_match.group(1) if table_match else ""
+    expl_match = re.search(r"Explanation[s]?:\s*(.*)", llm_output, re.DOTALL | re.IGNORECASE)
+    explanations = expl_match.group(1).strip() if expl_match else ""
+    rows = [row for row in csv.reader(io.StringIO(prediction_csv)) if row]
+    return prediction_csv, table_html, explanations, rows
+
+
+def well_formed(rows):
+    lines = ["symbol,month,predicted_price"]
+    lines.extend(f"S{i // 12:05d},{2030 + i % 12 // 12}-{i % 12 + 1:02d},{100 + i * 0.01:.2f}" for i in range(rows))
+    return "```csv\n" + "\n".join(lines) + "\n```\n<table><tr><td>x</td></tr></table>\nExplanations:\n" + "ok\n" * 100
+
+
+def adversarial(openers):
+    return "<table>\n" * openers + "```csv\n" + "text\n" * openers
+
+
+def timed(fn, text, repeat):
+    # Like timeit, keep the cyclic GC out of the measurement: it scans every
+    # live row object, which would otherwise dominate the larger sizes
+    best = float("inf")
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(text)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for name, build, sizes in [
+        ("well-formed rows", well_formed, [1_000, 10_000, 100_000]),
+        ("adversarial openers", adversarial, [25, 50, 100, 200]),
+    ]:
+        print(name)
+        for size in sizes:
+            text = build(size)
+            legacy = timed(legacy_parse, text, args.repeat)
+            single = timed(parse_completion, text, args.repeat)
+            print(
+                f"  n={size:>7,} {len(text) / 1e6:6.2f} MB  legacy {legacy * 1000:9.1f} ms  "
+                f"single-pass {single * 1000:8.1f} ms  ({single / len(text) * 1e9:6.1f} ns/byte)"
+            )
+
+
+if __name__ == "__main__":
+    main()
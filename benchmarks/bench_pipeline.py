@@ -0,0 +1,427 @@
+"""
+Load-test the whole prediction pipeline offline: upload, predict, render.
+
+Synthetic uploads (--sizes symbols x --months months) go through the app
+against the deterministic fake chat model (--latency, --tokens-per-second,
+--output-symbols), driven by Django's test client in this process
+("client") or by concurrent HTTP requests to a threaded WSGI server started
+here ("http"). For every stage it reports p50/p95/p99 latency,
+requests/second and the peak RSS of this process while the stage ran:
+
+    upload        POST upload/csv/ (validation, ingest, storage)
+    predict       POST predict/ end to end
+    read_inputs, build_prompt, llm_call, parse, render, ...
+                  the server's own stage timings, from Server-Timing
+
+A throwaway test database (of the configured engine) and upload directory
+are used, and the response cache is off so every prediction reaches the
+model. Results are written as JSON and can be compared with an earlier
+run, e.g. between commits. Run from the repository root:
+
+    python benchmarks/bench_pipeline.py --sizes 10,1000,10000 --output before.json
+    git checkout other-branch
+    python benchmarks/bench_pipeline.py --sizes 10,1000,10000 --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llm_stock_prediction.settings")
+os.environ["LLM_PROVIDER"] = "fake"
+
+import django  # noqa: E402
+
+django.setup()
+
+from bench_csv_digest import synthetic_csv  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from predictor import llm_clients  # noqa: E402
+from predictor.cache import reset_response_cache  # noqa: E402
+from predictor.router import percentile  # noqa: E402
+from predictor.storage import reset_upload_storage  # noqa: E402
+from predictor.throttling import reset_rate_limiter  # noqa: E402
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss():
+    """
+    Resident set size of this process in bytes (the peak so far where
+    /proc is not available).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Recorder:
+    """
+    Durations per stage, the wall-clock window each stage was active in, and
+    the peak RSS sampled while it was.
+    """
+
+    def __init__(self, interval=0.005):
+        self.durations = {}
+        self.errors = {}
+        self.windows = {}
+        self.peaks = {}
+        self.active = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_forever, args=(interval,), daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        rss = current_rss()
+        with self._lock:
+            for stage, count in self.active.items():
+                if count:
+                    self.peaks[stage] = max(self.peaks.get(stage, 0), rss)
+
+    def _sample_forever(self, interval):
+        while not self._stop.wait(interval):
+            self._sample()
+
+    @contextmanager
+    def stage(self, name):
+        with self._lock:
+            self.active[name] = self.active.get(name, 0) + 1
+        self._sample()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            ended = time.perf_counter()
+            self._sample()
+            with self._lock:
+                self.active[name] -= 1
+                self.add(name, ended - started, started, ended)
+
+    def add(self, name, seconds, started=None, ended=None):
+        # Called with the lock held by stage(), or for server stages
+        self.durations.setdefault(name, []).append(seconds)
+        if started is not None:
+            first, last = self.windows.get(name, (started, ended))
+            self.windows[name] = (min(first, started), max(last, ended))
+
+    def error(self, name):
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def close(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def summary(self):
+        stages = {}
+        predict_window = self.windows.get("predict")
+        for name, durations in self.durations.items():
+            durations = sorted(durations)
+            # Server stages run inside the predict requests
+            first, last = self.windows.get(name) or predict_window or (0.0, 0.0)
+            wall = last - first
+            peak = self.peaks.get(name)
+            stages[name] = {
+                "count": len(durations),
+                "errors": self.errors.get(name, 0),
+                "p50_ms": round(percentile(durations, 0.50) * 1000, 3),
+                "p95_ms": round(percentile(durations, 0.95) * 1000, 3),
+                "p99_ms": round(percentile(durations, 0.99) * 1000, 3),
+                "rps": round(len(durations) / wall, 3) if wall > 0 else None,
+                "peak_rss_mb": round(peak / 2**20, 1) if peak else None,
+            }
+        return stages
+
+
+def parse_server_timing(value):
+    """
+    [(stage, seconds)] from a Server-Timing header value.
+    """
+    timings = []
+    for part in (value or "").split(","):
+        name, _, duration = part.strip().partition(";dur=")
+        if name and duration:
+            timings.append((name, float(duration) / 1000))
+    return timings
+
+
+class TestClientDriver:
+    """
+    Requests through django.test.Client, in this thread.
+    """
+
+    name = "client"
+
+    def __init__(self, user):
+        self.client = Client()
+        self.client.force_login(user)
+
+    def upload(self, csv_bytes):
+        response = self.client.post(reverse("upload_csv"), {"csv_file": NamedBytes("data.csv", csv_bytes)})
+        return response.status_code in (200, 302), {}
+
+    def predict(self):
+        response = self.client.post(reverse("predict"))
+        ok = response.status_code == 200 and b"Prediction Results" in response.content
+        return ok, response.headers
+
+
+class NamedBytes:
+    """
+    A file-like upload for the test client.
+    """
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+    def read(self, *args):
+        data, self.data = self.data, b""
+        return data
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class HTTPDriver:
+    """
+    Requests over a real socket to a threaded WSGI server in this process.
+    """
+
+    name = "http"
+
+    def __init__(self, user, base_url):
+        client = Client()
+        client.force_login(user)
+        csrf_token = uuid.uuid4().hex
+        self.base_url = base_url
+        self.headers = {
+            "Cookie": f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}; "
+                      f"{settings.CSRF_COOKIE_NAME}={csrf_token}",
+            "X-CSRFToken": csrf_token,
+        }
+
+    def post(self, path, body=b"", content_type="application/x-www-form-urlencoded"):
+        request = urllib.request.Request(
+            self.base_url + path, data=body, method="POST",
+            headers={**self.headers, "Content-Type": content_type},
+        )
+        opener = urllib.request.build_opener(NoRedirect)
+        try:
+            with opener.open(request) as response:
+                return response.status, dict(response.headers), response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, dict(e.headers), e.read()
+
+    def upload(self, csv_bytes):
+        boundary = uuid.uuid4().hex
+        body = (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"csv_file\"; filename=\"data.csv\"\r\n"
+            f"Content-Type: text/csv\r\n\r\n"
+        ).encode() + csv_bytes + f"\r\n--{boundary}--\r\n".encode()
+        status, _, _ = self.post(reverse("upload_csv"), body, f"multipart/form-data; boundary={boundary}")
+        return status in (200, 302), {}
+
+    def predict(self):
+        status, headers, body = self.post(reverse("predict"))
+        return status == 200 and b"Prediction Results" in body, headers
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def configure(args, upload_root):
+    settings.ALLOWED_HOSTS = ["testserver", "localhost", "127.0.0.1"]
+    settings.LLM_RESPONSE_CACHE = {"BACKEND": "dummy"}
+    settings.PREDICTION_THROTTLING = {"ENABLED": False, "COALESCE": False}
+    settings.UPLOAD_STORAGE = dict(getattr(settings, "UPLOAD_STORAGE", {}), ROOT=upload_root, EVICT_INTERVAL=None)
+    settings.LLM_CLIENT = dict(getattr(settings, "LLM_CLIENT", {}), FAKE={
+        "latency": args.latency,
+        "tokens_per_second": args.tokens_per_second,
+        "output_symbols": args.output_symbols,
+        "output_months": args.output_months,
+    })
+    llm_clients.reset_client_registry()
+    reset_response_cache()
+    reset_upload_storage()
+    reset_rate_limiter()
+
+
+def run_scenario(drivers, csv_bytes, args):
+    recorder = Recorder()
+
+    def upload(driver):
+        with recorder.stage("upload"):
+            ok, _ = driver.upload(csv_bytes)
+        if not ok:
+            recorder.error("upload")
+
+    def predict(driver):
+        with recorder.stage("predict"):
+            ok, headers = driver.predict()
+        if not ok:
+            recorder.error("predict")
+        with recorder._lock:
+            for stage, seconds in parse_server_timing(headers.get("Server-Timing")):
+                recorder.add(stage, seconds)
+
+    with ThreadPoolExecutor(max_workers=len(drivers)) as pool:
+        list(pool.map(upload, drivers))
+        list(pool.map(predict, [drivers[i % len(drivers)] for i in range(args.requests)]))
+    recorder.close()
+    return recorder.summary()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return result["driver"], result["symbols"], result["months"]
+
+
+def compare(previous, current, threshold):
+    """
+    Print the p95 change of every stage both runs measured; returns the
+    number of stages more than threshold (and at least a millisecond)
+    slower, so that sub-millisecond noise is not a regression.
+    """
+    before = {result_key(result): result["stages"] for result in previous["results"]}
+    regressions = 0
+    print(f"\nCompared with {previous['meta'].get('commit') or 'the previous run'}:")
+    for result in current["results"]:
+        old_stages = before.get(result_key(result))
+        if old_stages is None:
+            continue
+        for stage, new in result["stages"].items():
+            old = old_stages.get(stage)
+            if not old or not old["p95_ms"]:
+                continue
+            change = new["p95_ms"] / old["p95_ms"] - 1
+            slower = change > threshold and new["p95_ms"] - old["p95_ms"] >= 1.0
+            flag = "  REGRESSION" if slower else ""
+            regressions += bool(flag)
+            print(f"  {result['driver']:<6} {result['symbols']:>6} symbols  {stage:<14} p95 "
+                  f"{old['p95_ms']:9.1f} -> {new['p95_ms']:9.1f} ms ({change:+.0%}){flag}")
+    return regressions
+
+
+def print_result(result):
+    print(f"\n{result['driver']}: {result['symbols']} symbols x {result['months']} months "
+          f"({result['csv_bytes'] / 2**20:.1f} MB)")
+    for stage, stats in result["stages"].items():
+        rss = f"{stats['peak_rss_mb']:8.1f} MB" if stats["peak_rss_mb"] else f"{'':>11}"
+        rps = f"{stats['rps']:8.1f}/s" if stats["rps"] else f"{'':>10}"
+        print(f"  {stage:<14} n={stats['count']:<4} p50 {stats['p50_ms']:9.1f}  p95 {stats['p95_ms']:9.1f}  "
+              f"p99 {stats['p99_ms']:9.1f} ms  {rps}  peak RSS {rss}"
+              + (f"  errors {stats['errors']}" if stats["errors"] else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10,100,1000", help="comma-separated symbol counts, up to 10000")
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--drivers", default="client,http", help='"client", "http" or both')
+    parser.add_argument("--concurrency", type=int, default=4, help="simultaneous users")
+    parser.add_argument("--requests", type=int, default=20, help="predictions per scenario")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake model latency per call, seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="fake model output rate (0: instant)")
+    parser.add_argument("--output-symbols", type=int, default=10)
+    parser.add_argument("--output-months", type=int, default=12)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p95 slowdown reported as a regression")
+    args = parser.parse_args()
+
+    upload_root = tempfile.mkdtemp(prefix="bench-uploads-")
+    configure(args, upload_root)
+    test_database = connection.creation.create_test_db(verbosity=0, serialize=False)
+    server = None
+    results = []
+    try:
+        users = [get_user_model().objects.create_user(username=f"bench{i}") for i in range(args.concurrency)]
+        drivers = args.drivers.split(",")
+        if "http" in drivers:
+            server = make_server(
+                "127.0.0.1", 0, get_wsgi_application(), server_class=ThreadingWSGIServer, handler_class=QuietHandler,
+            )
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        for symbols in (int(size) for size in args.sizes.split(",")):
+            csv_bytes = synthetic_csv(symbols, args.months).encode()
+            for driver in drivers:
+                if driver == "http":
+                    base_url = f"http://127.0.0.1:{server.server_port}"
+                    instances = [HTTPDriver(user, base_url) for user in users]
+                else:
+                    instances = [TestClientDriver(user) for user in users]
+                result = {
+                    "driver": driver, "symbols": symbols, "months": args.months, "csv_bytes": len(csv_bytes),
+                    "stages": run_scenario(instances, csv_bytes, args),
+                }
+                results.append(result)
+                print_result(result)
+    finally:
+        if server is not None:
+            server.shutdown()
+        connection.creation.destroy_test_db(test_database, verbosity=0)
+        subprocess.run(["rm", "-rf", upload_root])
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(json.load(f), report, args.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark rendering the prediction result table and chart data with the old
+template loops against the server-side builders in predictor/charts.py.
+
+The legacy path loops over csv_rows twice in the template (table rows and
+an inline JS array that the browser regroups per symbol); the new path
+groups once in Python and emits table rows plus a compact JSON payload or
+a static SVG. Run from the repository root:
+
+    python benchmarks/bench_result_page.py --symbols 10 --months 12
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llm_stock_prediction.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.template import Context, Template  # noqa: E402
+
+from predictor.charts import build_chart_payload, render_page_rows, render_svg_chart  # noqa: E402
+from predictor.fake_llm import build_fake_prediction  # noqa: E402
+from predictor.parsing import parse_completion  # noqa: E402
+
+LEGACY_TEMPLATE = Template("""
+{% for row in csv_rows|slice:"1:121" %}
+    <tr>
+        <td>{{ row.0 }}</td>
+        <td>{{ row.1 }}</td>
+        <td>{{ row.2 }}</td>
+    </tr>
+{% endfor %}
+const csvRows = [
+    {% for row in csv_rows|slice:"1:121" %}
+        ["{{ row.0 }}", "{{ row.1 }}", parseFloat("{{ row.2 }}")],
+    {% endfor %}
+];
+""")
+
+SERVER_SIDE_TEMPLATE = Template("""
+{% load prediction_results %}
+{% prediction_page_rows page_rows %}
+{{ chart|json_script:"prediction-chart-data" }}
+""")
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--symbols", type=int, default=10)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    symbols = [f"S{i:03d}" for i in range(args.symbols)]
+    parsed = parse_completion(build_fake_prediction(symbols, args.months))
+    csv_rows = parsed.csv_rows
+
+    legacy, legacy_html = timed(lambda: LEGACY_TEMPLATE.render(Context({"csv_rows": csv_rows})), args.repeat)
+
+    def server_side():
+        chart = build_chart_payload(parsed.rows)
+        return SERVER_SIDE_TEMPLATE.render(Context({"page_rows": parsed.rows[:120], "chart": chart}))
+
+    new, new_html = timed(server_side, args.repeat)
+    svg, svg_markup = timed(lambda: render_svg_chart(build_chart_payload(parsed.rows)), args.repeat)
+    table, _ = timed(lambda: render_page_rows(parsed.rows[:120]), args.repeat)
+
+    payload = json.dumps(build_chart_payload(parsed.rows), separators=(",", ":"))
+    print(f"{len(parsed.rows)} prediction rows")
+    print(f"template loops          {legacy * 1000:7.2f} ms  {len(legacy_html):7d} bytes")
+    print(f"table rows + JSON       {new * 1000:7.2f} ms  {len(new_html):7d} bytes  ({legacy / new:.1f}x faster)")
+    print(f"  of which table rows   {table * 1000:7.2f} ms")
+    print(f"static SVG chart        {svg * 1000:7.2f} ms  {len(svg_markup):7d} bytes")
+    print(f"chart JSON payload      {len(payload):7d} bytes")
+
+
+if __name__ == "__main__":
+    main()
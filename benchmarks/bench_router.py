@@ -0,0 +1,78 @@
+"""
+Benchmark the LLM router against simulated providers.
+
+Two fake backends stand in for real providers: a fast one that fails a
+share of its calls and a slower, reliable one with a long latency tail.
+Reports p50/p95/max latency and the error count of the calls, routed with
+and without hedging. Run from the repository root:
+
+    python benchmarks/bench_router.py --calls 200 --hedge-after p95
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llm_stock_prediction.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from predictor.router import DEFAULT_ROUTER_SETTINGS, build_router, percentile  # noqa: E402
+
+MESSAGES = [("user", "predict")]
+
+
+def backends(latency, failure_rate):
+    options = {"latency": latency, "latency_jitter": latency * 4, "seed": 1}
+    return [
+        {"NAME": "fast", "CLASS": "predictor.fake_llm.FakeChatModel",
+         "OPTIONS": {**options, "failure_rate": failure_rate}},
+        {"NAME": "steady", "CLASS": "predictor.fake_llm.FakeChatModel",
+         "OPTIONS": {**options, "latency": latency * 2, "seed": 2}},
+    ]
+
+
+def run(calls, hedge_after, latency, failure_rate):
+    config = {
+        **DEFAULT_ROUTER_SETTINGS,
+        "BACKENDS": backends(latency, failure_rate),
+        "HEDGE_AFTER": hedge_after,
+        "HEDGE_DEFAULT_DELAY": latency * 2,
+        "MIN_SAMPLES": 3,
+    }
+    router = build_router(config)
+    timings, errors = [], 0
+    for _ in range(calls):
+        started = time.perf_counter()
+        try:
+            router.invoke(MESSAGES)
+        except Exception:
+            errors += 1
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return percentile(timings, 0.5), percentile(timings, 0.95), timings[-1], errors, router
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.01, help="base latency of the fast backend, seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    parser.add_argument("--hedge-after", default="p95", help='seconds or "p95"')
+    args = parser.parse_args()
+    hedge_after = args.hedge_after if args.hedge_after == "p95" else float(args.hedge_after)
+
+    for label, hedge in (("no hedging", None), (f"hedge after {args.hedge_after}", hedge_after)):
+        p50, p95, worst, errors, router = run(args.calls, hedge, args.latency, args.failure_rate)
+        print(f"{label:>20}: p50 {p50 * 1000:7.1f} ms  p95 {p95 * 1000:7.1f} ms  "
+              f"max {worst * 1000:7.1f} ms  errors {errors}/{args.calls}")
+        for backend in router.snapshot():
+            print(f"{'':>22}{backend['name']}: {backend['state']}, {backend['samples']} calls, "
+                  f"error rate {backend['error_rate'] or 0:.0%}")
+
+
+if __name__ == "__main__":
+    main()
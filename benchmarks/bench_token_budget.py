@@ -0,0 +1,75 @@
+"""
+Measure the overhead of prompt token accounting next to the LLM call.
+
+Times loading the tokenizer (once per process), counting a typical prompt
+(the persona prompt is served from the count cache after the first call),
+and fitting an oversized upload to the budget. The LLM call is the local
+fake LLM with --latency seconds. tiktoken is used when its encoding can be
+loaded, otherwise the estimate. Run from the repository root:
+
+    python benchmarks/bench_token_budget.py --symbols 500 --months 60
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llm_stock_prediction.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from bench_csv_digest import synthetic_csv  # noqa: E402
+
+from predictor.budget import fit_prompt, get_budget_settings, get_tokenizer  # noqa: E402
+from predictor.fake_llm import FakeChatModel  # noqa: E402
+from predictor.views import USER_MESSAGE, build_llm_messages, build_persona_prompt  # noqa: E402
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--months", type=int, default=60)
+    parser.add_argument("--latency", type=float, default=2.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    config = get_budget_settings()
+    start = time.perf_counter()
+    tokenizer = get_tokenizer("gpt-4.1", config)
+    print(f"tokenizer {tokenizer.name}, loaded in {(time.perf_counter() - start) * 1000:.1f} ms (once per process)")
+
+    prompt = build_persona_prompt("Focus on large caps.")
+    framing = USER_MESSAGE.format(csv_data="")
+    small_csv = synthetic_csv(10, 24)
+    large_csv = synthetic_csv(args.symbols, args.months)
+
+    small = best_of(args.repeat, lambda: fit_prompt(prompt, small_csv, framing, "gpt-4.1", config))
+    large = best_of(args.repeat, lambda: fit_prompt(prompt, large_csv, framing, "gpt-4.1", config))
+    payload, report = fit_prompt(prompt, large_csv, framing, "gpt-4.1", config)
+
+    llm = FakeChatModel(latency=args.latency)
+    start = time.perf_counter()
+    llm.invoke(build_llm_messages(prompt, payload))
+    llm_time = time.perf_counter() - start
+
+    print(f"count a 10-symbol prompt          {small * 1000:8.2f} ms")
+    print(f"fit a {args.symbols}x{args.months} upload to {report.budget} tokens {large * 1000:8.2f} ms  "
+          f"({report.tokens_before:,} -> {report.tokens_after:,} tokens via {[name for name, _ in report.steps]})")
+    print(f"LLM call                          {llm_time * 1000:8.2f} ms")
+    print(f"overhead: {small / llm_time:.4%} (typical prompt), {large / llm_time:.2%} (oversized upload)")
+
+
+if __name__ == "__main__":
+    main()
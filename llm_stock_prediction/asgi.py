@@ -0,0 +1,23 @@
+"""
+ASGI config for backend project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn llm_stock_prediction.asgi:application``)
+so async views await LLM calls on the event loop instead of pinning a thread each.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llm_stock_prediction.settings")
+
+application = get_asgi_application()
+
+# Only server processes evict uploads in the background
+from predictor.storage import start_upload_evictor  # noqa: E402
+
+start_upload_evictor()
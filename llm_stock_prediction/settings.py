@@ -48,6 +48,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "llm_stock_prediction.wsgi.application"
+ASGI_APPLICATION = "llm_stock_prediction.asgi.application"
 
 DATABASES = {
     "default": {
@@ -88,3 +89,227 @@ MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Content-addressed cache for LLM responses (see predictor/cache.py).
+# BACKEND is one of "lru" (in-process), "file" (on-disk), "django" (uses
+# CACHES[CACHE_ALIAS]) or "dummy" (disabled).
+LLM_RESPONSE_CACHE = {
+    "BACKEND": "lru",
+    "TTL": 60 * 60,
+    "MAX_ENTRIES": 256,
+    "LOCATION": "/tmp/llm_stock_cache",
+    "CACHE_ALIAS": "default",
+}
+
+# Background prediction jobs (see predictor/jobs.py). With ASYNC enabled,
+# POST /predict/ enqueues a job and the result page is polled via HTMX.
+# Finished jobs are deleted after RESULT_TTL seconds; jobs not updated for
+# STALE_AFTER seconds (their worker died) are failed.
+PREDICTION_JOBS = {
+    "ASYNC": False,
+    "STORE": "memory",
+    "LOCATION": "/tmp/llm_stock_jobs.sqlite3",
+    "MAX_WORKERS": 4,
+    "MAX_JOBS_PER_USER": 2,
+    "POLL_INTERVAL": 2,
+    "RESULT_TTL": 3600,
+    "STALE_AFTER": 900,
+}
+
+# Pooled chat model clients (see predictor/llm_clients.py). Select the
+# provider with the LLM_PROVIDER env var ("openai" or "fake").
+LLM_CLIENT = {
+    "POOL_SIZE": 10,
+    "ASYNC_POOL_SIZE": 200,
+    "KEEPALIVE_EXPIRY": 60,
+    "CONNECT_TIMEOUT": 10,
+    "READ_TIMEOUT": 120,
+    "MAX_RETRIES": 2,
+    "FAKE": {"latency": 0.0, "connect_latency": 0.0},
+}
+
+# Pre-summarization of large uploads (see predictor/summarize.py). MODE is
+# "auto" (digest only above TOKEN_BUDGET), "always" or "never".
+LLM_CSV_DIGEST = {
+    "MODE": "auto",
+    "TOKEN_BUDGET": 6000,
+}
+
+# Map-reduce prediction over symbol shards for very large uploads (see
+# predictor/sharding.py). MODE is "never", "auto" or "always". The merged
+# result has the shape of PREDICTION_SHAPE.
+PREDICTION_SHARDING = {
+    "MODE": "never",
+    "MIN_SYMBOLS": 50,
+    "MAX_SHARD_TOKENS": 6000,
+    "MAX_CONCURRENCY": 4,
+}
+
+# Per-user cache of parsed uploads, indicators and assembled prompts (see
+# predictor/artifacts.py).
+ARTIFACT_CACHE = {
+    "MAX_USERS": 128,
+}
+
+# Shape of predictions (see predictor/results.py): the top SYMBOLS symbols
+# with PERIODS prices each at a HORIZON of "weekly", "monthly" or
+# "quarterly". Shape mismatches are shown as warnings, or reject the output
+# when STRICT; outputs over MAX_ROWS rows are rejected. The result table
+# shows PAGE_SIZE rows at a time.
+PREDICTION_SHAPE = {
+    "SYMBOLS": 10,
+    "HORIZON": "monthly",
+    "PERIODS": 12,
+    "STRICT": False,
+    "MAX_ROWS": 100000,
+    "PAGE_SIZE": 100,
+}
+
+# Batch predictions (see predictor/batch.py): POST /predict/batch/ or
+# `manage.py predict_batch`. Rate-limited LLM calls are retried with
+# exponential backoff starting at BACKOFF_BASE seconds.
+PREDICTION_BATCH = {
+    "MAX_ITEMS": 100,
+    "MAX_CONCURRENCY": 4,
+    "MAX_RETRIES": 5,
+    "BACKOFF_BASE": 2.0,
+    "BACKOFF_MAX": 60.0,
+}
+
+# Prediction chart on the result page (see predictor/charts.py). RENDERER is
+# "svg" (static, rendered server-side) or "chartjs" (interactive, loads Chart.js).
+# MAX_SERIES caps the symbols drawn; None draws all PREDICTION_SHAPE SYMBOLS.
+PREDICTION_CHART = {
+    "RENDERER": "svg",
+    "MAX_SERIES": None,
+    "WIDTH": 800,
+    "HEIGHT": 400,
+}
+
+# Stored prediction runs (see predictor/history.py): every prediction is saved
+# with its rows, latency and token usage, listed at /predictions/.
+PREDICTION_HISTORY = {
+    "ENABLED": True,
+    "PAGE_SIZE": 20,
+}
+
+# Prediction metrics (see predictor/metrics.py), scraped from /metrics. With
+# PROFILE on, prediction requests write a cProfile dump and a JSON stage trace
+# to PROFILE_DIR, one request at a time: those overlapping it are not profiled.
+PREDICTION_METRICS = {
+    "ENABLED": True,
+    "PROFILE": False,
+    "PROFILE_DIR": "/tmp/llm_stock_profiles",
+}
+
+# Local baseline forecaster (see predictor/forecast.py). MODE is "llm" (always
+# ask the LLM), "local" (never ask it) or "fallback" (forecast locally when
+# the LLM call fails or times out).
+PREDICTION_FORECAST = {
+    "MODE": "llm",
+    "ALPHA": 0.5,
+}
+
+# Prompt token budget (see predictor/budget.py). Prompts over MAX_PROMPT_TOKENS
+# have their data shrunk with STRATEGIES, in order, until they fit. TOKENIZER
+# is "auto" (tiktoken when its encoding is available locally), "tiktoken" or
+# "estimate".
+PROMPT_BUDGET = {
+    "ENABLED": True,
+    "MAX_PROMPT_TOKENS": 16000,
+    "MAX_INSTRUCTIONS_TOKENS": 2000,
+    "STRATEGIES": ["drop_oldest_months", "sample_symbols", "summarize"],
+    "MIN_MONTHS": 12,
+    "TOKENIZER": "auto",
+    "ENCODING": None,
+}
+
+# Multi-provider LLM router (see predictor/router.py). With BACKENDS set, calls
+# go to the fastest healthy backend and fail over to the next one; a backend's
+# circuit opens after FAILURE_THRESHOLD consecutive failures (or an error rate
+# over ERROR_RATE_THRESHOLD) for RESET_TIMEOUT seconds. HEDGE_AFTER (seconds or
+# "p95") also calls a second backend when the first is slow.
+LLM_ROUTER = {
+    "BACKENDS": [],
+    "WINDOW": 100,
+    "MIN_SAMPLES": 5,
+    "FAILURE_THRESHOLD": 5,
+    "ERROR_RATE_THRESHOLD": 0.5,
+    "RESET_TIMEOUT": 30.0,
+    "HEDGE_AFTER": None,
+}
+
+# Prediction prefetch (see predictor/prefetch.py). When ENABLED, a successful
+# upload starts the prediction for the new inputs in the background, and
+# predict waits up to WAIT seconds for it instead of calling the LLM again.
+PREDICTION_PREFETCH = {
+    "ENABLED": False,
+    "MAX_WORKERS": 4,
+    "MAX_ENTRIES": 64,
+    "TTL": 600,
+    "WAIT": 120,
+}
+
+# Backtesting (see predictor/backtest.py): /predictions/backtest/ and
+# `manage.py backtest` score predictions against realized prices, next to a
+# walk-forward replay of the local baseline over the last WINDOWS months.
+PREDICTION_BACKTEST = {
+    "TOP_N": 10,
+    "MAX_RUNS": 1000,
+    "WINDOWS": 12,
+    "HORIZON": 12,
+    "MIN_HISTORY": 3,
+    "MAX_WORKERS": 1,
+}
+
+# Upload storage (see predictor/storage.py): uploads are content-addressed
+# blobs under ROOT shared between users, with per-user quotas, eviction of
+# files unused for TTL seconds (every EVICT_INTERVAL seconds in server
+# processes) and optional gzip compression. Set
+# SENDFILE_HEADER (e.g. "X-Accel-Redirect") when the web server maps
+# SENDFILE_PREFIX to ROOT, so downloads bypass Django.
+UPLOAD_STORAGE = {
+    "ROOT": "/tmp/llm_stock_uploads",
+    "COMPRESS": False,
+    "USER_QUOTA": 200 * 1024 * 1024,
+    "MAX_FILE_SIZE": 100 * 1024 * 1024,
+    "TTL": 30 * 24 * 3600,
+    "EVICT_INTERVAL": 3600,
+    "SENDFILE_HEADER": None,
+}
+
+# Ensemble predictions (see predictor/ensemble.py). When ENABLED, SAMPLES
+# LLM calls run concurrently with the VARIANTS as invoke options and the
+# result page shows their median with the interquartile range. Stragglers
+# are cancelled GRACE seconds after QUORUM samples have answered.
+PREDICTION_ENSEMBLE = {
+    "ENABLED": False,
+    "SAMPLES": 5,
+    "QUORUM": 3,
+    "GRACE": 0.0,
+    "VARIANTS": [
+        {"temperature": 0.2},
+        {"temperature": 0.5},
+        {"temperature": 0.8},
+        {"temperature": 1.0},
+        {"temperature": 1.2},
+    ],
+    "MAX_CONCURRENCY": 5,
+}
+
+# Prediction throttling (see predictor/throttling.py). When ENABLED, predict
+# requests need a token from their user's and their IP's bucket and one of
+# MAX_CONCURRENT slots, or get a 429 with a Retry-After hint. "django" keeps
+# the buckets in CACHES[CACHE_ALIAS], shared by all workers. COALESCE lets
+# identical predictions in flight share one LLM call.
+PREDICTION_THROTTLING = {
+    "ENABLED": False,
+    "BACKEND": "memory",
+    "USER_RATE": "10/m",
+    "USER_BURST": 3,
+    "IP_RATE": "30/m",
+    "IP_BURST": 5,
+    "MAX_CONCURRENT": 8,
+    "TRUSTED_PROXY_HEADER": None,
+    "COALESCE": True,
+}
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llm_stock_prediction.settings")
 
 application = get_wsgi_application()
+
+# Only server processes evict uploads in the background
+from predictor.storage import start_upload_evictor  # noqa: E402
+
+start_upload_evictor()
@@ -0,0 +1,198 @@
+"""
+Per-user cache of artifacts derived from the uploaded files.
+
+Every prediction used to re-read and re-parse data.csv and instructions.md.
+This cache keeps, per user:
+
+- the text and content hash of each uploaded file, re-read only when the
+  file's (mtime, size) signature changes or an upload invalidates it;
+- the parsed dataset (a summarize.PriceTable, memory-mapped from the
+  columnar copy when ingest wrote one) and a symbol -> row-range index;
+- derived per-symbol indicators (summarize.compute_symbol_features);
+- the final assembled (prompt, csv_payload) for the current content hashes.
+
+Indicators are keyed by a hash of each symbol's rows, so when a new upload
+only appends months to some symbols, only those symbols are recomputed.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from . import ingest
+from .sharding import group_rows_by_symbol
+from .summarize import DIGEST_COLUMNS, compute_symbol_features, load_price_table
+
+DEFAULT_ARTIFACT_SETTINGS = {
+    "MAX_USERS": 128,  # least recently used users are evicted beyond this
+}
+
+
+def content_hash(text: str):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class UserArtifacts:
+    """
+    Everything cached for one user. Guarded by its own lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.files = {}  # path -> (signature, text, hash)
+        self.dataset_hash = None
+        self.table = None
+        self.symbol_index = {}  # symbol -> (start, stop) rows in table
+        self.symbol_hashes = {}  # symbol -> hash of its raw rows
+        self.symbol_features = {}  # symbol -> {feature: value}
+        self.prompts = {}  # (csv hash, instructions hash, options) -> assembled prompt
+
+
+class ArtifactCache:
+    """
+    LRU map of user id -> UserArtifacts.
+    """
+
+    def __init__(self, max_users=128):
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.feature_recomputes = 0  # symbols whose indicators were (re)computed
+
+    def entry(self, user_id):
+        with self._lock:
+            artifacts = self._users.get(user_id)
+            if artifacts is None:
+                artifacts = self._users[user_id] = UserArtifacts()
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return artifacts
+
+    def read_text(self, user_id, path):
+        """
+        Returns (text, hash) of path, or (None, None) if it does not exist.
+        The file is only read again when its signature changes. Files ending
+        in .gz (compressed upload blobs) are decompressed.
+        """
+        artifacts = self.entry(user_id)
+        signature = file_signature(path)
+        if signature is None:
+            return None, None
+        with artifacts.lock:
+            cached = artifacts.files.get(path)
+            if cached is not None and cached[0] == signature:
+                return cached[1], cached[2]
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8") as f:
+                text = f.read()
+            digest = content_hash(text)
+            artifacts.files[path] = (signature, text, digest)
+            return text, digest
+
+    def get_dataset(self, user_id, user_dir, csv_data, csv_hash):
+        """
+        Return the UserArtifacts with table, symbol_index and
+        symbol_features up to date for csv_data.
+        """
+        artifacts = self.entry(user_id)
+        with artifacts.lock:
+            if artifacts.dataset_hash == csv_hash:
+                return artifacts
+            header, groups = group_rows_by_symbol(csv_data)
+            hashes = {symbol: content_hash("\n".join(lines)) for symbol, lines in groups.items()}
+            changed = [symbol for symbol, digest in hashes.items() if artifacts.symbol_hashes.get(symbol) != digest]
+            if changed:
+                subset = header + "\n" + "\n".join("\n".join(groups[symbol]) for symbol in changed)
+                features = compute_symbol_features(load_price_table(subset))
+                for i, symbol in enumerate(features["symbol"].tolist()):
+                    artifacts.symbol_features[symbol] = {name: features[name][i] for name in DIGEST_COLUMNS}
+                self.feature_recomputes += len(changed)
+            for symbol in set(artifacts.symbol_features) - set(hashes):
+                del artifacts.symbol_features[symbol]
+            artifacts.symbol_hashes = hashes
+
+            table = ingest.load_price_table(user_dir)
+            if table is None or len(table) != sum(len(lines) for lines in groups.values()):
+                table = load_price_table(csv_data)
+            artifacts.table = table
+            artifacts.symbol_index = {
+                symbol: (int(start), int(start + count))
+                for symbol, start, count in zip(table.symbols.tolist(), table.starts, table.counts)
+            }
+            artifacts.dataset_hash = csv_hash
+            return artifacts
+
+    def get_features(self, user_id, user_dir, csv_data, csv_hash):
+        """
+        Per-symbol indicators in compute_symbol_features() layout.
+        """
+        artifacts = self.get_dataset(user_id, user_dir, csv_data, csv_hash)
+        with artifacts.lock:
+            symbols = sorted(artifacts.symbol_features)
+            rows = [artifacts.symbol_features[symbol] for symbol in symbols]
+        return {name: np.array([row[name] for row in rows]) for name in DIGEST_COLUMNS}
+
+    def get_prompt(self, user_id, key, build):
+        """
+        Return the assembled prompt cached under key, calling build() on a miss.
+        """
+        artifacts = self.entry(user_id)
+        with artifacts.lock:
+            if key not in artifacts.prompts:
+                # Only the current inputs are worth keeping
+                artifacts.prompts = {key: build()}
+            return artifacts.prompts[key]
+
+    def invalidate(self, user_id, path=None):
+        """
+        Forget the cached copy of an uploaded file (every file of the user
+        when path is None) and prompts built from it. Per-symbol indicators
+        are kept so the next load only recomputes the symbols whose rows
+        changed.
+        """
+        with self._lock:
+            artifacts = self._users.get(user_id)
+        if artifacts is None:
+            return
+        with artifacts.lock:
+            if path is None:
+                artifacts.files.clear()
+            else:
+                artifacts.files.pop(path, None)
+            artifacts.prompts.clear()
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self.feature_recomputes = 0
+
+
+_artifact_cache = None
+_artifact_cache_lock = threading.Lock()
+
+
+def get_artifact_cache():
+    """
+    Return the process-wide artifact cache configured by settings.ARTIFACT_CACHE.
+    """
+    global _artifact_cache
+    if _artifact_cache is None:
+        with _artifact_cache_lock:
+            if _artifact_cache is None:
+                config = dict(DEFAULT_ARTIFACT_SETTINGS)
+                config.update(getattr(settings, "ARTIFACT_CACHE", None) or {})
+                _artifact_cache = ArtifactCache(max_users=config["MAX_USERS"])
+    return _artifact_cache
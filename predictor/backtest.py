@@ -0,0 +1,347 @@
+"""
+Backtesting of predictions against realized prices.
+
+Predictions are `symbol,month,predicted_price` rows (what parse_llm_output
+extracts), grouped into runs: stored PredictionRuns, prediction.csv files,
+or the runs a walk-forward replay produces. Realized prices come from a CSV
+in the upload format, reduced to the last close of every month (see
+forecast.monthly_closes).
+
+All runs are scored together in one vectorized pass: every prediction row
+is matched to its realized close with a single sorted-key lookup, and the
+per-run, per-symbol and portfolio numbers are grouped reductions over the
+matched rows (np.bincount), so thousands of runs take milliseconds.
+
+- MAPE: mean absolute percentage error of the predicted prices.
+- Hit rate: share of rows that got the direction right, measured from the
+  base price, the realized close of the month before a (run, symbol)'s
+  first predicted month.
+- Top-N realized return: the realized return, from the base price to the
+  last predicted month that has a realized price, of the run's top_n
+  symbols by predicted return over the same span; next to the mean
+  realized return of all the run's symbols, for comparison.
+
+Realized prices are monthly, so only monthly runs are scored: weekly and
+quarterly predictions (PredictionRun.horizon) would be matched to the
+close of the month their period starts in. See scored_runs().
+
+walk_forward() replays history instead: for each of the last `windows`
+months it forecasts the following months with the local baseline (see
+forecast.py) from the data up to that month only, on a process pool, and
+scores those forecasts the same way.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.conf import settings
+
+from .forecast import forecast_table, monthly_closes
+from .ingest import normalize_date
+from .summarize import PriceTable
+
+DEFAULT_BACKTEST_SETTINGS = {
+    "TOP_N": 10,
+    "MAX_RUNS": 1000,  # newest stored runs scored by the backtest view
+    "WINDOWS": 12,  # walk-forward cutoffs, one per month
+    "HORIZON": 12,  # months forecast after each cutoff
+    "MIN_HISTORY": 3,  # months of data a walk-forward cutoff needs
+    "MAX_WORKERS": 1,  # walk-forward processes in the view; the command defaults to all cores
+}
+
+
+def get_backtest_settings():
+    config = dict(DEFAULT_BACKTEST_SETTINGS)
+    config.update(getattr(settings, "PREDICTION_BACKTEST", None) or {})
+    return config
+
+
+def to_months(labels):
+    """
+    datetime64[M] array for month or date labels; unrecognized labels are NaT.
+    Each distinct label is parsed once.
+    """
+    labels = np.asarray(labels, dtype=str)
+    unique, inverse = np.unique(labels, return_inverse=True)
+    months = np.empty(len(unique), dtype="datetime64[M]")
+    for i, label in enumerate(unique.tolist()):
+        try:
+            months[i] = normalize_date(label)[1].astype("datetime64[M]")
+        except ValueError:
+            months[i] = np.datetime64("NaT")
+    return months[inverse.reshape(-1)]
+
+
+class PredictionSet:
+    """
+    Flat columns of the predicted prices of many runs: row i predicts
+    prices[i] for symbols[i] in months[i], in run run_ids[runs[i]].
+    """
+
+    def __init__(self, run_ids, runs, symbols, months, prices):
+        self.run_ids = list(run_ids)
+        self.runs = np.asarray(runs, dtype=np.int64)
+        self.symbols = np.asarray(symbols, dtype=str)
+        self.months = np.asarray(months, dtype="datetime64[M]")
+        self.prices = np.asarray(prices, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.runs)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build from (run_id, symbol, month label, price) tuples.
+        """
+        run_ids, runs, symbols, labels, prices = {}, [], [], [], []
+        for run_id, symbol, label, price in rows:
+            runs.append(run_ids.setdefault(run_id, len(run_ids)))
+            symbols.append(symbol)
+            labels.append(label)
+            prices.append(price)
+        return cls(run_ids, runs, symbols, to_months(labels), prices)
+
+
+SCORED_HORIZON = "monthly"
+
+
+def scored_runs(runs):
+    """
+    The runs of a PredictionRun queryset that backtests can score: valid
+    ones of SCORED_HORIZON.
+    """
+    return runs.filter(valid_csv=True, horizon=SCORED_HORIZON)
+
+
+def load_stored_predictions(runs):
+    """
+    PredictionSet of stored runs (a PredictionRun queryset), read in one
+    query. Runs of another horizon than SCORED_HORIZON are left out.
+    """
+    from .models import PredictionRow
+
+    rows = PredictionRow.objects.filter(
+        run__in=runs, run__horizon=SCORED_HORIZON, month__isnull=False,
+    ).order_by()
+    values = list(rows.values_list("run_id", "symbol", "month", "price"))
+    if not values:
+        return PredictionSet([], [], [], [], [])
+    run_ids, symbols, months, prices = zip(*values)
+    ids, runs = np.unique(np.asarray([str(run_id) for run_id in run_ids], dtype=str), return_inverse=True)
+    return PredictionSet(ids.tolist(), runs.reshape(-1), symbols, np.asarray(months, dtype="datetime64[M]"), prices)
+
+
+class RealizedPrices:
+    """
+    Last close of every (symbol, month) of a PriceTable.
+    """
+
+    def __init__(self, symbols, months, closes):
+        self.symbols = np.asarray(symbols, dtype=str)
+        self.months = np.asarray(months, dtype="datetime64[M]")
+        self.closes = np.asarray(closes, dtype=np.float64)
+
+    @classmethod
+    def from_table(cls, table):
+        codes, months, closes = monthly_closes(table)
+        return cls(table.symbols[codes], to_months(months), closes)
+
+
+class BacktestResult:
+    """
+    Scores of a backtest. portfolio is one dict; runs and symbols are lists
+    of dicts, in run and symbol order.
+    """
+
+    def __init__(self, portfolio, runs, symbols):
+        self.portfolio = portfolio
+        self.runs = runs
+        self.symbols = symbols
+
+    def as_dict(self):
+        return {"portfolio": self.portfolio, "runs": self.runs, "symbols": self.symbols}
+
+
+def _ratio(numerator, denominator):
+    return np.where(denominator > 0, numerator / np.where(denominator > 0, denominator, 1), np.nan)
+
+
+def _number(value):
+    # JSON and templates get None instead of NaN
+    return None if value is None or not np.isfinite(value) else float(value)
+
+
+def score_predictions(predictions, realized, top_n=10):
+    """
+    Score every run of a PredictionSet against RealizedPrices; see the
+    module docstring for the metrics. Rows without a realized price are
+    counted as unscored.
+    """
+    n = len(predictions)
+    symbols, codes = np.unique(np.concatenate([predictions.symbols, realized.symbols]), return_inverse=True)
+    codes = codes.reshape(-1)
+    pred_codes, real_codes = codes[:n], codes[n:]
+    pred_months = predictions.months.astype(np.int64)
+    real_months = realized.months.astype(np.int64)
+    known = ~np.isnat(predictions.months)
+
+    # One integer key per (symbol, month); the month before the earliest
+    # one still gets a key of its own
+    all_months = np.concatenate([pred_months[known], real_months])
+    lowest = all_months.min() - 1 if len(all_months) else 0
+    span = all_months.max() - lowest + 1 if len(all_months) else 1
+    real_keys = real_codes * span + (real_months - lowest)
+    order = np.argsort(real_keys, kind="stable")
+    sorted_keys, sorted_closes = real_keys[order], realized.closes[order]
+
+    def lookup(keys):
+        positions = np.minimum(np.searchsorted(sorted_keys, keys), max(len(sorted_keys) - 1, 0))
+        if not len(sorted_keys):
+            return np.full(len(keys), np.nan)
+        return np.where(sorted_keys[positions] == keys, sorted_closes[positions], np.nan)
+
+    # Rows sorted by (run, symbol, month); a group is one symbol of one run
+    rows = np.flatnonzero(known)
+    composite = (predictions.runs[rows] * len(symbols) + pred_codes[rows]) * span + (pred_months[rows] - lowest)
+    rows = rows[np.argsort(composite, kind="stable")]
+    runs, sym, months, prices = predictions.runs[rows], pred_codes[rows], pred_months[rows], predictions.prices[rows]
+    actual = lookup(sym * span + (months - lowest))
+    new_group = np.r_[True, (runs[1:] != runs[:-1]) | (sym[1:] != sym[:-1])] if len(rows) else np.zeros(0, dtype=bool)
+    group = np.cumsum(new_group) - 1
+    starts = np.flatnonzero(new_group)
+    base = lookup(sym[starts] * span + (months[starts] - 1 - lowest))[group] if len(rows) else np.zeros(0)
+
+    scored = np.isfinite(actual) & (actual > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ape = np.where(scored, np.abs(prices - actual) / actual, 0.0)
+    directional = scored & np.isfinite(base)
+    hits = directional & (np.sign(prices - base) == np.sign(actual - base))
+
+    run_count = len(predictions.run_ids)
+    symbol_count = len(symbols)
+    run_rows = np.bincount(predictions.runs, minlength=run_count)
+    run_scored = np.bincount(runs, weights=scored, minlength=run_count)
+    run_mape = _ratio(np.bincount(runs, weights=ape, minlength=run_count), run_scored)
+    run_directional = np.bincount(runs, weights=directional, minlength=run_count)
+    run_hit_rate = _ratio(np.bincount(runs, weights=hits, minlength=run_count), run_directional)
+    symbol_scored = np.bincount(sym, weights=scored, minlength=symbol_count)
+    symbol_mape = _ratio(np.bincount(sym, weights=ape, minlength=symbol_count), symbol_scored)
+    symbol_directional = np.bincount(sym, weights=directional, minlength=symbol_count)
+    symbol_hit_rate = _ratio(np.bincount(sym, weights=hits, minlength=symbol_count), symbol_directional)
+
+    # Returns over each group's last directional row, then the run's top_n by predicted return
+    last = np.flatnonzero(directional)
+    if len(last):
+        last = last[np.r_[group[last][1:] != group[last][:-1], True]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        predicted_return = prices[last] / base[last] - 1.0
+        realized_return = actual[last] / base[last] - 1.0
+    last_runs = runs[last]
+    ranking = np.lexsort((sym[last], -predicted_return, last_runs))
+    ranked_runs = last_runs[ranking]
+    run_start = np.searchsorted(ranked_runs, ranked_runs)
+    picked = np.zeros(len(last), dtype=bool)
+    picked[ranking] = np.arange(len(ranking)) - run_start < top_n
+    run_top_return = _ratio(
+        np.bincount(last_runs, weights=realized_return * picked, minlength=run_count),
+        np.bincount(last_runs, weights=picked, minlength=run_count),
+    )
+    run_mean_return = _ratio(
+        np.bincount(last_runs, weights=realized_return, minlength=run_count),
+        np.bincount(last_runs, minlength=run_count),
+    )
+
+    total_scored = int(scored.sum())
+    total_directional = int(directional.sum())
+    with np.errstate(invalid="ignore"):
+        top = run_top_return[np.isfinite(run_top_return)]
+        mean = run_mean_return[np.isfinite(run_mean_return)]
+    portfolio = {
+        "runs": run_count,
+        "rows": int(n),
+        "scored_rows": total_scored,
+        "mape": _number(ape.sum() / total_scored) if total_scored else None,
+        "hit_rate": _number(hits.sum() / total_directional) if total_directional else None,
+        "top_return": _number(top.mean()) if len(top) else None,
+        "mean_return": _number(mean.mean()) if len(mean) else None,
+    }
+    portfolio["excess_return"] = (
+        portfolio["top_return"] - portfolio["mean_return"] if portfolio["top_return"] is not None else None
+    )
+    run_results = [
+        {
+            "run": run_id,
+            "rows": int(run_rows[i]),
+            "scored_rows": int(run_scored[i]),
+            "mape": _number(run_mape[i]),
+            "hit_rate": _number(run_hit_rate[i]),
+            "top_return": _number(run_top_return[i]),
+            "mean_return": _number(run_mean_return[i]),
+        }
+        for i, run_id in enumerate(predictions.run_ids)
+    ]
+    predicted = np.bincount(pred_codes, minlength=symbol_count) > 0
+    symbol_results = [
+        {
+            "symbol": str(symbols[i]),
+            "scored_rows": int(symbol_scored[i]),
+            "mape": _number(symbol_mape[i]),
+            "hit_rate": _number(symbol_hit_rate[i]),
+        }
+        for i in np.flatnonzero(predicted)
+    ]
+    return BacktestResult(portfolio, run_results, symbol_results)
+
+
+def _replay_window(symbols, codes, months, closes, cutoff, history, horizon, alpha):
+    """
+    Forecast `horizon` months after cutoff from the monthly closes up to it.
+    Returns (symbols, month labels, prices) columns. Runs in a worker process.
+    """
+    keep = (months <= cutoff) & (months > cutoff - history) if history else months <= cutoff
+    present, window_codes = np.unique(codes[keep], return_inverse=True)
+    if not len(present):
+        return np.array([], dtype=str), np.array([], dtype=str), np.array([])
+    labels = np.datetime_as_string(months[keep], unit="M")
+    table = PriceTable(symbols[present], window_codes.reshape(-1), labels, {"close": closes[keep]})
+    ranked = forecast_table(table, top_n=len(present), months=horizon, alpha=alpha)
+    return (
+        np.repeat([symbol for symbol, _, _, _ in ranked], horizon),
+        np.concatenate([month_labels for _, month_labels, _, _ in ranked]),
+        np.concatenate([prices for _, _, prices, _ in ranked]),
+    )
+
+
+def walk_forward(table, windows=12, horizon=12, history=None, min_history=3, alpha=0.5, max_workers=1):
+    """
+    Replay the local baseline over the last `windows` months of a PriceTable:
+    each cutoff month gets a forecast from the data up to it (only the last
+    `history` months, if given). Windows run on max_workers processes (all
+    cores for None). Returns (PredictionSet with one run per cutoff,
+    RealizedPrices of the table).
+    """
+    codes, labels, closes = monthly_closes(table)
+    months = to_months(labels)
+    realized = RealizedPrices(table.symbols[codes], months, closes)
+    distinct = np.unique(months)
+    # Every cutoff needs min_history months before it and one realized month after it
+    cutoffs = distinct[max(min_history - 1, 0):-1][-windows:] if windows else distinct[:0]
+    jobs = [
+        (table.symbols, codes, months, closes, cutoff, history, horizon, alpha)
+        for cutoff in cutoffs
+    ]
+    if max_workers == 1 or len(jobs) < 2:
+        results = [_replay_window(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+            results = list(pool.map(_replay_window, *zip(*jobs)))
+    run_ids = [f"walk-forward {cutoff}" for cutoff in np.datetime_as_string(cutoffs, unit="M")]
+    lengths = [len(prices) for _, _, prices in results]
+    predictions = PredictionSet(
+        run_ids,
+        np.repeat(np.arange(len(results)), lengths),
+        np.concatenate([symbols for symbols, _, _ in results]) if results else [],
+        np.concatenate([labels for _, labels, _ in results]).astype("datetime64[M]") if results else [],
+        np.concatenate([prices for _, _, prices in results]) if results else [],
+    )
+    return predictions, realized
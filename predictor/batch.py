@@ -0,0 +1,367 @@
+"""
+Batch predictions for many (csv, instructions) pairs in one request.
+
+A batch is a list of items, each with an id, the CSV text and optional
+instructions. Identical (csv, instructions) payloads are predicted once and
+their result is reused for every duplicate. Unique payloads run on a bounded
+thread pool; calls rejected by the provider's rate limit are retried with
+exponential backoff, and while one worker is backing off the others wait
+too instead of piling more requests onto the limit.
+
+Results are yielded as they complete and can be written out as
+newline-delimited JSON (one object per item, then a summary line) or as a
+zip with one <id>/prediction.csv per item plus summary.json. The summary
+reports aggregate throughput in requests per minute.
+"""
+import json
+import random
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+from .artifacts import content_hash
+
+DEFAULT_BATCH_SETTINGS = {
+    "MAX_ITEMS": 100,
+    "MAX_CONCURRENCY": 4,
+    "MAX_RETRIES": 5,  # rate-limited attempts retried per item
+    "BACKOFF_BASE": 2.0,  # seconds; doubled on every retry
+    "BACKOFF_MAX": 60.0,
+}
+
+FORMATS = ("ndjson", "zip")
+
+OK = "ok"
+INVALID = "invalid"  # the LLM answered, but without a usable prediction CSV
+ERROR = "error"
+
+
+class BatchRequestError(ValueError):
+    """
+    Raised when a batch payload is malformed.
+    """
+
+
+def get_batch_settings():
+    config = dict(DEFAULT_BATCH_SETTINGS)
+    config.update(getattr(settings, "PREDICTION_BATCH", None) or {})
+    return config
+
+
+def parse_batch_items(payload, max_items=None):
+    """
+    Validate a decoded batch payload ({"items": [...]} or a bare list) and
+    return a list of {"id", "csv", "instructions"} dicts. Items without an
+    id are numbered by position; instructions default to None.
+    """
+    items = payload.get("items") if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        raise BatchRequestError("Batch must contain a non-empty list of items")
+    if max_items is not None and len(items) > max_items:
+        raise BatchRequestError(f"Batch has {len(items)} items, the limit is {max_items}")
+    parsed = []
+    seen_ids = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise BatchRequestError(f"Item {index} is not an object")
+        item_id = str(item.get("id", index))
+        if item_id in seen_ids:
+            raise BatchRequestError(f"Duplicate item id {item_id!r}")
+        seen_ids.add(item_id)
+        csv_data = item.get("csv")
+        if not isinstance(csv_data, str) or not csv_data.strip():
+            raise BatchRequestError(f"Item {item_id!r} has no csv")
+        instructions = item.get("instructions")
+        if instructions is not None and not isinstance(instructions, str):
+            raise BatchRequestError(f"Item {item_id!r} has non-text instructions")
+        parsed.append({"id": item_id, "csv": csv_data, "instructions": instructions})
+    return parsed
+
+
+def payload_key(csv_data: str, instructions):
+    """
+    Content key identifying duplicate payloads within a batch.
+    """
+    return content_hash(f"{len(csv_data)}:{csv_data}{instructions or ''}")
+
+
+def is_rate_limit_error(error):
+    """
+    True for provider rate-limit rejections (HTTP 429), e.g.
+    openai.RateLimitError as raised through langchain.
+    """
+    if getattr(error, "status_code", None) == 429:
+        return True
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        return True
+    return type(error).__name__ == "RateLimitError"
+
+
+def retry_after(error):
+    """
+    Seconds the provider asked us to wait, from a Retry-After header, or None.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class BatchStats:
+    """
+    Counters for one batch run. requests_per_minute counts every item
+    answered, including duplicates served from a shared result.
+    """
+
+    def __init__(self, items=0, unique=0):
+        self.items = items
+        self.unique = unique
+        self.completed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.attempts = 0  # LLM pipeline calls, including retries
+        self.rate_limited = 0
+        self.cache_hits = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, status):
+        with self._lock:
+            self.completed += 1
+            if status == OK:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def requests_per_minute(self):
+        elapsed = self.elapsed
+        return self.completed * 60.0 / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            "items": self.items,
+            "unique": self.unique,
+            "duplicates": self.items - self.unique,
+            "completed": self.completed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "attempts": self.attempts,
+            "rate_limited": self.rate_limited,
+            "cache_hits": self.cache_hits,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "requests_per_minute": round(self.requests_per_minute, 2),
+        }
+
+
+class BatchRunner:
+    """
+    Runs predict(csv, instructions) -> predict_result.html context for every
+    unique payload of a batch with at most max_concurrency calls in flight.
+
+        runner = BatchRunner(predict)
+        for result in runner.run(items):
+            ...
+        runner.stats.as_dict()
+
+    predict is expected to raise the provider's exception on failure; rate
+    limit errors are retried up to max_retries times, anything else fails
+    the item immediately. Use one runner per batch.
+    """
+
+    def __init__(self, predict, max_concurrency=4, max_retries=5, backoff_base=2.0,
+                 backoff_max=60.0, sleep=time.sleep):
+        self.predict = predict
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sleep = sleep
+        self.stats = BatchStats()
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def _wait_for_cooldown(self):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            self.sleep(delay)
+
+    def _backoff(self, error, retry):
+        delay = retry_after(error)
+        if delay is None:
+            # Exponential backoff with jitter so workers don't retry in lockstep
+            delay = min(self.backoff_max, self.backoff_base * (2 ** retry)) * random.uniform(0.5, 1.0)
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+        self._wait_for_cooldown()
+
+    def _predict_with_retries(self, csv_data, instructions):
+        # Returns (context, error, attempts); exactly one of context/error is set
+        retry = 0
+        while True:
+            self._wait_for_cooldown()
+            with self._lock:
+                self.stats.attempts += 1
+            try:
+                return self.predict(csv_data, instructions), None, retry + 1
+            except Exception as e:
+                if not is_rate_limit_error(e) or retry >= self.max_retries:
+                    return None, e, retry + 1
+                with self._lock:
+                    self.stats.rate_limited += 1
+                self._backoff(e, retry)
+                retry += 1
+
+    def _run_one(self, csv_data, instructions):
+        started = time.monotonic()
+        context, error, attempts = self._predict_with_retries(csv_data, instructions)
+        if error is not None:
+            return {
+                "status": ERROR,
+                "error": f"LLM call failed: {error}",
+                "attempts": attempts,
+                "seconds": round(time.monotonic() - started, 3),
+            }
+        if context.get("cache_hit"):
+            with self._lock:
+                self.stats.cache_hits += 1
+        return {
+            "status": OK if context.get("valid_csv") else INVALID,
+            "run_id": context.get("run_id"),
+            "prediction_csv": context.get("prediction_csv", ""),
+            "explanations": context.get("explanations", ""),
+            "validation_errors": context.get("validation_errors", []),
+            "cache_hit": bool(context.get("cache_hit")),
+            "error": context.get("error"),
+            "attempts": attempts,
+            "seconds": round(time.monotonic() - started, 3),
+        }
+
+    def run(self, items):
+        """
+        Yield one result dict per item, in completion order. Duplicates of
+        a payload are yielded right after it, with duplicate_of set to the
+        id of the item that was actually predicted.
+        """
+        groups = {}
+        for item in items:
+            groups.setdefault(payload_key(item["csv"], item["instructions"]), []).append(item)
+        # Update the stats in place: encoders hold a reference to them
+        self.stats.items, self.stats.unique = len(items), len(groups)
+        self.stats.started = time.monotonic()
+        pool = ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(groups)) or 1)
+        try:
+            pending = {
+                pool.submit(self._run_one, group[0]["csv"], group[0]["instructions"]): group
+                for group in groups.values()
+            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    group = pending.pop(future)
+                    outcome = future.result()
+                    for item in group:
+                        result = {"id": item["id"], **outcome}
+                        if item is not group[0]:
+                            result["duplicate_of"] = group[0]["id"]
+                        self.stats.record(result["status"])
+                        yield result
+        finally:
+            # Also reached when the consumer stops early (client went away)
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.stats.finished = time.monotonic()
+
+
+def build_batch_runner(predict, options=None):
+    """
+    Build a BatchRunner from settings.PREDICTION_BATCH, overridden by options.
+    """
+    config = get_batch_settings()
+    config.update(options or {})
+    return BatchRunner(
+        predict,
+        max_concurrency=config["MAX_CONCURRENCY"],
+        max_retries=config["MAX_RETRIES"],
+        backoff_base=config["BACKOFF_BASE"],
+        backoff_max=config["BACKOFF_MAX"],
+    )
+
+
+def iter_ndjson(results, stats):
+    """
+    Encode results as newline-delimited JSON, ending with a summary line.
+    """
+    for result in results:
+        yield json.dumps(result) + "\n"
+    yield json.dumps({"summary": stats.as_dict()}) + "\n"
+
+
+class _ZipSink:
+    """
+    Write-only file object that hands zipfile's output back in pieces, so
+    the archive can be streamed while it is being built.
+    """
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+SAFE_NAME = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def zip_member_dir(item_id: str):
+    return SAFE_NAME.sub("_", item_id).strip("._") or "item"
+
+
+def iter_zip(results, stats):
+    """
+    Encode results as a zip stream: <id>/prediction.csv for every item with
+    a prediction, and summary.json with the per-item statuses and stats.
+    """
+    sink = _ZipSink()
+    statuses = []
+    used_dirs = set()
+    # zipfile falls back to data descriptors on an unseekable sink
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for result in results:
+            entry = {key: value for key, value in result.items() if key != "prediction_csv"}
+            if result.get("prediction_csv"):
+                directory = zip_member_dir(result["id"])
+                while directory in used_dirs:
+                    directory += "_"
+                used_dirs.add(directory)
+                entry["file"] = f"{directory}/prediction.csv"
+                archive.writestr(entry["file"], result["prediction_csv"] + "\n")
+            statuses.append(entry)
+            yield sink.drain()
+        archive.writestr("summary.json", json.dumps({"results": statuses, "summary": stats.as_dict()}, indent=2))
+    yield sink.drain()
+
+
+ENCODERS = {
+    "ndjson": (iter_ndjson, "application/x-ndjson"),
+    "zip": (iter_zip, "application/zip"),
+}
@@ -0,0 +1,371 @@
+"""
+Prompt token accounting and budgeting.
+
+Every prompt is made of three sections: the system prompt (persona plus the
+user's instructions), the CSV data and the fixed framing of the user
+message. fit_prompt() counts each section with a local tokenizer and, when
+the total exceeds MAX_PROMPT_TOKENS, shrinks the data with the configured
+strategies, in order, until it fits:
+
+    drop_oldest_months  keep only the most recent months (at least MIN_MONTHS)
+    sample_symbols      keep a deterministic sample of the symbols
+    summarize           replace the rows by the per-symbol digest (summarize.py)
+
+Instructions longer than MAX_INSTRUCTIONS_TOKENS are truncated first. Every
+reduction is logged with the token counts before and after.
+
+The tokenizer is loaded lazily, once per encoding, and shared by all
+threads. tiktoken is used when it is installed and its encoding files are
+available locally (it downloads them on first use, or reads them from
+TIKTOKEN_CACHE_DIR); otherwise counts fall back to the four characters per
+token estimate of summarize.estimate_tokens. Counts of short texts such as
+the persona prompt are cached, so repeated predictions only count the data.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .summarize import build_csv_digest, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET_SETTINGS = {
+    "ENABLED": True,
+    "MAX_PROMPT_TOKENS": 16000,
+    "MAX_INSTRUCTIONS_TOKENS": 2000,
+    "STRATEGIES": ["drop_oldest_months", "sample_symbols", "summarize"],
+    "MIN_MONTHS": 12,  # drop_oldest_months never keeps fewer months than this
+    "TOKENIZER": "auto",  # "auto" (tiktoken if available), "tiktoken" or "estimate"
+    "ENCODING": None,  # tiktoken encoding; None picks the model's own
+}
+
+DEFAULT_ENCODING = "cl100k_base"
+MESSAGE_OVERHEAD = 4  # tokens the chat format adds per message
+COUNT_CACHE_SIZE = 256
+COUNT_CACHE_MAX_CHARS = 65536  # longer texts (the data) are not worth caching
+
+
+def get_budget_settings():
+    config = dict(DEFAULT_BUDGET_SETTINGS)
+    config.update(getattr(settings, "PROMPT_BUDGET", None) or {})
+    return config
+
+
+class EstimateTokenizer:
+    """
+    Character-based estimate; needs nothing but the text.
+    """
+
+    name = "estimate"
+
+    def count(self, text: str):
+        return estimate_tokens(text)
+
+    def count_many(self, texts):
+        return [estimate_tokens(text) for text in texts]
+
+    def truncate(self, text: str, max_tokens: int):
+        return text[:max(max_tokens - 1, 0) * 4]
+
+
+class TiktokenTokenizer:
+    """
+    Exact counts for OpenAI models with a tiktoken encoding.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.name = f"tiktoken:{encoding.name}"
+
+    def count(self, text: str):
+        return len(self.encoding.encode_ordinary(text))
+
+    def count_many(self, texts):
+        return [len(tokens) for tokens in self.encoding.encode_ordinary_batch(list(texts))]
+
+    def truncate(self, text: str, max_tokens: int):
+        tokens = self.encoding.encode_ordinary(text)
+        return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+
+
+class CachingTokenizer:
+    """
+    Wraps a tokenizer with an LRU cache of counts for short texts.
+    """
+
+    def __init__(self, tokenizer, size=COUNT_CACHE_SIZE):
+        self.tokenizer = tokenizer
+        self.name = tokenizer.name
+        self.size = size
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, text: str):
+        if len(text) > COUNT_CACHE_MAX_CHARS:
+            return self.tokenizer.count(text)
+        with self._lock:
+            count = self._counts.get(text)
+            if count is not None:
+                self._counts.move_to_end(text)
+                self.hits += 1
+                return count
+        count = self.tokenizer.count(text)
+        with self._lock:
+            self.misses += 1
+            self._counts[text] = count
+            while len(self._counts) > self.size:
+                self._counts.popitem(last=False)
+        return count
+
+    def count_many(self, texts):
+        return self.tokenizer.count_many(texts)
+
+    def truncate(self, text: str, max_tokens: int):
+        return self.tokenizer.truncate(text, max_tokens)
+
+
+def load_tiktoken_encoding(model, encoding_name=None):
+    import tiktoken
+
+    if encoding_name:
+        return tiktoken.get_encoding(encoding_name)
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+
+def get_tokenizer(model=None, config=None):
+    """
+    Return the shared tokenizer for model, loading it on first use. A
+    tokenizer that cannot be loaded (tiktoken missing, encoding files not
+    available offline) falls back to the estimate, and the failure is
+    remembered so it is not retried on every prediction.
+    """
+    config = config or get_budget_settings()
+    key = (config["TOKENIZER"], config["ENCODING"], model)
+    tokenizer = _tokenizers.get(key)
+    if tokenizer is not None:
+        return tokenizer
+    with _tokenizers_lock:
+        tokenizer = _tokenizers.get(key)
+        if tokenizer is None:
+            tokenizer = CachingTokenizer(_load_tokenizer(config["TOKENIZER"], config["ENCODING"], model))
+            _tokenizers[key] = tokenizer
+    return tokenizer
+
+
+def _load_tokenizer(kind, encoding_name, model):
+    if kind == "estimate":
+        return EstimateTokenizer()
+    try:
+        return TiktokenTokenizer(load_tiktoken_encoding(model or "", encoding_name))
+    except Exception as e:
+        if kind == "tiktoken":
+            logger.warning("Could not load the tiktoken encoding, estimating token counts instead: %s", e)
+        else:
+            logger.info("tiktoken is not available, estimating token counts instead: %s", e)
+        return EstimateTokenizer()
+
+
+def reset_tokenizers():
+    with _tokenizers_lock:
+        _tokenizers.clear()
+
+
+class BudgetReport:
+    """
+    Token counts of one prompt before and after fitting it to the budget.
+    """
+
+    def __init__(self, budget, tokenizer_name, sections):
+        self.budget = budget
+        self.tokenizer = tokenizer_name
+        self.before = dict(sections)
+        self.after = dict(sections)
+        self.steps = []  # (strategy, data tokens after it)
+
+    @staticmethod
+    def total(sections):
+        return sum(sections.values()) + 2 * MESSAGE_OVERHEAD
+
+    @property
+    def tokens_before(self):
+        return self.total(self.before)
+
+    @property
+    def tokens_after(self):
+        return self.total(self.after)
+
+    @property
+    def fits(self):
+        return self.tokens_after <= self.budget
+
+    def as_dict(self):
+        return {
+            "budget": self.budget,
+            "tokenizer": self.tokenizer,
+            "before": self.before,
+            "after": self.after,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "steps": self.steps,
+        }
+
+
+def truncate_instructions(instructions: str, config=None, model=None):
+    """
+    Cut the user's instructions to MAX_INSTRUCTIONS_TOKENS, logging it.
+    """
+    config = config or get_budget_settings()
+    if not config["ENABLED"] or not instructions:
+        return instructions
+    limit = config["MAX_INSTRUCTIONS_TOKENS"]
+    tokenizer = get_tokenizer(model, config)
+    count = tokenizer.count(instructions)
+    if count <= limit:
+        return instructions
+    truncated = tokenizer.truncate(instructions, limit) + "\n\n[Instructions truncated to fit the prompt budget.]"
+    logger.info("Truncated instructions from %d to %d tokens", count, limit)
+    return truncated
+
+
+def _split_rows(csv_data: str):
+    # Returns (header, rows, symbol index, date index) or None when the
+    # text is not a symbol,date,... CSV (e.g. already a digest)
+    lines = [line for line in csv_data.splitlines() if line.strip()]
+    if len(lines) < 2:
+        return None
+    header = [name.strip().lower() for name in lines[0].split(",")]
+    if "symbol" not in header or "date" not in header:
+        return None
+    return lines[0], lines[1:], header.index("symbol"), header.index("date")
+
+
+def drop_oldest_months(csv_data: str, data_budget: int, tokenizer, config):
+    """
+    Keep the most recent months of every symbol that fit data_budget, but
+    never fewer than MIN_MONTHS.
+    """
+    split = _split_rows(csv_data)
+    if split is None:
+        return csv_data
+    header, rows, _, date_index = split
+    cells = [row.split(",") for row in rows]
+    months = [cell[date_index].strip()[:7] if len(cell) > date_index else "" for cell in cells]
+    row_tokens = tokenizer.count_many(rows)
+    tokens_by_month = {}
+    for month, tokens in zip(months, row_tokens):
+        tokens_by_month[month] = tokens_by_month.get(month, 0) + tokens + 1
+    used = tokenizer.count(header) + 1
+    kept = []
+    for month in sorted(tokens_by_month, reverse=True):
+        if used + tokens_by_month[month] > data_budget and len(kept) >= config["MIN_MONTHS"]:
+            break
+        used += tokens_by_month[month]
+        kept.append(month)
+    if len(kept) == len(tokens_by_month):
+        return csv_data
+    keep = set(kept)
+    return "\n".join([header] + [row for row, month in zip(rows, months) if month in keep]) + "\n"
+
+
+def sample_symbols(csv_data: str, data_budget: int, tokenizer, config):
+    """
+    Keep whole symbols, in a fixed pseudo-random order (by hash of the
+    symbol, so the same upload always gives the same sample), while they fit.
+    """
+    split = _split_rows(csv_data)
+    if split is None:
+        return csv_data
+    header, rows, symbol_index, _ = split
+    symbols = [row.split(",", symbol_index + 1)[symbol_index].strip() for row in rows]
+    tokens_by_symbol = {}
+    for symbol, tokens in zip(symbols, tokenizer.count_many(rows)):
+        tokens_by_symbol[symbol] = tokens_by_symbol.get(symbol, 0) + tokens + 1
+    note = f"# {{kept}} of {len(tokens_by_symbol)} symbols sampled to fit the token budget"
+    used = tokenizer.count(header) + tokenizer.count(note) + 2
+    kept = set()
+    for symbol in sorted(tokens_by_symbol, key=lambda name: hashlib.sha256(name.encode("utf-8")).digest()):
+        if used + tokens_by_symbol[symbol] > data_budget:
+            continue
+        used += tokens_by_symbol[symbol]
+        kept.add(symbol)
+    if len(kept) == len(tokens_by_symbol) or not kept:
+        return csv_data
+    lines = [header] + [row for row, symbol in zip(rows, symbols) if symbol in kept]
+    lines.append(note.format(kept=len(kept)))
+    return "\n".join(lines) + "\n"
+
+
+def summarize(csv_data: str, data_budget: int, tokenizer, config):
+    """
+    Replace the rows by the per-symbol digest, sized for data_budget.
+    """
+    if _split_rows(csv_data) is None:
+        return csv_data
+    # The digest sizes itself with the estimate and without its trailing
+    # "omitted" note; shrink its budget by any overshoot the tokenizer reports
+    target = data_budget
+    for _ in range(3):
+        try:
+            digest = build_csv_digest(csv_data, target)
+        except ValueError:
+            return csv_data
+        overshoot = tokenizer.count(digest) - data_budget
+        if overshoot <= 0:
+            break
+        target -= max(overshoot, 16)
+    return digest
+
+
+STRATEGIES = {
+    "drop_oldest_months": drop_oldest_months,
+    "sample_symbols": sample_symbols,
+    "summarize": summarize,
+}
+
+
+def fit_prompt(system_prompt: str, csv_data: str, framing: str = "", model=None, config=None):
+    """
+    Fit (system_prompt, csv_data) into MAX_PROMPT_TOKENS by shrinking the
+    data. Returns (csv_data, BudgetReport). The data is returned unchanged
+    when it already fits, when budgeting is disabled, or when no strategy
+    applies; the report then tells by how much the prompt is over.
+    """
+    config = config or get_budget_settings()
+    tokenizer = get_tokenizer(model, config)
+    report = BudgetReport(config["MAX_PROMPT_TOKENS"], tokenizer.name, {
+        "system": tokenizer.count(system_prompt),
+        "framing": tokenizer.count(framing),
+        "data": tokenizer.count(csv_data),
+    })
+    if not config["ENABLED"] or report.fits:
+        return csv_data, report
+    data_budget = report.budget - report.total({**report.before, "data": 0})
+    for name in config["STRATEGIES"]:
+        reduced = STRATEGIES[name](csv_data, data_budget, tokenizer, config)
+        if reduced is csv_data:
+            continue
+        csv_data = reduced
+        report.after["data"] = tokenizer.count(csv_data)
+        report.steps.append((name, report.after["data"]))
+        if report.fits:
+            break
+    log = logger.info if report.fits else logger.warning
+    log(
+        "Prompt %s from %d to %d tokens (budget %d, %s): %s",
+        "reduced" if report.fits else "still over budget after reducing",
+        report.tokens_before, report.tokens_after, report.budget, tokenizer.name,
+        ", ".join(f"{name} -> {tokens} data tokens" for name, tokens in report.steps) or "no strategy applied",
+    )
+    return csv_data, report
@@ -0,0 +1,297 @@
+"""
+Content-addressed cache for LLM responses.
+
+Identical (model, system prompt, CSV payload) triples always produce the same
+key, so resubmitting the same data.csv and instructions.md is served from the
+cache instead of paying for another LLM round-trip.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+DEFAULT_CACHE_SETTINGS = {
+    "BACKEND": "lru",  # "lru", "file", "django" or "dummy"
+    "TTL": 60 * 60,  # seconds; None keeps entries until evicted by size
+    "MAX_ENTRIES": 256,
+    "LOCATION": "/tmp/llm_stock_cache",  # used by the "file" backend
+    "CACHE_ALIAS": "default",  # used by the "django" backend
+}
+
+
+def make_cache_key(model: str, system_prompt: str, csv_data: str):
+    """
+    Hash (model, system prompt, CSV payload) into a stable hex key.
+    """
+    digest = hashlib.sha256()
+    for part in (model, system_prompt, csv_data):
+        encoded = (part or "").encode("utf-8")
+        # Length-prefix each part so ("ab", "c") and ("a", "bc") never collide
+        digest.update(str(len(encoded)).encode("ascii") + b":")
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class LRUCacheBackend:
+    """
+    In-process LRU cache with per-entry expiry. Thread-safe.
+    """
+
+    def __init__(self, ttl=None, max_entries=256, **kwargs):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FileCacheBackend:
+    """
+    On-disk cache: one JSON file per key, evicting the least recently used
+    files (by mtime) once MAX_ENTRIES is exceeded.
+    """
+
+    def __init__(self, location, ttl=None, max_entries=256, **kwargs):
+        self.location = location
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(self.location, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.location, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        expires_at = entry.get("expires_at")
+        if expires_at is not None and expires_at <= time.time():
+            self._remove(path)
+            return None
+        # Touch the file so eviction order follows recency of use
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get("value")
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": expires_at, "value": value}, f)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _entries(self):
+        try:
+            names = os.listdir(self.location)
+        except OSError:
+            return []
+        return [os.path.join(self.location, n) for n in names if n.endswith(".json")]
+
+    def _evict(self):
+        with self._lock:
+            entries = self._entries()
+            overflow = len(entries) - self.max_entries
+            if overflow <= 0:
+                return
+            entries.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+            for path in entries[:overflow]:
+                self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        for path in self._entries():
+            self._remove(path)
+
+    def __len__(self):
+        return len(self._entries())
+
+
+class DjangoCacheBackend:
+    """
+    Delegates to a cache configured in settings.CACHES, so entries can be
+    shared between processes (memcached, redis, database cache, ...).
+    Size-based eviction is left to the underlying cache.
+
+    The alias may be shared with other users (e.g. the throttling buckets),
+    so clear() cannot wipe it: keys carry a generation number, and clear()
+    moves to the next generation. Entries of older generations are never
+    read again and expire with their TTL.
+    """
+
+    key_prefix = "llm-response:"
+    generation_key = key_prefix + "generation"
+
+    def __init__(self, cache_alias="default", ttl=None, **kwargs):
+        from django.core.cache import caches
+
+        self.cache = caches[cache_alias]
+        self.ttl = ttl
+
+    def _key(self, key):
+        generation = self.cache.get_or_set(self.generation_key, 0, timeout=None)
+        return f"{self.key_prefix}{generation}:{key}"
+
+    def get(self, key):
+        return self.cache.get(self._key(key))
+
+    def set(self, key, value):
+        self.cache.set(self._key(key), value, timeout=self.ttl)
+
+    def clear(self):
+        try:
+            self.cache.incr(self.generation_key)
+        except ValueError:
+            self.cache.set(self.generation_key, 1, timeout=None)
+
+
+class DummyCacheBackend:
+    """
+    Never stores anything; used to switch the response cache off.
+    """
+
+    def __init__(self, **kwargs):
+        pass
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+
+BACKENDS = {
+    "lru": LRUCacheBackend,
+    "file": FileCacheBackend,
+    "django": DjangoCacheBackend,
+    "dummy": DummyCacheBackend,
+}
+
+
+class ResponseCache:
+    """
+    Front-end over a cache backend that keeps hit/miss counters.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    make_key = staticmethod(make_cache_key)
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def build_response_cache(options=None):
+    """
+    Build a ResponseCache from a settings-style dict (see DEFAULT_CACHE_SETTINGS).
+    """
+    config = dict(DEFAULT_CACHE_SETTINGS)
+    config.update(options or {})
+    backend_name = config["BACKEND"]
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Unknown LLM response cache backend: {backend_name}")
+    backend = BACKENDS[backend_name](
+        ttl=config["TTL"],
+        max_entries=config["MAX_ENTRIES"],
+        location=config["LOCATION"],
+        cache_alias=config["CACHE_ALIAS"],
+    )
+    return ResponseCache(backend)
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Return the process-wide response cache configured by
+    settings.LLM_RESPONSE_CACHE.
+    """
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = build_response_cache(getattr(settings, "LLM_RESPONSE_CACHE", None))
+    return _response_cache
+
+
+def reset_response_cache():
+    """
+    Drop the process-wide cache so the next call rebuilds it from settings.
+    """
+    global _response_cache
+    with _response_cache_lock:
+        _response_cache = None
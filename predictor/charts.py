@@ -0,0 +1,218 @@
+"""
+Server-side shaping of prediction results for the result page.
+
+The parsed prediction rows are grouped by symbol once into a compact chart
+payload:
+
+    {"labels": ["2024-07", ...],
+     "series": [{"symbol": "AAPL", "color": "#3366cc", "values": [200.0, ...]}, ...]}
+
+(ensemble predictions add "low"/"high" lists to each series, see
+add_chart_bands), which is either embedded with json_script for the Chart.js renderer or
+rendered here as a static SVG, so the result page needs no CDN script and
+no per-row template loops.
+"""
+from html import escape
+
+from django.conf import settings
+
+from .history import format_price
+from .results import get_shape_settings, period_title
+
+DEFAULT_CHART_SETTINGS = {
+    "RENDERER": "svg",  # "svg" (static, offline) or "chartjs" (interactive, loads Chart.js)
+    "MAX_SERIES": None,  # symbols drawn; None draws the shape's SYMBOLS
+    "WIDTH": 800,
+    "HEIGHT": 400,
+}
+
+COLORS = [
+    "#3366cc", "#dc3912", "#ff9900", "#109618", "#990099",
+    "#0099c6", "#dd4477", "#66aa00", "#b82e2e", "#316395",
+]
+
+
+def get_chart_settings():
+    config = dict(DEFAULT_CHART_SETTINGS)
+    config.update(getattr(settings, "PREDICTION_CHART", None) or {})
+    if config["MAX_SERIES"] is None:
+        config["MAX_SERIES"] = get_shape_settings()["SYMBOLS"]
+    return config
+
+
+def chart_title(payload, period=None):
+    """
+    "Predicted Prices for Top 10 Stocks (12 Months)", counting the series
+    and labels the payload actually draws. period defaults to the one of
+    the configured PREDICTION_SHAPE.
+    """
+    period = period or period_title(get_shape_settings()["HORIZON"])
+    return (
+        f"Predicted Prices for Top {len(payload['series'])} Stocks "
+        f"({len(payload['labels'])} {period}s)"
+    )
+
+
+def build_chart_payload(rows, max_series=10):
+    """
+    Group (symbol, month, price) rows into {"labels", "series"}. Months and
+    symbols keep their first-seen order; months a symbol has no prediction
+    for are None. Only the first max_series symbols are kept.
+    """
+    month_index = {}
+    series_index = {}
+    series = []
+    cells = []
+    for symbol, month, price in rows:
+        if month not in month_index:
+            month_index[month] = len(month_index)
+        position = series_index.get(symbol)
+        if position is None:
+            if len(series) >= max_series:
+                continue
+            position = series_index[symbol] = len(series)
+            series.append({"symbol": symbol, "color": COLORS[position % len(COLORS)], "values": None})
+        cells.append((position, month_index[month], price))
+    for entry in series:
+        entry["values"] = [None] * len(month_index)
+    for position, column, price in cells:
+        series[position]["values"][column] = price
+    return {"labels": list(month_index), "series": series}
+
+
+def add_chart_bands(payload, bands):
+    """
+    Add the interquartile band of parsing.BandRow rows to the payload's
+    series as "low" and "high" lists aligned with "values".
+    """
+    columns = {month: i for i, month in enumerate(payload["labels"])}
+    by_symbol = {}
+    for band in bands:
+        by_symbol.setdefault(band.symbol, []).append(band)
+    for entry in payload["series"]:
+        entry["low"] = [None] * len(columns)
+        entry["high"] = [None] * len(columns)
+        for band in by_symbol.get(entry["symbol"], ()):
+            column = columns.get(band.month)
+            if column is not None:
+                entry["low"][column], entry["high"][column] = band.low, band.high
+    return payload
+
+
+def render_page_rows(rows):
+    """
+    <tr> rows for a page of (symbol, month, price) prediction rows, parsed
+    or stored, with prices written as in prediction.csv.
+    """
+    return "".join(
+        f"<tr><td>{escape(symbol)}</td><td>{escape(month)}</td><td>{format_price(price)}</td></tr>"
+        for symbol, month, price in rows
+    )
+
+
+def render_band_rows(bands, limit=120):
+    """
+    <tr> rows (symbol, month, median, p25 - p75, samples) for the
+    uncertainty table of an ensemble prediction. Takes parsing.BandRow
+    rows or plain sequences, as they come back from a job store's JSON.
+    """
+    return "".join(
+        f"<tr><td>{escape(symbol)}</td><td>{escape(month)}</td><td>{_format_price(median)}</td>"
+        f"<td>{_format_price(low)} – {_format_price(high)}</td><td>{samples}</td></tr>"
+        for symbol, month, low, median, high, samples in bands[:limit]
+    )
+
+
+def _format_price(value):
+    return f"{value:,.2f}".rstrip("0").rstrip(".")
+
+
+def render_svg_chart(payload, width=800, height=400, title=None):
+    """
+    Render the chart payload as a standalone line chart SVG, titled
+    chart_title(payload) unless title is given.
+    """
+    title = title or chart_title(payload)
+    labels, series = payload["labels"], payload["series"]
+    values = [
+        value for entry in series for key in ("values", "low", "high")
+        for value in entry.get(key) or () if value is not None
+    ]
+    left, right, top, bottom = 70, 20, 60, 40
+    plot_width, plot_height = width - left - right, height - top - bottom
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" id="predictionChart" role="img" '
+        f'viewBox="0 0 {width} {height}" width="{width}" height="{height}" font-family="sans-serif" font-size="12">',
+        f"<title>{escape(title)}</title>",
+        f'<text x="{width / 2}" y="18" text-anchor="middle" font-size="14">{escape(title)}</text>',
+    ]
+    if not values:
+        parts.append(f'<text x="{width / 2}" y="{height / 2}" text-anchor="middle">No predictions to chart</text></svg>')
+        return "".join(parts)
+
+    low, high = min(values), max(values)
+    if high == low:
+        low, high = low - 1, high + 1
+    step = plot_width / max(len(labels) - 1, 1)
+
+    def x(column):
+        return round(left + column * step, 1)
+
+    def y(value):
+        return round(top + (high - value) / (high - low) * plot_height, 1)
+
+    # Axes with min/max price and first/last month labels
+    parts.append(
+        f'<path d="M{left},{top}V{top + plot_height}H{left + plot_width}" fill="none" stroke="#888"/>'
+        f'<text x="{left - 6}" y="{top + 4}" text-anchor="end">{_format_price(high)}</text>'
+        f'<text x="{left - 6}" y="{top + plot_height + 4}" text-anchor="end">{_format_price(low)}</text>'
+    )
+    for column in sorted({0, len(labels) - 1}):
+        parts.append(
+            f'<text x="{x(column)}" y="{height - bottom + 18}" text-anchor="middle">{escape(labels[column])}</text>'
+        )
+
+    for entry in series:
+        # Uncertainty bands first, so every line stays visible on top of them
+        band_low, band_high = entry.get("low"), entry.get("high")
+        if not band_low:
+            continue
+        columns = [
+            column for column in range(len(labels)) if band_low[column] is not None and band_high[column] is not None
+        ]
+        if len(columns) > 1:
+            outline = [f"{x(column)},{y(band_high[column])}" for column in columns]
+            outline += [f"{x(column)},{y(band_low[column])}" for column in reversed(columns)]
+            parts.append(
+                f'<polygon points="{" ".join(outline)}" fill="{escape(entry["color"])}" '
+                f'fill-opacity="0.15" stroke="none"/>'
+            )
+
+    legend_x = left
+    for entry in series:
+        color = escape(entry["color"])
+        # Break the line where a month is missing
+        segments, current = [], []
+        for column, value in enumerate(entry["values"]):
+            if value is None:
+                if current:
+                    segments.append(current)
+                current = []
+            else:
+                current.append(f"{x(column)},{y(value)}")
+        if current:
+            segments.append(current)
+        for points in segments:
+            if len(points) == 1:
+                cx, cy = points[0].split(",")
+                parts.append(f'<circle cx="{cx}" cy="{cy}" r="3" fill="{color}"/>')
+            else:
+                parts.append(f'<polyline points="{" ".join(points)}" fill="none" stroke="{color}" stroke-width="2"/>')
+        symbol = escape(entry["symbol"])
+        parts.append(
+            f'<rect x="{legend_x}" y="30" width="10" height="10" fill="{color}"/>'
+            f'<text x="{legend_x + 14}" y="39">{symbol}</text>'
+        )
+        legend_x += 14 + 8 * len(entry["symbol"]) + 16
+    parts.append("</svg>")
+    return "".join(parts)
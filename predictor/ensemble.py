@@ -0,0 +1,296 @@
+"""
+Ensemble prediction: several LLM samples of one prompt, aggregated.
+
+A single completion is one noisy draw of the price paths. With
+PREDICTION_ENSEMBLE["ENABLED"], SAMPLES calls are made concurrently, each
+with the next of VARIANTS as its invoke options (e.g. a temperature or a
+seed; a "model" key picks another model), and the prediction CSVs of the
+samples are aligned on a (sample, symbol, month) grid. The consensus is the
+per-cell median, the uncertainty the interquartile range across samples.
+The aggregate is an ordinary completion:
+
+    ```csv
+    symbol,month,predicted_price          the medians, validated as usual
+    ```
+    ```bands
+    symbol,month,p25,median,p75,samples   see parsing.ParsedPrediction.bands
+    ```
+    Explanations: ...
+
+so the response cache, the history and streaming handle it unchanged. It
+keeps the symbols and periods PREDICTION_SHAPE asks for (see results.py).
+
+Wall time stays close to that of one call: the samples run in parallel, and
+once QUORUM of them produced a prediction the stragglers get GRACE more
+seconds and are then cancelled (async calls are aborted; sync calls already
+running finish in the background and are ignored).
+"""
+import asyncio
+import contextvars
+import time
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+from django.conf import settings
+
+from .metrics import record_ensemble_sample
+from .results import get_shape_settings
+from .sharding import extract_candidates
+
+DEFAULT_ENSEMBLE_SETTINGS = {
+    "ENABLED": False,
+    "SAMPLES": 5,
+    "QUORUM": 3,  # samples with a prediction to wait for; None waits for all of them
+    "GRACE": 0.0,  # seconds stragglers still get once the quorum is reached
+    "VARIANTS": [  # invoke options of the samples, cycled
+        {"temperature": 0.2},
+        {"temperature": 0.5},
+        {"temperature": 0.8},
+        {"temperature": 1.0},
+        {"temperature": 1.2},
+    ],
+    "MAX_CONCURRENCY": 5,
+}
+
+BANDS_HEADER = "symbol,month,p25,median,p75,samples"
+
+
+def get_ensemble_settings():
+    config = dict(DEFAULT_ENSEMBLE_SETTINGS)
+    config.update(getattr(settings, "PREDICTION_ENSEMBLE", None) or {})
+    return config
+
+
+def should_ensemble(config=None):
+    config = config or get_ensemble_settings()
+    return bool(config["ENABLED"]) and config["SAMPLES"] > 1
+
+
+def ensemble_label(config=None):
+    """
+    Suffix for the model name in cache keys and the history, e.g.
+    "ensemble5", so ensembles and single calls are kept apart.
+    """
+    config = config or get_ensemble_settings()
+    return f"ensemble{config['SAMPLES']}"
+
+
+def sample_variants(config):
+    variants = config["VARIANTS"] or [{}]
+    return [dict(variants[i % len(variants)]) for i in range(config["SAMPLES"])]
+
+
+class EnsembleResult:
+    """
+    Per-cell statistics over the samples: symbols x months arrays of the
+    25th percentile, median and 75th percentile price, and of how many
+    samples predicted the cell (0 where none did; the prices are NaN there).
+    """
+
+    def __init__(self, symbols, months, low, median, high, counts, samples, requested):
+        self.symbols = symbols
+        self.months = months
+        self.low = low
+        self.median = median
+        self.high = high
+        self.counts = counts
+        self.samples = samples
+        self.requested = requested
+
+
+def aggregate_samples(samples, top_n=10, months=12, requested=None):
+    """
+    Aggregate samples, each {symbol: [(month, price), ...]} as returned by
+    sharding.extract_candidates, into an EnsembleResult. The top_n symbols
+    predicted by most samples are kept (ties: best average position within
+    the samples, then name), with the first `months` months any of them has.
+    """
+    votes = {}
+    for candidates in samples:
+        for position, symbol in enumerate(candidates):
+            count, positions = votes.get(symbol, (0, 0))
+            votes[symbol] = (count + 1, positions + position)
+    symbols = sorted(votes, key=lambda symbol: (-votes[symbol][0], votes[symbol][1] / votes[symbol][0], symbol))
+    symbols = symbols[:top_n]
+    month_labels = sorted({month for candidates in samples for symbol in symbols
+                           for month, _ in candidates.get(symbol, ())})[:months]
+
+    symbol_index = {symbol: i for i, symbol in enumerate(symbols)}
+    month_index = {month: i for i, month in enumerate(month_labels)}
+    grid = np.full((len(samples), len(symbols), len(month_labels)), np.nan)
+    for k, candidates in enumerate(samples):
+        for symbol, points in candidates.items():
+            row = symbol_index.get(symbol)
+            if row is None:
+                continue
+            for month, price in points:
+                column = month_index.get(month)
+                if column is not None:
+                    grid[k, row, column] = price
+    counts = np.count_nonzero(~np.isnan(grid), axis=0)
+    with warnings.catch_warnings():
+        # Cells no sample predicted are all-NaN slices; they stay NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        low, median, high = np.nanpercentile(grid, [25, 50, 75], axis=0)
+    return EnsembleResult(symbols, month_labels, low, median, high, counts, len(samples), requested or len(samples))
+
+
+def _price(value):
+    return f"{value:.2f}"
+
+
+def ensemble_completion(result, explanations=()):
+    """
+    The completion for an EnsembleResult (see the module docstring).
+    explanations are the samples' explanation texts; the first line a
+    sample wrote about a symbol explains it.
+    """
+    lines = ["symbol,month,predicted_price"]
+    bands = [BANDS_HEADER]
+    for i, symbol in enumerate(result.symbols):
+        for j, month in enumerate(result.months):
+            if not result.counts[i, j]:
+                continue
+            lines.append(f"{symbol},{month},{_price(result.median[i, j])}")
+            bands.append(
+                f"{symbol},{month},{_price(result.low[i, j])},{_price(result.median[i, j])},"
+                f"{_price(result.high[i, j])},{result.counts[i, j]}"
+            )
+    explanation_lines = {}
+    for text in explanations:
+        for line in text.splitlines():
+            symbol = line.split(":", 1)[0].strip().strip("*-# ")
+            if symbol in result.symbols and symbol not in explanation_lines:
+                explanation_lines[symbol] = line.strip()
+    summary = (
+        f"Consensus of {result.samples} of {result.requested} samples: median prices, "
+        f"with the interquartile range across samples as the uncertainty band."
+    )
+    body = "\n".join(
+        explanation_lines.get(symbol, f"{symbol}: median of {int(result.counts[i].max())} samples.")
+        for i, symbol in enumerate(result.symbols)
+    )
+    return (
+        "```csv\n" + "\n".join(lines) + "\n```\n"
+        "```bands\n" + "\n".join(bands) + "\n```\n"
+        f"Explanations:\n{summary}\n{body}"
+    )
+
+
+def _outcome(llm_output, parse_output):
+    # (candidates, explanations) of a sample, or the exception that spoiled it
+    try:
+        prediction_csv, _, explanations = parse_output(llm_output)
+    except Exception as e:
+        return e
+    candidates = extract_candidates(prediction_csv)
+    if not candidates:
+        return ValueError("sample has no prediction rows")
+    return candidates, explanations
+
+
+class _Collector:
+    """
+    Gathers sample outcomes until every sample is in, or the quorum is
+    reached and the grace period is over.
+    """
+
+    def __init__(self, config, requested):
+        self.quorum = min(config["QUORUM"] or requested, requested)
+        self.grace = config["GRACE"]
+        self.samples, self.explanations, self.errors = [], [], []
+        self.deadline = None
+
+    def timeout(self):
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def add(self, outcome):
+        if isinstance(outcome, Exception):
+            self.errors.append(outcome)
+            record_ensemble_sample("invalid" if isinstance(outcome, ValueError) else "error")
+        else:
+            self.samples.append(outcome[0])
+            self.explanations.append(outcome[1])
+            record_ensemble_sample("ok")
+        if self.deadline is None and len(self.samples) >= self.quorum:
+            self.deadline = time.monotonic() + self.grace
+
+    def cancelled(self, count):
+        for _ in range(count):
+            record_ensemble_sample("cancelled")
+
+    def completion(self, config, requested):
+        if not self.samples:
+            raise self.errors[-1]
+        shape = get_shape_settings()
+        result = aggregate_samples(self.samples, shape["SYMBOLS"], shape["PERIODS"], requested)
+        return ensemble_completion(result, self.explanations)
+
+
+def predict_ensemble(prompt: str, csv_data: str, call_llm, parse_output, config=None):
+    """
+    Make the samples with call_llm(prompt, csv_data, **variant) on a thread
+    pool and return the aggregated completion. parse_output is
+    views.parse_llm_output. Raises the last error if no sample produced a
+    prediction.
+    """
+    config = config or get_ensemble_settings()
+    variants = sample_variants(config)
+    collector = _Collector(config, len(variants))
+
+    def sample(variant):
+        try:
+            llm_output = call_llm(prompt, csv_data, **variant)
+        except Exception as e:
+            return e
+        return _outcome(llm_output, parse_output)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, config["MAX_CONCURRENCY"]), thread_name_prefix="prediction-ensemble")
+    # Each sample runs in a copy of the caller's context, so token usage
+    # collection and stage timing reach the workers
+    pending = {pool.submit(contextvars.copy_context().run, sample, variant) for variant in variants}
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=collector.timeout(), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                collector.add(future.result())
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        collector.cancelled(len(pending))
+    return collector.completion(config, len(variants))
+
+
+async def apredict_ensemble(prompt: str, csv_data: str, acall_llm, parse_output, config=None):
+    """
+    Async predict_ensemble over acall_llm(prompt, csv_data, **variant);
+    stragglers are cancelled, which aborts their HTTP requests.
+    """
+    config = config or get_ensemble_settings()
+    variants = sample_variants(config)
+    collector = _Collector(config, len(variants))
+    semaphore = asyncio.Semaphore(max(1, config["MAX_CONCURRENCY"]))
+
+    async def sample(variant):
+        try:
+            async with semaphore:
+                llm_output = await acall_llm(prompt, csv_data, **variant)
+        except Exception as e:
+            return e
+        return _outcome(llm_output, parse_output)
+
+    pending = {asyncio.ensure_future(sample(variant)) for variant in variants}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=collector.timeout(), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                collector.add(task.result())
+    finally:
+        for task in pending:
+            task.cancel()
+        collector.cancelled(len(pending))
+    return collector.completion(config, len(variants))
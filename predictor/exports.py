@@ -0,0 +1,145 @@
+"""
+Streaming exports of prediction rows.
+
+Every exporter takes an iterable of (symbol, month, price) tuples, usually
+a database cursor over models.PredictionRow (see history.iter_run_rows), and
+yields bytes. Rows are encoded CHUNK_SIZE at a time, so memory use does not
+grow with the size of the result:
+
+    csv      symbol,month,predicted_price, as the LLM writes it
+    jsonl    one {"symbol", "month", "predicted_price"} object per line
+    columns  one object per chunk of rows, holding each column as a list,
+             for columnar loading without parquet support
+    parquet  Apache Parquet with one row group per chunk (needs pyarrow)
+"""
+import json
+
+from .history import CSV_HEADER, format_price
+
+CHUNK_SIZE = 2000
+COLUMNS = ["symbol", "month", "predicted_price"]
+
+# name: (content type, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "columns": ("application/x-ndjson", "columns.jsonl"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def available_formats():
+    """
+    The export formats this installation can write, in EXPORT_FORMATS order.
+    """
+    return [name for name in EXPORT_FORMATS if name != "parquet" or has_pyarrow()]
+
+
+def export_filename(name, stem="prediction"):
+    return f"{stem}.{EXPORT_FORMATS[name][1]}"
+
+
+def chunked(rows, chunk_size=CHUNK_SIZE):
+    """
+    Lists of up to chunk_size rows.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_csv(rows, chunk_size=CHUNK_SIZE):
+    yield CSV_HEADER.encode("utf-8")
+    for chunk in chunked(rows, chunk_size):
+        yield "".join(f"{symbol},{month},{format_price(price)}\n" for symbol, month, price in chunk).encode("utf-8")
+
+
+def iter_jsonl(rows, chunk_size=CHUNK_SIZE):
+    for chunk in chunked(rows, chunk_size):
+        yield "".join(
+            json.dumps(dict(zip(COLUMNS, row)), separators=(",", ":")) + "\n" for row in chunk
+        ).encode("utf-8")
+
+
+def iter_columns(rows, chunk_size=CHUNK_SIZE):
+    for chunk in chunked(rows, chunk_size):
+        columns = dict(zip(COLUMNS, (list(column) for column in zip(*chunk))))
+        yield (json.dumps(columns, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+class _Drain:
+    """
+    Write-only file object for pyarrow that hands back what was written.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def iter_parquet(rows, chunk_size=CHUNK_SIZE):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([("symbol", pa.string()), ("month", pa.string()), ("predicted_price", pa.float64())])
+    sink = _Drain()
+    writer = pq.ParquetWriter(sink, schema)
+    for chunk in chunked(rows, chunk_size):
+        symbols, months, prices = zip(*chunk)
+        writer.write_table(pa.table([list(symbols), list(months), list(prices)], schema=schema))
+        yield sink.drain()
+    # The footer (schema and row group offsets) comes last
+    writer.close()
+    yield sink.drain()
+
+
+EXPORTERS = {
+    "csv": iter_csv,
+    "jsonl": iter_jsonl,
+    "columns": iter_columns,
+    "parquet": iter_parquet,
+}
+
+
+def iter_export(name, rows, chunk_size=CHUNK_SIZE):
+    """
+    Encode rows in export format name; raises ValueError for formats this
+    installation cannot write.
+    """
+    if name not in available_formats():
+        raise ValueError(f"Unknown export format {name!r}")
+    return EXPORTERS[name](rows, chunk_size)
@@ -0,0 +1,167 @@
+"""
+A local, deterministic stand-in for a remote chat model.
+
+Used by tests and benchmarks (and selectable with LLM_PROVIDER=fake) so the
+prediction pipeline can be exercised offline with simulated latency.
+"""
+import asyncio
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+FAKE_SYMBOLS = ["AAPL", "MSFT", "GOOG", "AMZN", "META", "TSLA", "NFLX", "NVDA", "ORCL", "AMD"]
+
+
+def build_fake_prediction(symbols=None, months=12, start_year=2025):
+    """
+    Build a well-formed completion with a 10x12 prediction CSV, an HTML
+    table and explanations, in the format parse_llm_output expects.
+    """
+    symbols = symbols or FAKE_SYMBOLS
+    lines = ["symbol,month,predicted_price"]
+    for i, symbol in enumerate(symbols):
+        base = 100.0 + 10 * i
+        for m in range(months):
+            year = start_year + m // 12
+            lines.append(f"{symbol},{year}-{m % 12 + 1:02d},{base * (1 + 0.01 * (m + 1)):.2f}")
+    table_rows = "".join(f"<tr><td>{s}</td></tr>" for s in symbols)
+    explanations = "\n".join(f"{s}: steady upward trend in the provided data." for s in symbols)
+    return (
+        "```csv\n" + "\n".join(lines) + "\n```\n"
+        f"<table><tr><th>Symbol</th></tr>{table_rows}</table>\n"
+        f"Explanations:\n{explanations}"
+    )
+
+
+class FakeLLMError(RuntimeError):
+    """
+    Simulated provider failure. status_code mimics the provider's HTTP
+    status (e.g. 429 for a rate limit, see batch.is_rate_limit_error).
+    """
+
+    def __init__(self, message, status_code=503):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model that returns a canned response after a simulated delay.
+
+    latency: seconds spent per call, as if waiting for the provider.
+    latency_jitter: up to this many extra seconds per call, drawn from the
+        seeded random generator.
+    connect_latency: extra seconds spent on the first call of an instance,
+        standing in for DNS/TCP/TLS setup of a fresh HTTP connection.
+    chunk_size: characters per chunk when streaming.
+    tokens_per_second: when set, generating the response also takes its
+        (estimated) tokens divided by this; streams are paced chunk by chunk.
+    output_symbols: when set (and no response is given), the canned
+        prediction has this many symbols, SYM00000 onwards, of output_months
+        months each, for results of any size.
+    fail_first: the first this many calls fail.
+    failure_rate: later calls fail with this probability (seeded, so a
+        given seed always fails the same calls).
+    failure_status: status_code of the raised FakeLLMError.
+    """
+
+    response: str = ""
+    latency: float = 0.0
+    latency_jitter: float = 0.0
+    connect_latency: float = 0.0
+    chunk_size: int = 32
+    tokens_per_second: float = 0.0
+    output_symbols: int = 0
+    output_months: int = 12
+    model_name: str = "fake-chat-model"
+    fail_first: int = 0
+    failure_rate: float = 0.0
+    failure_status: int = 503
+    seed: int = 0
+
+    _connected: bool = PrivateAttr(default=False)
+    _call_count: int = PrivateAttr(default=0)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _random: Any = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any) -> None:
+        super().model_post_init(__context)
+        if not self.response:
+            symbols = [f"SYM{i:05d}" for i in range(self.output_symbols)] if self.output_symbols else None
+            self.response = build_fake_prediction(symbols, self.output_months)
+        self._random = random.Random(self.seed)
+
+    @property
+    def call_count(self) -> int:
+        return self._call_count
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _setup_delay(self):
+        # Returns (delay, error): the call waits delay seconds, then raises error if set
+        with self._lock:
+            self._call_count += 1
+            first_call = not self._connected
+            self._connected = True
+            jitter = self._random.uniform(0.0, self.latency_jitter) if self.latency_jitter else 0.0
+            fails = self._call_count <= self.fail_first or (
+                self.failure_rate > 0 and self._random.random() < self.failure_rate
+            )
+        delay = self.latency + jitter + (self.connect_latency if first_call else 0.0)
+        error = FakeLLMError(f"Simulated failure of {self.model_name}", self.failure_status) if fails else None
+        return delay, error
+
+    def _wait(self):
+        delay, error = self._setup_delay()
+        time.sleep(delay)
+        if error is not None:
+            raise error
+
+    async def _await(self):
+        delay, error = self._setup_delay()
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+
+    def _chunks(self):
+        for i in range(0, len(self.response), self.chunk_size):
+            yield self.response[i:i + self.chunk_size]
+
+    def generation_time(self, text):
+        """
+        Seconds spent generating text at tokens_per_second (about four
+        characters per token, as summarize.estimate_tokens counts).
+        """
+        if not self.tokens_per_second:
+            return 0.0
+        return len(text) / 4 / self.tokens_per_second
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self._wait()
+        time.sleep(self.generation_time(self.response))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await self._await()
+        await asyncio.sleep(self.generation_time(self.response))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        self._wait()
+        for text in self._chunks():
+            time.sleep(self.generation_time(text))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await self._await()
+        for text in self._chunks():
+            await asyncio.sleep(self.generation_time(text))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text))
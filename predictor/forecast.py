@@ -0,0 +1,197 @@
+"""
+Deterministic local baseline forecaster.
+
+Forecasts closes for every symbol at once with NumPy, without any LLM
+call, one per week, month or quarter (PREDICTION_SHAPE["HORIZON"], see
+results.py). The price table (see summarize.PriceTable) is first reduced to
+one close per symbol and period (the last close of the period), so weekly
+forecasts need prices at least once a week. The forecast for h periods
+ahead is then the equal-weight mean of three estimates:
+
+- drift: the last close plus h times the average change per period,
+- exponential smoothing: the smoothed level of the closes,
+- linear trend: the least-squares line through the closes, extended.
+
+All three are grouped reductions over the whole table (np.bincount), so
+there is no per-symbol Python loop and thousands of symbols take
+milliseconds. Symbols are ranked by forecast return over their last close
+and the top ones are written as a completion in the format the LLM is asked
+for (a ```csv block plus explanations), so the rest of the predict path
+treats a local forecast exactly like an LLM answer.
+"""
+import numpy as np
+from django.conf import settings
+
+from .results import period_title
+
+DEFAULT_FORECAST_SETTINGS = {
+    # "llm" always asks the LLM, "local" only uses this forecaster, and
+    # "fallback" asks the LLM and forecasts locally when the call fails
+    # (including the client's READ_TIMEOUT)
+    "MODE": "llm",
+    "ALPHA": 0.5,  # exponential smoothing factor, 0 < ALPHA <= 1
+}
+
+LOCAL_MODEL_NAME = "local-baseline"
+MIN_PRICE = 0.01
+
+
+def get_forecast_settings():
+    config = dict(DEFAULT_FORECAST_SETTINGS)
+    config.update(getattr(settings, "PREDICTION_FORECAST", None) or {})
+    return config
+
+
+def monthly_closes(table):
+    """
+    Reduce a PriceTable to the last close of every (symbol, month).
+    Returns (codes, months, closes), still sorted by (symbol, month);
+    months are "YYYY-MM" strings.
+    """
+    codes = table.codes
+    months = np.asarray(table.dates).astype("U7")
+    keep = np.ones(len(codes), dtype=bool)
+    # A row is kept when the next row starts another month or symbol
+    keep[:-1] = (codes[1:] != codes[:-1]) | (months[1:] != months[:-1])
+    return codes[keep], months[keep], np.asarray(table["close"], dtype=np.float64)[keep]
+
+
+def period_closes(table, horizon="monthly"):
+    """
+    Reduce a PriceTable to the last close of every (symbol, period) of the
+    horizon. Returns (codes, periods, closes), still sorted by (symbol,
+    period); periods are the datetime64[D] first days of their period.
+    """
+    days = np.asarray(table.dates).astype("datetime64[D]")
+    if horizon == "weekly":
+        # Day 0 (1970-01-01) is a Thursday; weeks start on Monday
+        numbers = days.astype(np.int64)
+        periods = days - ((numbers + 3) % 7).astype("timedelta64[D]")
+    else:
+        months = days.astype("datetime64[M]")
+        if horizon == "quarterly":
+            months = months - (months.astype(np.int64) % 3).astype("timedelta64[M]")
+        periods = months.astype("datetime64[D]")
+    codes = table.codes
+    keep = np.ones(len(codes), dtype=bool)
+    # A row is kept when the next row starts another period or symbol
+    keep[:-1] = (codes[1:] != codes[:-1]) | (periods[1:] != periods[:-1])
+    return codes[keep], periods[keep], np.asarray(table["close"], dtype=np.float64)[keep]
+
+
+def forecast_prices(codes, closes, groups, months=12, alpha=0.5):
+    """
+    Forecast `months` steps (periods) ahead for every group of (codes,
+    closes), which must be sorted by code and then by time. Returns a
+    (groups, months) array; groups without rows are NaN.
+    """
+    counts = np.bincount(codes, minlength=groups)
+    starts = np.cumsum(counts) - counts
+    ends = starts + counts - 1
+    present = counts > 0
+    safe_ends = np.where(present, ends, 0)
+    safe_starts = np.where(present, starts, 0)
+    t = (np.arange(len(codes)) - starts[codes]).astype(np.float64)
+    from_end = ends[codes] - np.arange(len(codes))
+    n = counts.astype(np.float64)
+    last = np.where(present, closes[safe_ends], np.nan) if len(closes) else np.full(groups, np.nan)
+    first = np.where(present, closes[safe_starts], np.nan) if len(closes) else np.full(groups, np.nan)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Random walk with drift
+        drift = np.where(n > 1, (last - first) / (n - 1), 0.0)
+
+        # Simple exponential smoothing started at the first close:
+        # level = sum(alpha * (1 - alpha)**k * x[-1 - k]) + (1 - alpha)**(n - 1) * x[0]
+        weights = alpha * (1.0 - alpha) ** from_end
+        weights[t == 0] = (1.0 - alpha) ** from_end[t == 0]
+        level = np.bincount(codes, weights=weights * closes, minlength=groups)
+
+        # Least-squares line through (t, close) per symbol
+        sum_t = np.bincount(codes, weights=t, minlength=groups)
+        sum_tt = np.bincount(codes, weights=t * t, minlength=groups)
+        sum_x = np.bincount(codes, weights=closes, minlength=groups)
+        sum_tx = np.bincount(codes, weights=t * closes, minlength=groups)
+        denominator = n * sum_tt - sum_t ** 2
+        slope = np.where(denominator > 0, (n * sum_tx - sum_t * sum_x) / denominator, 0.0)
+        intercept = (sum_x - slope * sum_t) / n
+
+    steps = np.arange(1, months + 1, dtype=np.float64)
+    drift_forecast = last[:, None] + drift[:, None] * steps
+    smoothed_forecast = np.broadcast_to(level[:, None], drift_forecast.shape)
+    trend_forecast = intercept[:, None] + slope[:, None] * ((n - 1)[:, None] + steps)
+    forecast = (drift_forecast + smoothed_forecast + trend_forecast) / 3.0
+    return np.where(present[:, None], np.maximum(forecast, MIN_PRICE), np.nan)
+
+
+def add_months(month: str, steps):
+    """
+    "YYYY-MM" labels for `steps` (an int array) months after month.
+    """
+    start = np.datetime64(month, "M")
+    return np.datetime_as_string(start + np.asarray(steps), unit="M")
+
+
+def add_periods(period, steps, horizon="monthly"):
+    """
+    Prediction labels (see results.HORIZONS) for `steps` (an int array)
+    periods after the period starting on the datetime64[D] day period.
+    """
+    steps = np.asarray(steps)
+    if horizon == "weekly":
+        return np.datetime_as_string(period + 7 * steps, unit="D")
+    if horizon == "quarterly":
+        months = (period.astype("datetime64[M]") + 3 * steps).astype(np.int64)
+        return np.array([f"{1970 + month // 12}-Q{month % 12 // 3 + 1}" for month in months.tolist()])
+    return add_months(np.datetime_as_string(period, unit="M"), steps)
+
+
+def forecast_table(table, top_n=10, months=12, alpha=0.5, horizon="monthly"):
+    """
+    Forecast every symbol of a PriceTable `months` periods of the horizon
+    ahead and keep the top_n by forecast return. Returns a list of (symbol,
+    labels, prices, last_close) ranked best first; ties break on the symbol
+    name.
+    """
+    if not len(table):
+        raise ValueError("CSV has no data rows")
+    codes, periods, closes = period_closes(table, horizon)
+    groups = len(table.symbols)
+    if not np.all(np.isfinite(closes)) or np.any(closes <= 0):
+        raise ValueError("Closing prices must be positive numbers")
+    forecast = forecast_prices(codes, closes, groups, months, alpha)
+    counts = np.bincount(codes, minlength=groups)
+    ends = np.cumsum(counts) - 1
+    last_close = closes[ends]
+    expected_return = forecast[:, -1] / last_close - 1.0
+    order = np.lexsort((table.symbols, -expected_return))[:top_n]
+    steps = np.arange(1, months + 1)
+    return [
+        (str(table.symbols[i]), add_periods(periods[ends[i]], steps, horizon), forecast[i], float(last_close[i]))
+        for i in order
+    ]
+
+
+def render_completion(ranked, horizon="monthly"):
+    """
+    Write forecast_table() output as a completion: a ```csv block with
+    symbol,month,predicted_price rows and one explanation line per symbol.
+    """
+    period = period_title(horizon).lower()
+    lines = ["symbol,month,predicted_price"]
+    explanations = []
+    for symbol, labels, prices, last_close in ranked:
+        lines.extend(f"{symbol},{label},{price:.2f}" for label, price in zip(labels.tolist(), prices.tolist()))
+        explanations.append(
+            f"{symbol}: local baseline (drift, exponential smoothing and linear trend) forecasts "
+            f"{prices[-1] / last_close - 1.0:+.1%} over {len(prices)} {period}s from a last close of {last_close:.2f}."
+        )
+    return "```csv\n" + "\n".join(lines) + "\n```\nExplanations:\n" + "\n".join(explanations)
+
+
+def forecast_completion(table, top_n=10, months=12, alpha=0.5, horizon="monthly"):
+    """
+    Local stand-in for the LLM completion for a PriceTable: top_n symbols
+    with `months` prices each, one per period of the horizon.
+    """
+    return render_completion(forecast_table(table, top_n, months, alpha, horizon), horizon)
@@ -0,0 +1,206 @@
+"""
+Persistent history of prediction runs (see models.PredictionRun).
+
+Every prediction is stored with its inputs hash, model, latency, token
+usage and parsed rows, so a past result can be shown or downloaded again
+straight from the database instead of paying for another LLM call.
+
+Token usage is collected per prediction with collect_token_usage(): the
+LLM call helpers report each response's usage_metadata through
+record_token_usage(), including calls made from sharding worker threads.
+Providers that report nothing get an estimate (summarize.estimate_tokens).
+"""
+import contextvars
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import DatabaseError, transaction
+
+from .forecast import LOCAL_MODEL_NAME
+from .results import get_shape_settings, period_start, period_title
+from .summarize import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HISTORY_SETTINGS = {
+    "ENABLED": True,
+    "PAGE_SIZE": 20,
+}
+
+CSV_HEADER = "symbol,month,predicted_price\n"
+
+
+def get_history_settings():
+    config = dict(DEFAULT_HISTORY_SETTINGS)
+    config.update(getattr(settings, "PREDICTION_HISTORY", None) or {})
+    return config
+
+
+class TokenUsage:
+    """
+    Token counts reported by the provider for one prediction.
+    """
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def add(self, metadata):
+        with self._lock:
+            self.prompt_tokens += metadata.get("input_tokens", 0) or 0
+            self.completion_tokens += metadata.get("output_tokens", 0) or 0
+            self.calls += 1
+
+
+_token_usage = contextvars.ContextVar("prediction_token_usage", default=None)
+
+
+@contextmanager
+def collect_token_usage():
+    """
+    Collect the usage of every LLM response recorded inside the block.
+    """
+    usage = TokenUsage()
+    token = _token_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _token_usage.reset(token)
+
+
+def record_token_usage(message):
+    """
+    Add a chat model response's usage_metadata to the active collector.
+    """
+    usage = _token_usage.get()
+    metadata = getattr(message, "usage_metadata", None)
+    if usage is not None and metadata:
+        usage.add(metadata)
+
+
+def format_price(value: float):
+    text = repr(value)
+    return text[:-2] if text.endswith(".0") else text
+
+
+def token_counts(usage, cache_hit, prompt_text="", llm_output=""):
+    """
+    (prompt_tokens, completion_tokens, estimated) for one prediction: none
+    for a cache hit, the provider's counts when it reported any, otherwise
+    an estimate from the prompt and completion text.
+    """
+    if cache_hit:
+        return 0, 0, False
+    if usage is not None and usage.calls:
+        return usage.prompt_tokens, usage.completion_tokens, False
+    return estimate_tokens(prompt_text), estimate_tokens(llm_output), True
+
+
+def record_prediction_run(user, parsed, valid_csv, inputs_hash, model_name, latency, tokens, cache_hit):
+    """
+    Store a parsed prediction and its rows; tokens is token_counts(...).
+    Returns the PredictionRun, or None when history is disabled or the
+    database write fails: history is best-effort and never fails the
+    prediction itself.
+    """
+    from .models import PredictionRow, PredictionRun
+
+    if not get_history_settings()["ENABLED"]:
+        return None
+    if user is not None and not user.is_authenticated:
+        user = None
+    prompt_tokens, completion_tokens, estimated = tokens
+    try:
+        with transaction.atomic():
+            run = PredictionRun.objects.create(
+                user=user,
+                inputs_hash=inputs_hash,
+                model_name=model_name,
+                latency_ms=int(latency * 1000),
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                tokens_estimated=estimated,
+                cache_hit=cache_hit,
+                valid_csv=valid_csv,
+                horizon=get_shape_settings()["HORIZON"],
+                row_count=len(parsed.rows),
+                explanations=parsed.explanations,
+                symbol_explanations=parsed.symbol_explanations,
+                validation_errors=[error.message for error in parsed.errors],
+            )
+            PredictionRow.objects.bulk_create([
+                PredictionRow(
+                    run=run, user=user, symbol=row.symbol[:16], month=period_start(row.month),
+                    month_label=row.month[:20], price=row.price,
+                )
+                for row in parsed.rows
+            ])
+    except DatabaseError as e:
+        logger.warning("Could not store prediction run: %s", e)
+        return None
+    return run
+
+
+def iter_run_rows(run, chunk_size=2000):
+    """
+    (symbol, month_label, price) tuples of a run in prediction order, read
+    from the database chunk_size rows at a time.
+    """
+    return run.rows.order_by("id").values_list("symbol", "month_label", "price").iterator(chunk_size=chunk_size)
+
+
+def get_run_page(run, number=1, page_size=100):
+    """
+    The Paginator page `number` of a run's (symbol, month_label, price) rows.
+    """
+    rows = run.rows.order_by("id").values_list("symbol", "month_label", "price")
+    return Paginator(rows, page_size).get_page(number)
+
+
+def get_chart_rows(run, max_series=10):
+    """
+    The rows of a run's first max_series symbols, for the chart, without
+    reading the rest of a large run.
+    """
+    symbols = []
+    for symbol in run.rows.order_by("id").values_list("symbol", flat=True).iterator(chunk_size=500):
+        if symbol not in symbols:
+            if len(symbols) == max_series:
+                break
+            symbols.append(symbol)
+    return list(run.rows.filter(symbol__in=symbols).order_by("id").values_list("symbol", "month_label", "price"))
+
+
+def run_context(run, max_series=None):
+    """
+    predict_result.html context for a stored run, without any LLM call.
+    Only the first page of rows is read; the table loads further pages as
+    it is scrolled (see views.prediction_rows).
+    """
+    from .charts import build_chart_payload, get_chart_settings
+
+    max_series = max_series or get_chart_settings()["MAX_SERIES"]
+    page_size = get_shape_settings()["PAGE_SIZE"]
+    page = get_run_page(run, 1, page_size)
+    return {
+        "table_html": "",
+        "explanations": run.explanations,
+        "symbol_explanations": run.symbol_explanations,
+        "validation_errors": run.validation_errors,
+        "valid_csv": run.valid_csv,
+        "page_rows": list(page.object_list),
+        "next_page": page.next_page_number() if page.has_next() else None,
+        "row_count": run.row_count,
+        "period_title": period_title(run.horizon),
+        "chart": build_chart_payload(get_chart_rows(run, max_series), max_series),
+        "error": None,
+        "cache_hit": run.cache_hit,
+        "source": "local" if run.model_name == LOCAL_MODEL_NAME else "llm",
+        "run_id": str(run.pk),
+        "run": run,
+    }
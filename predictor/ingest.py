@@ -0,0 +1,304 @@
+"""
+Streaming, validating ingestion of uploaded stock CSVs.
+
+Uploads are validated chunk by chunk as they arrive from csv_file.chunks():
+the header and every row are checked, dates are normalized to ISO format and
+duplicate (symbol, date) rows are dropped, so a bad file is rejected before
+any LLM call is made. Rows are buffered CHUNK_ROWS at a time and flushed to
+disk, so memory stays bounded by the chunk size plus one small integer per
+distinct (symbol, date) key.
+
+Next to the normalized data.csv a columnar copy is written to data.columns/
+as one .npy file per column, which later stages load zero-copy with
+numpy.load(mmap_mode="r") instead of re-parsing text.
+"""
+import codecs
+import csv
+import datetime
+import json
+import math
+import os
+import re
+import shutil
+import uuid
+
+import numpy as np
+
+from .summarize import EXPECTED_COLUMNS, PRICE_COLUMNS, PriceTable
+
+COLUMNS_DIRNAME = "data.columns"
+CHUNK_ROWS = 4096
+COPY_BLOCK = 1 << 20  # elements copied at a time when finalizing .npy files
+
+DATE_FORMATS = [
+    (re.compile(r"^(\d{4})-(\d{1,2})$"), ("year", "month")),
+    (re.compile(r"^(\d{4})/(\d{1,2})$"), ("year", "month")),
+    (re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})$"), ("year", "month", "day")),
+    (re.compile(r"^(\d{4})/(\d{1,2})/(\d{1,2})$"), ("year", "month", "day")),
+    (re.compile(r"^(\d{4})(\d{2})(\d{2})$"), ("year", "month", "day")),
+    (re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})$"), ("month", "day", "year")),
+]
+
+
+class CSVValidationError(ValueError):
+    """
+    Raised when an uploaded CSV is malformed; the message names the line.
+    """
+
+
+def normalize_date(value: str):
+    """
+    Returns (iso_text, numpy datetime64[D]) for a date in any supported
+    format. Month-only dates stay month-only ("2021-01") and map to the first
+    day of the month. Raises ValueError for anything else.
+    """
+    value = value.strip()
+    for pattern, fields in DATE_FORMATS:
+        match = pattern.match(value)
+        if not match:
+            continue
+        parts = dict(zip(fields, (int(group) for group in match.groups())))
+        date = datetime.date(parts["year"], parts["month"], parts.get("day", 1))
+        if "day" in parts:
+            return date.isoformat(), np.datetime64(date, "D")
+        return f"{date.year:04d}-{date.month:02d}", np.datetime64(date, "D")
+    raise ValueError(f"unrecognized date {value!r}")
+
+
+class CSVIngestor:
+    """
+    Incrementally validates an uploaded CSV and writes the normalized text
+    and its columnar copy into target_dir.
+
+        ingestor = CSVIngestor(user_dir)
+        try:
+            for chunk in csv_file.chunks():
+                ingestor.feed(chunk)
+            summary = ingestor.finish()
+        except CSVValidationError:
+            ingestor.abort()
+            raise
+
+    Nothing in target_dir is touched until finish() succeeds.
+    """
+
+    def __init__(self, target_dir, csv_name="data.csv", chunk_rows=CHUNK_ROWS):
+        self.target_dir = target_dir
+        self.csv_name = csv_name
+        self.chunk_rows = chunk_rows
+        self.work_dir = os.path.join(target_dir, f".ingest-{uuid.uuid4().hex}")
+        os.makedirs(self.work_dir)
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._pending = ""
+        self._line_no = 0
+        self._positions = None
+        self._csv_out = open(os.path.join(self.work_dir, self.csv_name), "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._csv_out, lineterminator="\n")
+        self._column_files = {
+            name: open(os.path.join(self.work_dir, f"{name}.bin"), "wb")
+            for name in ["symbol", "date", *PRICE_COLUMNS]
+        }
+        self._buffer = {name: [] for name in self._column_files}
+        self._symbol_codes = {}
+        self._seen = set()
+        self.rows = 0
+        self.duplicates = 0
+
+    def feed(self, chunk: bytes):
+        try:
+            text = self._decoder.decode(chunk)
+        except UnicodeDecodeError:
+            raise CSVValidationError(f"Line {self._line_no + 1}: file is not valid UTF-8")
+        lines = (self._pending + text).split("\n")
+        self._pending = lines.pop()
+        for line in lines:
+            self._process_line(line)
+
+    def _process_line(self, line):
+        self._line_no += 1
+        line = line.rstrip("\r")
+        if not line.strip():
+            return
+        try:
+            cells = next(csv.reader([line]))
+        except csv.Error as e:
+            raise CSVValidationError(f"Line {self._line_no}: {e}")
+        if self._positions is None:
+            self._read_header(cells)
+            return
+        if len(cells) != self._width:
+            raise CSVValidationError(
+                f"Line {self._line_no}: expected {self._width} fields, got {len(cells)}"
+            )
+        symbol, date, *prices = (cells[i].strip() for i in self._positions)
+        if not symbol:
+            raise CSVValidationError(f"Line {self._line_no}: missing symbol")
+        try:
+            date_text, date_value = normalize_date(date)
+        except ValueError as e:
+            raise CSVValidationError(f"Line {self._line_no}: {e}")
+        values = []
+        for name, raw in zip(PRICE_COLUMNS, prices):
+            try:
+                value = float(raw)
+            except ValueError:
+                raise CSVValidationError(f"Line {self._line_no}: {name} {raw!r} is not a number")
+            if not math.isfinite(value) or value < 0:
+                raise CSVValidationError(f"Line {self._line_no}: {name} {raw!r} is out of range")
+            values.append(value)
+
+        code = self._symbol_codes.setdefault(symbol, len(self._symbol_codes))
+        key = (code << 32) | (int(date_value.astype(np.int64)) & 0xFFFFFFFF)
+        if key in self._seen:
+            self.duplicates += 1
+            return
+        self._seen.add(key)
+
+        self._writer.writerow([symbol, date_text, *prices])
+        self._buffer["symbol"].append(code)
+        self._buffer["date"].append(date_value)
+        for name, value in zip(PRICE_COLUMNS, values):
+            self._buffer[name].append(value)
+        self.rows += 1
+        if len(self._buffer["symbol"]) >= self.chunk_rows:
+            self._flush()
+
+    def _read_header(self, cells):
+        header = [cell.strip().lower() for cell in cells]
+        missing = [name for name in EXPECTED_COLUMNS if name not in header]
+        if missing:
+            raise CSVValidationError(f"Line {self._line_no}: header is missing columns: {', '.join(missing)}")
+        self._width = len(header)
+        self._positions = [header.index(name) for name in EXPECTED_COLUMNS]
+        self._writer.writerow(EXPECTED_COLUMNS)
+
+    def _flush(self):
+        if not self._buffer["symbol"]:
+            return
+        np.asarray(self._buffer["symbol"], dtype=np.int32).tofile(self._column_files["symbol"])
+        np.asarray(self._buffer["date"], dtype="datetime64[D]").tofile(self._column_files["date"])
+        for name in PRICE_COLUMNS:
+            np.asarray(self._buffer[name], dtype=np.float64).tofile(self._column_files[name])
+        for values in self._buffer.values():
+            values.clear()
+
+    def finish(self):
+        """
+        Validate the end of the file, then atomically move data.csv and
+        data.columns/ into target_dir. Returns a summary dict.
+        """
+        tail = self._pending + self._decoder.decode(b"", final=True)
+        self._pending = ""
+        if tail:
+            self._process_line(tail)
+        if self._positions is None:
+            raise CSVValidationError("File is empty")
+        if not self.rows:
+            raise CSVValidationError("File has a header but no data rows")
+        self._flush()
+        self._close_files()
+
+        columns_dir = os.path.join(self.work_dir, COLUMNS_DIRNAME)
+        os.makedirs(columns_dir)
+        dtypes = {"symbol": np.int32, "date": "datetime64[D]", **{name: np.float64 for name in PRICE_COLUMNS}}
+        for name, dtype in dtypes.items():
+            self._finalize_column(name, np.dtype(dtype), columns_dir)
+        symbols = sorted(self._symbol_codes, key=self._symbol_codes.get)
+        with open(os.path.join(columns_dir, "symbols.json"), "w", encoding="utf-8") as f:
+            json.dump(symbols, f)
+
+        self._install(self.csv_name)
+        self._install(COLUMNS_DIRNAME)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        return {"rows": self.rows, "duplicates": self.duplicates, "symbols": len(symbols)}
+
+    def _finalize_column(self, name, dtype, columns_dir):
+        raw_path = os.path.join(self.work_dir, f"{name}.bin")
+        target = np.lib.format.open_memmap(
+            os.path.join(columns_dir, f"{name}.npy"), mode="w+", dtype=dtype, shape=(self.rows,)
+        )
+        source = np.memmap(raw_path, dtype=dtype, mode="r", shape=(self.rows,))
+        for start in range(0, self.rows, COPY_BLOCK):
+            target[start:start + COPY_BLOCK] = source[start:start + COPY_BLOCK]
+        target.flush()
+        del target, source
+        os.remove(raw_path)
+
+    def _install(self, name):
+        source = os.path.join(self.work_dir, name)
+        destination = os.path.join(self.target_dir, name)
+        if os.path.isdir(destination):
+            stale = os.path.join(self.work_dir, f"{name}.old")
+            os.replace(destination, stale)
+        os.replace(source, destination)
+
+    def _close_files(self):
+        self._csv_out.close()
+        for f in self._column_files.values():
+            f.close()
+
+    def abort(self):
+        """
+        Discard everything written so far.
+        """
+        self._close_files()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def ingest_csv_chunks(chunks, target_dir, csv_name="data.csv"):
+    """
+    Run chunks through a CSVIngestor, cleaning up if validation fails.
+    """
+    ingestor = CSVIngestor(target_dir, csv_name=csv_name)
+    try:
+        for chunk in chunks:
+            ingestor.feed(chunk)
+        return ingestor.finish()
+    except Exception:
+        ingestor.abort()
+        raise
+
+
+def load_columns(target_dir):
+    """
+    Memory-map the columnar copy written by CSVIngestor. Returns
+    (symbols:list, columns:dict of read-only arrays), or None if there is
+    no columnar copy.
+    """
+    columns_dir = os.path.join(target_dir, COLUMNS_DIRNAME)
+    symbols_path = os.path.join(columns_dir, "symbols.json")
+    if not os.path.exists(symbols_path):
+        return None
+    with open(symbols_path, "r", encoding="utf-8") as f:
+        symbols = json.load(f)
+    columns = {
+        name: np.load(os.path.join(columns_dir, f"{name}.npy"), mmap_mode="r")
+        for name in ["symbol", "date", *PRICE_COLUMNS]
+    }
+    return symbols, columns
+
+
+def load_price_table(target_dir):
+    """
+    Build a summarize.PriceTable from the columnar copy, or None if there is
+    none. Only the sort permutation is computed; no text is parsed. Dates
+    come back as full ISO days, month-only dates as the first of the month.
+    """
+    loaded = load_columns(target_dir)
+    if loaded is None:
+        return None
+    symbols, columns = loaded
+    # Symbol codes are assigned in first-seen order; re-rank them
+    # alphabetically so the table matches summarize.load_price_table
+    names = np.asarray(symbols, dtype=str)
+    rank = np.empty(len(names), dtype=np.int64)
+    rank[np.argsort(names, kind="stable")] = np.arange(len(names))
+    codes = rank[columns["symbol"]]
+    order = np.lexsort((columns["date"], codes))
+    dates = np.datetime_as_string(columns["date"][order], unit="D")
+    return PriceTable(
+        np.sort(names),
+        codes[order],
+        dates,
+        {name: columns[name][order] for name in PRICE_COLUMNS},
+    )
@@ -0,0 +1,324 @@
+"""
+Background prediction jobs.
+
+A POST to the predict endpoint can enqueue a job instead of blocking a WSGI
+worker for the whole LLM round-trip. Jobs run on a bounded thread pool (LLM
+calls are I/O bound, so threads are enough) and their state lives in a job
+store: in-memory for a single process, or a local SQLite file shared by all
+workers on the host. No external broker is required.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+DEFAULT_JOB_SETTINGS = {
+    "ASYNC": False,  # when True, predict_view enqueues a job instead of blocking
+    "STORE": "memory",  # "memory" or "sqlite"
+    "LOCATION": "/tmp/llm_stock_jobs.sqlite3",  # used by the "sqlite" store
+    "MAX_WORKERS": 4,
+    "MAX_JOBS_PER_USER": 2,
+    "POLL_INTERVAL": 2,  # seconds between HTMX status polls
+    "RESULT_TTL": 3600,  # seconds finished jobs and their results are kept
+    # Queued or running jobs not updated for this many seconds are failed, so
+    # the jobs of a worker that died stop counting against MAX_JOBS_PER_USER
+    "STALE_AFTER": 900,
+}
+
+STALE_ERROR = "The prediction was abandoned by its worker. Please try again."
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+class JobLimitExceeded(Exception):
+    """
+    Raised when an owner already has MAX_JOBS_PER_USER active jobs.
+    """
+
+
+class InMemoryJobStore:
+    """
+    Job store kept in a dict; only visible to the current process.
+    """
+
+    def __init__(self, **kwargs):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, owner):
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "owner": owner,
+            "status": QUEUED,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        with self._lock:
+            self._jobs[job["id"]] = job
+        return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            job["updated_at"] = time.time()
+
+    def count_active(self, owner):
+        with self._lock:
+            return sum(
+                1 for job in self._jobs.values()
+                if job["owner"] == owner and job["status"] in ACTIVE_STATUSES
+            )
+
+    def cleanup(self, result_ttl, stale_after, keep=()):
+        """
+        Delete jobs finished more than result_ttl seconds ago and fail
+        active jobs not updated for stale_after seconds, except the ids in
+        keep. Returns (deleted, failed).
+        """
+        now = time.time()
+        deleted = failed = 0
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job["status"] in ACTIVE_STATUSES:
+                    if stale_after is not None and now - job["updated_at"] >= stale_after and job_id not in keep:
+                        job.update(status=FAILED, error=STALE_ERROR, updated_at=now)
+                        failed += 1
+                elif result_ttl is not None and now - job["updated_at"] >= result_ttl:
+                    del self._jobs[job_id]
+                    deleted += 1
+        return deleted, failed
+
+
+class SQLiteJobStore:
+    """
+    Job store backed by a local SQLite file, so status polls can be answered
+    by any worker process on the same host.
+    """
+
+    def __init__(self, location, **kwargs):
+        self.location = location
+        self._lock = threading.Lock()
+        directory = os.path.dirname(location)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS prediction_jobs ("
+                " id TEXT PRIMARY KEY, owner TEXT NOT NULL, status TEXT NOT NULL,"
+                " result TEXT, error TEXT, created_at REAL, updated_at REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS prediction_jobs_owner_status"
+                " ON prediction_jobs (owner, status)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS prediction_jobs_status_updated"
+                " ON prediction_jobs (status, updated_at)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.location, timeout=30)
+
+    def _row_to_job(self, row):
+        job_id, owner, status, result, error, created_at, updated_at = row
+        return {
+            "id": job_id,
+            "owner": owner,
+            "status": status,
+            "result": json.loads(result) if result else None,
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def create(self, owner):
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO prediction_jobs VALUES (?, ?, ?, NULL, NULL, ?, ?)",
+                (job_id, owner, QUEUED, now, now),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, owner, status, result, error, created_at, updated_at"
+                " FROM prediction_jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def update(self, job_id, **fields):
+        if "result" in fields and fields["result"] is not None:
+            fields["result"] = json.dumps(fields["result"])
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                f"UPDATE prediction_jobs SET {columns} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+
+    def count_active(self, owner):
+        with self._connect() as conn:
+            (count,) = conn.execute(
+                "SELECT COUNT(*) FROM prediction_jobs WHERE owner = ? AND status IN (?, ?)",
+                (owner, *ACTIVE_STATUSES),
+            ).fetchone()
+        return count
+
+    def cleanup(self, result_ttl, stale_after, keep=()):
+        """
+        InMemoryJobStore.cleanup for every worker sharing the file.
+        """
+        now = time.time()
+        deleted = failed = 0
+        with self._lock, self._connect() as conn:
+            if stale_after is not None:
+                keep = list(keep)
+                failed = conn.execute(
+                    "UPDATE prediction_jobs SET status = ?, error = ?, updated_at = ?"
+                    " WHERE status IN (?, ?) AND updated_at <= ?"
+                    f" AND id NOT IN ({', '.join('?' * len(keep))})",
+                    (FAILED, STALE_ERROR, now, *ACTIVE_STATUSES, now - stale_after, *keep),
+                ).rowcount
+            if result_ttl is not None:
+                deleted = conn.execute(
+                    "DELETE FROM prediction_jobs WHERE status IN (?, ?) AND updated_at <= ?",
+                    (DONE, FAILED, now - result_ttl),
+                ).rowcount
+        return deleted, failed
+
+
+STORES = {
+    "memory": InMemoryJobStore,
+    "sqlite": SQLiteJobStore,
+}
+
+
+class JobRunner:
+    """
+    Runs callables on a bounded thread pool and records their outcome in a
+    job store. The callable's return value must be JSON-serializable.
+    """
+
+    def __init__(self, store, max_workers=4, max_jobs_per_user=2, result_ttl=3600, stale_after=900):
+        self.store = store
+        self.max_jobs_per_user = max_jobs_per_user
+        self.result_ttl = result_ttl
+        self.stale_after = stale_after
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prediction-job")
+        self._futures = {}
+        self._submit_lock = threading.Lock()
+
+    def submit(self, owner, fn, *args, **kwargs):
+        """
+        Enqueue fn(*args, **kwargs) for owner and return the new job id.
+        Expired and stale jobs are cleaned up first.
+        """
+        with self._submit_lock:
+            # Jobs this process is still running are not stale, however long they take
+            self.store.cleanup(self.result_ttl, self.stale_after, keep=set(self._futures))
+            if self.max_jobs_per_user and self.store.count_active(owner) >= self.max_jobs_per_user:
+                raise JobLimitExceeded(
+                    f"You already have {self.max_jobs_per_user} predictions running. "
+                    "Please wait for one to finish."
+                )
+            job = self.store.create(owner)
+        future = self.executor.submit(self._run, job["id"], fn, args, kwargs)
+        self._futures[job["id"]] = future
+        future.add_done_callback(lambda f, job_id=job["id"]: self._futures.pop(job_id, None))
+        return job["id"]
+
+    def _run(self, job_id, fn, args, kwargs):
+        self.store.update(job_id, status=RUNNING)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.store.update(job_id, status=FAILED, error=str(e))
+            return
+        self.store.update(job_id, status=DONE, result=result)
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def wait(self, job_id, timeout=None):
+        """
+        Block until the job has finished (only for jobs started by this
+        process) and return its final state.
+        """
+        future = self._futures.get(job_id)
+        if future is not None:
+            future.exception(timeout=timeout)
+        return self.store.get(job_id)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+def get_job_settings():
+    config = dict(DEFAULT_JOB_SETTINGS)
+    config.update(getattr(settings, "PREDICTION_JOBS", None) or {})
+    return config
+
+
+def build_job_runner(options=None):
+    config = dict(DEFAULT_JOB_SETTINGS)
+    config.update(options or {})
+    if config["STORE"] not in STORES:
+        raise ValueError(f"Unknown prediction job store: {config['STORE']}")
+    store = STORES[config["STORE"]](location=config["LOCATION"])
+    return JobRunner(
+        store,
+        max_workers=config["MAX_WORKERS"],
+        max_jobs_per_user=config["MAX_JOBS_PER_USER"],
+        result_ttl=config["RESULT_TTL"],
+        stale_after=config["STALE_AFTER"],
+    )
+
+
+_job_runner = None
+_job_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    """
+    Return the process-wide job runner configured by settings.PREDICTION_JOBS.
+    """
+    global _job_runner
+    if _job_runner is None:
+        with _job_runner_lock:
+            if _job_runner is None:
+                _job_runner = build_job_runner(getattr(settings, "PREDICTION_JOBS", None))
+    return _job_runner
+
+
+def reset_job_runner():
+    """
+    Shut down the process-wide runner so the next call rebuilds it from settings.
+    """
+    global _job_runner
+    with _job_runner_lock:
+        if _job_runner is not None:
+            _job_runner.shutdown(wait=True)
+        _job_runner = None
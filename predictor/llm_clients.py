@@ -0,0 +1,130 @@
+"""
+Process-wide registry of chat model clients.
+
+Building a ChatOpenAI instance also builds a fresh HTTP client, so creating
+one per prediction repeats DNS, TCP and TLS setup on every call. The registry
+keeps one client per (provider, model, API key), each backed by a keep-alive
+connection pool. Clients are safe to share between threads.
+"""
+import hashlib
+import threading
+
+from django.conf import settings
+
+DEFAULT_CLIENT_SETTINGS = {
+    "POOL_SIZE": 10,  # max connections per client
+    # max connections of the async client; under ASGI every awaiting
+    # prediction holds one, so this bounds in-flight LLM calls per process
+    "ASYNC_POOL_SIZE": 200,
+    "KEEPALIVE_EXPIRY": 60,  # seconds an idle pooled connection is kept open
+    "CONNECT_TIMEOUT": 10,
+    "READ_TIMEOUT": 120,
+    "MAX_RETRIES": 2,
+    # Options passed to FakeChatModel when the "fake" provider is selected
+    "FAKE": {"latency": 0.0, "connect_latency": 0.0},
+}
+
+
+def get_client_settings():
+    config = dict(DEFAULT_CLIENT_SETTINGS)
+    config.update(getattr(settings, "LLM_CLIENT", None) or {})
+    return config
+
+
+def build_openai_client(model, api_key, config):
+    import httpx
+    from langchain_openai import ChatOpenAI
+
+    limits = httpx.Limits(
+        max_connections=config["POOL_SIZE"],
+        max_keepalive_connections=config["POOL_SIZE"],
+        keepalive_expiry=config["KEEPALIVE_EXPIRY"],
+    )
+    async_limits = httpx.Limits(
+        max_connections=config["ASYNC_POOL_SIZE"],
+        max_keepalive_connections=config["POOL_SIZE"],
+        keepalive_expiry=config["KEEPALIVE_EXPIRY"],
+    )
+    timeout = httpx.Timeout(config["READ_TIMEOUT"], connect=config["CONNECT_TIMEOUT"])
+    return ChatOpenAI(
+        api_key=api_key,
+        model=model,
+        max_retries=config["MAX_RETRIES"],
+        timeout=timeout,
+        http_client=httpx.Client(limits=limits, timeout=timeout),
+        http_async_client=httpx.AsyncClient(limits=async_limits, timeout=timeout),
+    )
+
+
+def build_fake_client(model, api_key, config):
+    from .fake_llm import FakeChatModel
+
+    return FakeChatModel(model_name=model, **config["FAKE"])
+
+
+PROVIDERS = {
+    "openai": build_openai_client,
+    "fake": build_fake_client,
+}
+
+
+class ClientRegistry:
+    """
+    Caches one chat model client per (provider, model, API key).
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_client_settings()
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(provider, model, api_key):
+        # Never keep raw API keys around as dict keys
+        fingerprint = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+        return (provider, model, fingerprint)
+
+    def get(self, provider, model, api_key=None):
+        if provider not in PROVIDERS:
+            raise ValueError(f"Unknown LLM provider: {provider}")
+        key = self.make_key(provider, model, api_key)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = PROVIDERS[provider](model, api_key, self.config)
+                    self._clients[key] = client
+        return client
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def __len__(self):
+        return len(self._clients)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_client_registry():
+    """
+    Return the process-wide client registry configured by settings.LLM_CLIENT.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ClientRegistry()
+    return _registry
+
+
+def reset_client_registry():
+    """
+    Drop all cached clients so the next call rebuilds them from settings.
+    """
+    global _registry
+    with _registry_lock:
+        _registry = None
@@ -0,0 +1,122 @@
+"""
+Score predictions against realized prices:
+
+    python manage.py backtest realized.csv                    # every stored valid monthly run
+    python manage.py backtest realized.csv --user alice --format json
+    python manage.py backtest realized.csv --predictions runs.csv
+    python manage.py backtest realized.csv --walk-forward --windows 36 --workers 8
+
+realized.csv is in the upload format (symbol,date,open,high,low,close,volume).
+Prediction files are prediction.csv files (symbol,month,predicted_price),
+one run each, or CSVs with an extra "run" column holding many runs.
+"""
+import csv
+import json
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from predictor.backtest import (
+    PredictionSet, RealizedPrices, get_backtest_settings, load_stored_predictions, score_predictions, scored_runs,
+    walk_forward,
+)
+from predictor.forecast import get_forecast_settings
+from predictor.models import PredictionRun
+from predictor.summarize import load_price_table
+
+
+def read_prediction_rows(path):
+    """
+    (run, symbol, month, price) tuples of a prediction file; runs without a
+    "run" column are named after the file.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        missing = {"symbol", "month", "predicted_price"} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"{path} is missing columns: {', '.join(sorted(missing))}")
+        name = os.path.basename(path)
+        for row in reader:
+            try:
+                price = float(row["predicted_price"])
+            except ValueError:
+                continue
+            yield row.get("run") or name, row["symbol"].strip(), row["month"].strip(), price
+
+
+def format_result(label, result):
+    def percent(value):
+        return "n/a" if value is None else f"{value * 100:.1f}%"
+
+    portfolio = result.portfolio
+    lines = [
+        f"{label}: {portfolio['runs']} runs, {portfolio['scored_rows']} of {portfolio['rows']} rows scored",
+        f"  MAPE {percent(portfolio['mape'])}  hit rate {percent(portfolio['hit_rate'])}  "
+        f"top-N return {percent(portfolio['top_return'])}  all symbols {percent(portfolio['mean_return'])}",
+    ]
+    for symbol in result.symbols:
+        lines.append(
+            f"  {symbol['symbol']:<10} {symbol['scored_rows']:>7} rows  MAPE {percent(symbol['mape']):>8}  "
+            f"hit rate {percent(symbol['hit_rate']):>7}"
+        )
+    return "\n".join(lines)
+
+
+class Command(BaseCommand):
+    help = "Score stored or file predictions (and optionally a walk-forward replay) against realized prices."
+
+    def add_arguments(self, parser):
+        config = get_backtest_settings()
+        parser.add_argument("realized", help="CSV of realized prices in the upload format")
+        parser.add_argument("--predictions", nargs="+", metavar="FILE", help="Prediction files instead of stored runs")
+        parser.add_argument("--user", help="Only score this user's stored runs")
+        parser.add_argument("--runs", type=int, help="Only score the newest N stored runs")
+        parser.add_argument("--walk-forward", action="store_true", help="Also replay the local baseline")
+        parser.add_argument("--windows", type=int, default=config["WINDOWS"])
+        parser.add_argument("--horizon", type=int, default=config["HORIZON"])
+        parser.add_argument("--history", type=int, help="Months of data each walk-forward window sees (default: all)")
+        parser.add_argument("--workers", type=int, help="Walk-forward processes (default: all cores)")
+        parser.add_argument("--top-n", type=int, default=config["TOP_N"])
+        parser.add_argument("--format", choices=["text", "json"], default="text")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["realized"], "r", encoding="utf-8") as f:
+                table = load_price_table(f.read())
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Invalid realized prices: {e}")
+        top_n = options["top_n"]
+
+        if options["predictions"]:
+            try:
+                predictions = PredictionSet.from_rows(
+                    row for path in options["predictions"] for row in read_prediction_rows(path)
+                )
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Invalid predictions: {e}")
+        else:
+            # Only monthly runs can be scored against monthly closes
+            runs = scored_runs(PredictionRun.objects.all())
+            if options["user"]:
+                user = get_user_model().objects.filter(username=options["user"]).first()
+                if user is None:
+                    raise CommandError(f"Unknown user {options['user']!r}")
+                runs = runs.filter(user=user)
+            if options["runs"]:
+                runs = runs[:options["runs"]]
+            predictions = load_stored_predictions(runs)
+        results = {"predictions": score_predictions(predictions, RealizedPrices.from_table(table), top_n)}
+
+        if options["walk_forward"]:
+            replay, realized = walk_forward(
+                table, options["windows"], options["horizon"], history=options["history"],
+                min_history=get_backtest_settings()["MIN_HISTORY"], alpha=get_forecast_settings()["ALPHA"],
+                max_workers=options["workers"],
+            )
+            results["walk_forward"] = score_predictions(replay, realized, top_n)
+
+        if options["format"] == "json":
+            self.stdout.write(json.dumps({name: result.as_dict() for name, result in results.items()}, indent=2))
+        else:
+            self.stdout.write("\n\n".join(format_result(name, result) for name, result in results.items()))
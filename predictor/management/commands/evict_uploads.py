@@ -0,0 +1,31 @@
+"""
+Apply the upload storage's TTL and delete unreferenced blobs:
+
+    python manage.py evict_uploads
+    python manage.py evict_uploads --ttl 86400    # override UPLOAD_STORAGE["TTL"]
+
+Every server process already does this every EVICT_INTERVAL seconds; this
+command is for cron when EVICT_INTERVAL is None.
+"""
+from django.core.management.base import BaseCommand
+
+from predictor.storage import build_storage, get_storage_settings
+
+
+class Command(BaseCommand):
+    help = "Evict expired uploads and garbage-collect unreferenced blobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ttl", type=int, help="Seconds since last use before a file is evicted")
+        parser.add_argument("--grace", type=int, help="Seconds an unreferenced blob is kept")
+
+    def handle(self, *args, **options):
+        config = get_storage_settings()
+        if options["ttl"] is not None:
+            config["TTL"] = options["ttl"]
+        if options["grace"] is not None:
+            config["GC_GRACE"] = options["grace"]
+        stats = build_storage(config).evict()
+        self.stdout.write(
+            f"Evicted {stats['files']} files, deleted {stats['blobs']} blobs ({stats['bytes']} bytes)"
+        )
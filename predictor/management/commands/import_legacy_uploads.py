@@ -0,0 +1,24 @@
+"""
+Move uploads of the old flat layout (<ROOT>/<user id>/) into the
+content-addressed storage:
+
+    python manage.py import_legacy_uploads
+
+Run it once after upgrading, before serving; the storage no longer reads
+the old layout. Files a user has uploaded since are kept.
+"""
+from django.core.management.base import BaseCommand
+
+from predictor.storage import build_storage
+
+
+class Command(BaseCommand):
+    help = "Import uploads of the old per-user directories into the upload storage."
+
+    def handle(self, *args, **options):
+        storage = build_storage()
+        imported = 0
+        for user_id, legacy_dir in storage.iter_legacy_dirs():
+            storage.import_legacy(user_id, legacy_dir)
+            imported += 1
+        self.stdout.write(f"Imported the uploads of {imported} users")
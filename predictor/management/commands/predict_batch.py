@@ -0,0 +1,73 @@
+"""
+Run a batch of predictions from a manifest file, e.g. for overnight runs:
+
+    python manage.py predict_batch portfolios.json --output predictions.zip
+
+The manifest is the JSON accepted by POST /predict/batch/. Items may point
+at files instead of inlining them with "csv_path" and "instructions_path",
+relative to the manifest's directory.
+"""
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from predictor import views
+from predictor.batch import ENCODERS, BatchRequestError, build_batch_runner, parse_batch_items
+
+
+def load_manifest(path):
+    with open(path, "r", encoding="utf-8") as f:
+        payload = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    items = payload.get("items") if isinstance(payload, dict) else payload
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        for key in ("csv", "instructions"):
+            file_path = item.pop(f"{key}_path", None)
+            if file_path:
+                with open(os.path.join(base_dir, file_path), "r", encoding="utf-8") as f:
+                    item[key] = f.read()
+    return items
+
+
+class Command(BaseCommand):
+    help = "Predict many (csv, instructions) pairs and write NDJSON or a zip of prediction.csv files."
+
+    def add_arguments(self, parser):
+        parser.add_argument("manifest", help="JSON file with the batch items")
+        parser.add_argument("-o", "--output", help="Output file (default: NDJSON on stdout)")
+        parser.add_argument("--format", choices=list(ENCODERS), help="Defaults to the output file's extension")
+        parser.add_argument("--concurrency", type=int, help="Overrides PREDICTION_BATCH MAX_CONCURRENCY")
+
+    def handle(self, *args, **options):
+        output = options["output"]
+        output_format = options["format"] or ("zip" if output and output.endswith(".zip") else "ndjson")
+        if output_format == "zip" and not output:
+            raise CommandError("--output is required for zip output")
+        try:
+            items = parse_batch_items(load_manifest(options["manifest"]))
+        except (OSError, ValueError, BatchRequestError) as e:
+            raise CommandError(f"Invalid manifest: {e}")
+
+        overrides = {}
+        if options["concurrency"]:
+            overrides["MAX_CONCURRENCY"] = options["concurrency"]
+        runner = build_batch_runner(views.predict_batch_item, overrides)
+        encode, _ = ENCODERS[output_format]
+        chunks = encode(runner.run(items), runner.stats)
+        if output:
+            with open(output, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+                self.stdout.flush()
+
+        summary = runner.stats.as_dict()
+        self.stderr.write(
+            f"{summary['completed']} predictions ({summary['unique']} unique, {summary['failed']} failed) "
+            f"in {summary['elapsed_seconds']}s: {summary['requests_per_minute']} requests/minute"
+        )
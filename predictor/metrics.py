@@ -0,0 +1,372 @@
+"""
+Request-level instrumentation for the predict path.
+
+Each stage of a prediction is timed with stage_timer():
+
+    read_inputs   reading the uploaded (or sample) CSV and instructions
+    build_prompt  persona prompt and CSV payload assembly
+    llm_call      LLM wall time (invoke, ainvoke, or a whole stream)
+    prefetch_wait waiting for a prefetched LLM call started at upload
+    parse         parsing the completion
+    render        rendering the result template
+
+Timings, prompt/completion token counts, cache hits and outcomes go into
+process-local histograms and counters, exposed in the Prometheus text
+format by the /metrics view. No client library is needed: the registry
+below writes the exposition format itself. With several worker processes
+every process keeps its own numbers, so scrape them individually.
+
+The stages of one request are also collected into a trace (see
+request_trace()), returned as a Server-Timing header and, when
+PROFILE is enabled, dumped as JSON next to a cProfile dump of the request.
+"""
+import contextvars
+import cProfile
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import ContextDecorator, contextmanager
+
+from django.conf import settings
+
+DEFAULT_METRICS_SETTINGS = {
+    "ENABLED": True,
+    "PROFILE": False,  # dump a cProfile and a stage trace of every prediction request
+    "PROFILE_DIR": "/tmp/llm_stock_profiles",
+}
+
+# Seconds; LLM calls take seconds, the other stages milliseconds
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+
+def get_metrics_settings():
+    config = dict(DEFAULT_METRICS_SETTINGS)
+    config.update(getattr(settings, "PREDICTION_METRICS", None) or {})
+    return config
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}_total{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with optional labels.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}  # labels -> [bucket counts..., sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-1] += value
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def total(self, *labels):
+        series = self._series.get(labels)
+        return series[-1] if series else 0
+
+    def samples(self):
+        with self._lock:
+            snapshot = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                label_text = _format_labels(self.labelnames, labels, [("le", _format_value(bound))])
+                yield f"{self.name}_bucket{label_text} {cumulative}"
+            label_text = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(series[-1])}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "prediction_stage_seconds", "Time spent in each stage of a prediction.", ["stage"],
+))
+TOKENS = REGISTRY.register(Histogram(
+    "prediction_tokens", "Prompt and completion tokens per prediction (estimated when not reported).", ["kind"],
+    buckets=TOKEN_BUCKETS,
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "prediction_cache_lookups", "Response cache lookups by result.", ["result"],
+))
+PREDICTIONS = REGISTRY.register(Counter(
+    "prediction_requests", "Predictions by outcome (ok, invalid, error).", ["outcome"],
+))
+
+LLM_BACKEND_SECONDS = REGISTRY.register(Histogram(
+    "llm_backend_seconds", "LLM call latency per router backend.", ["backend"],
+))
+LLM_BACKEND_CALLS = REGISTRY.register(Counter(
+    "llm_backend_calls", "LLM calls per router backend by outcome (ok, error, cancelled).", ["backend", "outcome"],
+))
+LLM_HEDGES = REGISTRY.register(Counter(
+    "llm_router_hedges", "Hedge requests fired by the LLM router.",
+))
+PREFETCHES = REGISTRY.register(Counter(
+    "prediction_prefetches", "Prefetches after uploads (started, coalesced, throttled, claimed, failed).", ["result"],
+))
+ENSEMBLE_SAMPLES = REGISTRY.register(Counter(
+    "prediction_ensemble_samples", "Ensemble samples by outcome (ok, invalid, error, cancelled).", ["outcome"],
+))
+THROTTLED = REGISTRY.register(Counter(
+    "prediction_throttled", "Predictions rejected by the rate limiter (user, ip, concurrency).", ["reason"],
+))
+COALESCED = REGISTRY.register(Counter(
+    "prediction_coalesced", "Predictions that shared the LLM call of an identical one in flight.",
+))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_trace = contextvars.ContextVar("prediction_trace", default=None)
+# Held by the one request being profiled
+_profiling = threading.Lock()
+
+
+class stage_timer(ContextDecorator):
+    """
+    Time a stage of the predict path, as a context manager or decorator:
+
+        with stage_timer("parse"):
+            ...
+
+    Works in sync and async code alike; the duration is also added to the
+    active request trace.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def _recreate_cm(self):
+        # A fresh timer per decorated call, so concurrent calls don't share _started
+        return type(self)(self.stage)
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_stage(self.stage, time.perf_counter() - self._started)
+        return False
+
+
+def record_stage(stage, seconds):
+    if not get_metrics_settings()["ENABLED"]:
+        return
+    STAGE_SECONDS.observe(seconds, stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((stage, seconds))
+
+
+def record_prediction(outcome, cache_hit=None, prompt_tokens=None, completion_tokens=None):
+    """
+    Count a finished prediction. cache_hit and the token counts are left
+    out for predictions that failed before the LLM answered.
+    """
+    if not get_metrics_settings()["ENABLED"]:
+        return
+    PREDICTIONS.inc(outcome)
+    if cache_hit is not None:
+        CACHE_LOOKUPS.inc("hit" if cache_hit else "miss")
+    if not cache_hit:
+        if prompt_tokens is not None:
+            TOKENS.observe(prompt_tokens, "prompt")
+        if completion_tokens is not None:
+            TOKENS.observe(completion_tokens, "completion")
+
+
+def record_backend_call(backend, outcome, seconds=None):
+    """
+    Count one LLM router call; seconds is observed for completed calls.
+    """
+    if not get_metrics_settings()["ENABLED"]:
+        return
+    LLM_BACKEND_CALLS.inc(backend, outcome)
+    if seconds is not None:
+        LLM_BACKEND_SECONDS.observe(seconds, backend)
+
+
+def record_hedge():
+    if get_metrics_settings()["ENABLED"]:
+        LLM_HEDGES.inc()
+
+
+def record_prefetch(result):
+    if get_metrics_settings()["ENABLED"]:
+        PREFETCHES.inc(result)
+
+
+def record_ensemble_sample(outcome):
+    if get_metrics_settings()["ENABLED"]:
+        ENSEMBLE_SAMPLES.inc(outcome)
+
+
+def record_throttled(reason):
+    if get_metrics_settings()["ENABLED"]:
+        THROTTLED.inc(reason)
+
+
+def record_coalesced():
+    if get_metrics_settings()["ENABLED"]:
+        COALESCED.inc()
+
+
+@contextmanager
+def request_trace():
+    """
+    Collect the stages timed inside the block as a list of (stage, seconds).
+    Context variables follow sync_to_async into worker threads, so stages
+    timed there are collected too.
+    """
+    trace = []
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+def server_timing(trace):
+    """
+    Server-Timing header value for a request trace (durations in ms).
+    """
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in trace)
+
+
+@contextmanager
+def profile_request(name="predict"):
+    """
+    When PROFILE is enabled, profile the block with cProfile and write
+    <PROFILE_DIR>/<name>-<id>.prof, plus <name>-<id>.json with the request
+    trace collected so far. Open a dump with `python -m pstats <file>` or
+    snakeviz. cProfile only sees the current thread, so profile the code
+    where it runs (see views.profiled).
+
+    Profilers do not share: two in one thread (coroutines on the event
+    loop) clobber each other, and from Python 3.12 a second one
+    anywhere raises. So one request is profiled at a time; blocks entered
+    while another is profiled run unprofiled and yield None.
+    """
+    config = get_metrics_settings()
+    if not config["PROFILE"] or not _profiling.acquire(blocking=False):
+        yield None
+        return
+    try:
+        profiler = cProfile.Profile()
+        started = time.time()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            os.makedirs(config["PROFILE_DIR"], exist_ok=True)
+            base = os.path.join(config["PROFILE_DIR"], f"{name}-{int(started)}-{uuid.uuid4().hex[:8]}")
+            profiler.dump_stats(base + ".prof")
+            with open(base + ".json", "w", encoding="utf-8") as f:
+                json.dump({
+                    "name": name,
+                    "started": started,
+                    "seconds": time.time() - started,
+                    "stages": [{"stage": stage, "seconds": seconds} for stage, seconds in _trace.get() or []],
+                }, f, indent=2)
+    finally:
+        _profiling.release()
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:26
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PredictionRun',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('inputs_hash', models.CharField(db_index=True, max_length=64)),
+                ('model_name', models.CharField(max_length=100)),
+                ('latency_ms', models.PositiveIntegerField(default=0)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('completion_tokens', models.PositiveIntegerField(default=0)),
+                ('tokens_estimated', models.BooleanField(default=False)),
+                ('cache_hit', models.BooleanField(default=False)),
+                ('valid_csv', models.BooleanField(default=False)),
+                ('row_count', models.PositiveIntegerField(default=0)),
+                ('explanations', models.TextField(blank=True)),
+                ('symbol_explanations', models.JSONField(blank=True, default=dict)),
+                ('validation_errors', models.JSONField(blank=True, default=list)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='prediction_runs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PredictionRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=16)),
+                ('month', models.DateField(blank=True, null=True)),
+                ('month_label', models.CharField(max_length=20)),
+                ('price', models.FloatField()),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rows', to='predictor.predictionrun')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='predictionrun',
+            index=models.Index(fields=['user', '-created_at'], name='predictor_run_user_created'),
+        ),
+        migrations.AddIndex(
+            model_name='predictionrow',
+            index=models.Index(fields=['user', 'symbol', 'month'], name='predictor_row_user_symbol'),
+        ),
+        migrations.AddIndex(
+            model_name='predictionrow',
+            index=models.Index(fields=['symbol', 'month'], name='predictor_row_symbol_month'),
+        ),
+    ]
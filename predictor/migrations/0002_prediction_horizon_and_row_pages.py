@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictor', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='predictionrun',
+            name='horizon',
+            field=models.CharField(default='monthly', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='predictionrow',
+            index=models.Index(fields=['run', 'id'], name='predictor_row_run_order'),
+        ),
+    ]
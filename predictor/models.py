@@ -0,0 +1,65 @@
+import uuid
+
+from django.conf import settings
+from django.db import models
+
+
+class PredictionRun(models.Model):
+    """
+    One prediction: who asked, for which inputs, what it cost and what the
+    LLM answered. The predicted prices live in PredictionRow.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE, related_name="prediction_runs"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    # cache.make_cache_key(model, prompt, csv payload): equal inputs, equal hash
+    inputs_hash = models.CharField(max_length=64, db_index=True)
+    model_name = models.CharField(max_length=100)
+    latency_ms = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    # True when the provider reported no usage and the counts are estimates
+    tokens_estimated = models.BooleanField(default=False)
+    cache_hit = models.BooleanField(default=False)
+    valid_csv = models.BooleanField(default=False)
+    # results.HORIZONS: what the rows' month labels count
+    horizon = models.CharField(max_length=10, default="monthly")
+    row_count = models.PositiveIntegerField(default=0)
+    explanations = models.TextField(blank=True)
+    symbol_explanations = models.JSONField(default=dict, blank=True)
+    validation_errors = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [models.Index(fields=["user", "-created_at"], name="predictor_run_user_created")]
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+
+class PredictionRow(models.Model):
+    """
+    One predicted price. user is copied from the run so per-user symbol and
+    month lookups are served by a single index.
+    """
+
+    run = models.ForeignKey(PredictionRun, on_delete=models.CASCADE, related_name="rows")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE, related_name="+")
+    symbol = models.CharField(max_length=16)
+    # First day of the predicted month, or null if the LLM's label is not a date
+    month = models.DateField(null=True, blank=True)
+    month_label = models.CharField(max_length=20)
+    price = models.FloatField()
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            # Pages of a run's rows in prediction order
+            models.Index(fields=["run", "id"], name="predictor_row_run_order"),
+            models.Index(fields=["user", "symbol", "month"], name="predictor_row_user_symbol"),
+            models.Index(fields=["symbol", "month"], name="predictor_row_symbol_month"),
+        ]
@@ -0,0 +1,327 @@
+"""
+Single-pass parser for LLM prediction completions.
+
+The completion is expected to contain, in any order:
+
+    ```csv
+    symbol,month,predicted_price
+    ...
+    ```
+    <table>...</table>
+    Explanations: ...
+
+plus, for ensemble predictions (see ensemble.py), a ```bands block of
+symbol,month,p25,median,p75,samples rows.
+
+LLMOutputParser is a line-oriented state machine: every character is looked
+at a bounded number of times, so parsing is linear in the completion size
+and there is no regex backtracking. It accepts the completion whole or as a
+stream of chunks (feed() returns the prediction rows completed so far), and
+produces typed rows, the raw CSV block, the HTML table, per-symbol
+explanations and structured validation errors.
+"""
+import csv
+import re
+from collections import namedtuple
+
+PredictionRow = namedtuple("PredictionRow", ["symbol", "month", "price"])
+
+# code is one of: missing_csv, bad_header, bad_row, bad_price, duplicate_row,
+# shape; line is the 1-based completion line, or None for whole-output errors
+ValidationError = namedtuple("ValidationError", ["code", "message", "line"])
+# Spread of an ensemble's samples for one cell; see ensemble.py
+BandRow = namedtuple("BandRow", ["symbol", "month", "low", "median", "high", "samples"])
+
+EXPECTED_HEADER = ["symbol", "month", "predicted_price"]
+
+TEXT, CSV_BLOCK, BANDS, TABLE, EXPLANATIONS = "text", "csv", "bands", "table", "explanations"
+
+EXPLANATIONS_MARKER = re.compile(r"explanations?:", re.IGNORECASE)
+# "AAPL: ...", "- **AAPL** - ...", "1. AAPL: ..." at the start of a line
+SYMBOL_LINE = re.compile(r"^\s*(?:[-*•]|\d+[.)])?\s*\**([A-Za-z][A-Za-z0-9.\-]{0,9})\**\s*[:\-–—]")
+
+
+class ParsedPrediction:
+    """
+    Result of parsing one completion.
+    """
+
+    def __init__(self):
+        self.header = None
+        self.rows = []  # PredictionRow with float prices
+        self.csv_rows = []  # header + data rows as string cells, as written
+        self.csv_lines = []
+        self.table_html = ""
+        self.explanations = ""
+        self.symbol_explanations = {}
+        self.bands = []  # BandRow, only for ensemble predictions
+        self.errors = []
+
+    @property
+    def prediction_csv(self):
+        return "\n".join(self.csv_lines).strip()
+
+    @property
+    def symbols(self):
+        return list(dict.fromkeys(row.symbol for row in self.rows))
+
+    def shape_errors(self):
+        return [error for error in self.errors if error.code == "shape"]
+
+
+class LLMOutputParser:
+    """
+    Incremental parser; call feed() with each chunk and close() at the end.
+    """
+
+    def __init__(self, expected_symbols=None, expected_months=None, period="month"):
+        self.expected_symbols = expected_symbols
+        self.expected_months = expected_months
+        self.period = period  # what a row's month column names, for shape errors
+        self.result = ParsedPrediction()
+        self.state = TEXT
+        self._pending_parts = []
+        self._line_no = 0
+        self._csv_seen = False
+        self._table_parts = []
+        self._explanation_lines = []
+        self._seen_keys = set()
+        self._new_rows = []
+
+    def feed(self, text: str):
+        """
+        Consume the next chunk and return the PredictionRows it completed.
+        """
+        if "\n" not in text:
+            # Defer joining until a line is complete, so a long line arriving
+            # in many small chunks is not re-concatenated on every chunk
+            self._pending_parts.append(text)
+            return []
+        lines = ("".join(self._pending_parts) + text).split("\n")
+        self._pending_parts = [lines.pop()]
+        i, count = 0, len(lines)
+        while i < count:
+            if self.state == CSV_BLOCK:
+                i = self._consume_csv_lines(lines, i)
+                if i == count:
+                    break
+            self._line_no += 1
+            self._process(lines[i])
+            i += 1
+        new_rows, self._new_rows = self._new_rows, []
+        return new_rows
+
+    def _consume_csv_lines(self, lines, i):
+        # Fast path for the bulk of a completion: plain rows inside the csv
+        # block. Returns the index of the first line it did not consume
+        # (a fence line, left for _process_csv).
+        csv_line = self._csv_line
+        for j in range(i, len(lines)):
+            line = lines[j]
+            if "```" in line:
+                return j
+            self._line_no += 1
+            text = line.strip()
+            if text:
+                csv_line(text)
+        return len(lines)
+
+    def close(self):
+        """
+        Flush the last line, validate, and return the ParsedPrediction.
+        """
+        pending = "".join(self._pending_parts)
+        self._pending_parts = []
+        if pending:
+            self._line_no += 1
+            self._process(pending)
+        result = self.result
+        if self.state == TABLE:
+            # Unterminated table: keep what was captured
+            result.table_html = "".join(self._table_parts)
+        result.explanations = "\n".join(self._explanation_lines).strip()
+        result.symbol_explanations = self._split_explanations()
+        if not self._csv_seen:
+            result.errors.append(ValidationError("missing_csv", "No ```csv block found in the output.", None))
+        elif result.header is None:
+            result.errors.append(ValidationError("missing_csv", "The ```csv block is empty.", None))
+        self._validate_shape()
+        return result
+
+    def _process(self, line):
+        # A line can hold several sections (e.g. "...```<table>..."), so keep
+        # handing the unconsumed remainder back to the current state
+        while line is not None:
+            line = getattr(self, f"_process_{self.state}")(line)
+
+    def _process_text(self, line):
+        if not self._csv_seen:
+            start = line.find("```csv")
+            if start != -1:
+                self._csv_seen = True
+                self.state = CSV_BLOCK
+                rest = line[start + len("```csv"):]
+                return rest if rest.strip() else None
+        start = line.find("```bands")
+        if start != -1:
+            self.state = BANDS
+            return None
+        if not self.result.table_html and not self._table_parts:
+            start = line.lower().find("<table")
+            if start != -1:
+                self.state = TABLE
+                return line[start:]
+        if not self._explanation_lines:
+            match = EXPLANATIONS_MARKER.search(line)
+            if match:
+                self.state = EXPLANATIONS
+                # An empty first line keeps "Explanations:\n..." and
+                # "Explanations: ..." equivalent once stripped
+                self._explanation_lines.append("")
+                rest = line[match.end():]
+                return rest if rest.strip() else None
+        return None
+
+    def _process_csv(self, line):
+        end = line.find("```")
+        content = line if end == -1 else line[:end]
+        if content.strip():
+            self._csv_line(content.strip())
+        if end == -1:
+            return None
+        self.state = TEXT
+        rest = line[end + 3:]
+        return rest if rest.strip() else None
+
+    def _process_bands(self, line):
+        end = line.find("```")
+        cells = (line if end == -1 else line[:end]).strip().split(",")
+        if len(cells) == 6:
+            try:
+                self.result.bands.append(BandRow(
+                    cells[0].strip(), cells[1].strip(), float(cells[2]), float(cells[3]), float(cells[4]),
+                    int(cells[5]),
+                ))
+            except ValueError:
+                pass  # the header, or a malformed row
+        if end == -1:
+            return None
+        self.state = TEXT
+        rest = line[end + 3:]
+        return rest if rest.strip() else None
+
+    def _process_table(self, line):
+        end = line.lower().find("</table>")
+        if end == -1:
+            self._table_parts.append(line + "\n")
+            return None
+        self._table_parts.append(line[:end + len("</table>")])
+        self.result.table_html = "".join(self._table_parts)
+        self.state = TEXT
+        rest = line[end + len("</table>"):]
+        return rest if rest.strip() else None
+
+    def _process_explanations(self, line):
+        # Explanations run until the next structured section
+        stripped = line.lstrip()
+        if stripped.startswith("```") or stripped.lower().startswith("<table"):
+            self.state = TEXT
+            return line
+        self._explanation_lines.append(line.strip())
+        return None
+
+    def _csv_line(self, text):
+        result = self.result
+        result.csv_lines.append(text)
+        if result.header is not None and '"' not in text:
+            cells = text.split(",")
+            if len(cells) == 3:
+                symbol, month = cells[0].strip(), cells[1].strip()
+                key = (symbol, month)
+                try:
+                    price = float(cells[2])
+                except ValueError:
+                    pass
+                else:
+                    if key not in self._seen_keys:
+                        self._seen_keys.add(key)
+                        result.csv_rows.append(cells)
+                        row = PredictionRow(symbol, month, price)
+                        result.rows.append(row)
+                        self._new_rows.append(row)
+                        return
+        # Slow path: header, quoted fields and rows that need an error report
+        try:
+            # Unquoted lines (nearly all of them) don't need the csv module
+            cells = text.split(",") if '"' not in text else next(csv.reader([text]))
+        except csv.Error as e:
+            result.errors.append(ValidationError("bad_row", f"Unreadable row: {e}", self._line_no))
+            return
+        result.csv_rows.append(cells)
+        if result.header is None:
+            result.header = [cell.strip().lower() for cell in cells]
+            if result.header != EXPECTED_HEADER:
+                result.errors.append(ValidationError(
+                    "bad_header", f"Expected header {','.join(EXPECTED_HEADER)}, got {text}", self._line_no
+                ))
+            return
+        if len(cells) != 3:
+            result.errors.append(ValidationError(
+                "bad_row", f"Expected 3 fields, got {len(cells)}: {text}", self._line_no
+            ))
+            return
+        symbol, month, price = (cell.strip() for cell in cells)
+        try:
+            price = float(price)
+        except ValueError:
+            result.errors.append(ValidationError("bad_price", f"Price {price!r} is not a number", self._line_no))
+            return
+        if (symbol, month) in self._seen_keys:
+            result.errors.append(ValidationError(
+                "duplicate_row", f"Duplicate prediction for {symbol} {month}", self._line_no
+            ))
+            return
+        self._seen_keys.add((symbol, month))
+        row = PredictionRow(symbol, month, price)
+        result.rows.append(row)
+        self._new_rows.append(row)
+
+    def _split_explanations(self):
+        known = set(self.result.symbols)
+        explanations = {}
+        current = None
+        for line in self._explanation_lines:
+            match = SYMBOL_LINE.match(line)
+            if match and match.group(1).upper() in known:
+                current = match.group(1).upper()
+                explanations[current] = line
+            elif current and line:
+                explanations[current] += "\n" + line
+        return explanations
+
+    def _validate_shape(self):
+        result = self.result
+        if not result.rows:
+            return
+        months = {}
+        for row in result.rows:
+            months[row.symbol] = months.get(row.symbol, 0) + 1
+        if self.expected_symbols is not None and len(months) != self.expected_symbols:
+            result.errors.append(ValidationError(
+                "shape", f"Expected {self.expected_symbols} symbols, got {len(months)}", None
+            ))
+        if self.expected_months is not None:
+            for symbol, count in months.items():
+                if count != self.expected_months:
+                    result.errors.append(ValidationError(
+                        "shape", f"{symbol} has {count} {self.period}s, expected {self.expected_months}", None
+                    ))
+
+
+def parse_completion(llm_output: str, expected_symbols=None, expected_months=None, period="month"):
+    """
+    Parse a complete LLM output in one pass.
+    """
+    parser = LLMOutputParser(expected_symbols, expected_months, period)
+    parser.feed(llm_output)
+    return parser.close()
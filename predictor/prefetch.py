@@ -0,0 +1,162 @@
+"""
+Speculative prediction after an upload.
+
+Users nearly always upload their CSV or instructions and then click
+predict, so with PREDICTION_PREFETCH["ENABLED"] a successful upload starts
+the LLM call for the new inputs right away. Prefetches are keyed by the
+response cache key of their (model, prompt, CSV payload), i.e. by content:
+uploading the same files again joins the prefetch already running instead
+of starting another one.
+
+When predict is clicked, the predict path claims the prefetch for its key
+and waits for it if it is still running, so only the remainder of the LLM
+call is left to wait for. The first claim owns the result (its token usage
+and latency go into the history); later claims of the same prefetch count
+as cache hits. Failed prefetches are simply dropped and predict calls the
+LLM itself.
+
+With PREDICTION_THROTTLING a prefetch counts as a prediction of its user:
+it takes their rate limiter tokens and holds a concurrency slot while it
+runs, and uploads the limiter turns away start no prefetch.
+
+Prefetches live in this process only; with several workers a predict
+request served by another worker finds nothing to claim, but still gets
+the response cache entry a finished prefetch wrote.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+DEFAULT_PREFETCH_SETTINGS = {
+    "ENABLED": False,
+    "MAX_WORKERS": 4,
+    "MAX_ENTRIES": 64,  # prefetches kept, oldest finished ones are dropped first
+    "TTL": 10 * 60,  # seconds an unclaimed result is kept
+    "WAIT": 120,  # seconds predict waits for a running prefetch before calling the LLM itself
+}
+
+
+def get_prefetch_settings():
+    config = dict(DEFAULT_PREFETCH_SETTINGS)
+    config.update(getattr(settings, "PREDICTION_PREFETCH", None) or {})
+    return config
+
+
+class PrefetchResult:
+    """
+    What a prefetch produced: the completion plus the token usage and
+    latency of producing it.
+    """
+
+    def __init__(self, llm_output, usage, latency):
+        self.llm_output = llm_output
+        self.usage = usage
+        self.latency = latency
+
+
+class Prefetcher:
+    """
+    Runs prefetches on a thread pool, at most one per key.
+    """
+
+    def __init__(self, max_workers=4, max_entries=64, ttl=600, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prediction-prefetch")
+        self._entries = OrderedDict()  # key -> {"future", "started_at", "claimed"}
+        self._lock = threading.Lock()
+
+    def _expired(self, entry):
+        future = entry["future"]
+        return future.done() and self.clock() - entry["started_at"] > self.ttl
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Start fn(*args, **kwargs) for key unless a prefetch for key is
+        already running or waiting to be claimed. Returns True if started.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry) and not entry["future"].cancelled():
+                return False
+            future = self.executor.submit(fn, *args, **kwargs)
+            self._entries[key] = {"future": future, "started_at": self.clock(), "claimed": False}
+            self._entries.move_to_end(key)
+            self._evict()
+        future.add_done_callback(lambda f, key=key: self._drop_failed(key, f))
+        return True
+
+    def _drop_failed(self, key, future):
+        if future.cancelled() or future.exception() is not None:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry["future"] is future:
+                    del self._entries[key]
+
+    def _evict(self):
+        for key in [key for key, entry in self._entries.items() if self._expired(entry)]:
+            del self._entries[key]
+        # Running prefetches are never dropped, they will be claimed soon
+        for key in [key for key, entry in self._entries.items() if entry["future"].done()]:
+            if len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    def claim(self, key):
+        """
+        (future, first) for key's prefetch, or (None, False) if there is none.
+        first is True for the first claim only.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry):
+                return None, False
+            first = not entry["claimed"]
+            entry["claimed"] = True
+            return entry["future"], first
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    """
+    Return the process-wide prefetcher configured by settings.PREDICTION_PREFETCH.
+    """
+    global _prefetcher
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                config = get_prefetch_settings()
+                _prefetcher = Prefetcher(
+                    max_workers=config["MAX_WORKERS"],
+                    max_entries=config["MAX_ENTRIES"],
+                    ttl=config["TTL"],
+                )
+    return _prefetcher
+
+
+def reset_prefetcher():
+    """
+    Shut down the process-wide prefetcher so the next call rebuilds it from settings.
+    """
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is not None:
+            _prefetcher.shutdown(wait=True)
+        _prefetcher = None
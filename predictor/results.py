@@ -0,0 +1,105 @@
+"""
+Shape of prediction results: how many symbols, how many periods, and at
+which horizon.
+
+settings.PREDICTION_SHAPE asks for the top SYMBOLS symbols with PERIODS
+prices each, one per week, month or quarter (HORIZON). The LLM is told the
+shape in the prompt (see output_instructions) and the parser checks it
+(see parsing.LLMOutputParser). The period goes in the "month" column of the
+prediction CSV, labelled as:
+
+    weekly     2025-01-06   the Monday starting the week
+    monthly    2025-01
+    quarterly  2025-Q1
+
+A result is SYMBOLS x PERIODS rows, up to MAX_ROWS. That can be thousands
+of rows, so the result page shows PAGE_SIZE rows at a time. Stored results
+are read from the database a page at a time, and exports stream from it
+(see exports.py).
+"""
+import datetime
+import re
+
+from django.conf import settings
+
+from .ingest import normalize_date
+
+DEFAULT_SHAPE_SETTINGS = {
+    "SYMBOLS": 10,  # top N
+    "HORIZON": "monthly",  # "weekly", "monthly" or "quarterly"
+    "PERIODS": 12,
+    "STRICT": False,  # reject outputs of another shape instead of warning
+    "MAX_ROWS": 100_000,  # larger outputs are rejected
+    "PAGE_SIZE": 100,  # table rows per page on the result page
+}
+
+# name: (column title, example label, what a label names)
+HORIZONS = {
+    "weekly": ("Week", "2025-01-06", "the date of the Monday starting the week"),
+    "monthly": ("Month", "2025-01", "the year and month"),
+    "quarterly": ("Quarter", "2025-Q1", "the year and quarter"),
+}
+
+QUARTER_LABEL = re.compile(r"^(\d{4})-?Q([1-4])$", re.IGNORECASE)
+WEEK_LABEL = re.compile(r"^(\d{4})-?W(\d{2})$", re.IGNORECASE)
+
+OUTPUT_INSTRUCTIONS = """
+
+Output format:
+Predict the top {symbols} most profitable symbols with {periods} {horizon} prices each.
+Return them in a ```csv block with the header symbol,month,predicted_price, one row per symbol and period, where the month column holds {description} (e.g. {example}).
+Follow it with "Explanations:" and one line per symbol starting with the symbol.
+"""
+
+
+def get_shape_settings():
+    config = dict(DEFAULT_SHAPE_SETTINGS)
+    overrides = getattr(settings, "PREDICTION_SHAPE", None) or {}
+    if "MONTHS" in overrides and "PERIODS" not in overrides:
+        # The monthly-only name of PERIODS
+        overrides = dict(overrides, PERIODS=overrides["MONTHS"])
+    config.update(overrides)
+    if config["HORIZON"] not in HORIZONS:
+        raise ValueError(f"Unknown PREDICTION_SHAPE HORIZON {config['HORIZON']!r}, expected one of {', '.join(HORIZONS)}")
+    return config
+
+
+def period_title(horizon):
+    """
+    "Week", "Month" or "Quarter": the heading of the period column.
+    """
+    return HORIZONS[horizon][0]
+
+
+def output_instructions(config=None):
+    """
+    The part of the system prompt that asks for the configured shape.
+    """
+    config = config or get_shape_settings()
+    _, example, description = HORIZONS[config["HORIZON"]]
+    return OUTPUT_INSTRUCTIONS.format(
+        symbols=config["SYMBOLS"], periods=config["PERIODS"], horizon=config["HORIZON"],
+        description=description, example=example,
+    )
+
+
+def period_start(label: str):
+    """
+    First day of the period a prediction label names ("2025-Q1",
+    "2025-W02", a month or a date), or None.
+    """
+    label = label.strip()
+    match = QUARTER_LABEL.match(label)
+    if match:
+        return datetime.date(int(match.group(1)), 3 * int(match.group(2)) - 2, 1)
+    match = WEEK_LABEL.match(label)
+    if match:
+        try:
+            return datetime.date.fromisocalendar(int(match.group(1)), int(match.group(2)), 1)
+        except ValueError:
+            return None
+    try:
+        _, value = normalize_date(label)
+    except ValueError:
+        return None
+    return value.astype(datetime.date)
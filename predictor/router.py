@@ -0,0 +1,529 @@
+"""
+Latency-aware router over several configured chat models.
+
+settings.LLM_ROUTER["BACKENDS"] lists the chat models to route between, e.g.
+
+    "BACKENDS": [
+        {"NAME": "openai", "PROVIDER": "openai", "MODEL": "gpt-4o-mini", "API_KEY_ENV": "OPENAI_API_KEY"},
+        {"NAME": "local", "CLASS": "predictor.fake_llm.FakeChatModel", "OPTIONS": {"latency": 0.5}},
+    ]
+
+PROVIDER backends come from the client registry (llm_clients.PROVIDERS);
+CLASS backends are any LangChain chat model class, built with OPTIONS.
+
+For every backend the router keeps a rolling window of call latencies and
+outcomes (p50, p95, error rate) and a circuit breaker. Each call goes to
+the fastest healthy backend; backends with too few samples are tried first
+so every backend gets measured. When a call fails, the next backend is
+tried. With HEDGE_AFTER set, a second backend is also called once the first
+has been running for HEDGE_AFTER seconds (or for its own p95, with "p95"),
+and the first valid answer wins.
+
+A backend's circuit opens after FAILURE_THRESHOLD consecutive failures, or
+when its error rate over the window reaches ERROR_RATE_THRESHOLD; it then
+gets no calls for RESET_TIMEOUT seconds, after which a single trial call
+decides whether it closes again. When every circuit is open the call fails
+with NoHealthyBackendError, like any other LLM error.
+
+The router has the invoke/ainvoke/stream interface of a chat model, so
+views.get_llm() can return it in place of a single client.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .llm_clients import get_client_registry
+from .metrics import record_backend_call, record_hedge
+
+DEFAULT_ROUTER_SETTINGS = {
+    "BACKENDS": [],  # empty: no router, get_llm() returns the single configured client
+    "WINDOW": 100,  # calls per backend kept for latency percentiles and error rate
+    "MIN_SAMPLES": 5,  # calls before a backend's latency and error rate are trusted
+    "FAILURE_THRESHOLD": 5,  # consecutive failures that open the circuit
+    "ERROR_RATE_THRESHOLD": 0.5,
+    "RESET_TIMEOUT": 30.0,  # seconds an open circuit waits before a trial call
+    "HEDGE_AFTER": None,  # None (no hedging), seconds, or "p95"
+    "HEDGE_DEFAULT_DELAY": 2.0,  # "p95" delay while the backend has too few samples
+    "HEDGE_POOL_SIZE": 16,  # threads for hedged sync calls
+}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class NoHealthyBackendError(RuntimeError):
+    """
+    Raised when every backend's circuit is open.
+    """
+
+
+class InvalidResponseError(RuntimeError):
+    """
+    Raised when every backend answered, but none with a valid prediction.
+    """
+
+
+def get_router_settings():
+    config = dict(DEFAULT_ROUTER_SETTINGS)
+    config.update(getattr(settings, "LLM_ROUTER", None) or {})
+    return config
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list, or None if empty.
+    """
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class CircuitBreaker:
+    """
+    closed -> open after too many failures -> half_open after reset_timeout,
+    allowing one trial call -> closed on success, open again on failure.
+    """
+
+    def __init__(self, failure_threshold=5, error_rate_threshold=0.5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def available(self):
+        """
+        Whether a call could be made now (without claiming a trial).
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return self.clock() - self.opened_at >= self.reset_timeout
+            return not self.trial_in_flight
+
+    def acquire(self):
+        """
+        Claim the right to call the backend; an elapsed open circuit turns
+        half-open and only lets this one trial call through.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def release(self):
+        """
+        Give back a claimed call that was cancelled before it finished.
+        """
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self, error_rate=None):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+            if (
+                self.state == HALF_OPEN
+                or self.consecutive_failures >= self.failure_threshold
+                or (error_rate is not None and error_rate >= self.error_rate_threshold)
+            ):
+                self.state = OPEN
+                self.opened_at = self.clock()
+
+
+class Backend:
+    """
+    One chat model with its rolling latency/outcome window and breaker.
+    """
+
+    def __init__(self, name, model, window=100, min_samples=5, breaker=None):
+        self.name = name
+        self.model = model
+        self.min_samples = min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self._calls = deque(maxlen=window)  # (seconds, ok)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self._calls.append((seconds, ok))
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure(self.error_rate)
+
+    @property
+    def samples(self):
+        return len(self._calls)
+
+    def latencies(self):
+        with self._lock:
+            return sorted(seconds for seconds, ok in self._calls if ok)
+
+    @property
+    def p50(self):
+        return percentile(self.latencies(), 0.50)
+
+    @property
+    def p95(self):
+        return percentile(self.latencies(), 0.95)
+
+    @property
+    def error_rate(self):
+        """
+        Share of failed calls in the window; None until min_samples calls.
+        """
+        with self._lock:
+            if len(self._calls) < self.min_samples:
+                return None
+            return sum(1 for _, ok in self._calls if not ok) / len(self._calls)
+
+    def snapshot(self):
+        return {
+            "name": self.name,
+            "state": self.breaker.state,
+            "samples": self.samples,
+            "p50": self.p50,
+            "p95": self.p95,
+            "error_rate": self.error_rate,
+        }
+
+
+class LLMRouter:
+    """
+    Routes chat model calls over backends; see the module docstring.
+
+    validate(text) -> bool decides whether a completion counts as an answer
+    (e.g. whether it contains a prediction); invalid answers make a hedged
+    call wait for the other backend, or fail over to the next one.
+    """
+
+    def __init__(self, backends, min_samples=5, hedge_after=None, hedge_default_delay=2.0,
+                 hedge_pool_size=16, validate=None, clock=time.monotonic):
+        if not backends:
+            raise ValueError("The LLM router needs at least one backend")
+        self.backends = list(backends)
+        self.min_samples = min_samples
+        self.hedge_after = hedge_after
+        self.hedge_default_delay = hedge_default_delay
+        self.validate = validate
+        self.clock = clock
+        self._hedge_pool_size = hedge_pool_size
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def name(self):
+        return "router:" + "+".join(backend.name for backend in self.backends)
+
+    def ranked(self):
+        """
+        Available backends, best first: those still being measured (in
+        configured order), then the others by p50 latency.
+        """
+        available = [(index, backend) for index, backend in enumerate(self.backends) if backend.breaker.available()]
+
+        def key(entry):
+            index, backend = entry
+            if backend.samples < self.min_samples:
+                return (0, 0.0, index)
+            return (1, backend.p50 if backend.p50 is not None else float("inf"), index)
+
+        return [backend for _, backend in sorted(available, key=key)]
+
+    def hedge_delay(self, backend):
+        if self.hedge_after is None:
+            return None
+        if self.hedge_after == "p95":
+            if backend.samples < self.min_samples or backend.p95 is None:
+                return self.hedge_default_delay
+            return backend.p95
+        return float(self.hedge_after)
+
+    def snapshot(self):
+        return [backend.snapshot() for backend in self.backends]
+
+    def _is_valid(self, response, validate):
+        validate = validate or self.validate
+        return validate is None or validate(response.content)
+
+    def _claim_next(self, queue):
+        # Pop backends until one lets us call it (a half-open one may be taken)
+        while queue:
+            backend = queue.pop(0)
+            if backend.breaker.acquire():
+                return backend
+        return None
+
+    def _finish(self, backend, started, error=None):
+        seconds = self.clock() - started
+        backend.record(seconds, error is None)
+        record_backend_call(backend.name, "ok" if error is None else "error", seconds)
+
+    def _call(self, backend, messages, **kwargs):
+        started = self.clock()
+        try:
+            response = backend.model.invoke(messages, **kwargs)
+        except Exception as e:
+            self._finish(backend, started, e)
+            raise
+        self._finish(backend, started)
+        response.response_metadata["router_backend"] = backend.name
+        return response
+
+    async def _acall(self, backend, messages, **kwargs):
+        started = self.clock()
+        try:
+            response = await backend.model.ainvoke(messages, **kwargs)
+        except asyncio.CancelledError:
+            # A hedge loser: neither a success nor a failure of the backend
+            backend.breaker.release()
+            record_backend_call(backend.name, "cancelled")
+            raise
+        except Exception as e:
+            self._finish(backend, started, e)
+            raise
+        self._finish(backend, started)
+        response.response_metadata["router_backend"] = backend.name
+        return response
+
+    def _hedge_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self._hedge_pool_size, thread_name_prefix="llm-hedge")
+            return self._pool
+
+    @staticmethod
+    def _give_up(errors):
+        if not errors:
+            raise NoHealthyBackendError("No healthy LLM backend available")
+        if all(isinstance(error, InvalidResponseError) for _, error in errors):
+            raise InvalidResponseError("; ".join(f"{name}: {error}" for name, error in errors))
+        # Re-raise the last real provider error, so callers can still inspect it
+        raise [error for _, error in errors if not isinstance(error, InvalidResponseError)][-1]
+
+    def invoke(self, messages, validate=None, **kwargs):
+        """
+        Call the best backend, failing over (and hedging, if configured).
+        kwargs (e.g. temperature) are passed to the backend's invoke.
+        Returns the chat model's response message.
+        """
+        queue = self.ranked()
+        errors = []
+        if self.hedge_after is None:
+            while True:
+                backend = self._claim_next(queue)
+                if backend is None:
+                    self._give_up(errors)
+                try:
+                    response = self._call(backend, messages, **kwargs)
+                except Exception as e:
+                    errors.append((backend.name, e))
+                    continue
+                if self._is_valid(response, validate):
+                    return response
+                errors.append((backend.name, InvalidResponseError("no valid prediction in the response")))
+
+        # Hedged: the calls run on the pool; a loser finishes in the
+        # background and still updates its backend's statistics
+        pool = self._hedge_pool()
+        pending = {}
+        hedged = False
+
+        def launch():
+            backend = self._claim_next(queue)
+            if backend is not None:
+                pending[pool.submit(self._call, backend, messages, **kwargs)] = backend
+            return backend
+
+        primary = launch()
+        if primary is None:
+            self._give_up(errors)
+        while pending:
+            timeout = None if hedged or not queue else self.hedge_delay(primary)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                if launch() is not None:
+                    record_hedge()
+                continue
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    errors.append((backend.name, e))
+                    continue
+                if self._is_valid(response, validate):
+                    return response
+                errors.append((backend.name, InvalidResponseError("no valid prediction in the response")))
+            if not pending:
+                launch()
+        self._give_up(errors)
+
+    async def ainvoke(self, messages, validate=None, **kwargs):
+        """
+        Async invoke. Hedge losers are cancelled, which also aborts their
+        HTTP requests.
+        """
+        queue = self.ranked()
+        errors = []
+        pending = {}
+        hedged = self.hedge_after is None
+
+        def launch():
+            backend = self._claim_next(queue)
+            if backend is not None:
+                pending[asyncio.ensure_future(self._acall(backend, messages, **kwargs))] = backend
+            return backend
+
+        primary = launch()
+        if primary is None:
+            self._give_up(errors)
+        try:
+            while pending:
+                timeout = None if hedged or not queue else self.hedge_delay(primary)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    if launch() is not None:
+                        record_hedge()
+                    continue
+                for task in done:
+                    backend = pending.pop(task)
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        errors.append((backend.name, e))
+                        continue
+                    if self._is_valid(response, validate):
+                        return response
+                    errors.append((backend.name, InvalidResponseError("no valid prediction in the response")))
+                if not pending:
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        self._give_up(errors)
+
+    def stream(self, messages, **kwargs):
+        """
+        Stream from the best backend. Fails over to the next backend only
+        while nothing has been yielded yet; streams are never hedged.
+        """
+        queue = self.ranked()
+        errors = []
+        while True:
+            backend = self._claim_next(queue)
+            if backend is None:
+                self._give_up(errors)
+            started = self.clock()
+            yielded = False
+            try:
+                for chunk in backend.model.stream(messages, **kwargs):
+                    yielded = True
+                    yield chunk
+            except GeneratorExit:
+                # Abandoned by the consumer: like a hedge loser, neither a
+                # success nor a failure, but a half-open trial must be freed
+                backend.breaker.release()
+                record_backend_call(backend.name, "cancelled")
+                raise
+            except Exception as e:
+                self._finish(backend, started, e)
+                if yielded:
+                    raise
+                errors.append((backend.name, e))
+                continue
+            self._finish(backend, started)
+            return
+
+
+def build_backend_model(spec):
+    """
+    Build the chat model for one BACKENDS entry.
+    """
+    if spec.get("CLASS"):
+        return import_string(spec["CLASS"])(**spec.get("OPTIONS", {}))
+    api_key = os.environ.get(spec["API_KEY_ENV"]) if spec.get("API_KEY_ENV") else None
+    return get_client_registry().get(spec["PROVIDER"], spec["MODEL"], api_key)
+
+
+def build_router(config=None, validate=None, clock=time.monotonic):
+    """
+    Build an LLMRouter from settings.LLM_ROUTER (or config).
+    """
+    config = config or get_router_settings()
+    backends = []
+    for index, spec in enumerate(config["BACKENDS"]):
+        breaker = CircuitBreaker(
+            failure_threshold=config["FAILURE_THRESHOLD"],
+            error_rate_threshold=config["ERROR_RATE_THRESHOLD"],
+            reset_timeout=config["RESET_TIMEOUT"],
+            clock=clock,
+        )
+        backends.append(Backend(
+            spec.get("NAME") or spec.get("MODEL") or f"backend{index}",
+            build_backend_model(spec),
+            window=config["WINDOW"],
+            min_samples=config["MIN_SAMPLES"],
+            breaker=breaker,
+        ))
+    return LLMRouter(
+        backends,
+        min_samples=config["MIN_SAMPLES"],
+        hedge_after=config["HEDGE_AFTER"],
+        hedge_default_delay=config["HEDGE_DEFAULT_DELAY"],
+        hedge_pool_size=config["HEDGE_POOL_SIZE"],
+        validate=validate,
+        clock=clock,
+    )
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router(validate=None):
+    """
+    Return the process-wide router, or None when no backends are configured.
+    Backend statistics live as long as the router does.
+    """
+    global _router
+    if not get_router_settings()["BACKENDS"]:
+        return None
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = build_router(validate=validate)
+    return _router
+
+
+def reset_router():
+    global _router
+    with _router_lock:
+        _router = None
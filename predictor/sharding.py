@@ -0,0 +1,194 @@
+"""
+Map-reduce prediction for uploads too large for a single prompt.
+
+The CSV is split by symbol into shards that each fit a token budget. Every
+shard is scored by its own LLM call (with bounded parallelism), and the
+per-shard candidates are merged deterministically into the global top-N
+`symbol,month,predicted_price` output that predict_view validates, in the
+shape of PREDICTION_SHAPE (see results.py). Wall time
+grows with shards / MAX_CONCURRENCY instead of with file size.
+"""
+import contextvars
+import csv
+import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .results import get_shape_settings, output_instructions
+from .summarize import estimate_tokens, load_price_table
+
+DEFAULT_SHARDING_SETTINGS = {
+    # "never" sends one prompt, "always" shards every upload, "auto" shards
+    # uploads larger than MAX_SHARD_TOKENS with at least MIN_SYMBOLS symbols
+    "MODE": "never",
+    "MIN_SYMBOLS": 50,
+    "MAX_SHARD_TOKENS": 6000,
+    "MAX_CONCURRENCY": 4,
+}
+
+# Followed by results.output_instructions()
+SHARD_INSTRUCTIONS = """
+
+Sharded analysis:
+This data is shard {index} of {total} of a larger upload and only contains some of the symbols.
+Pick the symbols from this shard only (all of them if there are fewer than asked for)."""
+
+
+def get_sharding_settings():
+    config = dict(DEFAULT_SHARDING_SETTINGS)
+    config.update(getattr(settings, "PREDICTION_SHARDING", None) or {})
+    return config
+
+
+def group_rows_by_symbol(csv_data: str):
+    """
+    Returns (header_line, OrderedDict of symbol -> list of raw data lines).
+    """
+    lines = csv_data.splitlines()
+    header = lines[0] if lines else ""
+    groups = OrderedDict()
+    for line in lines[1:]:
+        if not line.strip():
+            continue
+        symbol = line.split(",", 1)[0].strip()
+        groups.setdefault(symbol, []).append(line)
+    return header, groups
+
+
+def should_shard(csv_data: str, config=None):
+    """
+    Decide whether csv_data should go through the sharded path.
+    """
+    config = config or get_sharding_settings()
+    mode = config["MODE"]
+    if mode == "never":
+        return False
+    if mode == "always":
+        return True
+    if estimate_tokens(csv_data) <= config["MAX_SHARD_TOKENS"]:
+        return False
+    header, groups = group_rows_by_symbol(csv_data)
+    return len(groups) >= config["MIN_SYMBOLS"]
+
+
+def split_into_shards(csv_data: str, max_shard_tokens: int):
+    """
+    Pack whole symbols into CSV shards of at most max_shard_tokens each.
+    A single symbol larger than the budget gets a shard of its own.
+    """
+    header, groups = group_rows_by_symbol(csv_data)
+    header_cost = estimate_tokens(header)
+    shards = []
+    current, used = [], header_cost
+    for symbol_lines in groups.values():
+        block = "\n".join(symbol_lines)
+        cost = estimate_tokens(block)
+        if current and used + cost > max_shard_tokens:
+            shards.append(current)
+            current, used = [], header_cost
+        current.append(block)
+        used += cost
+    if current:
+        shards.append(current)
+    return [header + "\n" + "\n".join(blocks) + "\n" for blocks in shards]
+
+
+def extract_candidates(prediction_csv: str):
+    """
+    Turn a shard's prediction CSV into {symbol: [(month, price), ...]},
+    dropping malformed rows.
+    """
+    candidates = OrderedDict()
+    rows = csv.reader(io.StringIO(prediction_csv))
+    next(rows, None)
+    for row in rows:
+        if len(row) < 3:
+            continue
+        symbol, month, price = (cell.strip() for cell in row[:3])
+        try:
+            candidates.setdefault(symbol, []).append((month, float(price)))
+        except ValueError:
+            continue
+    return candidates
+
+
+def merge_shard_predictions(shard_results, last_closes, top_n=10, months=12):
+    """
+    Deterministically merge per-shard (prediction_csv, explanations) results.
+
+    Symbols are ranked by predicted return over their last known close (or
+    over their first predicted price when the close is unknown); ties break
+    on the symbol name. Returns a completion in the format
+    parse_llm_output expects.
+    """
+    candidates = {}
+    explanation_lines = {}
+    for prediction_csv, explanations in shard_results:
+        for symbol, points in extract_candidates(prediction_csv).items():
+            candidates.setdefault(symbol, sorted(points)[:months])
+        for line in explanations.splitlines():
+            symbol = line.split(":", 1)[0].strip().strip("*-# ")
+            if symbol in candidates and symbol not in explanation_lines:
+                explanation_lines[symbol] = line.strip()
+
+    def expected_return(symbol):
+        points = candidates[symbol]
+        base = last_closes.get(symbol) or points[0][1]
+        return points[-1][1] / base - 1.0 if base else 0.0
+
+    ranked = sorted(candidates, key=lambda symbol: (-expected_return(symbol), symbol))[:top_n]
+    lines = ["symbol,month,predicted_price"]
+    for symbol in ranked:
+        lines.extend(f"{symbol},{month},{price:g}" for month, price in candidates[symbol])
+    explanations = "\n".join(
+        explanation_lines.get(symbol, f"{symbol}: predicted return {expected_return(symbol):.1%}.")
+        for symbol in ranked
+    )
+    return "```csv\n" + "\n".join(lines) + "\n```\nExplanations:\n" + explanations
+
+
+def predict_sharded(prompt: str, csv_data: str, call_llm, parse_output, config=None, shape=None):
+    """
+    Score each shard with call_llm(prompt, shard_csv) using at most
+    MAX_CONCURRENCY parallel calls, then merge the results into the shape
+    (results.get_shape_settings()). Shards whose call fails are skipped; if
+    every shard fails the last error is raised.
+    """
+    config = config or get_sharding_settings()
+    shape = shape or get_shape_settings()
+    shards = split_into_shards(csv_data, config["MAX_SHARD_TOKENS"])
+    if not shards:
+        raise ValueError("CSV has no data rows")
+
+    def score(indexed_shard):
+        index, shard = indexed_shard
+        shard_prompt = (
+            prompt + SHARD_INSTRUCTIONS.format(index=index + 1, total=len(shards)) + output_instructions(shape)
+        )
+        try:
+            prediction_csv, table_html, explanations = parse_output(call_llm(shard_prompt, shard))
+        except Exception as e:
+            return e
+        return prediction_csv, explanations
+
+    with ThreadPoolExecutor(max_workers=max(1, config["MAX_CONCURRENCY"])) as pool:
+        # Run each shard in a copy of the caller's context, so per-request
+        # context variables (e.g. token usage collection) reach the workers
+        futures = [
+            pool.submit(contextvars.copy_context().run, score, indexed_shard)
+            for indexed_shard in enumerate(shards)
+        ]
+        outcomes = [future.result() for future in futures]
+    results = [outcome for outcome in outcomes if not isinstance(outcome, Exception)]
+    if not results:
+        raise outcomes[-1]
+
+    try:
+        table = load_price_table(csv_data)
+        ends = table.starts + table.counts - 1
+        last_closes = dict(zip(table.symbols.tolist(), table["close"][ends].tolist()))
+    except ValueError:
+        last_closes = {}
+    return merge_shard_predictions(results, last_closes, shape["SYMBOLS"], shape["PERIODS"])
@@ -0,0 +1,463 @@
+"""
+Content-addressed, quota-managed storage for uploaded files.
+
+Uploads used to live in one flat directory per user, overwritten on every
+upload and never cleaned up. Now every upload is a blob named by the
+SHA-256 of its content, shared by all users who uploaded the same bytes:
+
+    <ROOT>/blobs/ab/cd/abcd.../content        the file (content.gz when COMPRESS)
+    <ROOT>/blobs/ab/cd/abcd.../data.columns/  columnar copy of an ingested CSV
+    <ROOT>/users/7f/<user id>.json            the user's manifest
+    <ROOT>/tmp/                               staging for uploads in progress
+
+The hashed fan-out keeps every directory small however many blobs and users
+there are. A user's manifest maps file names (data.csv, instructions.md) to
+blob hashes with their size and upload/use times, and is replaced
+atomically, so readers always see a complete upload. Blobs are immutable,
+so a blob path also identifies the content (the artifact cache relies on
+this).
+
+Disk usage stays bounded by:
+
+- per-user quotas: USER_QUOTA bytes over all of a user's files and
+  MAX_FILE_SIZE per upload (uncompressed), checked while the upload streams;
+- TTL eviction: files not used for TTL seconds are dropped from manifests;
+- garbage collection: blobs no manifest refers to are deleted (after
+  GC_GRACE seconds, so uploads still being committed are not touched).
+
+evict() does both and runs every EVICT_INTERVAL seconds on a background
+thread of each server process (wsgi.py and asgi.py call
+start_upload_evictor()), or from `manage.py evict_uploads`.
+
+Files of the old flat layout (<ROOT>/<user id>/) are moved into blobs by
+`manage.py import_legacy_uploads`, once, after upgrading.
+
+Downloads are served straight from the blob file (see views.serve_upload):
+through FileResponse, which WSGI servers send with sendfile, or by handing
+the path to the web server with SENDFILE_HEADER (e.g. nginx's
+X-Accel-Redirect). Compressed blobs go out as is to clients that accept
+gzip, and are decompressed on the fly for the others.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+from .ingest import COLUMNS_DIRNAME, ingest_csv_chunks
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORAGE_SETTINGS = {
+    "ROOT": "/tmp/llm_stock_uploads",
+    "COMPRESS": False,  # gzip blobs on disk; reads decompress transparently
+    "COMPRESS_LEVEL": 6,
+    "USER_QUOTA": 200 * 1024 * 1024,  # bytes over all of a user's files
+    "MAX_FILE_SIZE": 100 * 1024 * 1024,
+    "TTL": 30 * 24 * 3600,  # seconds since last use before a user's file is evicted; None keeps files forever
+    "EVICT_INTERVAL": 3600,  # seconds between background evictions; None disables them
+    "GC_GRACE": 3600,  # seconds an unreferenced blob is kept
+    "TOUCH_INTERVAL": 3600,  # last-use times are written at most this often
+    "SENDFILE_HEADER": None,  # e.g. "X-Accel-Redirect" to let the web server send files
+    "SENDFILE_PREFIX": "/protected/uploads/",  # internal location mapped to ROOT
+}
+
+CONTENT_NAME = "content"
+COPY_BLOCK = 1 << 20
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when an upload would exceed MAX_FILE_SIZE or the user's quota.
+    """
+
+
+def get_storage_settings():
+    config = dict(DEFAULT_STORAGE_SETTINGS)
+    config.update(getattr(settings, "UPLOAD_STORAGE", None) or {})
+    return config
+
+
+def fanout(digest):
+    return os.path.join(digest[:2], digest[2:4], digest)
+
+
+class StoredFile:
+    """
+    One of a user's files: the blob it points to and its metadata.
+    """
+
+    def __init__(self, storage, name, entry):
+        self.name = name
+        self.hash = entry["hash"]
+        self.size = entry["size"]
+        self.compressed = entry.get("compressed", False)
+        self.uploaded_at = entry["uploaded_at"]
+        self.used_at = entry.get("used_at", entry["uploaded_at"])
+        self.blob_dir = storage.blob_dir(self.hash)
+        self.path = os.path.join(self.blob_dir, CONTENT_NAME + (".gz" if self.compressed else ""))
+
+    def open(self):
+        """
+        Binary file object of the (decompressed) content.
+        """
+        return gzip.open(self.path, "rb") if self.compressed else open(self.path, "rb")
+
+    def read_text(self):
+        with self.open() as f:
+            return f.read().decode("utf-8")
+
+
+class UploadStorage:
+    """
+    Blob store plus per-user manifests; see the module docstring.
+    """
+
+    def __init__(self, root, compress=False, compress_level=6, user_quota=None, max_file_size=None,
+                 ttl=None, gc_grace=3600, touch_interval=3600, clock=time.time):
+        self.root = root
+        self.compress = compress
+        self.compress_level = compress_level
+        self.user_quota = user_quota
+        self.max_file_size = max_file_size
+        self.ttl = ttl
+        self.gc_grace = gc_grace
+        self.touch_interval = touch_interval
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    # Layout
+
+    def blob_dir(self, digest):
+        return os.path.join(self.root, "blobs", fanout(digest))
+
+    def manifest_path(self, user_id):
+        user_hash = hashlib.sha256(str(user_id).encode("utf-8")).hexdigest()
+        return os.path.join(self.root, "users", user_hash[:2], f"{user_id}.json")
+
+    def _staging_dir(self):
+        path = os.path.join(self.root, "tmp", uuid.uuid4().hex)
+        os.makedirs(path)
+        return path
+
+    # Manifests
+
+    def _read_manifest(self, user_id):
+        try:
+            with open(self.manifest_path(user_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, user_id, manifest):
+        path = self.manifest_path(user_id)
+        if not manifest:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(temporary, path)
+
+    def get(self, user_id, name):
+        """
+        The user's StoredFile called name, or None. Only writes to disk to
+        refresh the last-use time now and then.
+        """
+        manifest = self._read_manifest(user_id)
+        entry = manifest.get(name)
+        if entry is None:
+            return None
+        now = self.clock()
+        if now - entry.get("used_at", entry["uploaded_at"]) > self.touch_interval:
+            with self._lock:
+                manifest = self._read_manifest(user_id)
+                if name in manifest:
+                    manifest[name]["used_at"] = now
+                    self._write_manifest(user_id, manifest)
+        return StoredFile(self, name, entry)
+
+    def usage(self, user_id, exclude=None):
+        """
+        Bytes (uncompressed) of the user's files, optionally leaving one out.
+        """
+        return sum(entry["size"] for name, entry in self._read_manifest(user_id).items() if name != exclude)
+
+    def delete(self, user_id, name):
+        with self._lock:
+            manifest = self._read_manifest(user_id)
+            if manifest.pop(name, None) is not None:
+                self._write_manifest(user_id, manifest)
+
+    # Uploads
+
+    def _limit(self, user_id, name):
+        # Bytes this upload may have
+        limits = []
+        if self.max_file_size:
+            limits.append(self.max_file_size)
+        if self.user_quota:
+            limits.append(self.user_quota - self.usage(user_id, exclude=name))
+        return min(limits) if limits else None
+
+    def _metered(self, chunks, limit):
+        total = 0
+        for chunk in chunks:
+            total += len(chunk)
+            if limit is not None and total > limit:
+                raise QuotaExceeded(
+                    f"upload is larger than the {max(limit, 0) // 1024} KB of storage left for your files"
+                )
+            yield chunk
+
+    def _store_content(self, source, staging):
+        """
+        Hash the file at source and move it (compressed if configured) into
+        staging as the blob content. Returns (hash, size, compressed).
+        """
+        digest = hashlib.sha256()
+        size = 0
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(COPY_BLOCK), b""):
+                digest.update(block)
+                size += len(block)
+        if self.compress:
+            with open(source, "rb") as f, gzip.open(
+                os.path.join(staging, CONTENT_NAME + ".gz"), "wb", compresslevel=self.compress_level
+            ) as out:
+                shutil.copyfileobj(f, out, COPY_BLOCK)
+            os.remove(source)
+        else:
+            os.replace(source, os.path.join(staging, CONTENT_NAME))
+        return digest.hexdigest(), size, self.compress
+
+    def _commit(self, user_id, name, staging, digest, size, compressed):
+        """
+        Install staging as the blob for digest, unless that blob already
+        exists (the upload is then deduplicated), and point the user's
+        manifest at it.
+        """
+        blob_dir = self.blob_dir(digest)
+        if os.path.isdir(blob_dir):
+            shutil.rmtree(staging, ignore_errors=True)
+            # Restart the GC grace period of a blob nobody referred to any more
+            os.utime(blob_dir)
+            compressed = os.path.exists(os.path.join(blob_dir, CONTENT_NAME + ".gz"))
+        else:
+            os.makedirs(os.path.dirname(blob_dir), exist_ok=True)
+            try:
+                os.rename(staging, blob_dir)
+            except OSError:
+                # Another upload of the same content won the race
+                shutil.rmtree(staging, ignore_errors=True)
+                compressed = os.path.exists(os.path.join(blob_dir, CONTENT_NAME + ".gz"))
+        now = self.clock()
+        with self._lock:
+            manifest = self._read_manifest(user_id)
+            manifest[name] = {
+                "hash": digest, "size": size, "compressed": compressed, "uploaded_at": now, "used_at": now,
+            }
+            self._write_manifest(user_id, manifest)
+        return StoredFile(self, name, manifest[name])
+
+    def save(self, user_id, name, chunks):
+        """
+        Store an upload as the user's file name. Raises QuotaExceeded (and
+        stores nothing) when it does not fit.
+        """
+        staging = self._staging_dir()
+        try:
+            upload = os.path.join(staging, "upload")
+            with open(upload, "wb") as f:
+                for chunk in self._metered(chunks, self._limit(user_id, name)):
+                    f.write(chunk)
+            digest, size, compressed = self._store_content(upload, staging)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return self._commit(user_id, name, staging, digest, size, compressed)
+
+    def ingest_csv(self, user_id, chunks, name="data.csv"):
+        """
+        Validate and normalize an uploaded CSV (see ingest.CSVIngestor) and
+        store it with its columnar copy. Returns the ingest summary. Raises
+        CSVValidationError or QuotaExceeded, storing nothing.
+        """
+        staging = self._staging_dir()
+        try:
+            summary = ingest_csv_chunks(self._metered(chunks, self._limit(user_id, name)), staging, name)
+            digest, size, compressed = self._store_content(os.path.join(staging, name), staging)
+            if self.user_quota and size > self._limit(user_id, name):
+                # Normalizing can make a file grow a little
+                raise QuotaExceeded("the normalized CSV does not fit in the storage left for your files")
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self._commit(user_id, name, staging, digest, size, compressed)
+        return summary
+
+    def iter_legacy_dirs(self):
+        """
+        (user id, directory) of every user directory of the old flat layout.
+        """
+        for entry in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []:
+            path = os.path.join(self.root, entry)
+            if entry not in ("blobs", "users", "tmp") and os.path.isdir(path):
+                yield entry, path
+
+    def import_legacy(self, user_id, legacy_dir):
+        """
+        Move files of the old flat layout (<ROOT>/<user id>/) into blobs,
+        keeping files the user has uploaded since. Run by `manage.py
+        import_legacy_uploads`, not while serving: it deletes legacy_dir.
+        """
+        for name in ("data.csv", "instructions.md"):
+            path = os.path.join(legacy_dir, name)
+            if not os.path.exists(path) or name in self._read_manifest(user_id):
+                continue
+            staging = self._staging_dir()
+            columns = os.path.join(legacy_dir, COLUMNS_DIRNAME)
+            if name == "data.csv" and os.path.isdir(columns):
+                os.replace(columns, os.path.join(staging, COLUMNS_DIRNAME))
+            shutil.copyfile(path, os.path.join(staging, "upload"))
+            digest, size, compressed = self._store_content(os.path.join(staging, "upload"), staging)
+            self._commit(user_id, name, staging, digest, size, compressed)
+        shutil.rmtree(legacy_dir, ignore_errors=True)
+
+    # Eviction
+
+    def iter_manifests(self):
+        users_dir = os.path.join(self.root, "users")
+        for shard in sorted(os.listdir(users_dir)) if os.path.isdir(users_dir) else []:
+            shard_dir = os.path.join(users_dir, shard)
+            for filename in sorted(os.listdir(shard_dir)):
+                if filename.endswith(".json"):
+                    yield filename[:-len(".json")], os.path.join(shard_dir, filename)
+
+    def evict(self):
+        """
+        Drop files unused for TTL seconds from the manifests, then delete
+        blobs nobody refers to and stale staging directories. Returns counts
+        of what was removed.
+        """
+        now = self.clock()
+        stats = {"files": 0, "blobs": 0, "bytes": 0}
+        live = set()
+        for user_id, _ in self.iter_manifests():
+            with self._lock:
+                manifest = self._read_manifest(user_id)
+                expired = [
+                    name for name, entry in manifest.items()
+                    if self.ttl is not None and now - entry.get("used_at", entry["uploaded_at"]) >= self.ttl
+                ]
+                for name in expired:
+                    del manifest[name]
+                if expired:
+                    self._write_manifest(user_id, manifest)
+            stats["files"] += len(expired)
+            live.update(entry["hash"] for entry in manifest.values())
+
+        blobs = os.path.join(self.root, "blobs")
+        for top in os.listdir(blobs) if os.path.isdir(blobs) else []:
+            for middle in os.listdir(os.path.join(blobs, top)):
+                shard = os.path.join(blobs, top, middle)
+                for digest in os.listdir(shard):
+                    blob_dir = os.path.join(shard, digest)
+                    if digest in live or now - os.stat(blob_dir).st_mtime < self.gc_grace:
+                        continue
+                    stats["bytes"] += sum(
+                        os.path.getsize(os.path.join(directory, filename))
+                        for directory, _, filenames in os.walk(blob_dir) for filename in filenames
+                    )
+                    shutil.rmtree(blob_dir, ignore_errors=True)
+                    stats["blobs"] += 1
+                if not os.listdir(shard):
+                    os.rmdir(shard)
+
+        staging_root = os.path.join(self.root, "tmp")
+        for entry in os.listdir(staging_root) if os.path.isdir(staging_root) else []:
+            path = os.path.join(staging_root, entry)
+            if now - os.stat(path).st_mtime > self.gc_grace:
+                shutil.rmtree(path, ignore_errors=True)
+        if stats["files"] or stats["blobs"]:
+            logger.info(
+                "Evicted %d uploaded files and %d blobs (%d bytes)", stats["files"], stats["blobs"], stats["bytes"]
+            )
+        return stats
+
+
+def build_storage(config=None):
+    config = config or get_storage_settings()
+    return UploadStorage(
+        config["ROOT"],
+        compress=config["COMPRESS"],
+        compress_level=config["COMPRESS_LEVEL"],
+        user_quota=config["USER_QUOTA"],
+        max_file_size=config["MAX_FILE_SIZE"],
+        ttl=config["TTL"],
+        gc_grace=config["GC_GRACE"],
+        touch_interval=config["TOUCH_INTERVAL"],
+    )
+
+
+_storage = None
+_storage_lock = threading.Lock()
+_evictor = None
+
+
+def _evict_forever(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            get_upload_storage().evict()
+        except Exception:
+            logger.exception("Upload eviction failed")
+
+
+def get_upload_storage():
+    """
+    Return the process-wide storage configured by settings.UPLOAD_STORAGE.
+    """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = build_storage()
+    return _storage
+
+
+def start_upload_evictor():
+    """
+    Start the background thread evicting uploads every EVICT_INTERVAL
+    seconds, once per process. Only server processes call this, so
+    management commands and tests never evict behind their own back.
+    Returns whether the thread runs.
+    """
+    global _evictor
+    interval = get_storage_settings()["EVICT_INTERVAL"]
+    with _storage_lock:
+        if interval and _evictor is None:
+            _evictor = threading.Thread(
+                target=_evict_forever, args=(interval,), name="upload-eviction", daemon=True,
+            )
+            _evictor.start()
+        return _evictor is not None
+
+
+def reset_upload_storage():
+    """
+    Drop the process-wide storage so the next call rebuilds it from settings.
+    """
+    global _storage
+    with _storage_lock:
+        _storage = None
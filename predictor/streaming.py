@@ -0,0 +1,15 @@
+"""
+Helpers for streaming predictions to the browser over server-sent events.
+"""
+import json
+
+
+def sse_event(event: str, data):
+    """
+    Format one server-sent event. Non-string data is JSON-encoded; multi-line
+    strings are split over several data: fields as the SSE spec requires.
+    """
+    if not isinstance(data, str):
+        data = json.dumps(data)
+    lines = "".join(f"data: {line}\n" for line in data.split("\n"))
+    return f"event: {event}\n{lines}\n"
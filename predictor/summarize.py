@@ -0,0 +1,223 @@
+"""
+Compact, vectorized pre-summarization of uploaded stock data.
+
+Large multi-year, multi-symbol files are expensive to paste verbatim into the
+prompt. This module parses the `symbol,date,open,high,low,close,volume` CSV
+once into NumPy columns and computes per-symbol features for all symbols at
+once (grouped reductions, no per-symbol Python loops), then renders them as a
+small CSV digest that fits a token budget.
+"""
+import csv
+import io
+
+import numpy as np
+from django.conf import settings
+
+EXPECTED_COLUMNS = ["symbol", "date", "open", "high", "low", "close", "volume"]
+PRICE_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+DEFAULT_DIGEST_SETTINGS = {
+    # "auto" digests only when the raw CSV exceeds TOKEN_BUDGET,
+    # "always" digests every upload, "never" sends the raw CSV
+    "MODE": "auto",
+    "TOKEN_BUDGET": 6000,
+}
+
+DIGEST_COLUMNS = [
+    "symbol", "periods", "first_date", "last_date", "last_close", "total_return",
+    "mean_return", "volatility", "ma_3", "ma_12", "max_drawdown", "volume_trend",
+]
+
+
+def estimate_tokens(text: str):
+    """
+    Rough token estimate (about four characters per token for CSV-like text).
+    """
+    return len(text) // 4 + 1
+
+
+class PriceTable:
+    """
+    Columnar view of the uploaded CSV, sorted by (symbol, date).
+
+    symbols holds the distinct symbols; codes maps every row to its index in
+    symbols, and starts/counts give each symbol's contiguous row range.
+    """
+
+    def __init__(self, symbols, codes, dates, columns):
+        self.symbols = symbols
+        self.codes = codes
+        self.dates = dates
+        self.columns = columns
+        self.starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.array([], dtype=np.int64)
+        self.counts = np.diff(np.r_[self.starts, len(codes)])
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+
+def load_price_table(csv_data: str):
+    """
+    Parse the CSV text into a PriceTable. Raises ValueError on a bad header
+    or non-numeric values.
+    """
+    reader = csv.reader(io.StringIO(csv_data))
+    header = [name.strip().lower() for name in next(reader, [])]
+    missing = [name for name in EXPECTED_COLUMNS if name not in header]
+    if missing:
+        raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+    rows = [row for row in reader if row]
+    if not rows:
+        raise ValueError("CSV has no data rows")
+    positions = [header.index(name) for name in EXPECTED_COLUMNS]
+    try:
+        raw = np.array([[row[i].strip() for i in positions] for row in rows], dtype=str)
+    except IndexError:
+        raise ValueError("CSV has rows with missing values")
+    symbol_col, date_col = raw[:, 0], raw[:, 1]
+    try:
+        values = raw[:, 2:].astype(np.float64)
+    except ValueError as e:
+        raise ValueError(f"CSV has non-numeric values: {e}")
+    symbols, codes = np.unique(symbol_col, return_inverse=True)
+    order = np.lexsort((date_col, codes))
+    columns = {name: values[order, i] for i, name in enumerate(PRICE_COLUMNS)}
+    return PriceTable(symbols, codes[order], date_col[order], columns)
+
+
+def _group_mean(codes, values, groups, mask=None):
+    if mask is not None:
+        codes, values = codes[mask], values[mask]
+    totals = np.bincount(codes, weights=values, minlength=groups)
+    counts = np.bincount(codes, minlength=groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return totals / counts, counts
+
+
+def compute_symbol_features(table: PriceTable):
+    """
+    Compute per-symbol features for every symbol in one vectorized pass.
+    Returns a dict of equally sized arrays keyed by DIGEST_COLUMNS.
+    """
+    groups = len(table.symbols)
+    codes, starts, counts = table.codes, table.starts, table.counts
+    ends = starts + counts - 1
+    close = table["close"]
+    volume = table["volume"]
+
+    # Period-over-period returns, ignoring pairs that straddle two symbols
+    same_symbol = codes[1:] == codes[:-1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = close[1:] / close[:-1] - 1.0
+    return_codes = codes[1:][same_symbol]
+    returns = returns[same_symbol]
+    mean_return, _ = _group_mean(return_codes, returns, groups)
+    mean_sq_return, _ = _group_mean(return_codes, returns ** 2, groups)
+    volatility = np.sqrt(np.maximum(mean_sq_return - mean_return ** 2, 0.0))
+
+    # Moving averages over each symbol's most recent rows
+    rows_from_end = ends[codes] - np.arange(len(codes))
+    ma_3, _ = _group_mean(codes, close, groups, rows_from_end < 3)
+    ma_12, _ = _group_mean(codes, close, groups, rows_from_end < 12)
+
+    # Grouped running maximum: offsetting each group above the previous one
+    # lets a single maximum.accumulate restart at every symbol boundary
+    offset = codes * (np.abs(close).max() + 1.0)
+    running_max = np.maximum.accumulate(close + offset) - offset
+    with np.errstate(invalid="ignore", divide="ignore"):
+        drawdown = close / running_max - 1.0
+    max_drawdown = np.minimum.reduceat(drawdown, starts)
+
+    recent_volume, _ = _group_mean(codes, volume, groups, rows_from_end < 3)
+    mean_volume, _ = _group_mean(codes, volume, groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        volume_trend = recent_volume / mean_volume - 1.0
+        total_return = close[ends] / close[starts] - 1.0
+
+    return {
+        "symbol": table.symbols,
+        "periods": counts,
+        "first_date": table.dates[starts],
+        "last_date": table.dates[ends],
+        "last_close": close[ends],
+        "total_return": total_return,
+        "mean_return": np.nan_to_num(mean_return),
+        "volatility": np.nan_to_num(volatility),
+        "ma_3": ma_3,
+        "ma_12": ma_12,
+        "max_drawdown": max_drawdown,
+        "volume_trend": np.nan_to_num(volume_trend),
+    }
+
+
+def _format_digest_row(features, i):
+    return (
+        f"{features['symbol'][i]},{features['periods'][i]},{features['first_date'][i]},"
+        f"{features['last_date'][i]},{features['last_close'][i]:.2f},{features['total_return'][i]:.4f},"
+        f"{features['mean_return'][i]:.4f},{features['volatility'][i]:.4f},{features['ma_3'][i]:.2f},"
+        f"{features['ma_12'][i]:.2f},{features['max_drawdown'][i]:.4f},{features['volume_trend'][i]:.4f}"
+    )
+
+
+def build_csv_digest(csv_data: str, token_budget: int = 6000):
+    """
+    Summarize the raw CSV into one feature row per symbol, ordered by total
+    return, keeping as many symbols as fit in token_budget.
+    """
+    return render_digest(compute_symbol_features(load_price_table(csv_data)), token_budget)
+
+
+def render_digest(features, token_budget: int = 6000):
+    """
+    Render precomputed compute_symbol_features() output as a digest.
+    """
+    order = np.argsort(-np.nan_to_num(features["total_return"], nan=-np.inf), kind="stable")
+    preamble = (
+        "# Per-symbol summary of the uploaded data (returns are per period, "
+        "drawdown and trends are fractions)\n"
+    )
+    lines = [preamble + ",".join(DIGEST_COLUMNS)]
+    used = estimate_tokens(lines[0])
+    kept = 0
+    for i in order:
+        line = _format_digest_row(features, i)
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            break
+        lines.append(line)
+        used += cost
+        kept += 1
+    omitted = len(order) - kept
+    if omitted:
+        lines.append(f"# {omitted} lower-return symbols omitted to fit the token budget")
+    return "\n".join(lines)
+
+
+def get_digest_settings():
+    config = dict(DEFAULT_DIGEST_SETTINGS)
+    config.update(getattr(settings, "LLM_CSV_DIGEST", None) or {})
+    return config
+
+
+def prepare_csv_payload(csv_data: str, get_features=None):
+    """
+    Return the CSV text to send to the LLM: the raw upload, or its digest
+    when settings.LLM_CSV_DIGEST says so. Files that cannot be parsed are
+    passed through unchanged. get_features, if given, returns precomputed
+    features for csv_data (see artifacts.ArtifactCache.get_features).
+    """
+    config = get_digest_settings()
+    mode = config["MODE"]
+    if mode == "never":
+        return csv_data
+    if mode == "auto" and estimate_tokens(csv_data) <= config["TOKEN_BUDGET"]:
+        return csv_data
+    try:
+        if get_features is not None:
+            return render_digest(get_features(), config["TOKEN_BUDGET"])
+        return build_csv_digest(csv_data, config["TOKEN_BUDGET"])
+    except ValueError:
+        return csv_data
@@ -0,0 +1,57 @@
+"""
+Template tags that render the prediction table and chart from data shaped
+in predictor/charts.py, instead of looping over rows in the template.
+"""
+from django import template
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from predictor.charts import chart_title, get_chart_settings, render_band_rows, render_page_rows, render_svg_chart
+from predictor.exports import available_formats, export_filename
+
+register = template.Library()
+
+
+@register.simple_tag
+def prediction_page_rows(rows):
+    return mark_safe(render_page_rows(rows or []))
+
+
+@register.simple_tag
+def prediction_export_formats():
+    """
+    [(format, filename)] of the exports this installation can write.
+    """
+    return [(name, export_filename(name)) for name in available_formats()]
+
+
+@register.simple_tag
+def prediction_band_rows(bands):
+    return mark_safe(render_band_rows(bands or []))
+
+
+@register.simple_tag
+def prediction_chart(chart, period=None):
+    """
+    The chart for a build_chart_payload() payload: a static SVG, or a canvas
+    fed by json_script when PREDICTION_CHART RENDERER is "chartjs". period
+    is the title of its labels ("Week", ...).
+    """
+    config = get_chart_settings()
+    chart = chart or {"labels": [], "series": []}
+    title = chart_title(chart, period)
+    if config["RENDERER"] == "chartjs":
+        return render_to_string("prediction_chart_js.html", {
+            "chart": chart, "title": title, "width": config["WIDTH"], "height": config["HEIGHT"],
+        })
+    return mark_safe(render_svg_chart(chart, config["WIDTH"], config["HEIGHT"], title))
+
+
+@register.filter
+def percent(value, digits=1):
+    """
+    0.123 -> "12.3%"; None (nothing to score) -> "n/a".
+    """
+    if value is None:
+        return "n/a"
+    return f"{value * 100:.{int(digits)}f}%"
@@ -3,11 +3,17 @@ from django.urls import reverse
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import override_settings
+import datetime
 import os
 import importlib
-from unittest.mock import patch
+import threading
+import time
+import json
+from unittest.mock import AsyncMock, Mock, patch
 
 from predictor import views as predictor_views
+from predictor import cache as response_cache_module
+from predictor import jobs as jobs_module
 
 class AuthFlowTests(TestCase):
     def test_signup_login_logout(self):
@@ -122,6 +128,7 @@ class PredictionWorkflowTests(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username="preduser", password="testpass1234")
         self.client.login(username="preduser", password="testpass1234")
+        response_cache_module.get_response_cache().clear()
 
     @patch("predictor.views.call_llm_with_prompt")
     def test_predict_view_with_valid_llm_output(self, mock_llm):
@@ -163,5 +170,2023 @@ class PredictionWorkflowTests(TestCase):
         mock_llm.return_value = llm_output
         response = self.client.post(reverse("predict"))
         self.assertContains(response, "Download prediction.csv")
-        # Check that the download link contains the CSV content
-        self.assertIn("AAPL%2C2024-07%2C200", response.content.decode())
+        # The download link serves the stored run's CSV
+        download_url = reverse("prediction_download", args=[response.context["run_id"]])
+        self.assertContains(response, download_url)
+        download = self.client.get(download_url)
+        self.assertEqual(
+            b"".join(download.streaming_content).decode(),
+            "symbol,month,predicted_price\nAAPL,2024-07,200\nAAPL,2024-08,210\n",
+        )
+
+VALID_LLM_OUTPUT = (
+    "```csv\nsymbol,month,predicted_price\nAAPL,2024-07,200\nAAPL,2024-08,210\n```\n"
+    "<table><tr><td>AAPL</td><td>200</td></tr></table>\n"
+    "Explanations: AAPL is predicted to rise."
+)
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        response_cache_module.get_response_cache().clear()
+
+    def test_cache_key_depends_on_all_parts(self):
+        make_key = response_cache_module.make_cache_key
+        key = make_key("gpt", "prompt", "csv")
+        self.assertEqual(key, make_key("gpt", "prompt", "csv"))
+        self.assertNotEqual(key, make_key("gpt-4", "prompt", "csv"))
+        self.assertNotEqual(key, make_key("gpt", "prompt2", "csv"))
+        self.assertNotEqual(make_key("gpt", "ab", "c"), make_key("gpt", "a", "bc"))
+
+    def test_lru_backend_evicts_least_recently_used(self):
+        backend = response_cache_module.LRUCacheBackend(max_entries=2)
+        backend.set("a", "1")
+        backend.set("b", "2")
+        backend.get("a")
+        backend.set("c", "3")
+        self.assertEqual(backend.get("a"), "1")
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("c"), "3")
+
+    @patch("predictor.cache.time.monotonic")
+    def test_lru_backend_expires_entries(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        backend = response_cache_module.LRUCacheBackend(ttl=10)
+        backend.set("a", "1")
+        mock_monotonic.return_value = 109.0
+        self.assertEqual(backend.get("a"), "1")
+        mock_monotonic.return_value = 111.0
+        self.assertIsNone(backend.get("a"))
+
+    def test_django_backend_clear_keeps_other_keys_of_the_alias(self):
+        from django.core.cache import caches
+        backend = response_cache_module.DjangoCacheBackend("default")
+        caches["default"].set("prediction-throttle:slots", 3)
+        backend.set("a", "1")
+        backend.clear()
+        self.assertIsNone(backend.get("a"))
+        self.assertEqual(caches["default"].get("prediction-throttle:slots"), 3)
+        backend.set("a", "2")
+        self.assertEqual(backend.get("a"), "2")
+
+    def test_file_backend_roundtrip_and_eviction(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = response_cache_module.FileCacheBackend(location=tmp, max_entries=1)
+            backend.set("a", "1")
+            self.assertEqual(backend.get("a"), "1")
+            backend.set("b", "2")
+            self.assertEqual(len(backend), 1)
+
+    def test_build_response_cache_rejects_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            response_cache_module.build_response_cache({"BACKEND": "nope"})
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_identical_requests_hit_cache(self, mock_llm):
+        mock_llm.return_value = VALID_LLM_OUTPUT
+        first = self.client.post(reverse("predict"))
+        second = self.client.post(reverse("predict"))
+        self.assertEqual(mock_llm.call_count, 1)
+        self.assertContains(second, "AAPL is predicted to rise")
+        self.assertEqual(first.context["cache_hit"], False)
+        self.assertEqual(second.context["cache_hit"], True)
+        stats = response_cache_module.get_response_cache().stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_invalid_outputs_are_not_cached(self, mock_llm):
+        mock_llm.return_value = "No CSV here."
+        self.client.post(reverse("predict"))
+        self.client.post(reverse("predict"))
+        self.assertEqual(mock_llm.call_count, 2)
+
+class PredictionJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="jobuser", password="testpass1234")
+        self.client.login(username="jobuser", password="testpass1234")
+        response_cache_module.get_response_cache().clear()
+        jobs_module.reset_job_runner()
+        self.addCleanup(jobs_module.reset_job_runner)
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_submit_then_poll_until_done(self, mock_llm):
+        mock_llm.return_value = VALID_LLM_OUTPUT
+        response = self.client.post(reverse("predict_job_submit"))
+        self.assertEqual(response.status_code, 202)
+        job_id = response.context["job"]["id"]
+        self.assertContains(response, reverse("predict_job_status", args=[job_id]), status_code=202)
+        jobs_module.get_job_runner().wait(job_id, timeout=5)
+        response = self.client.get(reverse("predict_job_status", args=[job_id]))
+        self.assertContains(response, "Prediction Results")
+        self.assertContains(response, "AAPL is predicted to rise")
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_job_reports_llm_failure(self, mock_llm):
+        mock_llm.side_effect = RuntimeError("LLM error")
+        response = self.client.post(reverse("predict_job_submit"))
+        job_id = response.context["job"]["id"]
+        jobs_module.get_job_runner().wait(job_id, timeout=5)
+        response = self.client.get(reverse("predict_job_status", args=[job_id]))
+        self.assertContains(response, "LLM call failed")
+
+    def test_status_of_other_users_job_is_404(self):
+        runner = jobs_module.get_job_runner()
+        job_id = runner.submit("user:someone-else", lambda: {})
+        runner.wait(job_id, timeout=5)
+        response = self.client.get(reverse("predict_job_status", args=[job_id]))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(PREDICTION_JOBS={"ASYNC": True, "MAX_JOBS_PER_USER": 1})
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_predict_view_enqueues_and_enforces_per_user_limit(self, mock_llm):
+        import threading
+        release = threading.Event()
+        mock_llm.side_effect = lambda prompt, csv_data: release.wait(5) and VALID_LLM_OUTPUT
+        first = self.client.post(reverse("predict"))
+        self.assertEqual(first.status_code, 202)
+        second = self.client.post(reverse("predict"))
+        self.assertEqual(second.status_code, 429)
+        release.set()
+        job = jobs_module.get_job_runner().wait(first.context["job"]["id"], timeout=5)
+        self.assertEqual(job["status"], jobs_module.DONE)
+
+    def test_sqlite_store_roundtrip(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            store = jobs_module.SQLiteJobStore(location=os.path.join(tmp, "jobs.sqlite3"))
+            job = store.create("user:1")
+            self.assertEqual(store.count_active("user:1"), 1)
+            store.update(job["id"], status=jobs_module.DONE, result={"valid_csv": True})
+            job = store.get(job["id"])
+            self.assertEqual(job["status"], jobs_module.DONE)
+            self.assertEqual(job["result"], {"valid_csv": True})
+            self.assertEqual(store.count_active("user:1"), 0)
+
+    def test_finished_jobs_expire_and_stale_jobs_are_failed(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            for store in (jobs_module.InMemoryJobStore(), jobs_module.SQLiteJobStore(os.path.join(tmp, "jobs.sqlite3"))):
+                with patch("predictor.jobs.time.time", return_value=1000.0):
+                    done, stale, kept = store.create("user:1"), store.create("user:1"), store.create("user:1")
+                    store.update(done["id"], status=jobs_module.DONE, result={"valid_csv": True})
+                    store.update(stale["id"], status=jobs_module.RUNNING)
+                with patch("predictor.jobs.time.time", return_value=1500.0):
+                    self.assertEqual(store.cleanup(result_ttl=600, stale_after=300, keep={kept["id"]}), (0, 1))
+                self.assertEqual(store.get(stale["id"])["status"], jobs_module.FAILED)
+                self.assertEqual(store.count_active("user:1"), 1)  # the job this process still runs
+                with patch("predictor.jobs.time.time", return_value=2000.0):
+                    self.assertEqual(store.cleanup(result_ttl=600, stale_after=None), (1, 0))
+                self.assertIsNone(store.get(done["id"]))
+                self.assertIsNotNone(store.get(stale["id"]))
+
+class StreamingPredictionTests(TestCase):
+    def setUp(self):
+        response_cache_module.get_response_cache().clear()
+
+    def test_output_parser_handles_rows_split_across_chunks(self):
+        from predictor.parsing import LLMOutputParser, PredictionRow
+        parser = LLMOutputParser()
+        rows = []
+        for chunk in ["Here you go\n``", "`csv\nsymbol,month,pred", "icted_price\nAAPL,2024-0", "7,200\nMSFT,2024-07,3", "00\n```\nExplanations: ..."]:
+            rows.extend(parser.feed(chunk))
+        parsed = parser.close()
+        self.assertEqual(rows, [PredictionRow("AAPL", "2024-07", 200.0), PredictionRow("MSFT", "2024-07", 300.0)])
+        self.assertEqual(parsed.rows, rows)
+
+    def test_sse_event_format(self):
+        from predictor.streaming import sse_event
+        self.assertEqual(sse_event("token", "a\nb"), "event: token\ndata: a\ndata: b\n\n")
+        self.assertEqual(sse_event("row", ["AAPL", "2024-07", "200"]), 'event: row\ndata: ["AAPL", "2024-07", "200"]\n\n')
+
+    @patch("predictor.views.stream_llm_with_prompt")
+    def test_stream_events_emit_rows_progressively(self, mock_stream):
+        mock_stream.return_value = iter([VALID_LLM_OUTPUT[:40], VALID_LLM_OUTPUT[40:70], VALID_LLM_OUTPUT[70:]])
+        response = self.client.get(reverse("predict_stream_events"))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(body.count("event: row"), 2)
+        self.assertLess(body.index("event: row"), body.index("event: done"))
+        self.assertIn("AAPL is predicted to rise", body)
+
+    @patch("predictor.views.stream_llm_with_prompt")
+    def test_stream_events_report_llm_errors(self, mock_stream):
+        def failing(prompt, csv_data):
+            raise RuntimeError("LLM error")
+            yield
+        mock_stream.side_effect = failing
+        response = self.client.get(reverse("predict_stream_events"))
+        body = b"".join(response.streaming_content).decode()
+        self.assertIn("event: error", body)
+        self.assertIn("LLM call failed", body)
+
+    def test_stream_page_renders(self):
+        response = self.client.get(reverse("predict_stream"))
+        self.assertContains(response, reverse("predict_stream_events"))
+
+class LLMClientRegistryTests(TestCase):
+    def setUp(self):
+        from predictor import llm_clients
+        llm_clients.reset_client_registry()
+        self.addCleanup(llm_clients.reset_client_registry)
+
+    def test_registry_reuses_clients_per_key(self):
+        from predictor.llm_clients import ClientRegistry
+        registry = ClientRegistry()
+        first = registry.get("openai", "gpt-3.5-turbo", "sk-one")
+        self.assertIs(first, registry.get("openai", "gpt-3.5-turbo", "sk-one"))
+        self.assertIsNot(first, registry.get("openai", "gpt-3.5-turbo", "sk-two"))
+        self.assertIsNot(first, registry.get("openai", "gpt-4o", "sk-one"))
+        self.assertEqual(len(registry), 3)
+
+    def test_registry_keys_do_not_contain_api_key(self):
+        from predictor.llm_clients import ClientRegistry
+        self.assertNotIn("sk-secret", repr(ClientRegistry.make_key("openai", "gpt", "sk-secret")))
+
+    def test_registry_rejects_unknown_provider(self):
+        from predictor.llm_clients import ClientRegistry
+        with self.assertRaises(ValueError):
+            ClientRegistry().get("nope", "model")
+
+    @patch.dict(os.environ, {"LLM_PROVIDER": "fake"})
+    def test_get_llm_returns_shared_fake_client(self):
+        llm = predictor_views.get_llm()
+        self.assertIs(llm, predictor_views.get_llm())
+        self.assertIn("```csv", predictor_views.call_llm_with_prompt("prompt", "csv"))
+
+    @override_settings(LLM_CLIENT={"FAKE": {"latency": 0.0, "connect_latency": 0.05}})
+    def test_fake_connect_latency_is_paid_once_per_client(self):
+        import time
+        from predictor.llm_clients import ClientRegistry
+        client = ClientRegistry().get("fake", "fake-chat-model")
+        start = time.perf_counter()
+        client.invoke("first")
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        client.invoke("second")
+        second = time.perf_counter() - start
+        self.assertGreaterEqual(first, 0.05)
+        self.assertLess(second, 0.05)
+        self.assertEqual(client.call_count, 2)
+
+    def test_fake_output_size_and_token_rate(self):
+        import time
+        from predictor.fake_llm import FakeChatModel
+        llm = FakeChatModel(output_symbols=300, output_months=3, tokens_per_second=1e6)
+        prediction_csv, _, _ = predictor_views.parse_llm_output(llm.response)
+        self.assertEqual(len(prediction_csv.splitlines()), 1 + 300 * 3)
+        self.assertIn("SYM00299,", prediction_csv)
+        self.assertAlmostEqual(llm.generation_time(llm.response), len(llm.response) / 4e6)
+        start = time.perf_counter()
+        llm.invoke("prompt")
+        self.assertGreaterEqual(time.perf_counter() - start, llm.generation_time(llm.response))
+
+def make_price_csv(symbols, months, start_year=2020):
+    lines = ["symbol,date,open,high,low,close,volume"]
+    for i, symbol in enumerate(symbols):
+        for m in range(months):
+            close = 100.0 + 10 * i + m * (i + 1)
+            lines.append(
+                f"{symbol},{start_year + m // 12}-{m % 12 + 1:02d},{close},{close + 5},{close - 5},{close},{1000 * (m + 1)}"
+            )
+    return "\n".join(lines) + "\n"
+
+class CSVDigestTests(TestCase):
+    def test_features_match_per_symbol_computation(self):
+        from predictor.summarize import compute_symbol_features, load_price_table
+        csv_data = (
+            "symbol,date,open,high,low,close,volume\n"
+            "BBB,2021-02,0,0,0,50,10\n"
+            "AAA,2021-01,0,0,0,100,10\n"
+            "AAA,2021-03,0,0,0,90,30\n"
+            "AAA,2021-02,0,0,0,120,20\n"
+            "BBB,2021-01,0,0,0,40,10\n"
+        )
+        features = compute_symbol_features(load_price_table(csv_data))
+        self.assertEqual(list(features["symbol"]), ["AAA", "BBB"])
+        self.assertEqual(list(features["periods"]), [3, 2])
+        self.assertEqual(list(features["last_date"]), ["2021-03", "2021-02"])
+        self.assertAlmostEqual(features["total_return"][0], -0.1)
+        self.assertAlmostEqual(features["total_return"][1], 0.25)
+        self.assertAlmostEqual(features["mean_return"][0], (0.2 + (90 / 120 - 1)) / 2)
+        self.assertAlmostEqual(features["max_drawdown"][0], 90 / 120 - 1)
+        self.assertAlmostEqual(features["max_drawdown"][1], 0.0)
+        self.assertAlmostEqual(features["ma_3"][0], (100 + 120 + 90) / 3)
+
+    def test_load_price_table_rejects_bad_files(self):
+        from predictor.summarize import load_price_table
+        with self.assertRaises(ValueError):
+            load_price_table("symbol,date,close\nAAPL,2021-01,1\n")
+        with self.assertRaises(ValueError):
+            load_price_table("symbol,date,open,high,low,close,volume\nAAPL,2021-01,a,b,c,d,e\n")
+
+    def test_digest_respects_token_budget(self):
+        from predictor.summarize import build_csv_digest, estimate_tokens
+        csv_data = make_price_csv([f"S{i:03d}" for i in range(200)], 36)
+        digest = build_csv_digest(csv_data, token_budget=1000)
+        self.assertLessEqual(estimate_tokens(digest), 1100)
+        self.assertIn("symbols omitted", digest)
+        self.assertLess(len(digest), len(csv_data) / 20)
+
+    @override_settings(LLM_CSV_DIGEST={"MODE": "auto", "TOKEN_BUDGET": 500})
+    def test_prepare_csv_payload_only_digests_large_files(self):
+        from predictor.summarize import prepare_csv_payload
+        small = make_price_csv(["AAPL"], 3)
+        self.assertEqual(prepare_csv_payload(small), small)
+        large = make_price_csv([f"S{i:03d}" for i in range(50)], 24)
+        self.assertIn("total_return", prepare_csv_payload(large))
+
+    @override_settings(LLM_CSV_DIGEST={"MODE": "always", "TOKEN_BUDGET": 500})
+    def test_prepare_csv_payload_passes_unparseable_files_through(self):
+        from predictor.summarize import prepare_csv_payload
+        self.assertEqual(prepare_csv_payload("not,a,stock,file\n"), "not,a,stock,file\n")
+
+def make_shard_completion(prompt, shard_csv):
+    """
+    Fake LLM for sharded tests: extends every symbol's last monthly change
+    for 12 months.
+    """
+    closes = {}
+    for line in shard_csv.splitlines()[1:]:
+        cells = line.split(",")
+        closes.setdefault(cells[0], []).append(float(cells[5]))
+    lines = ["symbol,month,predicted_price"]
+    for symbol, history in closes.items():
+        slope = history[-1] - history[-2]
+        lines.extend(f"{symbol},2030-{m:02d},{history[-1] + slope * m}" for m in range(1, 13))
+    explanations = "\n".join(f"{symbol}: looks good." for symbol in closes)
+    return "```csv\n" + "\n".join(lines) + "\n```\nExplanations:\n" + explanations
+
+class ShardedPredictionTests(TestCase):
+    def test_split_into_shards_keeps_symbols_whole_and_within_budget(self):
+        from predictor.sharding import split_into_shards
+        from predictor.summarize import estimate_tokens
+        csv_data = make_price_csv([f"S{i:03d}" for i in range(30)], 12)
+        shards = split_into_shards(csv_data, max_shard_tokens=1000)
+        self.assertGreater(len(shards), 1)
+        seen = []
+        for shard in shards:
+            self.assertTrue(shard.startswith("symbol,date,open,high,low,close,volume\n"))
+            self.assertLessEqual(estimate_tokens(shard), 1000)
+            symbols = {line.split(",")[0] for line in shard.splitlines()[1:]}
+            self.assertFalse(symbols & set(seen))
+            seen.extend(symbols)
+        self.assertEqual(len(seen), 30)
+
+    def test_merge_is_deterministic_and_picks_top_n(self):
+        from predictor.sharding import merge_shard_predictions
+        shard_a = ("symbol,month,predicted_price\nAAA,2030-01,110\nBBB,2030-01,300\n", "AAA: meh\nBBB: great")
+        shard_b = ("symbol,month,predicted_price\nCCC,2030-01,150\n", "")
+        last_closes = {"AAA": 100.0, "BBB": 100.0, "CCC": 100.0}
+        merged = merge_shard_predictions([shard_a, shard_b], last_closes, top_n=2, months=1)
+        self.assertEqual(merged, merge_shard_predictions([shard_b, shard_a], last_closes, top_n=2, months=1))
+        prediction_csv, table_html, explanations = predictor_views.parse_llm_output(merged)
+        self.assertEqual(prediction_csv.splitlines()[1:], ["BBB,2030-01,300", "CCC,2030-01,150"])
+        self.assertIn("BBB: great", explanations)
+        self.assertIn("CCC: predicted return 50.0%", explanations)
+
+    @override_settings(PREDICTION_SHARDING={"MODE": "auto", "MIN_SYMBOLS": 20, "MAX_SHARD_TOKENS": 1500, "MAX_CONCURRENCY": 3})
+    def test_sharded_prediction_produces_top_10_by_12(self):
+        from predictor.sharding import predict_sharded, should_shard, split_into_shards
+        csv_data = make_price_csv([f"S{i:03d}" for i in range(40)], 24)
+        self.assertTrue(should_shard(csv_data))
+        self.assertFalse(should_shard(make_price_csv(["AAPL"], 12)))
+        calls = []
+        def fake_llm(prompt, shard_csv):
+            calls.append(shard_csv)
+            return make_shard_completion(prompt, shard_csv)
+        output = predict_sharded("persona", csv_data, fake_llm, predictor_views.parse_llm_output)
+        self.assertEqual(len(calls), len(split_into_shards(csv_data, 1500)))
+        context = predictor_views.build_prediction_context(output)
+        self.assertTrue(context["valid_csv"])
+        self.assertEqual(context["row_count"], 120)
+        # make_price_csv gives higher-index symbols the steepest trend
+        self.assertEqual(context["page_rows"][0].symbol, "S039")
+
+    @override_settings(PREDICTION_SHAPE={"SYMBOLS": 20, "HORIZON": "quarterly", "PERIODS": 6})
+    def test_sharded_prediction_keeps_the_configured_shape(self):
+        from predictor.parsing import parse_completion
+        from predictor.sharding import predict_sharded
+        csv_data = make_price_csv([f"S{i:03d}" for i in range(40)], 24)
+        prompts = []
+
+        def fake_llm(prompt, shard_csv):
+            prompts.append(prompt)
+            return make_shard_completion(prompt, shard_csv)
+        output = predict_sharded("persona", csv_data, fake_llm, predictor_views.parse_llm_output,
+                                 {"MAX_SHARD_TOKENS": 1500, "MAX_CONCURRENCY": 2})
+        self.assertIn("top 20 most profitable symbols with 6 quarterly prices", prompts[0])
+        self.assertNotIn("monthly", prompts[0])
+        parsed = parse_completion(output)
+        self.assertEqual(len(parsed.symbols), 20)
+        self.assertEqual(len(parsed.rows), 20 * 6)
+
+    @override_settings(PREDICTION_SHARDING={"MODE": "always", "MAX_SHARD_TOKENS": 1500})
+    def test_sharded_prediction_survives_partial_failures(self):
+        from predictor.sharding import predict_sharded
+        csv_data = make_price_csv([f"S{i:03d}" for i in range(40)], 24)
+        def flaky_llm(prompt, shard_csv):
+            if "shard 1 of" in prompt:
+                raise RuntimeError("rate limited")
+            return make_shard_completion(prompt, shard_csv)
+        output = predict_sharded("persona", csv_data, flaky_llm, predictor_views.parse_llm_output)
+        self.assertIn("```csv", output)
+        with self.assertRaises(RuntimeError):
+            predict_sharded("persona", csv_data, lambda p, c: (_ for _ in ()).throw(RuntimeError("down")), predictor_views.parse_llm_output)
+
+class CSVIngestionTests(TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(__import__("shutil").rmtree, self.tmp, True)
+
+    def ingest(self, content, chunk_size=7):
+        from predictor.ingest import ingest_csv_chunks
+        chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        return ingest_csv_chunks(chunks, self.tmp)
+
+    def test_normalizes_dates_and_drops_duplicates_across_chunks(self):
+        from predictor.ingest import load_columns
+        summary = self.ingest(
+            b"\xef\xbb\xbfSymbol,Date,Open,High,Low,Close,Volume\r\n"
+            b"AAPL,2021/1,100,110,90,105,1000\r\n"
+            b"AAPL,2021-01,1,1,1,1,1\r\n"
+            b"MSFT,03/15/2021,200,210,195,205,800\r\n"
+            b"MSFT,20210316,201,211,196,206,900"
+        )
+        self.assertEqual(summary, {"rows": 3, "duplicates": 1, "symbols": 2})
+        with open(os.path.join(self.tmp, "data.csv"), encoding="utf-8") as f:
+            self.assertEqual(f.read().splitlines(), [
+                "symbol,date,open,high,low,close,volume",
+                "AAPL,2021-01,100,110,90,105,1000",
+                "MSFT,2021-03-15,200,210,195,205,800",
+                "MSFT,2021-03-16,201,211,196,206,900",
+            ])
+        symbols, columns = load_columns(self.tmp)
+        self.assertEqual(symbols, ["AAPL", "MSFT"])
+        self.assertEqual(columns["close"].tolist(), [105.0, 205.0, 206.0])
+        self.assertEqual(str(columns["date"][1]), "2021-03-15")
+        import numpy as np
+        self.assertIsInstance(columns["close"], np.memmap)
+
+    def test_rejects_bad_files_without_touching_existing_upload(self):
+        from predictor.ingest import CSVValidationError
+        self.ingest(b"symbol,date,open,high,low,close,volume\nAAPL,2021-01,1,1,1,1,1\n")
+        bad_files = [
+            b"",
+            b"symbol,date,close\nAAPL,2021-01,1\n",
+            b"symbol,date,open,high,low,close,volume\n",
+            b"symbol,date,open,high,low,close,volume\nAAPL,2021-13,1,1,1,1,1\n",
+            b"symbol,date,open,high,low,close,volume\nAAPL,2021-01,1,1,1,abc,1\n",
+            b"symbol,date,open,high,low,close,volume\nAAPL,2021-01,1,1,1,1\n",
+            b"symbol,date,open,high,low,close,volume\nAAPL,2021-01,1,1,1,-5,1\n",
+            b"symbol,date,open,high,low,close,volume\n\xff\xfe\n",
+        ]
+        for content in bad_files:
+            with self.subTest(content=content), self.assertRaises(CSVValidationError):
+                self.ingest(content)
+        with open(os.path.join(self.tmp, "data.csv"), encoding="utf-8") as f:
+            self.assertIn("AAPL,2021-01,1,1,1,1,1", f.read())
+        self.assertEqual(sorted(os.listdir(self.tmp)), ["data.columns", "data.csv"])
+
+    def test_price_table_from_columns_matches_text_parser(self):
+        from predictor import ingest, summarize
+        content = make_price_csv(["MSFT", "AAPL", "GOOG"], 14)
+        self.ingest(content.encode(), chunk_size=50)
+        from_columns = summarize.compute_symbol_features(ingest.load_price_table(self.tmp))
+        from_text = summarize.compute_symbol_features(summarize.load_price_table(content))
+        for name in ["symbol", "periods", "last_close", "total_return", "volatility", "max_drawdown"]:
+            self.assertEqual(list(from_columns[name]), list(from_text[name]))
+
+    def test_upload_view_rejects_malformed_csv(self):
+        User.objects.create_user(username="ingestuser", password="testpass1234")
+        self.client.login(username="ingestuser", password="testpass1234")
+        response = self.client.post(
+            reverse("upload_csv"),
+            {"csv_file": SimpleUploadedFile("data.csv", b"symbol,date\nAAPL,2021-01\n")},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertContains(response, "CSV rejected", status_code=400)
+
+class ArtifactCacheTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from predictor.artifacts import ArtifactCache
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(__import__("shutil").rmtree, self.tmp, True)
+        self.cache = ArtifactCache()
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def test_read_text_only_rereads_changed_files(self):
+        path = self.write("instructions.md", "first")
+        self.assertEqual(self.cache.read_text(1, path)[0], "first")
+        with patch("builtins.open", side_effect=AssertionError("file re-read")):
+            self.assertEqual(self.cache.read_text(1, path)[0], "first")
+        self.write("instructions.md", "second version")
+        self.assertEqual(self.cache.read_text(1, path)[0], "second version")
+        self.assertEqual(self.cache.read_text(1, os.path.join(self.tmp, "missing")), (None, None))
+
+    def test_appended_months_only_recompute_changed_symbols(self):
+        from predictor.artifacts import content_hash
+        from predictor.summarize import compute_symbol_features, load_price_table
+        old_csv = make_price_csv(["AAA", "BBB", "CCC"], 12)
+        self.cache.get_features(1, self.tmp, old_csv, content_hash(old_csv))
+        self.assertEqual(self.cache.feature_recomputes, 3)
+
+        new_csv = old_csv + "BBB,2021-01,500,505,495,500,13000\n"
+        features = self.cache.get_features(1, self.tmp, new_csv, content_hash(new_csv))
+        self.assertEqual(self.cache.feature_recomputes, 4)
+        expected = compute_symbol_features(load_price_table(new_csv))
+        self.assertEqual(list(features["symbol"]), list(expected["symbol"]))
+        self.assertEqual(list(features["last_close"]), list(expected["last_close"]))
+        self.assertEqual(self.cache.entry(1).symbol_index["BBB"], (12, 25))
+
+        # Same content again is a no-op
+        self.cache.get_features(1, self.tmp, new_csv, content_hash(new_csv))
+        self.assertEqual(self.cache.feature_recomputes, 4)
+
+    def test_uploads_invalidate_assembled_prompt(self):
+        User.objects.create_user(username="artifactuser", password="testpass1234")
+        self.client.login(username="artifactuser", password="testpass1234")
+        request = type("Request", (), {"user": User.objects.get(username="artifactuser")})()
+        self.client.post(reverse("upload_instructions"), {
+            "instructions_file": SimpleUploadedFile("instructions.md", b"Prefer AAPL."),
+        })
+        self.client.post(reverse("upload_csv"), {
+            "csv_file": SimpleUploadedFile("data.csv", make_price_csv(["AAPL"], 3).encode()),
+        })
+        prompt, payload = predictor_views.get_prediction_inputs(request)
+        self.assertIn("Prefer AAPL.", prompt)
+        self.client.post(reverse("upload_instructions"), {
+            "instructions_file": SimpleUploadedFile("instructions.md", b"Prefer MSFT."),
+        })
+        prompt, payload = predictor_views.get_prediction_inputs(request)
+        self.assertIn("Prefer MSFT.", prompt)
+        self.assertIn("AAPL,2020-03", payload)
+
+class LLMOutputParserTests(TestCase):
+    def test_matches_legacy_sections(self):
+        prediction_csv, table_html, explanations = predictor_views.parse_llm_output(VALID_LLM_OUTPUT)
+        self.assertEqual(prediction_csv, "symbol,month,predicted_price\nAAPL,2024-07,200\nAAPL,2024-08,210")
+        self.assertEqual(table_html, "<table><tr><td>AAPL</td><td>200</td></tr></table>")
+        self.assertEqual(explanations, "AAPL is predicted to rise.")
+
+    def test_explanations_stop_at_next_section(self):
+        from predictor.parsing import parse_completion
+        output = (
+            "Explanations:\n- **AAPL**: strong iPhone cycle.\n  Services keep growing.\nMSFT: cloud.\n"
+            "```csv\nsymbol,month,predicted_price\nAAPL,2024-07,200\nMSFT,2024-07,300\n```\n"
+            "<table><tr><td>x</td></tr></table>\nThanks!"
+        )
+        parsed = parse_completion(output)
+        self.assertNotIn("```", parsed.explanations)
+        self.assertNotIn("Thanks", parsed.explanations)
+        self.assertEqual(parsed.symbol_explanations["AAPL"], "- **AAPL**: strong iPhone cycle.\nServices keep growing.")
+        self.assertEqual(parsed.symbol_explanations["MSFT"], "MSFT: cloud.")
+        self.assertEqual(parsed.table_html, "<table><tr><td>x</td></tr></table>")
+
+    def test_reports_structured_errors(self):
+        from predictor.parsing import parse_completion
+        parsed = parse_completion(
+            "```csv\nsymbol,month,predicted_price\nAAPL,2024-07,abc\nAAPL,2024-08\n"
+            "MSFT,2024-07,1\nMSFT,2024-07,2\n```",
+            expected_symbols=10, expected_months=12,
+        )
+        codes = [error.code for error in parsed.errors]
+        self.assertEqual(codes[:3], ["bad_price", "bad_row", "duplicate_row"])
+        self.assertEqual(parsed.errors[0].line, 3)
+        self.assertIn("Expected 10 symbols, got 1", [e.message for e in parsed.shape_errors()])
+        self.assertEqual(parse_completion("nothing").errors[0].code, "missing_csv")
+
+    def test_full_grid_has_no_errors(self):
+        from predictor.fake_llm import build_fake_prediction
+        from predictor.parsing import parse_completion
+        parsed = parse_completion(build_fake_prediction(), expected_symbols=10, expected_months=12)
+        self.assertEqual(parsed.errors, [])
+        self.assertEqual(len(parsed.rows), 120)
+        self.assertIsInstance(parsed.rows[0].price, float)
+        self.assertEqual(len(parsed.symbol_explanations), 10)
+
+    @override_settings(PREDICTION_SHAPE={"SYMBOLS": 10, "MONTHS": 12, "STRICT": True})
+    def test_strict_shape_rejects_partial_grids(self):
+        context = predictor_views.build_prediction_context(VALID_LLM_OUTPUT)
+        self.assertFalse(context["valid_csv"])
+        self.assertTrue(context["validation_errors"])
+
+    def test_parsing_time_is_linear(self):
+        import time
+        from predictor.parsing import parse_completion
+        def timed(n):
+            text = "<table " * n + "```csv\n" + "x" * n
+            start = time.perf_counter()
+            parse_completion(text)
+            return time.perf_counter() - start
+        small, large = timed(20_000), timed(200_000)
+        self.assertLess(large, small * 40)
+
+class RateLimitError(Exception):
+    status_code = 429
+
+class BatchPredictionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="batchuser", password="testpass1234")
+        self.client.login(username="batchuser", password="testpass1234")
+        response_cache_module.get_response_cache().clear()
+
+    def post_batch(self, payload):
+        return self.client.post(reverse("predict_batch"), data=json.dumps(payload), content_type="application/json")
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_ndjson_deduplicates_identical_payloads(self, mock_llm):
+        mock_llm.return_value = VALID_LLM_OUTPUT
+        csv_a = make_price_csv(["AAPL"], 3)
+        csv_b = make_price_csv(["MSFT"], 3)
+        response = self.post_batch({"items": [
+            {"id": "a", "csv": csv_a},
+            {"id": "b", "csv": csv_b},
+            {"id": "a2", "csv": csv_a},
+        ]})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        results = {line["id"]: line for line in lines[:-1]}
+        self.assertEqual(set(results), {"a", "b", "a2"})
+        self.assertEqual(results["a2"]["duplicate_of"], "a")
+        self.assertTrue(all(result["status"] == "ok" for result in results.values()))
+        self.assertIn("AAPL,2024-07,200", results["b"]["prediction_csv"])
+        self.assertEqual(mock_llm.call_count, 2)
+        summary = lines[-1]["summary"]
+        self.assertEqual((summary["items"], summary["unique"], summary["succeeded"]), (3, 2, 3))
+        self.assertGreater(summary["requests_per_minute"], 0)
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_zip_output_has_one_prediction_csv_per_item(self, mock_llm):
+        import io
+        import zipfile
+        mock_llm.side_effect = lambda prompt, csv_data: "No CSV here." if "MSFT" in csv_data else VALID_LLM_OUTPUT
+        response = self.post_batch({"format": "zip", "items": [
+            {"id": "client/1", "csv": make_price_csv(["AAPL"], 3)},
+            {"id": "client-2", "csv": make_price_csv(["MSFT"], 3), "instructions": "Be bold."},
+        ]})
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertIn("client_1/prediction.csv", archive.namelist())
+        self.assertIn(b"AAPL,2024-07,200", archive.read("client_1/prediction.csv"))
+        summary = json.loads(archive.read("summary.json"))
+        statuses = {result["id"]: result["status"] for result in summary["results"]}
+        self.assertEqual(statuses, {"client/1": "ok", "client-2": "invalid"})
+
+    def test_rejects_malformed_batches(self):
+        self.assertEqual(self.post_batch({"items": []}).status_code, 400)
+        self.assertEqual(self.post_batch({"items": [{"id": "x"}]}).status_code, 400)
+        self.assertEqual(self.post_batch({"format": "xml", "items": [{"csv": "a"}]}).status_code, 400)
+        with override_settings(PREDICTION_BATCH={"MAX_ITEMS": 1}):
+            self.assertEqual(self.post_batch([{"csv": "a"}, {"csv": "b"}]).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.post_batch([{"csv": "a"}]).status_code, 401)
+
+    def test_runner_retries_rate_limits_with_backoff(self):
+        from predictor.batch import BatchRunner
+        calls = []
+        sleeps = []
+
+        def predict(csv_data, instructions):
+            calls.append(csv_data)
+            if len(calls) <= 2:
+                raise RateLimitError("slow down")
+            return {"valid_csv": True, "prediction_csv": "symbol,month,predicted_price"}
+
+        runner = BatchRunner(predict, max_concurrency=1, max_retries=3, backoff_base=0.001, sleep=sleeps.append)
+        results = list(runner.run([{"id": "a", "csv": "x", "instructions": None}]))
+        self.assertEqual(results[0]["status"], "ok")
+        self.assertEqual(results[0]["attempts"], 3)
+        self.assertEqual(runner.stats.rate_limited, 2)
+        self.assertTrue(sleeps)
+
+        runner = BatchRunner(lambda csv_data, instructions: (_ for _ in ()).throw(RateLimitError("no")),
+                             max_retries=2, backoff_base=0, sleep=sleeps.append)
+        results = list(runner.run([{"id": "a", "csv": "x", "instructions": None}]))
+        self.assertEqual((results[0]["status"], results[0]["attempts"]), ("error", 3))
+
+    def test_runner_does_not_retry_other_errors(self):
+        from predictor.batch import BatchRunner
+        predict = Mock(side_effect=RuntimeError("boom"))
+        runner = BatchRunner(predict, max_retries=5, backoff_base=0)
+        results = list(runner.run([{"id": "a", "csv": "x", "instructions": None}]))
+        self.assertEqual(results[0]["status"], "error")
+        self.assertIn("boom", results[0]["error"])
+        self.assertEqual(predict.call_count, 1)
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_management_command_reads_manifest_files(self, mock_llm):
+        import tempfile
+        import zipfile
+        from io import StringIO
+        from django.core.management import call_command
+        mock_llm.return_value = VALID_LLM_OUTPUT
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "a.csv"), "w") as f:
+                f.write(make_price_csv(["AAPL"], 3))
+            with open(os.path.join(tmp, "batch.json"), "w") as f:
+                json.dump({"items": [{"id": "a", "csv_path": "a.csv"}]}, f)
+            output = os.path.join(tmp, "out.zip")
+            stderr = StringIO()
+            call_command("predict_batch", os.path.join(tmp, "batch.json"), output=output, stderr=stderr)
+            self.assertIn("a/prediction.csv", zipfile.ZipFile(output).namelist())
+            self.assertIn("requests/minute", stderr.getvalue())
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="asyncuser", password="testpass1234")
+        self.async_client.force_login(self.user)
+        response_cache_module.get_response_cache().clear()
+
+    @patch("predictor.views.call_llm_with_prompt")
+    @patch("predictor.views.acall_llm_with_prompt", new_callable=AsyncMock)
+    async def test_asgi_predict_awaits_async_llm_call(self, mock_allm, mock_llm):
+        mock_allm.return_value = VALID_LLM_OUTPUT
+        response = await self.async_client.post(reverse("predict"))
+        self.assertContains(response, "AAPL is predicted to rise")
+        mock_allm.assert_awaited_once()
+        mock_llm.assert_not_called()
+        # The second request is served from the response cache
+        response = await self.async_client.post(reverse("predict"))
+        self.assertTrue(response.context["cache_hit"])
+        self.assertEqual(mock_allm.await_count, 1)
+
+    @patch("predictor.views.acall_llm_with_prompt", new_callable=AsyncMock)
+    async def test_asgi_predict_reports_llm_errors(self, mock_allm):
+        mock_allm.side_effect = RuntimeError("LLM error")
+        response = await self.async_client.post(reverse("predict"))
+        self.assertContains(response, "LLM call failed")
+
+    async def test_async_file_views(self):
+        response = await self.async_client.post(reverse("upload_instructions"), {
+            "instructions_file": SimpleUploadedFile("instructions.md", b"Async instructions."),
+        })
+        self.assertEqual(response.status_code, 302)
+        response = await self.async_client.get(reverse("view_instructions"))
+        self.assertContains(response, "Async instructions.")
+        response = await self.async_client.get(reverse("download_uploaded_instructions"))
+        self.assertIn(b"Async instructions.", b"".join(response.streaming_content))
+
+    @override_settings(LLM_CLIENT={"FAKE": {"latency": 0.2}})
+    async def test_fake_llm_calls_overlap_on_one_event_loop(self):
+        import asyncio
+        import time
+        from predictor import llm_clients
+        llm_clients.reset_client_registry()
+        self.addCleanup(llm_clients.reset_client_registry)
+        with patch.dict(os.environ, {"LLM_PROVIDER": "fake"}):
+            start = time.monotonic()
+            outputs = await asyncio.gather(*[predictor_views.acall_llm_with_prompt("prompt", "csv") for _ in range(20)])
+        self.assertLess(time.monotonic() - start, 2.0)
+        self.assertTrue(all("```csv" in output for output in outputs))
+
+    async def test_asgi_streaming_responses_send_chunks_as_they_are_produced(self):
+        import asyncio
+        from asgiref.sync import sync_to_async
+        from django.test import AsyncRequestFactory
+        received, closed = threading.Event(), threading.Event()
+
+        def chunks():
+            try:
+                yield b"first"
+                # Only produced once the first chunk reached the consumer
+                if not received.wait(5):
+                    raise AssertionError("first chunk was held back")
+                yield b"second"
+                yield b"third"
+            finally:
+                closed.set()
+
+        response = predictor_views.streaming_response(AsyncRequestFactory().get("/"), chunks(), "text/plain")
+        self.assertTrue(response.is_async)
+        content = aiter(response.streaming_content)
+        self.assertEqual(await asyncio.wait_for(anext(content), 5), b"first")
+        received.set()
+        self.assertEqual(await anext(content), b"second")
+        # A client going away closes the generator
+        await content.aclose()
+        await sync_to_async(response.close)()
+        self.assertTrue(await asyncio.to_thread(closed.wait, 5))
+
+class ResultChartTests(TestCase):
+    def test_chart_payload_groups_rows_by_symbol(self):
+        from predictor.charts import build_chart_payload
+        from predictor.parsing import PredictionRow
+        rows = [
+            PredictionRow("AAPL", "2024-07", 200.0),
+            PredictionRow("MSFT", "2024-08", 310.0),
+            PredictionRow("AAPL", "2024-08", 210.0),
+            PredictionRow("MSFT", "2024-07", 300.0),
+            PredictionRow("GOOG", "2024-07", 400.0),
+        ]
+        payload = build_chart_payload(rows, max_series=2)
+        self.assertEqual(payload["labels"], ["2024-07", "2024-08"])
+        self.assertEqual([series["symbol"] for series in payload["series"]], ["AAPL", "MSFT"])
+        self.assertEqual(payload["series"][0]["values"], [200.0, 210.0])
+        self.assertEqual(payload["series"][1]["values"], [300.0, 310.0])
+        payload = build_chart_payload(rows[:2])
+        self.assertEqual(payload["series"][1]["values"], [None, 310.0])
+
+    def test_svg_chart_escapes_symbols(self):
+        from predictor.charts import build_chart_payload, render_svg_chart
+        from predictor.parsing import PredictionRow
+        svg = render_svg_chart(build_chart_payload([
+            PredictionRow("<b>", "2024-07", 1.0), PredictionRow("<b>", "2024-08", 2.0),
+        ]))
+        self.assertTrue(svg.startswith("<svg"))
+        self.assertIn("&lt;b&gt;", svg)
+        self.assertIn("<polyline", svg)
+        self.assertIn("No predictions", render_svg_chart({"labels": [], "series": []}))
+
+    @override_settings(PREDICTION_SHAPE={"SYMBOLS": 20}, PREDICTION_CHART={"MAX_SERIES": 2})
+    def test_chart_title_counts_the_series_drawn(self):
+        from predictor.charts import build_chart_payload, chart_title, get_chart_settings
+        from predictor.parsing import PredictionRow
+        rows = [PredictionRow(symbol, month, 1.0) for symbol in ("A", "B", "C") for month in ("2024-07", "2024-08")]
+        payload = build_chart_payload(rows, get_chart_settings()["MAX_SERIES"])
+        self.assertEqual(chart_title(payload), "Predicted Prices for Top 2 Stocks (2 Months)")
+        self.assertEqual(chart_title(payload, "Week"), "Predicted Prices for Top 2 Stocks (2 Weeks)")
+        with override_settings(PREDICTION_CHART={}):
+            self.assertEqual(get_chart_settings()["MAX_SERIES"], 20)
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_result_page_renders_offline_svg_by_default(self, mock_llm):
+        mock_llm.return_value = VALID_LLM_OUTPUT
+        response = self.client.post(reverse("predict"))
+        self.assertContains(response, '<svg xmlns="http://www.w3.org/2000/svg" id="predictionChart"')
+        self.assertContains(response, "<tr><td>AAPL</td><td>2024-07</td><td>200</td></tr>")
+        self.assertNotContains(response, "npm/chart.js")
+
+    @override_settings(PREDICTION_CHART={"RENDERER": "chartjs"})
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_chartjs_renderer_embeds_json_payload(self, mock_llm):
+        mock_llm.return_value = VALID_LLM_OUTPUT
+        response = self.client.post(reverse("predict"))
+        self.assertContains(response, '<canvas id="predictionChart"')
+        self.assertContains(response, '<script id="prediction-chart-data" type="application/json">')
+        self.assertEqual(response.context["chart"]["series"][0]["values"], [200.0, 210.0])
+
+class PredictionHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="histuser", password="testpass1234")
+        self.client.login(username="histuser", password="testpass1234")
+        response_cache_module.get_response_cache().clear()
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_prediction_is_stored_with_rows_and_usage(self, mock_llm):
+        from predictor.models import PredictionRun
+        mock_llm.return_value = VALID_LLM_OUTPUT
+        response = self.client.post(reverse("predict"))
+        run = PredictionRun.objects.get(pk=response.context["run_id"])
+        self.assertEqual(run.user, self.user)
+        self.assertFalse(run.cache_hit)
+        self.assertEqual(run.row_count, 2)
+        # The mock reports no usage, so tokens are estimated
+        self.assertTrue(run.tokens_estimated)
+        self.assertGreater(run.prompt_tokens, 0)
+        self.assertEqual(
+            list(run.rows.values_list("symbol", "month", "price")),
+            [("AAPL", datetime.date(2024, 7, 1), 200.0), ("AAPL", datetime.date(2024, 8, 1), 210.0)],
+        )
+        # A cache hit is stored too, without token cost
+        response = self.client.post(reverse("predict"))
+        cached = PredictionRun.objects.get(pk=response.context["run_id"])
+        self.assertTrue(cached.cache_hit)
+        self.assertEqual(cached.total_tokens, 0)
+
+    def test_token_usage_is_collected_from_responses(self):
+        from predictor.history import collect_token_usage, record_token_usage
+        message = Mock(usage_metadata={"input_tokens": 120, "output_tokens": 30})
+        with collect_token_usage() as usage:
+            record_token_usage(message)
+            record_token_usage(message)
+        record_token_usage(message)  # outside any collector: ignored
+        self.assertEqual((usage.prompt_tokens, usage.completion_tokens, usage.calls), (240, 60, 2))
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_history_pages_are_served_without_llm_call(self, mock_llm):
+        mock_llm.return_value = VALID_LLM_OUTPUT
+        run_id = self.client.post(reverse("predict")).context["run_id"]
+        mock_llm.reset_mock()
+
+        response = self.client.get(reverse("prediction_history"))
+        self.assertContains(response, reverse("prediction_detail", args=[run_id]))
+        response = self.client.get(reverse("prediction_detail", args=[run_id]))
+        self.assertContains(response, "<tr><td>AAPL</td><td>2024-07</td><td>200</td></tr>")
+        self.assertContains(response, "AAPL is predicted to rise")
+        response = self.client.get(reverse("prediction_symbol_history", args=["aapl"]))
+        predictions = response.json()["predictions"]
+        self.assertEqual(
+            [(p["run"], p["month"], p["price"]) for p in predictions],
+            [(run_id, "2024-07", 200.0), (run_id, "2024-08", 210.0)],
+        )
+        mock_llm.assert_not_called()
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_runs_are_private_to_their_user(self, mock_llm):
+        mock_llm.return_value = VALID_LLM_OUTPUT
+        run_id = self.client.post(reverse("predict")).context["run_id"]
+        User.objects.create_user(username="other", password="testpass1234")
+        self.client.login(username="other", password="testpass1234")
+        self.assertEqual(self.client.get(reverse("prediction_detail", args=[run_id])).status_code, 404)
+        self.assertEqual(self.client.get(reverse("prediction_download", args=[run_id])).status_code, 404)
+        self.assertNotContains(self.client.get(reverse("prediction_history")), run_id)
+
+    @override_settings(PREDICTION_HISTORY={"ENABLED": False})
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_history_can_be_disabled(self, mock_llm):
+        from predictor.models import PredictionRun
+        mock_llm.return_value = VALID_LLM_OUTPUT
+        response = self.client.post(reverse("predict"))
+        self.assertIsNone(response.context.get("run_id"))
+        # Without a stored run the export comes from the response cache
+        export_url = reverse("predict_export", args=["csv"])
+        self.assertContains(response, export_url)
+        self.assertEqual(
+            b"".join(self.client.get(export_url).streaming_content).decode(),
+            "symbol,month,predicted_price\nAAPL,2024-07,200\nAAPL,2024-08,210\n",
+        )
+        self.assertFalse(PredictionRun.objects.exists())
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        from predictor.metrics import REGISTRY
+        REGISTRY.reset()
+        self.user = User.objects.create_user(username="metricsuser", password="testpass1234")
+        self.client.login(username="metricsuser", password="testpass1234")
+        response_cache_module.get_response_cache().clear()
+
+    def test_histogram_exposition_format(self):
+        from predictor.metrics import Histogram
+        histogram = Histogram("demo_seconds", "Demo.", ["stage"], buckets=(0.1, 1))
+        histogram.observe(0.05, "parse")
+        histogram.observe(0.5, "parse")
+        histogram.observe(5, "parse")
+        self.assertEqual(list(histogram.samples()), [
+            'demo_seconds_bucket{stage="parse",le="0.1"} 1',
+            'demo_seconds_bucket{stage="parse",le="1"} 2',
+            'demo_seconds_bucket{stage="parse",le="+Inf"} 3',
+            'demo_seconds_sum{stage="parse"} 5.55',
+            'demo_seconds_count{stage="parse"} 3',
+        ])
+
+    def test_prediction_stages_tokens_and_cache_hits_are_exposed(self):
+        from predictor.fake_llm import FakeChatModel
+        with patch("predictor.views.get_llm", return_value=FakeChatModel(response=VALID_LLM_OUTPUT)):
+            response = self.client.post(reverse("predict"))
+            self.client.post(reverse("predict"))
+        stages = [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+        for stage in ("read_inputs", "build_prompt", "llm_call", "parse", "render"):
+            self.assertIn(stage, stages)
+
+        metrics = self.client.get(reverse("metrics"))
+        self.assertEqual(metrics["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        body = metrics.content.decode()
+        self.assertIn("# TYPE prediction_stage_seconds histogram", body)
+        self.assertIn('prediction_stage_seconds_count{stage="llm_call"} 1', body)
+        self.assertIn('prediction_stage_seconds_count{stage="render"} 2', body)
+        self.assertIn('prediction_tokens_count{kind="prompt"} 1', body)
+        self.assertIn('prediction_cache_lookups_total{result="hit"} 1', body)
+        self.assertIn('prediction_cache_lookups_total{result="miss"} 1', body)
+        self.assertIn('prediction_requests_total{outcome="ok"} 2', body)
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_llm_errors_are_counted(self, mock_llm):
+        from predictor.metrics import PREDICTIONS
+        mock_llm.side_effect = RuntimeError("LLM error")
+        self.client.post(reverse("predict"))
+        self.assertEqual(PREDICTIONS.value("error"), 1)
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_profile_dumps_are_written_when_enabled(self, mock_llm):
+        import pstats
+        import tempfile
+        mock_llm.return_value = VALID_LLM_OUTPUT
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with override_settings(PREDICTION_METRICS={"PROFILE": True, "PROFILE_DIR": profile_dir}):
+                self.client.post(reverse("predict"))
+            names = sorted(os.listdir(profile_dir))
+            self.assertEqual([os.path.splitext(name)[1] for name in names], [".json", ".prof"])
+            trace, dump = (os.path.join(profile_dir, name) for name in names)
+            pstats.Stats(dump)
+            with open(trace) as f:
+                stages = [entry["stage"] for entry in json.load(f)["stages"]]
+            self.assertIn("parse", stages)
+
+    def test_overlapping_requests_are_not_profiled(self):
+        import asyncio
+        import tempfile
+        from predictor.metrics import profile_request
+
+        async def request(name, started, done):
+            with profile_request(name) as profiler:
+                started.set()
+                await done.wait()
+                return profiler
+
+        async def overlapping():
+            started, done = asyncio.Event(), asyncio.Event()
+            first = asyncio.ensure_future(request("first", started, done))
+            await started.wait()
+            second = asyncio.ensure_future(request("second", asyncio.Event(), done))
+            await asyncio.sleep(0)
+            done.set()
+            return await first, await second
+
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with override_settings(PREDICTION_METRICS={"PROFILE": True, "PROFILE_DIR": profile_dir}):
+                first, second = asyncio.run(overlapping())
+                self.assertIsNotNone(first)
+                self.assertIsNone(second)
+                self.assertEqual({name.split("-")[0] for name in os.listdir(profile_dir)}, {"first"})
+                # The profiler is free again once the request is done
+                with profile_request("third") as profiler:
+                    self.assertIsNotNone(profiler)
+
+class LocalForecastTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="forecastuser", password="testpass1234")
+        self.client.login(username="forecastuser", password="testpass1234")
+        response_cache_module.get_response_cache().clear()
+
+    def test_linear_series_is_extended_and_ranked(self):
+        from predictor.forecast import forecast_table
+        from predictor.summarize import load_price_table
+        lines = ["symbol,date,open,high,low,close,volume"]
+        for month in range(1, 7):
+            lines.append(f"UP,2024-{month:02d}-15,1,1,1,{100 + 10 * month},1000")
+            # Two rows in a month: only the last close of the month counts
+            lines.append(f"FLAT,2024-{month:02d}-01,1,1,1,1,1000")
+            lines.append(f"FLAT,2024-{month:02d}-28,1,1,1,50,1000")
+        ranked = forecast_table(load_price_table("\n".join(lines)), top_n=2, months=3, alpha=1.0)
+        self.assertEqual([entry[0] for entry in ranked], ["UP", "FLAT"])
+        symbol, labels, prices, last_close = ranked[0]
+        self.assertEqual(labels.tolist(), ["2024-07", "2024-08", "2024-09"])
+        self.assertEqual(last_close, 160.0)
+        # Drift and trend both continue the line, smoothing with ALPHA=1 stays at the last close
+        expected = [(170 + 160 + 170) / 3, (180 + 160 + 180) / 3, (190 + 160 + 190) / 3]
+        self.assertEqual(prices.round(6).tolist(), [round(price, 6) for price in expected])
+        self.assertEqual(ranked[1][2].tolist(), [50.0, 50.0, 50.0])
+
+    def test_completion_matches_prediction_contract(self):
+        from predictor.forecast import forecast_completion
+        from predictor.parsing import parse_completion
+        from predictor.summarize import load_price_table
+        lines = ["symbol,date,open,high,low,close,volume"]
+        for symbol in range(15):
+            for month in range(1, 13):
+                lines.append(f"S{symbol:02d},2023-{month:02d},1,1,1,{100 + symbol * month},1000")
+        parsed = parse_completion(forecast_completion(load_price_table("\n".join(lines))), 10, 12)
+        self.assertEqual(parsed.errors, [])
+        self.assertEqual(parsed.symbols[0], "S14")
+        self.assertEqual(len(parsed.rows), 120)
+        self.assertIn("S14", parsed.symbol_explanations)
+
+    def test_forecasts_follow_the_horizon(self):
+        from predictor.forecast import forecast_completion, forecast_table
+        from predictor.parsing import parse_completion
+        from predictor.summarize import load_price_table
+        lines = ["symbol,date,open,high,low,close,volume"]
+        for day in range(70):
+            date = datetime.date(2024, 1, 1) + datetime.timedelta(days=day)
+            lines.append(f"UP,{date.isoformat()},1,1,1,{100 + day},1000")
+        table = load_price_table("\n".join(lines))
+        # The last close (2024-03-10) is in the week of Monday 2024-03-04
+        symbol, labels, prices, last_close = forecast_table(table, months=3, alpha=1.0, horizon="weekly")[0]
+        self.assertEqual(labels.tolist(), ["2024-03-11", "2024-03-18", "2024-03-25"])
+        self.assertEqual(last_close, 169.0)
+        self.assertGreater(prices[0], last_close)
+        labels = forecast_table(table, months=3, horizon="quarterly")[0][1]
+        self.assertEqual(labels.tolist(), ["2024-Q2", "2024-Q3", "2024-Q4"])
+        completion = forecast_completion(table, top_n=1, months=8, horizon="weekly")
+        self.assertIn("over 8 weeks", completion)
+        self.assertEqual(parse_completion(completion, 1, 8, "week").errors, [])
+
+    @override_settings(
+        PREDICTION_FORECAST={"MODE": "local"}, PREDICTION_SHAPE={"SYMBOLS": 1, "HORIZON": "quarterly", "PERIODS": 4},
+    )
+    def test_local_mode_uses_the_configured_shape(self):
+        response = self.client.post(reverse("predict"))
+        self.assertTrue(response.context["valid_csv"])
+        self.assertEqual(response.context["validation_errors"], [])
+        self.assertEqual(len(response.context["page_rows"]), 4)
+        self.assertRegex(response.context["page_rows"][0].month, r"^\d{4}-Q[1-4]$")
+
+    @override_settings(PREDICTION_FORECAST={"MODE": "local"})
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_local_mode_skips_the_llm(self, mock_llm):
+        from predictor.models import PredictionRun
+        response = self.client.post(reverse("predict"))
+        mock_llm.assert_not_called()
+        self.assertContains(response, "Local baseline forecast")
+        self.assertTrue(response.context["valid_csv"])
+        run = PredictionRun.objects.get(pk=response.context["run_id"])
+        self.assertEqual((run.model_name, run.total_tokens), ("local-baseline", 0))
+
+    @override_settings(PREDICTION_FORECAST={"MODE": "fallback"})
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_fallback_mode_answers_locally_when_the_llm_fails(self, mock_llm):
+        mock_llm.side_effect = TimeoutError("Request timed out")
+        response = self.client.post(reverse("predict"))
+        self.assertContains(response, "Local baseline forecast")
+        self.assertContains(response, "LLM call failed: Request timed out")
+        self.assertTrue(response.context["valid_csv"])
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_llm_mode_still_reports_errors(self, mock_llm):
+        mock_llm.side_effect = TimeoutError("Request timed out")
+        response = self.client.post(reverse("predict"))
+        self.assertContains(response, "LLM call failed: Request timed out")
+        self.assertNotContains(response, "Local baseline forecast")
+
+class PromptBudgetTests(TestCase):
+    ESTIMATE = {"TOKENIZER": "estimate", "MIN_MONTHS": 3}
+
+    def setUp(self):
+        from predictor.budget import reset_tokenizers
+        reset_tokenizers()
+
+    def budget_config(self, **overrides):
+        from predictor.budget import DEFAULT_BUDGET_SETTINGS
+        return {**DEFAULT_BUDGET_SETTINGS, **self.ESTIMATE, **overrides}
+
+    def monthly_csv(self, symbols=4, months=24):
+        lines = ["symbol,date,open,high,low,close,volume"]
+        for month in range(months):
+            for symbol in range(symbols):
+                lines.append(f"SYM{symbol},{2020 + month // 12}-{month % 12 + 1:02d},1,1,1,{100 + month},1000")
+        return "\n".join(lines) + "\n"
+
+    def test_prompt_within_budget_is_unchanged(self):
+        from predictor.budget import fit_prompt
+        csv_data = self.monthly_csv()
+        payload, report = fit_prompt("system", csv_data, config=self.budget_config())
+        self.assertIs(payload, csv_data)
+        self.assertEqual(report.steps, [])
+        self.assertEqual(report.before["data"], len(csv_data) // 4 + 1)
+
+    def test_oldest_months_are_dropped_first(self):
+        from predictor.budget import fit_prompt
+        csv_data = self.monthly_csv()
+        with self.assertLogs("predictor.budget", "INFO") as logs:
+            payload, report = fit_prompt("system", csv_data, config=self.budget_config(MAX_PROMPT_TOKENS=400))
+        self.assertTrue(report.fits)
+        self.assertEqual([name for name, _ in report.steps], ["drop_oldest_months"])
+        months = {line.split(",")[1] for line in payload.splitlines()[1:]}
+        self.assertIn("2021-12", months)
+        self.assertNotIn("2020-01", months)
+        self.assertGreaterEqual(len(months), 3)
+        self.assertIn("Prompt reduced from", logs.output[0])
+
+    def test_symbols_are_sampled_then_summarized(self):
+        from predictor.budget import fit_prompt
+        csv_data = self.monthly_csv(symbols=40, months=6)
+        config = self.budget_config(MAX_PROMPT_TOKENS=400)
+        payload, report = fit_prompt("system", csv_data, config=config)
+        self.assertEqual([name for name, _ in report.steps], ["drop_oldest_months", "sample_symbols"])
+        self.assertTrue(report.fits)
+        self.assertIn("symbols sampled to fit the token budget", payload)
+        # The sample is deterministic
+        self.assertEqual(fit_prompt("system", csv_data, config=config)[0], payload)
+
+        payload, report = fit_prompt("system", csv_data, config={**config, "STRATEGIES": ["summarize"]})
+        self.assertTrue(payload.startswith("# Per-symbol summary"))
+        self.assertTrue(report.fits)
+
+    def test_long_instructions_are_truncated(self):
+        from predictor.budget import truncate_instructions
+        config = self.budget_config(MAX_INSTRUCTIONS_TOKENS=10)
+        self.assertEqual(truncate_instructions("short", config), "short")
+        truncated = truncate_instructions("x" * 1000, config)
+        self.assertTrue(truncated.startswith("x" * 36))
+        self.assertIn("[Instructions truncated", truncated)
+
+    def test_tokenizer_is_loaded_once_and_counts_are_cached(self):
+        from predictor import budget
+        config = self.budget_config(TOKENIZER="auto")
+        with patch.object(budget, "load_tiktoken_encoding", side_effect=OSError("offline")) as load:
+            tokenizer = budget.get_tokenizer("gpt-4o", config)
+            self.assertIs(budget.get_tokenizer("gpt-4o", config), tokenizer)
+        load.assert_called_once()
+        self.assertEqual(tokenizer.name, "estimate")
+        tokenizer.count(budget.__doc__)
+        tokenizer.count(budget.__doc__)
+        self.assertEqual((tokenizer.misses, tokenizer.hits), (1, 1))
+
+    @override_settings(PROMPT_BUDGET={"TOKENIZER": "estimate", "MAX_PROMPT_TOKENS": 900, "MIN_MONTHS": 1})
+    def test_prediction_inputs_are_fitted_to_the_budget(self):
+        from predictor.budget import get_tokenizer
+        with override_settings(LLM_CSV_DIGEST={"MODE": "never"}):
+            prompt, payload = predictor_views.assemble_prediction_inputs(self.monthly_csv(months=36), "Pick winners.")
+        tokenizer = get_tokenizer()
+        self.assertLessEqual(tokenizer.count(prompt) + tokenizer.count(payload), 900)
+        self.assertIn("2022-12", payload)
+
+class LLMRouterTests(TestCase):
+    MESSAGES = [("user", "predict")]
+
+    def setUp(self):
+        from predictor.metrics import REGISTRY
+        from predictor.router import reset_router
+        REGISTRY.reset()
+        reset_router()
+        self.addCleanup(reset_router)
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def make_router(self, *models, **options):
+        from predictor.router import Backend, CircuitBreaker, LLMRouter
+        backends = [
+            Backend(f"b{index}", model, min_samples=2, breaker=CircuitBreaker(
+                failure_threshold=2, reset_timeout=10, clock=self.clock,
+            ))
+            for index, model in enumerate(models)
+        ]
+        return LLMRouter(backends, min_samples=2, **options)
+
+    def test_failover_to_the_next_backend(self):
+        from predictor.fake_llm import FakeChatModel
+        from predictor.metrics import LLM_BACKEND_CALLS
+        router = self.make_router(FakeChatModel(fail_first=1), FakeChatModel())
+        response = router.invoke(self.MESSAGES)
+        self.assertEqual(response.response_metadata["router_backend"], "b1")
+        self.assertEqual(LLM_BACKEND_CALLS.value("b0", "error"), 1)
+        self.assertEqual(LLM_BACKEND_CALLS.value("b1", "ok"), 1)
+
+    def test_invalid_answers_fail_over(self):
+        from predictor.fake_llm import FakeChatModel
+        router = self.make_router(
+            FakeChatModel(response="no prediction"), FakeChatModel(),
+            validate=predictor_views.has_prediction_rows,
+        )
+        self.assertEqual(router.invoke(self.MESSAGES).response_metadata["router_backend"], "b1")
+
+    def test_circuit_opens_and_recovers_after_a_trial_call(self):
+        from predictor.fake_llm import FakeChatModel, FakeLLMError
+        from predictor.router import CLOSED, HALF_OPEN, OPEN, NoHealthyBackendError
+        flaky = FakeChatModel(fail_first=3)
+        router = self.make_router(flaky)
+        backend = router.backends[0]
+        for _ in range(2):
+            with self.assertRaises(FakeLLMError):
+                router.invoke(self.MESSAGES)
+        self.assertEqual(backend.breaker.state, OPEN)
+        with self.assertRaises(NoHealthyBackendError):
+            router.invoke(self.MESSAGES)
+        self.assertEqual(flaky.call_count, 2)
+
+        # After the reset timeout one trial call is let through; it fails again
+        self.now = 10.0
+        self.assertTrue(backend.breaker.acquire())
+        self.assertEqual(backend.breaker.state, HALF_OPEN)
+        self.assertFalse(backend.breaker.acquire())
+        backend.breaker.release()
+        with self.assertRaises(FakeLLMError):
+            router.invoke(self.MESSAGES)
+        self.assertEqual(backend.breaker.state, OPEN)
+
+        self.now = 20.0
+        router.invoke(self.MESSAGES)
+        self.assertEqual(backend.breaker.state, CLOSED)
+
+    def test_fastest_backend_is_preferred_once_measured(self):
+        from predictor.fake_llm import FakeChatModel
+        router = self.make_router(FakeChatModel(latency=0.02), FakeChatModel())
+        # Both backends are explored first, in configured order
+        backends = [router.invoke(self.MESSAGES).response_metadata["router_backend"] for _ in range(6)]
+        self.assertEqual(backends[:2], ["b0", "b0"])
+        self.assertEqual(backends[2:4], ["b1", "b1"])
+        self.assertEqual(backends[4:], ["b1", "b1"])
+        self.assertGreater(router.backends[0].p50, router.backends[1].p50)
+
+    def test_hedged_call_returns_the_faster_backend(self):
+        from predictor.fake_llm import FakeChatModel
+        from predictor.metrics import LLM_HEDGES
+        router = self.make_router(FakeChatModel(latency=1.0), FakeChatModel(), hedge_after=0.05)
+        started = time.monotonic()
+        response = router.invoke(self.MESSAGES)
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(response.response_metadata["router_backend"], "b1")
+        self.assertEqual(LLM_HEDGES.value(), 1)
+
+    def test_async_hedge_cancels_the_slower_call(self):
+        from asgiref.sync import async_to_sync
+        from predictor.fake_llm import FakeChatModel
+        from predictor.metrics import LLM_BACKEND_CALLS
+        router = self.make_router(FakeChatModel(latency=1.0), FakeChatModel(), hedge_after=0.05)
+        response = async_to_sync(router.ainvoke)(self.MESSAGES)
+        self.assertEqual(response.response_metadata["router_backend"], "b1")
+        self.assertEqual(LLM_BACKEND_CALLS.value("b0", "cancelled"), 1)
+
+    def test_stream_fails_over_before_the_first_chunk(self):
+        from predictor.fake_llm import FakeChatModel, build_fake_prediction
+        router = self.make_router(FakeChatModel(fail_first=1), FakeChatModel())
+        self.assertEqual("".join(chunk.content for chunk in router.stream(self.MESSAGES)), build_fake_prediction())
+
+    def test_closing_a_stream_releases_a_half_open_backend(self):
+        from predictor.fake_llm import FakeChatModel
+        from predictor.metrics import LLM_BACKEND_CALLS
+        from predictor.router import HALF_OPEN
+        router = self.make_router(FakeChatModel())
+        breaker = router.backends[0].breaker
+        breaker.record_failure()
+        breaker.record_failure()
+        self.now = 10
+        stream = router.stream(self.MESSAGES)
+        next(stream)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertFalse(breaker.available())
+        stream.close()
+        self.assertTrue(breaker.available())
+        self.assertEqual(LLM_BACKEND_CALLS.value("b0", "cancelled"), 1)
+
+    @override_settings(LLM_ROUTER={"BACKENDS": [
+        {"NAME": "down", "CLASS": "predictor.fake_llm.FakeChatModel", "OPTIONS": {"fail_first": 100}},
+        {"NAME": "up", "CLASS": "predictor.fake_llm.FakeChatModel"},
+    ]})
+    def test_predict_view_uses_the_configured_router(self):
+        from predictor.models import PredictionRun
+        response_cache_module.get_response_cache().clear()
+        User.objects.create_user(username="routeruser", password="testpass1234")
+        self.client.login(username="routeruser", password="testpass1234")
+        response = self.client.post(reverse("predict"))
+        self.assertIsNone(response.context["error"])
+        run = PredictionRun.objects.get(pk=response.context["run_id"])
+        self.assertEqual(run.model_name, "router:down+up")
+
+class PredictionPrefetchTests(TestCase):
+    CSV = b"symbol,date,open,high,low,close,volume\nAAPL,2021-01,100,110,90,105,1000000\nAAPL,2021-02,105,115,95,110,1000000\n"
+
+    def setUp(self):
+        from predictor.metrics import REGISTRY
+        from predictor.prefetch import reset_prefetcher
+        self.user = User.objects.create_user(username="prefetchuser", password="testpass1234")
+        self.client.login(username="prefetchuser", password="testpass1234")
+        response_cache_module.get_response_cache().clear()
+        REGISTRY.reset()
+        reset_prefetcher()
+        self.addCleanup(reset_prefetcher)
+
+    def test_prefetches_are_coalesced_and_claimed_once(self):
+        from predictor.prefetch import Prefetcher
+        prefetcher = Prefetcher(max_workers=2)
+        self.addCleanup(prefetcher.shutdown)
+        release = threading.Event()
+        calls = []
+
+        def work():
+            calls.append(1)
+            release.wait(5)
+            return "output"
+
+        self.assertTrue(prefetcher.submit("key", work))
+        self.assertFalse(prefetcher.submit("key", work))
+        release.set()
+        future, first = prefetcher.claim("key")
+        self.assertEqual((future.result(), first), ("output", True))
+        self.assertFalse(prefetcher.claim("key")[1])
+        self.assertEqual(prefetcher.claim("other"), (None, False))
+        self.assertEqual(len(calls), 1)
+
+    def test_failed_prefetches_are_dropped(self):
+        from predictor.prefetch import Prefetcher
+        prefetcher = Prefetcher(max_workers=1)
+        self.addCleanup(prefetcher.shutdown)
+        prefetcher.submit("key", Mock(side_effect=RuntimeError("down")))
+        prefetcher.shutdown(wait=True)
+        self.assertNotIn("key", prefetcher)
+
+    @override_settings(PREDICTION_PREFETCH={"ENABLED": True})
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_predict_attaches_to_the_upload_prefetch(self, mock_llm):
+        from predictor.fake_llm import build_fake_prediction
+        from predictor.metrics import PREFETCHES
+        from predictor.models import PredictionRun
+        release = threading.Event()
+
+        def slow_llm(prompt, csv_data):
+            release.wait(5)
+            return build_fake_prediction()
+
+        mock_llm.side_effect = slow_llm
+        for _ in range(2):
+            self.client.post(reverse("upload_csv"), {"csv_file": SimpleUploadedFile("data.csv", self.CSV)})
+        self.assertEqual((PREFETCHES.value("started"), PREFETCHES.value("coalesced")), (1, 1))
+        release.set()
+        response = self.client.post(reverse("predict"))
+        self.assertTrue(response.context["valid_csv"])
+        self.assertFalse(response.context["cache_hit"])
+        self.assertEqual(mock_llm.call_count, 1)
+        self.assertEqual(PREFETCHES.value("claimed"), 1)
+        run = PredictionRun.objects.get(pk=response.context["run_id"])
+        self.assertGreater(run.total_tokens, 0)
+
+        # Later predictions of the same inputs are cache hits
+        response = self.client.post(reverse("predict"))
+        self.assertTrue(response.context["cache_hit"])
+        self.assertEqual(mock_llm.call_count, 1)
+
+    @override_settings(
+        PREDICTION_PREFETCH={"ENABLED": True},
+        PREDICTION_THROTTLING={"ENABLED": True, "USER_RATE": "1/h", "USER_BURST": 1, "MAX_CONCURRENT": 1},
+    )
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_prefetch_takes_a_token_and_a_slot(self, mock_llm):
+        from predictor.fake_llm import build_fake_prediction
+        from predictor.metrics import PREFETCHES
+        from predictor.prefetch import get_prefetcher
+        from predictor.throttling import RateLimited, get_rate_limiter, reset_rate_limiter
+        reset_rate_limiter()
+        self.addCleanup(reset_rate_limiter)
+        release = threading.Event()
+
+        def slow_llm(prompt, csv_data):
+            release.wait(5)
+            return build_fake_prediction()
+
+        mock_llm.side_effect = slow_llm
+        self.client.post(reverse("upload_csv"), {"csv_file": SimpleUploadedFile("data.csv", self.CSV)})
+        self.assertEqual(PREFETCHES.value("started"), 1)
+        with self.assertRaises(RateLimited) as raised:
+            get_rate_limiter().admit(None, "10.0.0.1")
+        self.assertEqual(raised.exception.reason, "concurrency")
+        release.set()
+        get_prefetcher().shutdown(wait=True)
+        get_rate_limiter().admit(None, "10.0.0.1")()
+
+        # The user's only token went to the first prefetch
+        self.client.post(reverse("upload_instructions"), {
+            "instructions_file": SimpleUploadedFile("instructions.md", b"Pick growth stocks."),
+        })
+        self.assertEqual(PREFETCHES.value("throttled"), 1)
+        self.assertEqual(mock_llm.call_count, 1)
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_prefetch_is_off_by_default(self, mock_llm):
+        self.client.post(reverse("upload_csv"), {"csv_file": SimpleUploadedFile("data.csv", self.CSV)})
+        from predictor.prefetch import get_prefetcher
+        self.assertEqual(len(get_prefetcher()), 0)
+        mock_llm.assert_not_called()
+
+class BacktestTests(TestCase):
+    def realized_csv(self):
+        lines = ["symbol,date,open,high,low,close,volume"]
+        for month in range(1, 13):
+            lines.append(f"UP,2024-{month:02d}-15,1,1,1,{100 + 10 * month},1000")
+            lines.append(f"DOWN,2024-{month:02d}-15,1,1,1,{200 - 10 * month},1000")
+        return "\n".join(lines) + "\n"
+
+    def realized(self):
+        from predictor.backtest import RealizedPrices
+        from predictor.summarize import load_price_table
+        return RealizedPrices.from_table(load_price_table(self.realized_csv()))
+
+    def test_runs_are_scored_against_realized_prices(self):
+        from predictor.backtest import PredictionSet, score_predictions
+        predictions = PredictionSet.from_rows([
+            ("r1", "UP", "2024-07", 180.0), ("r1", "UP", "2024-08", 185.0),
+            ("r1", "DOWN", "2024-07", 150.0), ("r1", "DOWN", "2024-08", 140.0),
+            ("r2", "UP", "2030-01", 1.0),
+        ])
+        result = score_predictions(predictions, self.realized(), top_n=1)
+        r1, r2 = result.runs
+        self.assertEqual((r1["scored_rows"], r2["scored_rows"]), (4, 0))
+        # Bases are the June closes: UP 160, DOWN 140; DOWN was predicted flat-to-up but fell
+        self.assertEqual(r1["hit_rate"], 0.5)
+        expected_mape = (10 / 170 + 5 / 180 + 20 / 130 + 20 / 120) / 4
+        self.assertAlmostEqual(r1["mape"], expected_mape)
+        # UP has the best predicted return (185/160) and realized 180/160
+        self.assertAlmostEqual(r1["top_return"], 180 / 160 - 1)
+        self.assertAlmostEqual(r1["mean_return"], ((180 / 160 - 1) + (120 / 140 - 1)) / 2)
+        self.assertIsNone(r2["mape"])
+        self.assertEqual([symbol["symbol"] for symbol in result.symbols], ["DOWN", "UP"])
+        self.assertEqual(result.portfolio["scored_rows"], 4)
+
+    def test_walk_forward_in_processes_matches_inline(self):
+        from predictor.backtest import score_predictions, walk_forward
+        from predictor.summarize import load_price_table
+        table = load_price_table(self.realized_csv())
+        inline = walk_forward(table, windows=4, horizon=3, max_workers=1)
+        parallel = walk_forward(table, windows=4, horizon=3, max_workers=2)
+        self.assertEqual(inline[0].run_ids, ["walk-forward 2024-08", "walk-forward 2024-09",
+                                             "walk-forward 2024-10", "walk-forward 2024-11"])
+        self.assertEqual(score_predictions(*inline).as_dict(), score_predictions(*parallel).as_dict())
+        # Linear data: every walk-forward forecast gets the direction right
+        self.assertEqual(score_predictions(*inline).portfolio["hit_rate"], 1.0)
+
+    def test_backtest_view_scores_stored_runs(self):
+        from predictor.history import record_prediction_run
+        from predictor.parsing import parse_completion
+        user = User.objects.create_user(username="backtestuser", password="testpass1234")
+        self.client.login(username="backtestuser", password="testpass1234")
+        self.client.post(reverse("upload_csv"), {"csv_file": SimpleUploadedFile("data.csv", self.realized_csv().encode())})
+        parsed = parse_completion("```csv\nsymbol,month,predicted_price\nUP,2024-07,170\nDOWN,2024-07,150\n```")
+        run = record_prediction_run(user, parsed, True, "hash", "test-model", 1.0, (1, 1, False), False)
+        # Weekly runs cannot be scored against monthly closes and are left out
+        with override_settings(PREDICTION_SHAPE={"HORIZON": "weekly"}):
+            record_prediction_run(user, parsed, True, "hash", "weekly-model", 1.0, (1, 1, False), False)
+        response = self.client.get(reverse("backtest"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["is_user_csv"])
+        (result,) = response.context["stored"].runs
+        self.assertEqual((result["run"], result["model_name"], result["scored_rows"]), (str(run.pk), "test-model", 2))
+        self.assertContains(response, "Walk-forward local baseline")
+        self.assertContains(response, reverse("prediction_detail", args=[run.pk]))
+
+    def test_management_command_scores_prediction_files(self):
+        import tempfile
+        from io import StringIO
+        from django.core.management import call_command
+        with tempfile.TemporaryDirectory() as tmp:
+            realized = os.path.join(tmp, "realized.csv")
+            with open(realized, "w") as f:
+                f.write(self.realized_csv())
+            runs = os.path.join(tmp, "runs.csv")
+            with open(runs, "w") as f:
+                f.write("run,symbol,month,predicted_price\na,UP,2024-07,170\nb,DOWN,2024-07,150\nb,UP,2024-07,bad\n")
+            stdout = StringIO()
+            call_command("backtest", realized, predictions=[runs], walk_forward=True, windows=2,
+                         horizon=2, workers=1, format="json", stdout=stdout)
+        results = json.loads(stdout.getvalue())
+        self.assertEqual([run["run"] for run in results["predictions"]["runs"]], ["a", "b"])
+        self.assertAlmostEqual(results["predictions"]["portfolio"]["mape"], (20 / 130) / 2)
+        self.assertEqual(results["walk_forward"]["portfolio"]["runs"], 2)
+
+
+class UploadStorageTests(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from predictor import storage as storage_module
+        self.storage_module = storage_module
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.now = 1_000_000.0
+        override = override_settings(UPLOAD_STORAGE={"ROOT": self.root, "EVICT_INTERVAL": None})
+        override.enable()
+        self.addCleanup(override.disable)
+        storage_module.reset_upload_storage()
+        self.addCleanup(storage_module.reset_upload_storage)
+
+    def make_storage(self, **kwargs):
+        options = {"ttl": 100, "gc_grace": 10, "touch_interval": 1, "clock": lambda: self.now, **kwargs}
+        return self.storage_module.UploadStorage(self.root, **options)
+
+    def test_identical_uploads_share_one_blob(self):
+        storage = self.make_storage()
+        first = storage.save(1, "instructions.md", [b"# Same", b" content"])
+        second = storage.save(2, "instructions.md", [b"# Same content"])
+        self.assertEqual(first.path, second.path)
+        self.assertEqual(second.read_text(), "# Same content")
+        self.assertEqual(len(os.listdir(os.path.join(self.root, "tmp"))), 0)
+
+    def test_quota_rejects_upload_and_keeps_previous_file(self):
+        storage = self.make_storage(user_quota=20)
+        storage.save(1, "instructions.md", [b"x" * 15])
+        storage.save(1, "instructions.md", [b"y" * 18])  # replacing a file frees its share
+        with self.assertRaises(self.storage_module.QuotaExceeded):
+            storage.save(1, "data.csv", [b"z" * 5])
+        self.assertIsNone(storage.get(1, "data.csv"))
+        self.assertEqual(storage.get(1, "instructions.md").read_text(), "y" * 18)
+        self.assertEqual(storage.usage(1), 18)
+
+    def test_eviction_drops_unused_files_then_their_blobs(self):
+        storage = self.make_storage()
+        shared = storage.save(1, "instructions.md", [b"shared"])
+        storage.save(2, "instructions.md", [b"shared"])
+        self.now += 50
+        storage.get(2, "instructions.md")  # user 2 keeps using it
+        self.now += 60
+        self.assertEqual(storage.evict()["files"], 1)
+        self.assertIsNone(storage.get(1, "instructions.md"))
+        self.assertTrue(os.path.exists(shared.path))
+        self.now += 200
+        os.utime(shared.blob_dir, (self.now - 20, self.now - 20))
+        stats = storage.evict()
+        self.assertEqual((stats["files"], stats["blobs"]), (1, 1))
+        self.assertFalse(os.path.exists(shared.blob_dir))
+
+    def test_compressed_csv_round_trip_and_legacy_import(self):
+        from predictor.artifacts import ArtifactCache, content_hash
+        csv_data = "symbol,date,open,high,low,close,volume\n" + "".join(
+            f"AAPL,2021-{month:02d},1,2,0.5,{month},100\n" for month in range(1, 13)
+        )
+        storage = self.make_storage(compress=True)
+        storage.ingest_csv(1, [csv_data.encode()])
+        stored = storage.get(1, "data.csv")
+        self.assertTrue(stored.path.endswith(".gz"))
+        self.assertEqual(stored.read_text(), csv_data)
+        self.assertLess(os.path.getsize(stored.path), stored.size)
+        text, digest = ArtifactCache().read_text(1, stored.path)
+        self.assertEqual(text, csv_data)
+        table = ArtifactCache().get_dataset(1, stored.blob_dir, text, digest).table
+        self.assertEqual(len(table), 12)
+
+        legacy_dir = os.path.join(self.root, "7")
+        os.makedirs(legacy_dir)
+        with open(os.path.join(legacy_dir, "instructions.md"), "w") as f:
+            f.write("old instructions")
+        # Reads leave the old layout alone, the command imports it
+        self.assertIsNone(storage.get(7, "instructions.md"))
+        self.assertTrue(os.path.exists(legacy_dir))
+        from io import StringIO
+        from django.core.management import call_command
+        stdout = StringIO()
+        call_command("import_legacy_uploads", stdout=stdout)
+        self.assertIn("Imported the uploads of 1 users", stdout.getvalue())
+        self.assertEqual(storage.get(7, "instructions.md").read_text(), "old instructions")
+        self.assertFalse(os.path.exists(legacy_dir))
+        self.assertEqual(content_hash(csv_data), content_hash(storage.get(1, "data.csv").read_text()))
+
+    def test_download_views_serve_blobs(self):
+        User.objects.create_user(username="storageuser", password="testpass1234")
+        self.client.login(username="storageuser", password="testpass1234")
+        with override_settings(UPLOAD_STORAGE={"ROOT": self.root, "EVICT_INTERVAL": None, "COMPRESS": True}):
+            self.storage_module.reset_upload_storage()
+            self.client.post(reverse("upload_instructions"),
+                             {"instructions_file": SimpleUploadedFile("instructions.md", b"# Compressed")})
+            response = self.client.get(reverse("download_uploaded_instructions"), HTTP_ACCEPT_ENCODING="gzip")
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            import gzip
+            self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), b"# Compressed")
+            response = self.client.get(reverse("download_uploaded_instructions"))
+            self.assertEqual(b"".join(response.streaming_content), b"# Compressed")
+        with override_settings(UPLOAD_STORAGE={"ROOT": self.root, "EVICT_INTERVAL": None,
+                                               "SENDFILE_HEADER": "X-Accel-Redirect"}):
+            self.storage_module.reset_upload_storage()
+            response = self.client.get(reverse("download_uploaded_instructions"), HTTP_ACCEPT_ENCODING="gzip")
+            self.assertTrue(response["X-Accel-Redirect"].startswith("/protected/uploads/blobs/"))
+            self.assertTrue(response["X-Accel-Redirect"].endswith("/content.gz"))
+
+    def test_eviction_thread_is_started_by_server_processes_only(self):
+        with patch("predictor.storage._evictor", None), patch("threading.Thread") as thread:
+            self.storage_module.get_upload_storage()
+            thread.assert_not_called()
+            with override_settings(UPLOAD_STORAGE={"ROOT": self.root, "EVICT_INTERVAL": 60}):
+                self.assertTrue(self.storage_module.start_upload_evictor())
+                self.assertTrue(self.storage_module.start_upload_evictor())
+            thread.assert_called_once()
+            thread.return_value.start.assert_called_once()
+
+    def test_evict_uploads_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+        storage = self.storage_module.get_upload_storage()
+        storage.save(1, "instructions.md", [b"old"])
+        stdout = StringIO()
+        call_command("evict_uploads", ttl=0, grace=0, stdout=stdout)
+        self.assertIn("Evicted 1 files, deleted 1 blobs", stdout.getvalue())
+        self.assertIsNone(storage.get(1, "instructions.md"))
+
+
+def ensemble_output(prices, symbols=("AAPL", "MSFT")):
+    lines = ["symbol,month,predicted_price"]
+    for offset, symbol in enumerate(symbols):
+        lines.extend(f"{symbol},2024-{month:02d},{price + 100 * offset}" for month, price in zip((7, 8), prices))
+    return "```csv\n" + "\n".join(lines) + "\n```\nExplanations:\n" + "\n".join(f"{s}: sampled." for s in symbols)
+
+
+class EnsemblePredictionTests(TestCase):
+    def setUp(self):
+        response_cache_module.get_response_cache().clear()
+        self.config = {
+            "ENABLED": True, "SAMPLES": 4, "QUORUM": None, "GRACE": 0.0, "MAX_CONCURRENCY": 4,
+            "VARIANTS": [{"temperature": t} for t in (0.1, 0.2, 0.3, 0.4)],
+        }
+
+    def test_aggregate_takes_median_and_interquartile_range(self):
+        from predictor.ensemble import aggregate_samples
+        from predictor.sharding import extract_candidates
+        samples = [extract_candidates(f"symbol,month,predicted_price\nAAPL,2024-07,{p}\nAAPL,2024-08,{p * 2}")
+                   for p in (10, 20, 30, 40)]
+        samples[0]["MSFT"] = [("2024-07", 5.0)]  # a minority symbol ranks last
+        result = aggregate_samples(samples, top_n=2, months=12)
+        self.assertEqual((result.symbols, result.months), (["AAPL", "MSFT"], ["2024-07", "2024-08"]))
+        self.assertEqual(result.median[0].tolist(), [25.0, 50.0])
+        self.assertEqual((result.low[0, 0], result.high[0, 0]), (17.5, 32.5))
+        self.assertEqual(result.counts.tolist(), [[4, 4], [1, 0]])
+
+    def test_consensus_completion_parses_with_bands(self):
+        from predictor.ensemble import predict_ensemble
+        from predictor.parsing import parse_completion
+        prices = {0.1: (100, 110), 0.2: (102, 112), 0.3: (98, 108), 0.4: (140, 150)}
+        seen = []
+
+        def call(prompt, csv_data, temperature):
+            seen.append(temperature)
+            return ensemble_output(prices[temperature])
+
+        output = predict_ensemble("prompt", "csv", call, predictor_views.parse_llm_output, self.config)
+        self.assertEqual(sorted(seen), [0.1, 0.2, 0.3, 0.4])
+        parsed = parse_completion(output)
+        self.assertEqual([row.price for row in parsed.rows if row.symbol == "AAPL"], [101.0, 111.0])
+        band = parsed.bands[0]
+        self.assertEqual((band.symbol, band.month, band.median, band.samples), ("AAPL", "2024-07", 101.0, 4))
+        self.assertLess(band.low, band.median)
+        self.assertLess(band.median, band.high)
+        self.assertIn("Consensus of 4 of 4 samples", parsed.explanations)
+        self.assertEqual(parsed.symbol_explanations["MSFT"], "MSFT: sampled.")
+
+    @override_settings(PREDICTION_SHAPE={"SYMBOLS": 1, "PERIODS": 1})
+    def test_consensus_keeps_the_configured_shape(self):
+        from predictor.ensemble import predict_ensemble
+        from predictor.parsing import parse_completion
+        output = predict_ensemble("prompt", "csv", lambda prompt, csv_data, temperature: ensemble_output((100, 110)),
+                                  predictor_views.parse_llm_output, self.config)
+        self.assertEqual([tuple(row) for row in parse_completion(output).rows], [("AAPL", "2024-07", 100.0)])
+
+    def test_quorum_cancels_stragglers(self):
+        from predictor.ensemble import apredict_ensemble, predict_ensemble
+        import asyncio
+        config = {**self.config, "QUORUM": 2}
+
+        def call(prompt, csv_data, temperature):
+            if temperature >= 0.3:
+                time.sleep(1.0)
+            return ensemble_output((100, 110))
+
+        started = time.monotonic()
+        output = predict_ensemble("prompt", "csv", call, predictor_views.parse_llm_output, config)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertIn("Consensus of 2 of 4 samples", output)
+
+        cancelled = []
+
+        async def acall(prompt, csv_data, temperature):
+            try:
+                await asyncio.sleep(1.0 if temperature >= 0.3 else 0.0)
+            except asyncio.CancelledError:
+                cancelled.append(temperature)
+                raise
+            return ensemble_output((100, 110))
+
+        started = time.monotonic()
+        output = asyncio.run(apredict_ensemble("prompt", "csv", acall, predictor_views.parse_llm_output, config))
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(sorted(cancelled), [0.3, 0.4])
+
+    def test_failed_samples_are_skipped_unless_all_fail(self):
+        from predictor.ensemble import predict_ensemble
+
+        def call(prompt, csv_data, temperature):
+            if temperature == 0.1:
+                raise RuntimeError("provider down")
+            return "no csv" if temperature == 0.2 else ensemble_output((100, 110))
+
+        output = predict_ensemble("prompt", "csv", call, predictor_views.parse_llm_output, self.config)
+        self.assertIn("Consensus of 2 of 4 samples", output)
+        with self.assertRaises(RuntimeError):
+            predict_ensemble("prompt", "csv", Mock(side_effect=RuntimeError("down")),
+                             predictor_views.parse_llm_output, self.config)
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_predict_view_shows_consensus(self, mock_llm):
+        User.objects.create_user(username="ensembleuser", password="testpass1234")
+        self.client.login(username="ensembleuser", password="testpass1234")
+        mock_llm.side_effect = lambda prompt, csv_data, temperature: ensemble_output((100 * temperature * 10, 110))
+        with override_settings(PREDICTION_ENSEMBLE=self.config):
+            response = self.client.post(reverse("predict"))
+        self.assertEqual(mock_llm.call_count, 4)
+        self.assertTrue(response.context["valid_csv"])
+        self.assertContains(response, "Consensus and Uncertainty")
+        self.assertContains(response, "<td>AAPL</td><td>2024-07</td><td>250</td><td>175 – 325</td><td>4</td>", html=False)
+        self.assertIn("low", response.context["chart"]["series"][0])
+        from predictor.models import PredictionRun
+        self.assertTrue(PredictionRun.objects.get(pk=response.context["run_id"]).model_name.endswith("+ensemble4"))
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_ensemble_job_result_survives_the_sqlite_store(self, mock_llm):
+        import tempfile
+        User.objects.create_user(username="ensemblejobuser", password="testpass1234")
+        self.client.login(username="ensemblejobuser", password="testpass1234")
+        mock_llm.side_effect = lambda prompt, csv_data, temperature: ensemble_output((100 * temperature * 10, 110))
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        jobs_module.reset_job_runner()
+        self.addCleanup(jobs_module.reset_job_runner)
+        with override_settings(
+            PREDICTION_ENSEMBLE=self.config,
+            PREDICTION_JOBS={"STORE": "sqlite", "LOCATION": os.path.join(tmp.name, "jobs.sqlite3")},
+        ):
+            job_id = self.client.post(reverse("predict_job_submit")).context["job"]["id"]
+            job = jobs_module.get_job_runner().wait(job_id, timeout=5)
+            self.assertEqual(job["status"], jobs_module.DONE)
+            response = self.client.get(reverse("predict_job_status", args=[job_id]))
+        self.assertContains(response, "<td>AAPL</td><td>2024-07</td><td>250</td><td>175 – 325</td><td>4</td>", html=False)
+
+
+class PredictionThrottlingTests(TestCase):
+    def setUp(self):
+        from predictor import throttling
+        self.throttling = throttling
+        self.now = 1000.0
+        throttling.reset_rate_limiter()
+        self.addCleanup(throttling.reset_rate_limiter)
+        response_cache_module.get_response_cache().clear()
+
+    def make_limiter(self, backend=None, **kwargs):
+        backend = backend or self.throttling.MemoryThrottleBackend()
+        return self.throttling.RateLimiter(backend, clock=lambda: self.now, **kwargs)
+
+    def test_token_buckets_refill_over_time(self):
+        limiter = self.make_limiter(user_rate="1/s", user_burst=2, ip_rate="10/m", ip_burst=5)
+        limiter.check(1, "10.0.0.1")
+        limiter.check(1, "10.0.0.1")
+        with self.assertRaises(self.throttling.RateLimited) as raised:
+            limiter.check(1, "10.0.0.1")
+        self.assertEqual(raised.exception.reason, "user")
+        self.assertAlmostEqual(raised.exception.retry_after, 1.0)
+        limiter.check(2, "10.0.0.1")  # another user, same IP
+        self.now += 1.0
+        limiter.check(1, "10.0.0.1")
+        # The IP bucket (5 tokens, one per 6 s) ran dry: the rejected call took none
+        limiter.check(None, "10.0.0.1")
+        with self.assertRaises(self.throttling.RateLimited) as raised:
+            limiter.check(None, "10.0.0.1")
+        self.assertEqual(raised.exception.reason, "ip")
+        self.assertAlmostEqual(raised.exception.retry_after, 5.0)
+
+    def test_concurrency_ceiling_and_shared_backend(self):
+        backend = self.throttling.DjangoCacheThrottleBackend()
+        backend.cache.clear()
+        first, second = (self.make_limiter(backend, user_rate="1/m", max_concurrent=1) for _ in range(2))
+        release = first.admit(1)
+        with self.assertRaises(self.throttling.RateLimited) as raised:
+            second.admit(2)
+        self.assertEqual(raised.exception.reason, "concurrency")
+        release()
+        release()  # releasing twice frees one slot only
+        second.admit(2)()
+        # The buckets are shared by both limiters
+        with self.assertRaises(self.throttling.RateLimited):
+            second.check(1)
+
+    def test_single_flight_shares_one_call(self):
+        single_flight = self.throttling.SingleFlight()
+        gate = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            gate.wait(5)
+            return "completion"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(single_flight.do("key", slow))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while not calls:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        gate.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(leader for _, leader in results), [False, False, True])
+        self.assertEqual({output for output, _ in results}, {"completion"})
+        self.assertEqual(len(single_flight), 0)
+        with self.assertRaises(RuntimeError):
+            single_flight.do("key", Mock(side_effect=RuntimeError("LLM down")))
+
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_predict_view_returns_429_with_retry_hint(self, mock_llm):
+        mock_llm.return_value = VALID_LLM_OUTPUT
+        with override_settings(PREDICTION_THROTTLING={"ENABLED": True, "USER_RATE": "1/h", "USER_BURST": 1}):
+            User.objects.create_user(username="throttleuser", password="testpass1234")
+            self.client.login(username="throttleuser", password="testpass1234")
+            self.assertEqual(self.client.post(reverse("predict")).status_code, 200)
+            response = self.client.post(reverse("predict"), HTTP_HX_REQUEST="true")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "3600")
+        self.assertEqual(json.loads(response["HX-Trigger-After-Settle"])["predictionThrottled"],
+                         {"retryAfter": 3600, "reason": "user"})
+        self.assertContains(response, "Too many predictions", status_code=429)
+        self.assertEqual(mock_llm.call_count, 1)
+    @override_settings(PREDICTION_THROTTLING={"ENABLED": True, "USER_RATE": "1/h", "USER_BURST": 2, "IP_RATE": None})
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_jobs_and_batches_take_tokens(self, mock_llm):
+        mock_llm.return_value = VALID_LLM_OUTPUT
+        jobs_module.reset_job_runner()
+        self.addCleanup(jobs_module.reset_job_runner)
+        User.objects.create_user(username="throttlebatchuser", password="testpass1234")
+        self.client.login(username="throttlebatchuser", password="testpass1234")
+
+        def post_batch(count):
+            items = [{"id": str(i), "csv": make_price_csv([f"S{i}"], 3)} for i in range(count)]
+            return self.client.post(reverse("predict_batch"), data=json.dumps({"items": items}),
+                                    content_type="application/json")
+
+        # More items than a burst never fit
+        response = post_batch(3)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("3 requested, at most 2 allowed", response.json()["error"])
+        self.assertEqual(mock_llm.call_count, 0)
+        response = post_batch(1)
+        self.assertEqual(response.status_code, 200)
+        b"".join(response.streaming_content)
+        self.assertEqual(self.client.post(reverse("predict_job_submit")).status_code, 202)
+        response = self.client.post(reverse("predict_job_submit"))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "3600")
+        self.assertEqual(post_batch(1).status_code, 429)
+
+
+def shaped_output(symbols, labels):
+    rows = "\n".join(f"S{i:04d},{label},{100 + i}" for i in range(symbols) for label in labels)
+    return f"```csv\nsymbol,month,predicted_price\n{rows}\n```\nExplanations:\nS0000: strong."
+
+class ResultShapeTests(TestCase):
+    def setUp(self):
+        User.objects.create_user(username="shapeuser", password="testpass1234")
+        self.client.login(username="shapeuser", password="testpass1234")
+        response_cache_module.get_response_cache().clear()
+
+    def test_period_labels_map_to_their_first_day(self):
+        from predictor.results import period_start
+        self.assertEqual(period_start("2025-Q3"), datetime.date(2025, 7, 1))
+        self.assertEqual(period_start("2025-W02"), datetime.date(2025, 1, 6))
+        self.assertEqual(period_start("2025-01-06"), datetime.date(2025, 1, 6))
+        self.assertEqual(period_start("2025-02"), datetime.date(2025, 2, 1))
+        self.assertIsNone(period_start("next spring"))
+
+    @override_settings(PREDICTION_SHAPE={"SYMBOLS": 25, "HORIZON": "quarterly", "PERIODS": 8})
+    def test_prompt_asks_for_the_configured_shape(self):
+        from predictor.results import get_shape_settings
+        prompt = predictor_views.build_persona_prompt("Focus on tech.")
+        self.assertIn("top 25 most profitable symbols with 8 quarterly prices", prompt)
+        self.assertIn("2025-Q1", prompt)
+        with override_settings(PREDICTION_SHAPE={"MONTHS": 6}):
+            self.assertEqual(get_shape_settings()["PERIODS"], 6)
+
+    @override_settings(PREDICTION_SHAPE={"SYMBOLS": 60, "HORIZON": "weekly", "PERIODS": 52, "PAGE_SIZE": 50})
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_large_results_are_paged_and_exported(self, mock_llm):
+        from predictor.models import PredictionRun
+        weeks = [(datetime.date(2025, 1, 6) + datetime.timedelta(weeks=w)).isoformat() for w in range(52)]
+        mock_llm.return_value = shaped_output(60, weeks)
+        response = self.client.post(reverse("predict"))
+        self.assertTrue(response.context["valid_csv"])
+        self.assertEqual(response.context["row_count"], 3120)
+        self.assertEqual(response.content.decode().count("<tr><td>S"), 50)
+        self.assertContains(response, "<th>Week</th>")
+        self.assertContains(response, "Predicted Prices for Top 60 Stocks (52 Weeks)")
+        # Only the page is kept in the context, the exports have the rest
+        self.assertNotIn("csv_rows", response.context)
+        self.assertNotIn("prediction_csv", response.context)
+        run = PredictionRun.objects.get(pk=response.context["run_id"])
+        self.assertEqual((run.horizon, run.row_count), ("weekly", 3120))
+        self.assertEqual(run.rows.first().month, datetime.date(2025, 1, 6))
+
+        rows_url = reverse("prediction_rows", args=[run.pk])
+        self.assertContains(response, f"{rows_url}?page=2")
+        page = self.client.get(rows_url, {"page": 2}).content.decode()
+        self.assertEqual(page.count("<tr><td>S"), 50)
+        self.assertIn("<tr><td>S0000</td><td>2025-12-29</td><td>100</td></tr>", page)
+        self.assertIn(f"{rows_url}?page=3", page)
+        self.assertNotIn("hx-get", self.client.get(rows_url, {"page": 63}).content.decode())
+
+        export = self.client.get(reverse("prediction_export", args=[run.pk, "jsonl"]))
+        self.assertEqual(export["Content-Type"], "application/x-ndjson")
+        self.assertIn('filename="prediction.jsonl"', export["Content-Disposition"])
+        lines = b"".join(export.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3120)
+        self.assertEqual(json.loads(lines[-1]), {"symbol": "S0059", "month": weeks[-1], "predicted_price": 159.0})
+        export = self.client.get(reverse("prediction_export", args=[run.pk, "columns"]))
+        batches = [json.loads(line) for line in b"".join(export.streaming_content).decode().splitlines()]
+        self.assertEqual([len(batch["symbol"]) for batch in batches], [2000, 1120])
+        self.assertEqual(self.client.get(reverse("prediction_export", args=[run.pk, "xlsx"])).status_code, 404)
+
+    @override_settings(PREDICTION_SHAPE={"SYMBOLS": 1, "HORIZON": "quarterly", "PERIODS": 4})
+    def test_shape_errors_name_the_period(self):
+        parsed = predictor_views.parse_prediction(shaped_output(1, ["2025-Q1", "2025-Q2"]))
+        self.assertEqual([e.message for e in parsed.shape_errors()], ["S0000 has 2 quarters, expected 4"])
+
+    @override_settings(PREDICTION_SHAPE={"MAX_ROWS": 100})
+    @patch("predictor.views.call_llm_with_prompt")
+    def test_outputs_over_max_rows_are_rejected(self, mock_llm):
+        mock_llm.return_value = shaped_output(10, [f"2025-{m:02d}" for m in range(1, 13)])
+        response = self.client.post(reverse("predict"))
+        self.assertFalse(response.context["valid_csv"])
+
+    def test_parquet_export_streams_row_groups(self):
+        from predictor.exports import available_formats, iter_export
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            self.assertNotIn("parquet", available_formats())
+            return
+        import io
+        rows = [(f"S{i:04d}", "2025-01", float(i)) for i in range(5000)]
+        chunks = list(iter_export("parquet", iter(rows), chunk_size=1000))
+        self.assertEqual(len(chunks), 6)  # a row group per chunk, then the footer
+        parquet = pq.ParquetFile(io.BytesIO(b"".join(chunks)))
+        self.assertEqual(parquet.metadata.num_row_groups, 5)
+        self.assertEqual(parquet.read().column("predicted_price").to_pylist()[-1], 4999.0)
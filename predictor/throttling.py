@@ -0,0 +1,399 @@
+"""
+Admission control for predictions: rate limiting and request coalescing.
+
+Every prediction request costs an LLM call, so with
+PREDICTION_THROTTLING["ENABLED"] the predict endpoints admit a request only
+if it gets a token from each of its token buckets:
+
+- one per user (USER_RATE, refilled continuously, at most USER_BURST saved up);
+- one per client IP (IP_RATE / IP_BURST), for anonymous requests as well as
+  scripts spread over several accounts;
+
+and, while it runs, one of MAX_CONCURRENT slots (a global ceiling on
+predictions in flight). Rates are "N/s", "N/m", "N/h" or "N/d"; None switches
+a bucket off. Rejected requests get RateLimited with the seconds until they
+would be admitted, which views turn into a 429 with a Retry-After header.
+A batch takes one token per item, and is refused outright if it has more
+items than a burst. Prediction jobs and batches run on their own bounded
+workers, so they take tokens but no slot.
+
+The "memory" backend keeps buckets and slots per process; the "django"
+backend keeps them in CACHES[CACHE_ALIAS] (e.g. a database or redis cache)
+so all workers share them. Django's cache API has no compare-and-swap, so
+under heavy contention the shared buckets may admit slightly more than
+their rate.
+
+Independently of the limits, with COALESCE identical concurrent predictions
+(same response cache key) share one in-flight LLM call: the first request
+makes the call and the others wait for its result (SingleFlight). This
+works within a process; a double-click usually lands on the same worker.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+
+DEFAULT_THROTTLING_SETTINGS = {
+    "ENABLED": False,
+    "BACKEND": "memory",  # "memory" (per process) or "django" (shared through CACHES[CACHE_ALIAS])
+    "CACHE_ALIAS": "default",
+    "USER_RATE": "10/m",
+    "USER_BURST": 3,
+    "IP_RATE": "30/m",
+    "IP_BURST": 5,
+    "MAX_CONCURRENT": 8,  # predictions in flight at once; None for no ceiling
+    "BUSY_RETRY_AFTER": 5,  # seconds suggested to requests turned away by the ceiling
+    "SLOT_TTL": 15 * 60,  # seconds a slot counter outlives its last change ("django" backend)
+    "MAX_KEYS": 10_000,  # buckets kept by the "memory" backend
+    "TRUSTED_PROXY_HEADER": None,  # e.g. "X-Forwarded-For" behind a reverse proxy
+    "COALESCE": True,
+}
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+class RateLimited(Exception):
+    """
+    Raised when a request is not admitted; retry_after is in seconds.
+    reason is "user", "ip" or "concurrency".
+    """
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def get_throttling_settings():
+    config = dict(DEFAULT_THROTTLING_SETTINGS)
+    config.update(getattr(settings, "PREDICTION_THROTTLING", None) or {})
+    return config
+
+
+def parse_rate(rate):
+    """
+    "10/m" -> tokens per second (10 / 60); None stays None.
+    """
+    if rate is None:
+        return None
+    count, _, period = str(rate).partition("/")
+    try:
+        return float(count) / PERIODS[period.strip().lower()[:1] or "s"]
+    except (KeyError, ValueError):
+        raise ValueError(f"Invalid rate {rate!r}, expected e.g. '10/m'")
+
+
+def refill(state, rate, burst, now):
+    """
+    Tokens in a bucket (tokens, updated_at) at time now; a missing bucket is full.
+    """
+    if state is None:
+        return float(burst)
+    tokens, updated_at = state
+    return min(float(burst), tokens + max(0.0, now - updated_at) * rate)
+
+
+def take_tokens(states, buckets, now, tokens=1):
+    """
+    Take tokens from each of buckets, (key, rate, burst), whose current
+    states are in states (key -> (tokens, updated_at) or None). Returns
+    (new states, retry_after, key of the emptiest bucket); nothing is taken
+    unless every bucket has enough tokens, and retry_after is 0 then.
+    """
+    levels = {key: refill(states.get(key), rate, burst, now) for key, rate, burst in buckets}
+    waits = [((tokens - levels[key]) / rate, key) for key, rate, _ in buckets if levels[key] < tokens]
+    retry_after, empty = max(waits) if waits else (0.0, None)
+    taken = 0.0 if waits else float(tokens)
+    return {key: (levels[key] - taken, now) for key in levels}, retry_after, empty
+
+
+class MemoryThrottleBackend:
+    """
+    Buckets and slots of this process.
+    """
+
+    def __init__(self, max_keys=10_000, **kwargs):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._slots = 0
+        self._lock = threading.Lock()
+
+    def take(self, buckets, now, tokens=1):
+        with self._lock:
+            states, retry_after, empty = take_tokens(
+                {key: self._buckets.get(key) for key, _, _ in buckets}, buckets, now, tokens,
+            )
+            self._buckets.update(states)
+            if len(self._buckets) > self.max_keys:
+                # Forget the buckets touched longest ago; they are (nearly) full again
+                for key, _ in sorted(self._buckets.items(), key=lambda item: item[1][1])[:len(self._buckets) // 2]:
+                    del self._buckets[key]
+        return retry_after, empty
+
+    def acquire_slot(self, limit):
+        with self._lock:
+            if self._slots >= limit:
+                return False
+            self._slots += 1
+            return True
+
+    def release_slot(self):
+        with self._lock:
+            self._slots = max(0, self._slots - 1)
+
+
+class DjangoCacheThrottleBackend:
+    """
+    Buckets and slots in a Django cache, shared by every process using it.
+    """
+
+    key_prefix = "prediction-throttle:"
+
+    def __init__(self, cache_alias="default", slot_ttl=900, **kwargs):
+        from django.core.cache import caches
+
+        self.cache = caches[cache_alias]
+        self.slot_ttl = slot_ttl
+        self.slots_key = self.key_prefix + "slots"
+
+    def take(self, buckets, now, tokens=1):
+        keys = {key: self.key_prefix + key for key, _, _ in buckets}
+        stored = self.cache.get_many(list(keys.values()))
+        states, retry_after, empty = take_tokens({key: stored.get(keys[key]) for key in keys}, buckets, now, tokens)
+        # Kept until the bucket would be full again
+        timeout = max(int(burst / rate) + 1 for _, rate, burst in buckets)
+        self.cache.set_many({keys[key]: state for key, state in states.items()}, timeout=timeout)
+        return retry_after, empty
+
+    def acquire_slot(self, limit):
+        self.cache.add(self.slots_key, 0, timeout=self.slot_ttl)
+        try:
+            in_flight = self.cache.incr(self.slots_key)
+        except ValueError:
+            # The counter expired between add and incr
+            self.cache.add(self.slots_key, 1, timeout=self.slot_ttl)
+            in_flight = 1
+        if in_flight > limit:
+            self.release_slot()
+            return False
+        return True
+
+    def release_slot(self):
+        try:
+            self.cache.decr(self.slots_key)
+        except ValueError:
+            pass
+
+
+BACKENDS = {
+    "memory": MemoryThrottleBackend,
+    "django": DjangoCacheThrottleBackend,
+}
+
+
+class RateLimiter:
+    """
+    Token buckets per user and per IP plus the concurrency ceiling.
+    """
+
+    def __init__(self, backend, user_rate=None, user_burst=1, ip_rate=None, ip_burst=1,
+                 max_concurrent=None, busy_retry_after=5, clock=time.time):
+        self.backend = backend
+        self.user_rate = parse_rate(user_rate)
+        self.user_burst = user_burst
+        self.ip_rate = parse_rate(ip_rate)
+        self.ip_burst = ip_burst
+        self.max_concurrent = max_concurrent
+        self.busy_retry_after = busy_retry_after
+        self.clock = clock
+
+    def check(self, user_id=None, ip=None, tokens=1):
+        """
+        Take the request's tokens (one per prediction it makes) or raise
+        RateLimited. More tokens than a bucket's burst are never admitted.
+        """
+        buckets = []
+        if user_id is not None and self.user_rate:
+            buckets.append((f"user:{user_id}", self.user_rate, self.user_burst))
+        if ip and self.ip_rate:
+            buckets.append((f"ip:{ip}", self.ip_rate, self.ip_burst))
+        if not buckets:
+            return
+        for key, rate, burst in buckets:
+            if tokens > burst:
+                raise RateLimited(
+                    f"Too many predictions at once: {tokens} requested, at most {burst} allowed.",
+                    burst / rate, key.split(":", 1)[0],
+                )
+        retry_after, empty = self.backend.take(buckets, self.clock(), tokens)
+        if empty is not None:
+            raise RateLimited(
+                f"Too many predictions. Please try again in {max(1, round(retry_after))} seconds.",
+                retry_after, empty.split(":", 1)[0],
+            )
+
+    def admit(self, user_id=None, ip=None, slot=True, tokens=1):
+        """
+        Take (with slot) one of the MAX_CONCURRENT slots, then check().
+        Requests turned away by the ceiling keep their tokens. Returns the
+        function that gives the slot back; call it when the prediction is
+        done.
+        """
+        if not slot or not self.max_concurrent:
+            self.check(user_id, ip, tokens)
+            return lambda: None
+        if not self.backend.acquire_slot(self.max_concurrent):
+            raise RateLimited(
+                "The server is busy with other predictions. Please try again in a few seconds.",
+                self.busy_retry_after, "concurrency",
+            )
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                self.backend.release_slot()
+        try:
+            self.check(user_id, ip, tokens)
+        except BaseException:
+            release()
+            raise
+        return release
+
+
+def client_ip(request, config=None):
+    """
+    The client's IP: REMOTE_ADDR, or the first address of
+    TRUSTED_PROXY_HEADER when the app sits behind a proxy that sets it.
+    """
+    config = config or get_throttling_settings()
+    header = config["TRUSTED_PROXY_HEADER"]
+    if header:
+        forwarded = request.headers.get(header, "")
+        if forwarded.strip():
+            return forwarded.split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR")
+
+
+class SingleFlight:
+    """
+    At most one call per key in flight; concurrent callers with the same
+    key wait for the first one's result (or exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key):
+        """
+        (future, leader). The leader must make the call and hand its
+        outcome to finish(); the others wait on future.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        (fn(*args, **kwargs), leader), sharing the call with concurrent
+        callers for key.
+        """
+        future, leader = self.begin(key)
+        if not leader:
+            return future.result(), False
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, future, error=e if isinstance(e, Exception) else RuntimeError("coalesced call aborted"))
+            raise
+        self.finish(key, future, result)
+        return result, True
+
+    async def ado(self, key, coroutine_fn, *args, **kwargs):
+        """
+        Async do(); waiting callers hold no thread.
+        """
+        future, leader = self.begin(key)
+        if not leader:
+            # Shielded, so a waiter giving up does not cancel the shared call
+            return await asyncio.shield(asyncio.wrap_future(future)), False
+        try:
+            result = await coroutine_fn(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, future, error=e if isinstance(e, Exception) else RuntimeError("coalesced call aborted"))
+            raise
+        self.finish(key, future, result)
+        return result, True
+
+    def __len__(self):
+        return len(self._calls)
+
+
+def build_rate_limiter(config=None):
+    config = config or get_throttling_settings()
+    if config["BACKEND"] not in BACKENDS:
+        raise ValueError(f"Unknown prediction throttling backend: {config['BACKEND']}")
+    backend = BACKENDS[config["BACKEND"]](
+        max_keys=config["MAX_KEYS"], cache_alias=config["CACHE_ALIAS"], slot_ttl=config["SLOT_TTL"],
+    )
+    return RateLimiter(
+        backend,
+        user_rate=config["USER_RATE"],
+        user_burst=config["USER_BURST"],
+        ip_rate=config["IP_RATE"],
+        ip_burst=config["IP_BURST"],
+        max_concurrent=config["MAX_CONCURRENT"],
+        busy_retry_after=config["BUSY_RETRY_AFTER"],
+    )
+
+
+_rate_limiter = None
+_single_flight = SingleFlight()
+_throttling_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Return the process-wide rate limiter configured by
+    settings.PREDICTION_THROTTLING, or None when limiting is disabled.
+    """
+    global _rate_limiter
+    if not get_throttling_settings()["ENABLED"]:
+        return None
+    if _rate_limiter is None:
+        with _throttling_lock:
+            if _rate_limiter is None:
+                _rate_limiter = build_rate_limiter()
+    return _rate_limiter
+
+
+def get_single_flight():
+    """
+    Return the process-wide SingleFlight, or None when COALESCE is off.
+    """
+    return _single_flight if get_throttling_settings()["COALESCE"] else None
+
+
+def reset_rate_limiter():
+    """
+    Drop the process-wide limiter (and its in-memory buckets) so the next
+    call rebuilds it from settings.
+    """
+    global _rate_limiter
+    with _throttling_lock:
+        _rate_limiter = None
@@ -14,4 +14,18 @@ urlpatterns = [
     path("download/uploaded-instructions/", views.download_uploaded_instructions, name="download_uploaded_instructions"),
     path("instructions/", views.view_instructions, name="view_instructions"),
     path("predict/", views.predict_view, name="predict"),
+    path("predict/stream/", views.predict_stream, name="predict_stream"),
+    path("predict/stream/events/", views.predict_stream_events, name="predict_stream_events"),
+    path("predict/export/prediction.<str:fmt>", views.predict_export, name="predict_export"),
+    path("predictions/", views.prediction_history, name="prediction_history"),
+    path("predictions/<uuid:run_id>/", views.prediction_detail, name="prediction_detail"),
+    path("predictions/<uuid:run_id>/prediction.csv", views.prediction_download, name="prediction_download"),
+    path("predictions/<uuid:run_id>/prediction.<str:fmt>", views.prediction_export, name="prediction_export"),
+    path("predictions/<uuid:run_id>/rows/", views.prediction_rows, name="prediction_rows"),
+    path("predictions/symbol/<str:symbol>/", views.prediction_symbol_history, name="prediction_symbol_history"),
+    path("predictions/backtest/", views.backtest_view, name="backtest"),
+    path("predict/batch/", views.predict_batch, name="predict_batch"),
+    path("predict/jobs/", views.predict_job_submit, name="predict_job_submit"),
+    path("predict/jobs/<str:job_id>/", views.predict_job_status, name="predict_job_status"),
+    path("metrics", views.metrics_view, name="metrics"),
 ]
@@ -2,24 +2,66 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib import messages
-from django.http import HttpResponse, FileResponse, Http404
+from django.http import HttpResponse, FileResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.html import format_html
 from django.views.decorators.http import require_POST
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import Paginator
+from django.db import close_old_connections, connections
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import math
 import os
+import threading
+import time
 from .forms import UploadCSVForm, UploadInstructionsForm
+from .cache import get_response_cache
+from .llm_clients import get_client_registry
+from .router import get_router
+from .jobs import DONE, FAILED, JobLimitExceeded, get_job_runner, get_job_settings
+from .streaming import sse_event
+from .parsing import LLMOutputParser, parse_completion
+from .summarize import get_digest_settings, load_price_table, prepare_csv_payload
+from .budget import fit_prompt, get_budget_settings, truncate_instructions
+from .sharding import get_sharding_settings, predict_sharded, should_shard
+from .ensemble import apredict_ensemble, ensemble_label, predict_ensemble, should_ensemble
+from .artifacts import content_hash, get_artifact_cache
+from .ingest import CSVValidationError
+from .storage import QuotaExceeded, get_storage_settings, get_upload_storage
+from .charts import add_chart_bands, build_chart_payload, get_chart_settings
+from .forecast import LOCAL_MODEL_NAME, forecast_completion, get_forecast_settings
+from .history import (
+    collect_token_usage, get_history_settings, get_run_page, iter_run_rows, record_prediction_run, record_token_usage,
+    run_context, token_counts,
+)
+from .results import get_shape_settings, output_instructions, period_title
+from .exports import EXPORT_FORMATS, available_formats, export_filename, iter_export
+from .models import PredictionRow, PredictionRun
+from .metrics import (
+    CONTENT_TYPE, REGISTRY, get_metrics_settings, profile_request, record_coalesced, record_prediction, record_prefetch,
+    record_throttled, request_trace, server_timing, stage_timer,
+)
+from .prefetch import PrefetchResult, get_prefetch_settings, get_prefetcher
+from .throttling import RateLimited, client_ip, get_rate_limiter, get_single_flight
+from .backtest import (
+    RealizedPrices, get_backtest_settings, load_stored_predictions, score_predictions, scored_runs, walk_forward,
+)
+from .batch import ENCODERS, BatchRequestError, build_batch_runner, get_batch_settings, parse_batch_items
+
+logger = logging.getLogger(__name__)
 
 # Langchain imports
 from langchain.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI  # Default, but can be swapped for any supported LLM
-
-import csv
-import io
-import re
 
 from django.views.decorators.csrf import csrf_exempt
 
-UPLOAD_DIR = "/tmp/llm_stock_uploads"
-
 # Persona prompt as per spec
 PERSONA_PROMPT = """
 You are “The Oracle,” a world-class stock market analyst with a reputation for uncanny accuracy and deep insight. Your tone is confident, concise, and professional, but approachable. You analyze data with scientific rigor, explain your reasoning clearly, and always back up your predictions with evidence from the data. You avoid hype and speculation, focusing on actionable, data-driven insights. When presenting predictions, you rank them by expected profitability and explain the logic behind each one in plain language.
@@ -33,43 +75,237 @@ Use state of the art analysis techniques. Take into consideration:
 Use any data you have access to. The `data.csv` input file is a set of Stock data for an x amount of years. Use that as a baseline. Then use whatever data you have access to about current news events, geopolitical understanding, and the best fundamental & technical analysis expertise you have.
 """
 
+USER_MESSAGE = "Here is the stock data CSV:\n\n{csv_data}\n\nPlease provide your predictions as specified."
+
 def build_persona_prompt(user_instructions: str = None):
     """
-    Build the full LLM prompt using the persona and user instructions.
+    Build the full LLM prompt using the persona, user instructions and the
+    output shape of settings.PREDICTION_SHAPE (see results.py).
     """
     if user_instructions:
-        return f"{PERSONA_PROMPT}\n\nUser Instructions:\n{user_instructions.strip()}"
-    return PERSONA_PROMPT
+        return f"{PERSONA_PROMPT}\n\nUser Instructions:\n{user_instructions.strip()}{output_instructions()}"
+    return PERSONA_PROMPT + output_instructions()
 
-def get_llm():
+def get_model_name():
+    """
+    Return the chat model name, configurable via the OPENAI_MODEL env var.
+    With LLM_ROUTER backends configured this names the router instead, so
+    cached responses of single-model and routed predictions stay apart.
+    """
+    router = get_router(validate=has_prediction_rows)
+    if router is not None:
+        return router.name
+    return os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo")
+
+def get_cache_model_name():
+    """
+    The model part of response cache keys and history entries:
+    get_model_name(), tagged with the ensemble size when predictions are
+    ensembles (see ensemble.py).
+    """
+    if should_ensemble():
+        return f"{get_model_name()}+{ensemble_label()}"
+    return get_model_name()
+
+def get_llm_provider():
+    """
+    Return the chat model provider, configurable via the LLM_PROVIDER env var
+    ("openai" by default, "fake" for the local offline model).
+    """
+    return os.environ.get("LLM_PROVIDER", "openai")
+
+def get_llm(model=None):
     """
     Return a Langchain chat model instance using the API key from env.
     Uses OpenAI by default, but can be swapped for any supported LLM.
+    Instances come from a process-wide registry, so their pooled HTTP
+    connections are reused across requests. With LLM_ROUTER backends
+    configured, returns the router over them (see router.py), unless model
+    asks for a specific model of the provider.
     """
+    if model is None:
+        router = get_router(validate=has_prediction_rows)
+        if router is not None:
+            return router
+        model = get_model_name()
+    provider = get_llm_provider()
+    if provider == "fake":
+        return get_client_registry().get(provider, model)
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY environment variable not set")
-    # You can swap ChatOpenAI for any other langchain.chat_models class as needed
-    return ChatOpenAI(api_key=api_key)
+    # Register other langchain chat model classes in llm_clients.PROVIDERS as needed
+    return get_client_registry().get(provider, model, api_key)
 
-def call_llm_with_prompt(prompt: str, csv_data: str):
+def has_prediction_rows(llm_output: str):
     """
-    Call the LLM with the constructed prompt and CSV data.
-    Returns the LLM's response.
+    Whether a completion contains at least one prediction row; the router
+    treats answers without any as failed.
+    """
+    return bool(parse_completion(llm_output).rows)
+
+def build_llm_messages(prompt: str, csv_data: str):
+    """
+    Build the chat messages sent to the LLM for a prompt and CSV data.
     """
-    llm = get_llm()
     chat_prompt = ChatPromptTemplate.from_messages([
         ("system", prompt),
-        ("user", f"Here is the stock data CSV:\n\n{csv_data}\n\nPlease provide your predictions as specified.")
+        ("user", USER_MESSAGE.format(csv_data=csv_data))
     ])
-    messages = chat_prompt.format_messages()
-    response = llm.invoke(messages)
+    return chat_prompt.format_messages()
+
+def call_llm_with_prompt(prompt: str, csv_data: str, model=None, **options):
+    """
+    Call the LLM with the constructed prompt and CSV data.
+    Returns the LLM's response. model and options (e.g. temperature) let
+    ensemble samples vary the call.
+    """
+    llm = get_llm(model)
+    messages = build_llm_messages(prompt, csv_data)
+    with stage_timer("llm_call"):
+        response = llm.invoke(messages, **options)
+    record_token_usage(response)
     return response.content
 
-def ensure_user_dir(user):
-    user_dir = os.path.join(UPLOAD_DIR, str(user.id))
-    os.makedirs(user_dir, exist_ok=True)
-    return user_dir
+async def acall_llm_with_prompt(prompt: str, csv_data: str, model=None, **options):
+    """
+    Async call_llm_with_prompt: awaits the chat model's ainvoke, so under
+    ASGI an in-flight call holds no thread.
+    """
+    llm = get_llm(model)
+    messages = build_llm_messages(prompt, csv_data)
+    with stage_timer("llm_call"):
+        response = await llm.ainvoke(messages, **options)
+    record_token_usage(response)
+    return response.content
+
+def stream_llm_with_prompt(prompt: str, csv_data: str):
+    """
+    Like call_llm_with_prompt, but yields the response text chunk by chunk
+    using the chat model's streaming interface.
+    """
+    llm = get_llm()
+    messages = build_llm_messages(prompt, csv_data)
+    # Times the whole stream, including the time the consumer takes per chunk
+    with stage_timer("llm_call"):
+        for chunk in llm.stream(messages):
+            record_token_usage(chunk)
+            if chunk.content:
+                yield chunk.content
+
+def get_user_file(user, name):
+    """
+    The user's uploaded file name as a storage.StoredFile, or None.
+    """
+    return get_upload_storage().get(user.id, name)
+
+def get_sample_instructions():
+    sample_md = os.path.join(settings.BASE_DIR, "samples", "sample_instructions.md")
+    with open(sample_md, "r", encoding="utf-8") as f:
+        return f.read()
+
+def in_thread(fn):
+    """
+    Wrap blocking file I/O so async views can await it without stalling the
+    event loop.
+    """
+    return sync_to_async(fn, thread_sensitive=False)
+
+class ThreadedChunks:
+    """
+    Async iterable over a blocking iterator of response chunks. Under ASGI,
+    StreamingHttpResponse reads a sync iterator to the end before sending
+    anything; this hands over each chunk as soon as it is produced. Every
+    chunk is produced in the same dedicated thread and in the caller's
+    context, so database cursors and context variables carry over between
+    chunks. close(), which the response calls when it is done or the client
+    went away, closes chunks, running its finally blocks.
+    """
+
+    _done = object()
+
+    def __init__(self, chunks):
+        self.iterator = iter(chunks)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="streaming-response")
+        self.context = contextvars.copy_context()
+        self._closed = False
+        self._lock = threading.Lock()
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.executor, self.context.run, next, self.iterator, self._done)
+                if chunk is self._done:
+                    return
+                yield chunk
+        finally:
+            self.close()
+
+    def _finish(self):
+        try:
+            close = getattr(self.iterator, "close", None)
+            if close is not None:
+                close()
+        finally:
+            # The thread goes away with this response
+            connections.close_all()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        # Queued behind a next() still running, without waiting for either
+        self.executor.submit(self.context.run, self._finish)
+        self.executor.shutdown(wait=False)
+
+def streaming_response(request, chunks, content_type):
+    """
+    StreamingHttpResponse over chunks that streams under ASGI too (see
+    ThreadedChunks).
+    """
+    if isinstance(request, ASGIRequest):
+        chunks = ThreadedChunks(chunks)
+    return StreamingHttpResponse(chunks, content_type=content_type)
+
+async def arender(request, template_name, context=None, status=None):
+    """
+    render() for async views. Templates read request.user and the session,
+    which may query the database, so rendering runs in Django's sync thread.
+    """
+    return await sync_to_async(render)(request, template_name, context, status=status)
+
+def open_if_exists(path):
+    return open(path, "rb") if os.path.exists(path) else None
+
+def serve_upload(request, stored, filename, content_type):
+    """
+    Download response for a stored upload, without copying it through
+    Python where possible: the web server sends it when SENDFILE_HEADER is
+    set, otherwise FileResponse does (with sendfile under WSGI). Compressed
+    blobs are sent as is to clients accepting gzip.
+    """
+    config = get_storage_settings()
+    gzip_ok = "gzip" in request.headers.get("Accept-Encoding", "")
+    if config["SENDFILE_HEADER"] and (gzip_ok or not stored.compressed):
+        response = HttpResponse(content_type=content_type)
+        relative = os.path.relpath(stored.path, config["ROOT"]).replace(os.sep, "/")
+        response[config["SENDFILE_HEADER"]] = config["SENDFILE_PREFIX"] + relative
+    elif stored.compressed and gzip_ok:
+        response = FileResponse(open(stored.path, "rb"), content_type=content_type)
+    else:
+        response = FileResponse(stored.open(), content_type=content_type)
+    if stored.compressed and gzip_ok:
+        response["Content-Encoding"] = "gzip"
+    response["Vary"] = "Accept-Encoding"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    response["ETag"] = f'"{stored.hash}"'
+    return response
+
+def load_post_and_files(request):
+    # Parsing a multipart body may spool uploads to temporary files
+    return request.POST, request.FILES
 
 def index(request):
     return render(request, "base.html")
@@ -106,123 +342,346 @@ def logout_view(request):
         return HttpResponse("<script>window.location.reload()</script>")
     return redirect("index")
 
-def upload_csv(request):
-    if not request.user.is_authenticated:
+async def upload_csv(request):
+    user = await request.auser()
+    if not user.is_authenticated:
         return redirect("login")
     if request.method == "POST":
-        form = UploadCSVForm(request.POST, request.FILES)
+        post, files = await in_thread(load_post_and_files)(request)
+        form = UploadCSVForm(post, files)
         if form.is_valid():
-            user_dir = ensure_user_dir(request.user)
-            csv_file = request.FILES["csv_file"]
-            with open(os.path.join(user_dir, "data.csv"), "wb+") as dest:
-                for chunk in csv_file.chunks():
-                    dest.write(chunk)
+            csv_file = files["csv_file"]
+            try:
+                summary = await in_thread(get_upload_storage().ingest_csv)(user.id, csv_file.chunks())
+                get_artifact_cache().invalidate(user.id)
+            except (CSVValidationError, QuotaExceeded) as e:
+                if request.htmx:
+                    return HttpResponse(format_html("<div>CSV rejected: {}</div>", e))
+                form.add_error("csv_file", f"CSV rejected: {e}")
+                return await arender(request, "upload_csv.html", {"form": form}, status=400)
+            message = f"CSV uploaded successfully. {summary['rows']} rows for {summary['symbols']} symbols"
+            if summary["duplicates"]:
+                message += f", {summary['duplicates']} duplicate rows dropped"
+            message += "."
+            await in_thread(start_prefetch)(user, client_ip(request))
             if request.htmx:
-                return HttpResponse("<div>CSV uploaded successfully.</div>")
-            messages.success(request, "CSV uploaded successfully.")
+                return HttpResponse(format_html("<div>{}</div>", message))
+            messages.success(request, message)
             return redirect("index")
     else:
         form = UploadCSVForm()
-    return render(request, "upload_csv.html", {"form": form})
+    return await arender(request, "upload_csv.html", {"form": form})
 
-def upload_instructions(request):
-    if not request.user.is_authenticated:
+async def upload_instructions(request):
+    user = await request.auser()
+    if not user.is_authenticated:
         return redirect("login")
     if request.method == "POST":
-        form = UploadInstructionsForm(request.POST, request.FILES)
+        post, files = await in_thread(load_post_and_files)(request)
+        form = UploadInstructionsForm(post, files)
         if form.is_valid():
-            user_dir = ensure_user_dir(request.user)
-            md_file = request.FILES["instructions_file"]
-            with open(os.path.join(user_dir, "instructions.md"), "wb+") as dest:
-                for chunk in md_file.chunks():
-                    dest.write(chunk)
+            md_file = files["instructions_file"]
+            try:
+                await in_thread(get_upload_storage().save)(user.id, "instructions.md", md_file.chunks())
+            except QuotaExceeded as e:
+                if request.htmx:
+                    return HttpResponse(format_html("<div>Instructions rejected: {}</div>", e))
+                form.add_error("instructions_file", f"Instructions rejected: {e}")
+                return await arender(request, "upload_instructions.html", {"form": form}, status=400)
+            get_artifact_cache().invalidate(user.id)
+            await in_thread(start_prefetch)(user, client_ip(request))
             if request.htmx:
                 return HttpResponse("<div>Instructions uploaded successfully.</div>")
             messages.success(request, "Instructions uploaded successfully.")
             return redirect("index")
     else:
         form = UploadInstructionsForm()
-    return render(request, "upload_instructions.html", {"form": form})
+    return await arender(request, "upload_instructions.html", {"form": form})
 
-def download_sample_csv(request):
+async def download_sample_csv(request):
     sample_path = os.path.join(settings.BASE_DIR, "samples", "sample_data.csv")
-    if not os.path.exists(sample_path):
+    f = await in_thread(open_if_exists)(sample_path)
+    if f is None:
         raise Http404("Sample CSV not found.")
-    return FileResponse(open(sample_path, "rb"), as_attachment=True, filename="sample_data.csv")
+    return FileResponse(f, as_attachment=True, filename="sample_data.csv")
 
-def download_sample_instructions(request):
+async def download_sample_instructions(request):
     sample_path = os.path.join(settings.BASE_DIR, "samples", "sample_instructions.md")
-    if not os.path.exists(sample_path):
+    f = await in_thread(open_if_exists)(sample_path)
+    if f is None:
         raise Http404("Sample instructions not found.")
-    return FileResponse(open(sample_path, "rb"), as_attachment=True, filename="sample_instructions.md")
+    return FileResponse(f, as_attachment=True, filename="sample_instructions.md")
 
-def download_uploaded_csv(request):
-    if not request.user.is_authenticated:
+async def download_uploaded_csv(request):
+    user = await request.auser()
+    if not user.is_authenticated:
         return redirect("login")
-    user_dir = ensure_user_dir(request.user)
-    file_path = os.path.join(user_dir, "data.csv")
-    if not os.path.exists(file_path):
+    stored = await in_thread(get_user_file)(user, "data.csv")
+    if stored is None:
         raise Http404("No uploaded CSV found.")
-    return FileResponse(open(file_path, "rb"), as_attachment=True, filename="data.csv")
+    return await in_thread(serve_upload)(request, stored, "data.csv", "text/csv")
 
-def download_uploaded_instructions(request):
-    if not request.user.is_authenticated:
+async def download_uploaded_instructions(request):
+    user = await request.auser()
+    if not user.is_authenticated:
         return redirect("login")
-    user_dir = ensure_user_dir(request.user)
-    file_path = os.path.join(user_dir, "instructions.md")
-    if not os.path.exists(file_path):
+    stored = await in_thread(get_user_file)(user, "instructions.md")
+    if stored is None:
         raise Http404("No uploaded instructions found.")
-    return FileResponse(open(file_path, "rb"), as_attachment=True, filename="instructions.md")
+    return await in_thread(serve_upload)(request, stored, "instructions.md", "text/markdown")
 
-def view_instructions(request):
+async def view_instructions(request):
     """
     Display instructions.md: user's uploaded file if present, else default sample.
     """
-    if request.user.is_authenticated:
-        user_dir = ensure_user_dir(request.user)
-        user_md = os.path.join(user_dir, "instructions.md")
-        if os.path.exists(user_md):
-            with open(user_md, "r", encoding="utf-8") as f:
-                content = f.read()
-            return render(request, "view_instructions.html", {"instructions_md": content, "is_user": True})
+    user = await request.auser()
+    if user.is_authenticated:
+        stored = await in_thread(get_user_file)(user, "instructions.md")
+        if stored is not None:
+            content = await in_thread(stored.read_text)()
+            return await arender(request, "view_instructions.html", {"instructions_md": content, "is_user": True})
     # fallback to default sample
-    sample_path = os.path.join(settings.BASE_DIR, "samples", "sample_instructions.md")
-    with open(sample_path, "r", encoding="utf-8") as f:
-        content = f.read()
-    return render(request, "view_instructions.html", {"instructions_md": content, "is_user": False})
+    content = await in_thread(get_sample_instructions)()
+    return await arender(request, "view_instructions.html", {"instructions_md": content, "is_user": False})
 
 def get_user_csv_and_instructions(request):
     """
     Returns (csv_data:str, instructions_md:str, is_user_csv:bool, is_user_md:bool)
+    Uploaded files are served from the artifact cache and only re-read from
+    disk when they change.
+    """
+    return get_user_csv_and_instructions_for(request.user)
+
+@stage_timer("read_inputs")
+def get_user_csv_and_instructions_for(user):
+    """
+    get_user_csv_and_instructions() for an already resolved user, as async
+    views get it from request.auser().
     """
     # CSV
     user_csv = None
     user_md = None
     is_user_csv = False
     is_user_md = False
-    if request.user.is_authenticated:
-        user_dir = ensure_user_dir(request.user)
-        csv_path = os.path.join(user_dir, "data.csv")
-        md_path = os.path.join(user_dir, "instructions.md")
-        if os.path.exists(csv_path):
-            with open(csv_path, "r", encoding="utf-8") as f:
-                user_csv = f.read()
-            is_user_csv = True
-        if os.path.exists(md_path):
-            with open(md_path, "r", encoding="utf-8") as f:
-                user_md = f.read()
-            is_user_md = True
+    if user.is_authenticated:
+        artifact_cache = get_artifact_cache()
+        stored_csv = get_user_file(user, "data.csv")
+        stored_md = get_user_file(user, "instructions.md")
+        if stored_csv is not None:
+            user_csv, _ = artifact_cache.read_text(user.id, stored_csv.path)
+        if stored_md is not None:
+            user_md, _ = artifact_cache.read_text(user.id, stored_md.path)
+        is_user_csv = user_csv is not None
+        is_user_md = user_md is not None
     if not user_csv:
         # fallback to sample
         sample_csv = os.path.join(settings.BASE_DIR, "samples", "sample_data.csv")
         with open(sample_csv, "r", encoding="utf-8") as f:
             user_csv = f.read()
     if not user_md:
-        sample_md = os.path.join(settings.BASE_DIR, "samples", "sample_instructions.md")
-        with open(sample_md, "r", encoding="utf-8") as f:
-            user_md = f.read()
+        user_md = get_sample_instructions()
     return user_csv, user_md, is_user_csv, is_user_md
 
+def assemble_prediction_inputs(csv_data: str, instructions_md: str, get_features=None):
+    """
+    Returns (prompt:str, csv_payload:str) for the LLM: the persona prompt
+    with the user's instructions, and the CSV (or its digest, see
+    summarize.prepare_csv_payload), fitted to the prompt token budget (see
+    budget.fit_prompt).
+    """
+    model = get_model_name()
+    prompt = build_persona_prompt(truncate_instructions(instructions_md, model=model))
+    if should_shard(csv_data):
+        # Shards are cut from the raw rows, see generate_llm_output
+        return prompt, csv_data
+    csv_payload, _ = fit_prompt(prompt, prepare_csv_payload(csv_data, get_features), USER_MESSAGE.format(csv_data=""), model)
+    return prompt, csv_payload
+
+def get_prediction_inputs(request):
+    """
+    assemble_prediction_inputs() for the request's files. For uploaded CSVs
+    the result and the indicators behind it come from the artifact cache.
+    """
+    return get_prediction_inputs_for(request.user)
+
+def get_prediction_inputs_for(user):
+    """
+    get_prediction_inputs() for an already resolved user.
+    """
+    csv_data, instructions_md, is_user_csv, is_user_md = get_user_csv_and_instructions_for(user)
+    with stage_timer("build_prompt"):
+        if not is_user_csv:
+            return assemble_prediction_inputs(csv_data, instructions_md)
+        return get_cached_prediction_inputs(user, csv_data, instructions_md)
+
+def get_cached_prediction_inputs(user, csv_data: str, instructions_md: str):
+    """
+    assemble_prediction_inputs() for an uploaded CSV, through the artifact cache.
+    """
+    artifact_cache = get_artifact_cache()
+    user_id = user.id
+    stored_csv = get_user_file(user, "data.csv")
+    _, csv_hash = artifact_cache.read_text(user_id, stored_csv.path)
+    key = (
+        csv_hash,
+        content_hash(instructions_md),
+        repr(sorted(get_digest_settings().items())),
+        repr(sorted(get_sharding_settings().items())),
+        repr(sorted(get_budget_settings().items())),
+        get_model_name(),
+    )
+    return artifact_cache.get_prompt(user_id, key, lambda: assemble_prediction_inputs(
+        csv_data,
+        instructions_md,
+        lambda: artifact_cache.get_features(user_id, stored_csv.blob_dir, csv_data, csv_hash),
+    ))
+
+def generate_llm_output(prompt: str, csv_data: str):
+    """
+    Produce the LLM completion for (prompt, csv_data): one call, a
+    map-reduce over symbol shards for uploads too large for one prompt, or
+    the consensus of several samples when ensembles are enabled.
+    """
+    if should_shard(csv_data):
+        return predict_sharded(prompt, csv_data, call_llm_with_prompt, parse_llm_output)
+    if should_ensemble():
+        return predict_ensemble(prompt, csv_data, call_llm_with_prompt, parse_llm_output)
+    return call_llm_with_prompt(prompt, csv_data)
+
+async def agenerate_llm_output(prompt: str, csv_data: str):
+    """
+    Async generate_llm_output. Sharded predictions fan out on their own
+    thread pool, so they run in a worker thread.
+    """
+    if should_shard(csv_data):
+        return await in_thread(generate_llm_output)(prompt, csv_data)
+    if should_ensemble():
+        return await apredict_ensemble(prompt, csv_data, acall_llm_with_prompt, parse_llm_output)
+    return await acall_llm_with_prompt(prompt, csv_data)
+
+def coalesce_llm_output(cache_key: str, prompt: str, csv_data: str):
+    """
+    (completion, coalesced): generate_llm_output, sharing the call with an
+    identical prediction already in flight in this process (see
+    throttling.SingleFlight). coalesced is True when the completion came
+    from another request's call.
+    """
+    single_flight = get_single_flight()
+    if single_flight is None:
+        return generate_llm_output(prompt, csv_data), False
+    llm_output, leader = single_flight.do(cache_key, generate_llm_output, prompt, csv_data)
+    if not leader:
+        record_coalesced()
+    return llm_output, not leader
+
+async def acoalesce_llm_output(cache_key: str, prompt: str, csv_data: str):
+    """
+    Async coalesce_llm_output.
+    """
+    single_flight = get_single_flight()
+    if single_flight is None:
+        return await agenerate_llm_output(prompt, csv_data), False
+    llm_output, leader = await single_flight.ado(cache_key, agenerate_llm_output, prompt, csv_data)
+    if not leader:
+        record_coalesced()
+    return llm_output, not leader
+
+def prefetch_llm_output(prompt: str, csv_data: str, cache_key: str):
+    """
+    Prefetch body: the completion for (prompt, csv_data) as a
+    prefetch.PrefetchResult. A valid one is also put in the response cache,
+    for predict requests that cannot claim the prefetch itself.
+    """
+    started = time.monotonic()
+    with collect_token_usage() as usage:
+        llm_output = generate_llm_output(prompt, csv_data)
+    latency = time.monotonic() - started
+    if prediction_context_from_parsed(parse_prediction(llm_output))["valid_csv"]:
+        get_response_cache().set(cache_key, llm_output)
+    return PrefetchResult(llm_output, usage, latency)
+
+def start_prefetch(user, ip=None):
+    """
+    After an upload, start predicting the user's new inputs in the
+    background (see prefetch.py). Returns whether a prefetch was started;
+    an identical one already running or a cached response means there is
+    nothing to do. A prefetch is a prediction to the rate limiter: it takes
+    the user's tokens and a concurrency slot, and is skipped when the
+    limiter turns it away. Never fails the upload.
+    """
+    if not get_prefetch_settings()["ENABLED"] or get_forecast_settings()["MODE"] == "local":
+        return False
+    release = lambda: None  # noqa: E731
+    try:
+        prompt, csv_data = get_prediction_inputs_for(user)
+        response_cache = get_response_cache()
+        cache_key = response_cache.make_key(get_cache_model_name(), prompt, csv_data)
+        if response_cache.get(cache_key) is not None:
+            return False
+        limiter = get_rate_limiter()
+        if limiter is not None:
+            release = limiter.admit(user.id, ip)
+
+        def prefetch():
+            try:
+                return prefetch_llm_output(prompt, csv_data, cache_key)
+            finally:
+                release()
+        started = get_prefetcher().submit(cache_key, prefetch)
+    except RateLimited:
+        record_prefetch("throttled")
+        return False
+    except Exception as e:
+        release()
+        logger.warning("Could not start prediction prefetch: %s", e)
+        return False
+    if not started:
+        release()
+    record_prefetch("started" if started else "coalesced")
+    return started
+
+def claim_prefetch(cache_key: str):
+    """
+    (PrefetchResult, first) of the prefetch for cache_key, waiting up to
+    PREDICTION_PREFETCH["WAIT"] seconds if it is still running, or
+    (None, False) when there is none or it failed.
+    """
+    config = get_prefetch_settings()
+    if not config["ENABLED"]:
+        return None, False
+    future, first = get_prefetcher().claim(cache_key)
+    if future is None:
+        return None, False
+    try:
+        with stage_timer("prefetch_wait"):
+            result = future.result(timeout=config["WAIT"])
+    except Exception:
+        record_prefetch("failed")
+        return None, False
+    record_prefetch("claimed")
+    return result, first
+
+async def aclaim_prefetch(cache_key: str):
+    """
+    Async claim_prefetch: awaits the prefetch without holding a thread.
+    """
+    config = get_prefetch_settings()
+    if not config["ENABLED"]:
+        return None, False
+    future, first = get_prefetcher().claim(cache_key)
+    if future is None:
+        return None, False
+    try:
+        with stage_timer("prefetch_wait"):
+            # Shielded, so giving up on it does not cancel the prefetch
+            result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), config["WAIT"])
+    except Exception:
+        record_prefetch("failed")
+        return None, False
+    record_prefetch("claimed")
+    return result, first
+
+@stage_timer("parse")
 def parse_llm_output(llm_output):
     """
     Parse LLM output into (prediction_csv:str, table_html:str, explanations:str)
@@ -233,44 +692,720 @@ def parse_llm_output(llm_output):
     ```
     <table>...</table>
     Explanations: ...
+    See parsing.LLMOutputParser for the typed, single-pass parser behind it.
     """
-    # Extract CSV block
-    csv_match = re.search(r"```csv\s*(.*?)```", llm_output, re.DOTALL)
-    prediction_csv = csv_match.group(1).strip() if csv_match else ""
-    # Extract HTML table (if any)
-    table_match = re.search(r"(<table.*?>.*?</table>)", llm_output, re.DOTALL)
-    table_html = table_match.group(1) if table_match else ""
-    # Extract explanations (after "Explanation" or "Explanations")
-    expl_match = re.search(r"Explanation[s]?:\s*(.*)", llm_output, re.DOTALL | re.IGNORECASE)
-    explanations = expl_match.group(1).strip() if expl_match else ""
-    return prediction_csv, table_html, explanations
+    parsed = parse_completion(llm_output)
+    return parsed.prediction_csv, parsed.table_html, parsed.explanations
+
+def prediction_parser():
+    """
+    An LLMOutputParser checking the shape of settings.PREDICTION_SHAPE.
+    """
+    config = get_shape_settings()
+    return LLMOutputParser(config["SYMBOLS"], config["PERIODS"], period_title(config["HORIZON"]).lower())
+
+def parse_prediction(llm_output: str):
+    """
+    parse_completion checking the shape of settings.PREDICTION_SHAPE.
+    """
+    parser = prediction_parser()
+    parser.feed(llm_output)
+    return parser.close()
+
+def prediction_context_from_parsed(parsed):
+    """
+    Build the predict_result.html context from a parsing.ParsedPrediction.
+    The table shows the first PREDICTION_SHAPE["PAGE_SIZE"] rows; once the
+    run is stored the rest is loaded page by page (see prediction_rows).
+    """
+    shape = get_shape_settings()
+    valid_csv = 2 <= len(parsed.csv_rows) <= shape["MAX_ROWS"] + 1  # header + up to MAX_ROWS rows
+    if shape["STRICT"] and parsed.shape_errors():
+        valid_csv = False
+    chart = build_chart_payload(parsed.rows, get_chart_settings()["MAX_SERIES"])
+    if parsed.bands:
+        add_chart_bands(chart, parsed.bands)
+    # Only a page of rows: the context is rendered, and stored by job
+    # stores, so it must not grow with the result (exports stream the rest)
+    return {
+        "table_html": parsed.table_html,
+        "explanations": parsed.explanations,
+        "symbol_explanations": parsed.symbol_explanations,
+        "validation_errors": [error.message for error in parsed.errors],
+        "valid_csv": valid_csv,
+        "page_rows": parsed.rows[:shape["PAGE_SIZE"]],
+        "next_page": 2 if len(parsed.rows) > shape["PAGE_SIZE"] else None,
+        "row_count": len(parsed.rows),
+        "period_title": period_title(shape["HORIZON"]),
+        "chart": chart,
+        "bands": parsed.bands,
+        "error": None,
+        "source": "llm",
+    }
+
+def build_prediction_context(llm_output):
+    """
+    Parse the LLM output and build the predict_result.html context.
+    """
+    with stage_timer("parse"):
+        parsed = parse_prediction(llm_output)
+    return prediction_context_from_parsed(parsed)
+
+def finish_prediction(user, parsed, context, cache_key, latency, usage, prompt_text, llm_output):
+    """
+    Count a completed prediction in the metrics and store it in the
+    history; sets context["run_id"].
+    """
+    outcome = "ok" if context["valid_csv"] else "invalid"
+    cache_hit = context["cache_hit"]
+    if context.get("source") == "local":
+        model_name, tokens = LOCAL_MODEL_NAME, (0, 0, False)
+        record_prediction(outcome)
+    else:
+        model_name, tokens = get_cache_model_name(), token_counts(usage, cache_hit, prompt_text, llm_output)
+        record_prediction(outcome, cache_hit, tokens[0], tokens[1])
+    run = record_prediction_run(
+        user, parsed, context["valid_csv"], cache_key, model_name, latency, tokens, cache_hit,
+    )
+    context["run_id"] = str(run.pk) if run else None
+
+def get_price_table_for(user):
+    """
+    The user's data as a summarize.PriceTable: uploads come from the
+    artifact cache (memory-mapped when ingest wrote a columnar copy), the
+    sample CSV is parsed.
+    """
+    csv_data, _, is_user_csv, _ = get_user_csv_and_instructions_for(user)
+    if not is_user_csv:
+        return load_price_table(csv_data)
+    artifact_cache = get_artifact_cache()
+    stored_csv = get_user_file(user, "data.csv")
+    _, csv_hash = artifact_cache.read_text(user.id, stored_csv.path)
+    return artifact_cache.get_dataset(user.id, stored_csv.blob_dir, csv_data, csv_hash).table
+
+def get_local_prediction_context(prompt: str, csv_data: str, user=None, load_table=None, fallback_reason=None,
+                                 with_csv=False):
+    """
+    predict_result.html context from the local baseline forecaster instead
+    of the LLM. load_table returns the PriceTable to forecast; by default
+    csv_data is parsed, which only works when it is the raw CSV rather than
+    a digest. fallback_reason, if given, says why the LLM was not used.
+    with_csv adds the whole prediction CSV as context["prediction_csv"].
+    """
+    parsed, context = local_prediction(prompt, csv_data, user, load_table, fallback_reason)
+    if with_csv:
+        context["prediction_csv"] = parsed.prediction_csv
+    return context
+
+def local_completion(table):
+    """
+    The local forecaster's completion for a PriceTable, in the shape of
+    settings.PREDICTION_SHAPE.
+    """
+    shape = get_shape_settings()
+    return forecast_completion(
+        table, shape["SYMBOLS"], shape["PERIODS"], get_forecast_settings()["ALPHA"], shape["HORIZON"],
+    )
+
+def local_prediction(prompt: str, csv_data: str, user=None, load_table=None, fallback_reason=None):
+    """
+    (parsed prediction, context) of get_local_prediction_context.
+    """
+    started = time.monotonic()
+    with stage_timer("local_forecast"):
+        table = load_table() if load_table is not None else load_price_table(csv_data)
+        llm_output = local_completion(table)
+    latency = time.monotonic() - started
+    with stage_timer("parse"):
+        parsed = parse_prediction(llm_output)
+    context = prediction_context_from_parsed(parsed)
+    context["cache_hit"] = False
+    context["source"] = "local"
+    context["fallback_reason"] = fallback_reason
+    cache_key = get_response_cache().make_key(LOCAL_MODEL_NAME, prompt, csv_data)
+    finish_prediction(user, parsed, context, cache_key, latency, None, prompt + csv_data, llm_output)
+    return parsed, context
+
+def local_fallback(prompt: str, csv_data: str, user, load_table, error, with_csv=False):
+    """
+    get_local_prediction_context() after a failed LLM call in "fallback"
+    mode; re-raises error in any other mode or if the forecast fails too.
+    """
+    if get_forecast_settings()["MODE"] != "fallback":
+        raise error
+    try:
+        return get_local_prediction_context(
+            prompt, csv_data, user, load_table, fallback_reason=f"LLM call failed: {error}", with_csv=with_csv,
+        )
+    except ValueError:
+        raise error
+
+def get_prediction_context(prompt: str, csv_data: str, user=None, load_table=None, with_csv=False):
+    """
+    Return the predict_result.html context for (prompt, csv_data), serving
+    identical requests from the response cache. Only outputs with a valid
+    prediction CSV are cached, so a bad completion is retried next time.
+    Every run is stored in the prediction history; context["run_id"] names it.
+    Depending on settings.PREDICTION_FORECAST the local forecaster (see
+    get_local_prediction_context) answers instead of, or after a failure
+    of, the LLM. A prefetch started by the upload (see start_prefetch) is
+    claimed first, and identical predictions in flight share one LLM call
+    (see coalesce_llm_output). with_csv adds the whole prediction CSV as
+    context["prediction_csv"]. Raises whatever generate_llm_output raises.
+    """
+    if get_forecast_settings()["MODE"] == "local":
+        return get_local_prediction_context(prompt, csv_data, user, load_table, with_csv=with_csv)
+    response_cache = get_response_cache()
+    cache_key = response_cache.make_key(get_cache_model_name(), prompt, csv_data)
+    prefetched, first_claim = claim_prefetch(cache_key)
+    started = time.monotonic()
+    with collect_token_usage() as usage:
+        llm_output = prefetched.llm_output if prefetched else response_cache.get(cache_key)
+        cache_hit = llm_output is not None
+        if not cache_hit:
+            try:
+                # A coalesced prediction made no LLM call of its own, like a cache hit
+                llm_output, cache_hit = coalesce_llm_output(cache_key, prompt, csv_data)
+            except Exception as e:
+                record_prediction("error")
+                return local_fallback(prompt, csv_data, user, load_table, e, with_csv)
+    latency = time.monotonic() - started
+    if first_claim:
+        # The prefetch made the LLM call this prediction would have made
+        cache_hit, usage, latency = False, prefetched.usage, prefetched.latency
+    with stage_timer("parse"):
+        parsed = parse_prediction(llm_output)
+    context = prediction_context_from_parsed(parsed)
+    if context["valid_csv"] and not cache_hit:
+        response_cache.set(cache_key, llm_output)
+    context["cache_hit"] = cache_hit
+    if with_csv:
+        context["prediction_csv"] = parsed.prediction_csv
+    finish_prediction(user, parsed, context, cache_key, latency, usage, prompt + csv_data, llm_output)
+    return context
+
+async def aget_prediction_context(prompt: str, csv_data: str, user=None, load_table=None):
+    """
+    Async get_prediction_context. Cache backends may touch disk or the
+    network, so their calls run in a worker thread; the history is written
+    from Django's sync thread.
+    """
+    if get_forecast_settings()["MODE"] == "local":
+        return await sync_to_async(get_local_prediction_context)(prompt, csv_data, user, load_table)
+    response_cache = get_response_cache()
+    cache_key = response_cache.make_key(get_cache_model_name(), prompt, csv_data)
+    prefetched, first_claim = await aclaim_prefetch(cache_key)
+    started = time.monotonic()
+    with collect_token_usage() as usage:
+        llm_output = prefetched.llm_output if prefetched else await in_thread(response_cache.get)(cache_key)
+        cache_hit = llm_output is not None
+        if not cache_hit:
+            try:
+                llm_output, cache_hit = await acoalesce_llm_output(cache_key, prompt, csv_data)
+            except Exception as e:
+                record_prediction("error")
+                return await sync_to_async(local_fallback)(prompt, csv_data, user, load_table, e)
+    latency = time.monotonic() - started
+    if first_claim:
+        cache_hit, usage, latency = False, prefetched.usage, prefetched.latency
+    with stage_timer("parse"):
+        parsed = parse_prediction(llm_output)
+    context = prediction_context_from_parsed(parsed)
+    if context["valid_csv"] and not cache_hit:
+        await in_thread(response_cache.set)(cache_key, llm_output)
+    context["cache_hit"] = cache_hit
+    await sync_to_async(finish_prediction)(
+        user, parsed, context, cache_key, latency, usage, prompt + csv_data, llm_output,
+    )
+    return context
+
+def run_prediction_job(prompt: str, csv_data: str, user=None):
+    """
+    Job body for background predictions: returns the result context, with
+    LLM failures reported the same way predict_view reports them.
+    """
+    load_table = functools.partial(get_price_table_for, user) if user is not None else None
+    try:
+        return get_prediction_context(prompt, csv_data, user, load_table)
+    except Exception as e:
+        return {"error": f"LLM call failed: {e}"}
+    finally:
+        # Job threads live outside the request cycle that normally does this
+        close_old_connections()
+
+def rate_limited_context(request, error):
+    """
+    (context, headers) of the 429 for a request the rate limiter turned
+    away: the error with a Retry-After hint, and for HTMX requests a
+    predictionThrottled event carrying it, fired once the 429 page has
+    settled; base.html counts it down.
+    """
+    retry_after = max(1, math.ceil(error.retry_after))
+    record_throttled(error.reason)
+    headers = {"Retry-After": str(retry_after)}
+    if request.htmx:
+        headers["HX-Trigger-After-Settle"] = json.dumps({
+            "predictionThrottled": {"retryAfter": retry_after, "reason": error.reason},
+        })
+    return {"error": str(error), "retry_after": retry_after}, headers
+
+async def admit_prediction(request, slot=True):
+    """
+    Let the request past the rate limiter (see throttling.py); returns the
+    function releasing its concurrency slot. Raises RateLimited.
+    """
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return lambda: None
+    user = await request.auser()
+    user_id = user.id if user.is_authenticated else None
+    return await in_thread(limiter.admit)(user_id, client_ip(request), slot)
+
+def admit_request(request, slot=True, tokens=1):
+    """
+    admit_prediction for sync views, taking one token per prediction the
+    request makes. Raises RateLimited.
+    """
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return lambda: None
+    user_id = request.user.id if request.user.is_authenticated else None
+    return limiter.admit(user_id, client_ip(request), slot, tokens)
+
+def rate_limited_response(response, headers):
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+def get_job_owner(request):
+    """
+    Identify who owns a prediction job: the user id, or the session for
+    anonymous visitors.
+    """
+    if request.user.is_authenticated:
+        return f"user:{request.user.id}"
+    if not request.session.session_key:
+        request.session.save()
+    return f"session:{request.session.session_key}"
 
 @csrf_exempt
-def predict_view(request):
+@require_POST
+def predict_job_submit(request):
+    """
+    Enqueue a prediction job and return a status page that polls for it,
+    or a 429 when the rate limiter turns the request away.
+    """
+    try:
+        # Jobs are bounded by the job runner's workers, not by slots
+        admit_request(request, slot=False)
+    except RateLimited as e:
+        context, headers = rate_limited_context(request, e)
+        return rate_limited_response(render(request, "predict_result.html", context, status=429), headers)
+    return submit_prediction_job(request)
+
+def submit_prediction_job(request):
+    """
+    predict_job_submit for requests the rate limiter already admitted.
     """
-    View to trigger prediction using LLM.
+    prompt, csv_data = get_prediction_inputs(request)
+    try:
+        job_id = get_job_runner().submit(
+            get_job_owner(request), run_prediction_job, prompt, csv_data,
+            request.user if request.user.is_authenticated else None,
+        )
+    except JobLimitExceeded as e:
+        return render(request, "predict_result.html", {"error": str(e)}, status=429)
+    job = get_job_runner().get(job_id)
+    return render(request, "predict_pending.html", {
+        "job": job,
+        "poll_interval": get_job_settings()["POLL_INTERVAL"],
+    }, status=202)
+
+def predict_job_status(request, job_id):
+    """
+    HTMX-pollable job status: the pending page until the job finishes, then
+    the regular prediction result page.
+    """
+    job = get_job_runner().get(job_id)
+    if job is None or job["owner"] != get_job_owner(request):
+        raise Http404("Prediction job not found.")
+    if job["status"] == DONE:
+        return render(request, "predict_result.html", job["result"])
+    if job["status"] == FAILED:
+        return render(request, "predict_result.html", {"error": f"Prediction job failed: {job['error']}"})
+    return render(request, "predict_pending.html", {
+        "job": job,
+        "poll_interval": get_job_settings()["POLL_INTERVAL"],
+    })
+
+def predict_stream(request):
+    """
+    Page that shows the prediction filling in as the LLM streams its output.
+    """
+    shape = get_shape_settings()
+    return render(request, "predict_stream.html", {
+        "page_size": shape["PAGE_SIZE"], "period_title": period_title(shape["HORIZON"]),
+    })
+
+def predict_stream_events(request):
+    """
+    Server-sent events for predict_stream: "token" events carry raw output
+    text, "row" events carry each parsed prediction row as soon as its line
+    is complete, and a final "done" (or "error") event carries the results.
+    Requests the rate limiter turns away get a single "error" event, since
+    EventSource drops non-200 responses without reading them.
+    """
+    try:
+        release = admit_request(request)
+    except RateLimited as e:
+        context, headers = rate_limited_context(request, e)
+        response = StreamingHttpResponse([sse_event("error", context["error"])], content_type="text/event-stream")
+        response["Retry-After"] = headers["Retry-After"]
+        return response
+    try:
+        prompt, csv_data = get_prediction_inputs(request)
+    except BaseException:
+        release()
+        raise
+
+    def merged_chunks():
+        # Shard and ensemble results only exist once they are merged
+        yield generate_llm_output(prompt, csv_data)
+
+    def local_events(fallback_reason=None):
+        parsed, context = local_prediction(
+            prompt, csv_data, request.user, functools.partial(get_price_table_for, request.user), fallback_reason,
+        )
+        for row in parsed.rows:
+            yield sse_event("row", row)
+        with stage_timer("render"):
+            html = render_to_string("predict_stream_done.html", context)
+        yield sse_event("done", {"valid_csv": context["valid_csv"], "html": html})
+
+    def events():
+        forecast_mode = get_forecast_settings()["MODE"]
+        if forecast_mode == "local":
+            yield from local_events()
+            return
+        response_cache = get_response_cache()
+        cache_key = response_cache.make_key(get_cache_model_name(), prompt, csv_data)
+        prefetched, first_claim = claim_prefetch(cache_key)
+        cached_output = prefetched.llm_output if prefetched else response_cache.get(cache_key)
+        if cached_output is not None:
+            chunks = [cached_output]
+        elif should_shard(csv_data) or should_ensemble():
+            chunks = merged_chunks()
+        else:
+            chunks = stream_llm_with_prompt(prompt, csv_data)
+        parser = prediction_parser()
+        output = []
+        emitted = 0
+        started = time.monotonic()
+        with collect_token_usage() as usage:
+            try:
+                for chunk in chunks:
+                    output.append(chunk)
+                    yield sse_event("token", chunk)
+                    for row in parser.feed(chunk):
+                        emitted += 1
+                        yield sse_event("row", row)
+            except Exception as e:
+                record_prediction("error")
+                if forecast_mode == "fallback" and not output:
+                    # Nothing was shown yet, so the local forecast can take over
+                    try:
+                        yield from local_events(f"LLM call failed: {e}")
+                        return
+                    except ValueError:
+                        pass
+                yield sse_event("error", f"LLM call failed: {e}")
+                return
+        with stage_timer("parse"):
+            parsed = parser.close()
+        for row in parsed.rows[emitted:]:
+            yield sse_event("row", row)
+        llm_output = "".join(output)
+        context = prediction_context_from_parsed(parsed)
+        if context["valid_csv"] and cached_output is None:
+            response_cache.set(cache_key, llm_output)
+        context["cache_hit"] = cached_output is not None
+        latency = time.monotonic() - started
+        if first_claim:
+            context["cache_hit"], usage, latency = False, prefetched.usage, prefetched.latency
+        finish_prediction(
+            request.user, parsed, context, cache_key, latency, usage, prompt + csv_data, llm_output,
+        )
+        with stage_timer("render"):
+            html = render_to_string("predict_stream_done.html", context)
+        yield sse_event("done", {"valid_csv": context["valid_csv"], "html": html})
+
+    def admitted_events():
+        # The slot is held until the stream ends or the client goes away
+        try:
+            yield from events()
+        finally:
+            release()
+
+    response = streaming_response(request, admitted_events(), "text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+def predict_batch_item(csv_data: str, instructions_md: str = None, user=None):
+    """
+    Predict one batch item: the predict_result.html context for the CSV and
+    instructions (the sample instructions when none are given). LLM errors
+    propagate so the batch runner can retry rate-limited calls, except in
+    "fallback" forecast mode, where the item is forecast locally instead.
+    """
+    if not instructions_md:
+        instructions_md = get_sample_instructions()
+    with stage_timer("build_prompt"):
+        prompt, csv_payload = assemble_prediction_inputs(csv_data, instructions_md)
+    try:
+        return get_prediction_context(
+            prompt, csv_payload, user, functools.partial(load_price_table, csv_data), with_csv=True,
+        )
+    finally:
+        # Batch items run on the runner's worker threads
+        close_old_connections()
+
+@csrf_exempt
+@require_POST
+def predict_batch(request):
+    """
+    Predict many portfolios in one request. Expects a JSON body
+    {"format": "ndjson"|"zip", "items": [{"id", "csv", "instructions"}, ...]}
+    and streams back one JSON line per item plus a summary line, or a zip of
+    <id>/prediction.csv files (see batch.py). The rate limiter charges one
+    token per item.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+    try:
+        payload = json.loads(request.body or b"null")
+        output_format = (payload.get("format") if isinstance(payload, dict) else None) or "ndjson"
+        if output_format not in ENCODERS:
+            raise BatchRequestError(f"Unknown format {output_format!r}, expected one of {', '.join(ENCODERS)}")
+        items = parse_batch_items(payload, get_batch_settings()["MAX_ITEMS"])
+    except (ValueError, BatchRequestError) as e:
+        return JsonResponse({"error": f"Invalid batch: {e}"}, status=400)
+    try:
+        admit_request(request, slot=False, tokens=len(items))
+    except RateLimited as e:
+        context, headers = rate_limited_context(request, e)
+        return rate_limited_response(JsonResponse(context, status=429), headers)
+    runner = build_batch_runner(functools.partial(predict_batch_item, user=request.user))
+    encode, content_type = ENCODERS[output_format]
+    response = streaming_response(request, encode(runner.run(items), runner.stats), content_type)
+    if output_format == "zip":
+        response["Content-Disposition"] = 'attachment; filename="predictions.zip"'
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+def get_user_run(request, run_id):
+    """
+    The stored run run_id if the requester may see it: their own runs, and
+    runs made anonymously (their ids are random UUIDs).
+    """
+    run = PredictionRun.objects.filter(pk=run_id).first()
+    if run is None or (run.user_id is not None and run.user_id != request.user.id):
+        raise Http404("Prediction not found.")
+    return run
+
+def prediction_history(request):
+    """
+    The user's past predictions, newest first.
+    """
+    if not request.user.is_authenticated:
+        return redirect("login")
+    runs = PredictionRun.objects.filter(user=request.user).defer(
+        "explanations", "symbol_explanations", "validation_errors"
+    )
+    page = Paginator(runs, get_history_settings()["PAGE_SIZE"]).get_page(request.GET.get("page"))
+    return render(request, "prediction_history.html", {"page": page})
+
+def prediction_detail(request, run_id):
+    """
+    Show a stored prediction again, straight from the database.
+    """
+    run = get_user_run(request, run_id)
+    return render(request, "predict_result.html", run_context(run))
+
+def export_response(request, name, rows):
+    """
+    Streaming response with rows in export format name (see exports.py),
+    encoded as the response is sent.
+    """
+    if name not in available_formats():
+        raise Http404("Unknown export format.")
+    response = streaming_response(request, iter_export(name, rows), EXPORT_FORMATS[name][0])
+    response["Content-Disposition"] = f'attachment; filename="{export_filename(name)}"'
+    return response
+
+def prediction_export(request, run_id, fmt):
+    """
+    Stream a stored prediction as prediction.<fmt>, straight from the rows table.
+    """
+    run = get_user_run(request, run_id)
+    return export_response(request, fmt, iter_run_rows(run))
+
+def prediction_download(request, run_id):
+    """
+    Stream a stored prediction's prediction.csv.
+    """
+    return prediction_export(request, run_id, "csv")
+
+def predict_export(request, fmt):
+    """
+    Export the prediction for the user's current inputs when it was not
+    stored (history disabled): LLM predictions are taken from the response
+    cache, and are gone once the cache evicted them; local forecasts are
+    simply made again.
+    """
+    if not request.user.is_authenticated:
+        return redirect("login")
+    if get_forecast_settings()["MODE"] == "local":
+        llm_output = local_completion(get_price_table_for(request.user))
+    else:
+        prompt, csv_data = get_prediction_inputs_for(request.user)
+        response_cache = get_response_cache()
+        llm_output = response_cache.get(response_cache.make_key(get_cache_model_name(), prompt, csv_data))
+    if llm_output is None:
+        raise Http404("This prediction is no longer available; run it again.")
+    rows = parse_completion(llm_output).rows
+    return export_response(request, fmt, rows)
+
+def prediction_rows(request, run_id):
+    """
+    A page of a stored prediction's table rows, as <tr> elements for htmx
+    to append as the table is scrolled.
+    """
+    run = get_user_run(request, run_id)
+    page = get_run_page(run, request.GET.get("page"), get_shape_settings()["PAGE_SIZE"])
+    return render(request, "prediction_rows.html", {
+        "page_rows": page.object_list,
+        "next_page": page.next_page_number() if page.has_next() else None,
+        "run_id": str(run.pk),
+    })
+
+def prediction_symbol_history(request, symbol):
+    """
+    JSON list of every price the user has been predicted for symbol, by month.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+    symbol = symbol.upper()
+    rows = PredictionRow.objects.filter(user=request.user, symbol=symbol).order_by("month", "id").values_list(
+        "run_id", "run__created_at", "month_label", "price"
+    )
+    return JsonResponse({"symbol": symbol, "predictions": [
+        {"run": str(run_id), "created_at": created_at.isoformat(), "month": month, "price": price}
+        for run_id, created_at, month, price in rows
+    ]})
+
+def backtest_view(request):
+    """
+    Score the user's stored predictions, and a walk-forward replay of the
+    local baseline, against the realized prices in their data (see backtest.py).
+    """
+    if not request.user.is_authenticated:
+        return redirect("login")
+    config = get_backtest_settings()
+    runs = list(scored_runs(PredictionRun.objects.filter(user=request.user)).only(
+        "id", "created_at", "model_name",
+    )[:config["MAX_RUNS"]])
+    _, _, is_user_csv, _ = get_user_csv_and_instructions_for(request.user)
+    try:
+        table = get_price_table_for(request.user)
+        stored = score_predictions(
+            load_stored_predictions(runs), RealizedPrices.from_table(table), config["TOP_N"],
+        )
+        replay = score_predictions(*walk_forward(
+            table, config["WINDOWS"], config["HORIZON"], min_history=config["MIN_HISTORY"],
+            alpha=get_forecast_settings()["ALPHA"], max_workers=config["MAX_WORKERS"],
+        ), config["TOP_N"])
+    except ValueError as e:
+        return render(request, "backtest.html", {"error": f"Backtest failed: {e}"})
+    runs_by_id = {str(run.pk): run for run in runs}
+    for result in stored.runs:
+        run = runs_by_id[result["run"]]
+        result["created_at"], result["model_name"] = run.created_at, run.model_name
+    stored.runs.sort(key=lambda result: result["created_at"], reverse=True)
+    return render(request, "backtest.html", {
+        "stored": stored,
+        "walk_forward": replay,
+        "summaries": [("Your predictions", stored), ("Walk-forward local baseline", replay)],
+        "top_n": config["TOP_N"],
+        "is_user_csv": is_user_csv,
+    })
+
+@csrf_exempt
+async def predict_view(request):
+    """
+    View to trigger prediction using LLM. POSTs pass the rate limiter
+    first (see throttling.py) and get a 429 when they are turned away.
+    Under ASGI the LLM call is awaited natively, so a pending prediction
+    holds no thread. Under WSGI every request gets its own event loop, which
+    pooled async HTTP connections cannot outlive, so the blocking call runs
+    in the request's thread instead (which WSGI holds for the whole request
+    anyway).
     """
     if request.method == "POST":
-        csv_data, instructions_md, is_user_csv, is_user_md = get_user_csv_and_instructions(request)
-        prompt = build_persona_prompt(instructions_md)
+        jobs = get_job_settings()["ASYNC"]
         try:
-            llm_output = call_llm_with_prompt(prompt, csv_data)
-        except Exception as e:
-            return render(request, "predict_result.html", {
-                "error": f"LLM call failed: {e}"
-            })
-        prediction_csv, table_html, explanations = parse_llm_output(llm_output)
-        # Validate prediction_csv: should have 120 rows (header + 119)
-        csv_rows = [row for row in csv.reader(io.StringIO(prediction_csv)) if row]
-        valid_csv = len(csv_rows) >= 2 and len(csv_rows) <= 121  # header + up to 120 rows
-        return render(request, "predict_result.html", {
-            "prediction_csv": prediction_csv,
-            "table_html": table_html,
-            "explanations": explanations,
-            "valid_csv": valid_csv,
-            "csv_rows": csv_rows,
-            "error": None,
-        })
+            # Jobs are bounded by the job runner's workers, not by slots
+            release = await admit_prediction(request, slot=not jobs)
+        except RateLimited as e:
+            context, headers = rate_limited_context(request, e)
+            return rate_limited_response(await arender(request, "predict_result.html", context, status=429), headers)
+        try:
+            if jobs:
+                return await sync_to_async(submit_prediction_job)(request)
+            with request_trace() as trace:
+                response = await predict_post(request)
+        finally:
+            release()
+        if get_metrics_settings()["ENABLED"]:
+            response["Server-Timing"] = server_timing(trace)
+        return response
     # GET: show a simple form to trigger prediction
-    return render(request, "predict_form.html")
-    return render(request, "predict_form.html")
+    return await arender(request, "predict_form.html")
+
+def profiled(fn):
+    """
+    Run fn under metrics.profile_request in whichever thread it ends up in.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with profile_request(fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+async def predict_post(request):
+    user = await request.auser()
+    load_table = functools.partial(get_price_table_for, user)
+    try:
+        if isinstance(request, ASGIRequest):
+            # Profiles the event loop thread, so concurrent requests show up
+            # too; they are not profiled themselves (see profile_request)
+            with profile_request("aget_prediction_context"):
+                prompt, csv_data = await in_thread(get_prediction_inputs_for)(user)
+                context = await aget_prediction_context(prompt, csv_data, user, load_table)
+        else:
+            prompt, csv_data = await in_thread(get_prediction_inputs_for)(user)
+            context = await sync_to_async(profiled(get_prediction_context))(prompt, csv_data, user, load_table)
+    except Exception as e:
+        return await arender(request, "predict_result.html", {
+            "error": f"LLM call failed: {e}"
+        })
+    with stage_timer("render"):
+        return await arender(request, "predict_result.html", context)
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint for the prediction metrics (see metrics.py).
+    """
+    if not get_metrics_settings()["ENABLED"]:
+        raise Http404("Metrics are disabled")
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)